@@ -1,5 +1,6 @@
 from flask import Flask, render_template, jsonify, request
 import os
+import sys
 import json
 import time
 from datetime import datetime
@@ -32,6 +33,8 @@ def initialize_agents():
     if trading_coordinator is None:
         # Import here to avoid startup issues
         from trading_agent.coordinator import run_trading_cycle
+        from trading_agent.agents.storage_agent import start_storage
+        start_storage()
         trading_coordinator = run_trading_cycle
 
     if email_agent is None:
@@ -70,12 +73,35 @@ def continuous_trading_loop():
     while is_trading_active:
         try:
             run_trading_cycle()
-            # Wait 5 minutes between cycles (adjust as needed)
-            time.sleep(300)
+            # Wait 5 minutes between cycles (adjust as needed); storage maintenance runs in that idle time
+            idle_until = time.time() + 300
+            run_storage_maintenance()
+            time.sleep(max(0, idle_until - time.time()))
         except Exception as e:
             print(f"❌ Continuous trading error: {str(e)}")
             time.sleep(60)  # Shorter wait on error
 
+    # Stopped: make sure queued storage writes reach the database
+    storage = sys.modules.get('trading_agent.agents.storage_agent')
+    if storage:
+        storage.trading_storage.flush()
+
+def run_storage_maintenance():
+    """Retention/compaction of stored market data when it is due (see RETENTION_* settings)."""
+    if 'trading_agent.agents.storage_agent' not in sys.modules:
+        return None
+    try:
+        from trading_agent.agents.retention import run_if_due
+        return run_if_due()
+    except Exception as e:
+        print(f"❌ Storage maintenance failed: {str(e)}")
+        return None
+
+def storage_queue_stats():
+    """Write-behind queue depth/latency, if storage has been loaded."""
+    storage = sys.modules.get('trading_agent.agents.storage_agent')
+    return storage.trading_storage.queue_stats() if storage else None
+
 @app.route('/')
 def dashboard():
     """Main dashboard page"""
@@ -117,7 +143,19 @@ def get_trading_status():
     return jsonify({
         'is_active': is_trading_active,
         'last_update': datetime.now().isoformat(),
-        'last_data': last_trading_data
+        'last_data': last_trading_data,
+        'storage_queue': storage_queue_stats()
+    })
+
+@app.route('/api/storage_health')
+def storage_health():
+    """Astra DB connection health (connects or pings now, honouring the retry backoff)"""
+    from trading_agent.agents.astra_db_agent import astra_db
+    return jsonify({
+        'status': 'success',
+        'astra': astra_db.health_check(),
+        'storage_queue': storage_queue_stats(),
+        'timestamp': datetime.now().isoformat()
     })
 
 @app.route('/api/market_data')
@@ -270,6 +308,23 @@ def get_historical_data(symbol):
         timeframe = request.args.get('timeframe', '5Min')
         hours_back = int(request.args.get('hours', 24))  # Default 24 hours
 
+        if request.args.get('source') == 'archive':
+            # Long ranges straight from the local bar archive, no API calls
+            import pandas as pd
+            from trading_agent.agents.bar_archive import get_bar_archive
+            archive = get_bar_archive()
+            start = pd.Timestamp.now(tz='UTC') - pd.Timedelta(hours=hours_back)
+            records = archive.read(symbol.upper(), start=start, timeframe=timeframe) if archive else []
+            return jsonify({
+                'status': 'success',
+                'symbol': symbol,
+                'data': [{'timestamp': pd.Timestamp(ts, tz='UTC').isoformat(), 'open': o, 'high': h, 'low': l,
+                          'close': c, 'volume': int(v)}
+                         for ts, o, h, l, c, v in zip(*(records[f].tolist() for f in ('ts', 'o', 'h', 'l', 'c', 'v')))]
+                        if len(records) else [],
+                'timestamp': datetime.now().isoformat()
+            })
+
         bars = get_bars(symbol, hours_back=hours_back, timeframe=timeframe)
 
         # Always return success - even with empty data (subscription limitations)
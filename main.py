@@ -2,7 +2,7 @@
 import os
 from dotenv import load_dotenv
 from trading_agent.coordinator import run_trading_cycle
-from trading_agent.agents.storage_agent import trading_storage
+from trading_agent.agents.storage_agent import trading_storage, start_storage
 
 # Load environment variables
 load_dotenv()
@@ -29,6 +29,7 @@ except Exception as e:
 # Run the trading cycle
 if __name__ == '__main__':
     symbol = 'AAPL'  # You can change this or make it configurable
+    start_storage()
 
     print("=== TRADING STORAGE STATUS ===")
     performance = trading_storage.get_performance_summary()
@@ -41,7 +42,7 @@ if __name__ == '__main__':
 
     # Show Astra DB data if available
     try:
-        recent_trades = trading_storage.get_recent_trades(3)
+        recent_trades = trading_storage.get_recent_trades(3, fields=["symbol", "decision", "timestamp"])
         if recent_trades:
             print(f"\nRecent Astra DB trades: {len(recent_trades)} found")
             for trade in recent_trades[-2:]:  # Show last 2
@@ -76,7 +77,7 @@ if __name__ == '__main__':
 
     # Show updated Astra DB data
     try:
-        updated_trades = trading_storage.get_recent_trades(3)
+        updated_trades = trading_storage.get_recent_trades(3, fields=["symbol", "decision", "timestamp"])
         if updated_trades:
             print(f"Recent Astra DB trades: {len(updated_trades)} found")
             if len(updated_trades) > 0:
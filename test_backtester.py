@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Tests for the vectorized backtester (synthetic bars, simulated broker, no network)."""
+
+import time
+import numpy as np
+import pandas as pd
+
+from trading_agent.agents.backtester import Backtester, backtest_document, compute_stats
+from trading_agent.agents.model_cascade import rule_based_decision, rule_based_decisions
+from trading_agent.agents.session_replay import SessionReplay, RuleDecider
+from trading_agent.agents.param_sweep import SharedBars, grid_params, random_params, run_sweep
+
+
+def _bars(closes, start="2026-01-05 14:30", spread=0.3):
+    closes = np.asarray(closes, dtype=float)
+    opens = np.concatenate(([closes[0]], closes[:-1]))
+    index = pd.date_range(start, periods=len(closes), freq="1min", tz="UTC")
+    return pd.DataFrame({"open": opens, "high": np.maximum(opens, closes) + spread,
+                         "low": np.minimum(opens, closes) - spread, "close": closes, "volume": 100}, index=index)
+
+
+def test_vectorized_rules_match_scalar_rules():
+    """rule_based_decisions gives the same answer as rule_based_decision for every row."""
+    print("🧪 Testing vectorized rule engine...")
+    rng = np.random.default_rng(3)
+    n = 5_000
+    price = rng.uniform(50, 150, n)
+    entry = np.where(rng.random(n) < 0.3, 0.0, price * rng.uniform(0.85, 1.15, n))
+    rsi = rng.uniform(0, 100, n)
+    ema = price * rng.uniform(0.95, 1.05, n)
+    decisions, confidence = rule_based_decisions(price, entry, rsi, ema)
+    for i in range(n):
+        expected, expected_confidence = rule_based_decision(
+            {"current_price": price[i], "avg_entry_price": entry[i]}, {"rsi": rsi[i], "ema": ema[i]})
+        assert decisions[i] == expected, (i, decisions[i], expected)
+        assert abs(confidence[i] - expected_confidence) < 1e-9
+    print("✅ Vectorized rules agree with the scalar rules")
+
+
+def test_backtest_runs_coordinator_path():
+    """A dip-and-recovery series buys through the coordinator sizing and ends with sane stats."""
+    print("🧪 Testing an end-to-end backtest...")
+    rng = np.random.default_rng(11)
+    drift = np.concatenate((np.linspace(0, -0.08, 120), np.linspace(-0.08, 0.06, 200)))
+    bars = {
+        "AAPL": _bars(100 * np.exp(drift + rng.normal(0, 0.002, len(drift)))),
+        "MSFT": _bars(300 * np.exp(-drift + rng.normal(0, 0.002, len(drift)))),
+    }
+    start = time.perf_counter()
+    results = Backtester(bars, starting_cash=50_000, decision_every=5).run()
+    elapsed = time.perf_counter() - start
+    stats = results["stats"]
+
+    assert stats["symbols"] == 2 and stats["bars"] == 640
+    assert len(results["equity_curve"]) == stats["decision_steps"]
+    assert stats["orders_submitted"] > 0 and stats["order_errors"] == 0
+    assert stats["decisions"].get("BRACKET_BUY", 0) > 0
+    assert any(f["side"] == "buy" for f in results["trades"])
+    # Risk checks run on every cycle: no single buy spends more than the per-trade cap
+    assert max(f["qty"] * f["price"] for f in results["trades"] if f["side"] == "buy") <= 0.2 * 50_000 * 1.1
+    assert stats["max_drawdown_pct"] <= 0
+
+    document = backtest_document(results, max_points=20)
+    assert len(document["equity_curve"]) == 20
+    print(f"✅ Backtest: {stats['fills']} fills, return {stats['total_return_pct']:.2f}% in {elapsed:.2f}s")
+
+
+def test_stats_from_equity_and_fills():
+    equity = pd.Series([100.0, 110.0, 99.0, 121.0],
+                       index=pd.date_range("2026-01-05", periods=4, freq="D", tz="UTC"))
+    fills = [{"realized_pl": 10.0}, {"realized_pl": -5.0}, {"realized_pl": None}, {"realized_pl": 15.0}]
+    stats = compute_stats(equity, fills, 100.0)
+    assert abs(stats["total_return_pct"] - 21.0) < 1e-9
+    assert abs(stats["max_drawdown_pct"] - (99 / 110 - 1) * 100) < 1e-9
+    assert stats["round_trips"] == 3 and abs(stats["win_rate"] - 200 / 3) < 1e-9
+    assert stats["profit_factor"] == 5.0
+
+
+def test_parameter_sweep_over_shared_bars():
+    """Bars round-trip through shared memory and a small grid runs on a process pool, ranked by Sharpe."""
+    print("🧪 Testing the parameter sweep...")
+    rng = np.random.default_rng(5)
+    bars = {f"S{i}": _bars(100 * np.exp(np.cumsum(rng.normal(0, 0.003, 150)))) for i in range(3)}
+
+    shared = SharedBars.create(bars)
+    try:
+        frames = shared.frames()
+        assert frames["S1"].index.equals(bars["S1"].index)
+        assert np.array_equal(frames["S1"]["c"].to_numpy(), bars["S1"]["close"].to_numpy())
+    finally:
+        shared.close()
+
+    param_sets = grid_params({"ema_period": [10, 20], "bracket_take_profit": [1.02, 1.05]})
+    assert len(param_sets) == 4
+    assert len(random_params({"rsi_period": (5, 30), "stop_loss": [0.95, 0.97]}, 6, seed=1)) == 6
+    try:
+        grid_params({"not_a_param": [1]})
+        assert False, "unknown parameters must be rejected"
+    except ValueError:
+        pass
+    from trading_agent.agents.strategy_params import DEFAULT_STRATEGY_PARAMS, resolve_params
+    resolve_params()["ema_period"] = 99  # a run tweaking its params leaves the defaults alone
+    assert DEFAULT_STRATEGY_PARAMS["ema_period"] == 20
+
+    sweep = run_sweep(bars, param_sets, workers=2, decision_every=5)
+    results = sweep["results"]
+    assert [r["rank"] for r in results] == [1, 2, 3, 4]
+    assert all(r["error"] is None for r in results), results
+    sharpes = [r["stats"]["sharpe"] for r in results]
+    assert sharpes == sorted(sharpes, reverse=True)
+    print(f"✅ Sweep ranked {len(results)} runs in {sweep['elapsed_s']:.2f}s")
+
+
+def test_session_replay_runs_the_graph():
+    """Recorded bars replay through coordinator.app on a virtual clock with stubbed agents."""
+    print("🧪 Testing accelerated session replay...")
+    from trading_agent import coordinator
+    rng = np.random.default_rng(9)
+    bars = {s: _bars(100 * np.exp(np.cumsum(rng.normal(0, 0.003, 120)))) for s in ["AAPL", "MSFT"]}
+    getters = coordinator._get_llm_agent, coordinator._get_data_ingestor
+
+    replay = SessionReplay(bars, initial_positions={"AAPL": 10, "MSFT": 5},
+                           decider=RuleDecider(recorded={"MSFT": "HOLD"}))
+    seen = []
+    real_get_bars = replay.market_data.get_bars
+    def get_bars(symbol, **kwargs):
+        window = real_get_bars(symbol, **kwargs)
+        seen.append(len(window) == 0 or window.index[-1] < replay.clock.now())
+        return window
+    replay.market_data.get_bars = get_bars
+
+    report = replay.run(max_cycles=12)
+    assert report["cycles"] == 12 and not report["errors"], report["errors"]
+    assert all(report["node_ms"][node]["p50"] is not None for node in report["node_ms"])
+    assert report["decisions"].get("HOLD", 0) >= 12  # MSFT's recorded answer every cycle
+    assert sum(report["decisions"].values()) == 24 and report["llm_calls"] == 24
+    assert report["orders"]["orders"] >= 2 and replay.email.reports == 12
+    assert seen and all(seen), "bars after the virtual clock leaked into a cycle"
+    assert (coordinator._get_llm_agent, coordinator._get_data_ingestor) == getters
+    print(f"✅ Replayed {report['cycles']} cycles at {report['speedup']}x real time")
+
+
+def test_load_history_merges_archive_with_stored_bars():
+    """An archive that only started filling recently is topped up with the older stored history."""
+    print("🧪 Testing history loading across the archive and storage...")
+    import tempfile
+    from trading_agent.agents import bar_archive, storage_agent
+    from trading_agent.agents.backtester import load_history
+
+    bars = _bars(100 + np.arange(300) * 0.1).rename(columns={"open": "o", "high": "h", "low": "l",
+                                                             "close": "c", "volume": "v"})
+    stored = storage_agent.TradingStorage(write_behind=False, local_path=":memory:")
+    stored.local.write_frame("market_data", "AAPL", bars.iloc[:250])
+    original = bar_archive._bar_archive, storage_agent.trading_storage
+    with tempfile.TemporaryDirectory() as root:
+        archive = bar_archive.BarArchive(root)
+        archive.append("AAPL", bars.iloc[200:], "5Min")
+        bar_archive._bar_archive, storage_agent.trading_storage = archive, stored
+        try:
+            history = load_history(["AAPL"], start_date=str(bars.index[0]))
+            latest = load_history(["AAPL"], start_date=str(bars.index[250]))
+        finally:
+            bar_archive._bar_archive, storage_agent.trading_storage = original
+
+    assert len(history["AAPL"]) == 300 and history["AAPL"].index.is_monotonic_increasing
+    assert np.allclose(history["AAPL"]["c"].to_numpy(), bars["c"].to_numpy())
+    assert len(latest["AAPL"]) == 50  # the archive covers this window alone
+    print("✅ Archive and stored history merge into one series")
+
+
+if __name__ == "__main__":
+    test_vectorized_rules_match_scalar_rules()
+    test_backtest_runs_coordinator_path()
+    test_stats_from_equity_and_fills()
+    test_parameter_sweep_over_shared_bars()
+    test_session_replay_runs_the_graph()
+    test_load_history_merges_archive_with_stored_bars()
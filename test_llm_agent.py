@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Offline tests for the LLM decision layer (no Gemini or LangSmith calls)."""
+
+import os
+import time
+import tempfile
+
+# Keep the LLM agent offline: dummy key, tracing off
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ["LANGSMITH_TRACING"] = "false"
+
+from trading_agent.agents import llm_agent
+from trading_agent.agents.llm_cache import DecisionCache, prompt_key
+from trading_agent.agents.llm_client import AsyncLLMClient, FakeLLMBackend, LLMTimeoutError
+from trading_agent.agents.decision_parser import StreamingDecisionMatcher, DECISION_VOCABULARY
+from trading_agent.agents.model_cascade import ModelCascade, RuleTier, LLMTier, parse_confidence
+from trading_agent.agents.prompt_builder import build_compact_prompt, estimate_tokens, STATIC_PREAMBLE
+from trading_agent.agents import tracing
+
+
+def test_decision_cache():
+    """Identical and whitespace-variant prompts reuse one LLM response."""
+    print("🧪 Testing LLM decision cache...")
+    fake_llm = FakeLLMBackend(answer="OCO_SELL")
+    llm_agent.llm_client.set_backend(fake_llm)
+    llm_agent.decision_cache.clear()
+
+    first, second = {}, {}
+    d1 = llm_agent.make_trade_decision("AAPL", indicators={'rsi': 75.0}, metadata=first)
+    d2 = llm_agent.make_trade_decision("AAPL", indicators={'rsi': 75.0}, metadata=second)
+
+    assert d1 == d2 == "OCO_SELL"
+    assert fake_llm.calls == 1
+    assert first['cache_hit'] is False
+    assert second['cache_hit'] is True and second['cache_tier'] == "memory"
+
+    # Untraced calls share the cache with the traced invoke_llm
+    prompt = llm_agent.format_prompt("MSFT", "data")
+    llm_agent.invoke_llm(prompt)
+    llm_agent._invoke_cached("  " + prompt.replace("\n", "\n   "))
+    assert fake_llm.calls == 2
+    print("✅ Cache hits recorded in decision metadata")
+
+
+def test_decision_cache_ttl_lru_and_disk():
+    """Entries expire after the TTL, the LRU is bounded and the disk tier survives restarts."""
+    print("🧪 Testing cache TTL, eviction and disk tier...")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = DecisionCache(ttl_seconds=60, max_entries=2, cache_dir=cache_dir)
+        for i in range(3):
+            cache.set(prompt_key(f"prompt {i}"), f"answer {i}")
+        assert len(cache) == 2 and cache.stats['evictions'] == 1
+
+        # A fresh process-level cache picks the evicted entry up from disk
+        restarted = DecisionCache(ttl_seconds=60, max_entries=2, cache_dir=cache_dir)
+        entry = restarted.get(prompt_key("prompt 0"))
+        assert entry['response'] == "answer 0" and entry['tier'] == "disk"
+
+        expired = DecisionCache(ttl_seconds=-1, max_entries=2, cache_dir=cache_dir)
+        assert expired.get(prompt_key("prompt 1")) is None
+        assert expired.purge_expired() == 2
+    print("✅ TTL, LRU eviction and disk tier behave as expected")
+
+
+def test_llm_client_concurrency_and_deadlines():
+    """The semaphore caps in-flight calls and slow calls fail at their deadline."""
+    print("🧪 Testing async LLM client limits...")
+    backend = FakeLLMBackend(answer="HOLD", latency=0.05)
+    client = AsyncLLMClient(backend, max_concurrency=2, timeout=1.0)
+    results = client.invoke_many([f"prompt {i}" for i in range(6)])
+    assert results == ["HOLD"] * 6
+    assert backend.max_in_flight == 2
+
+    slow = AsyncLLMClient(FakeLLMBackend(latency=0.5), timeout=0.05)
+    try:
+        slow.invoke("slow prompt")
+        assert False, "expected a timeout"
+    except LLMTimeoutError:
+        pass
+    assert slow.stats['timeouts'] == 1
+    print("✅ Concurrency limited and deadlines enforced")
+
+
+def test_llm_client_retries_and_hedging():
+    """Rate limits are retried with backoff and stragglers are hedged after p95."""
+    print("🧪 Testing retries and hedged requests...")
+    flaky = AsyncLLMClient(FakeLLMBackend(answer="STOP_LOSS", rate_limit_failures=2),
+                           backoff_seconds=0.01, timeout=2.0)
+    assert flaky.invoke("prompt") == "STOP_LOSS"
+    assert flaky.stats['retries'] == 2
+
+    # Every 10th call straggles; the hedge should answer long before it finishes
+    backend = FakeLLMBackend(answer="HOLD", latency=lambda n: 1.0 if n % 10 == 0 else 0.01)
+    client = AsyncLLMClient(backend, max_concurrency=4, timeout=2.0, hedge=True, hedge_min_samples=5)
+    for i in range(9):
+        client.invoke(f"warmup {i}")
+    start = time.perf_counter()
+    assert client.invoke("straggler") == "HOLD"
+    assert time.perf_counter() - start < 0.5
+    assert client.stats['hedged'] == 1 and client.stats['hedge_wins'] == 1
+    print("✅ Retries and hedging work offline")
+
+
+def test_make_trade_decision_timeout_holds():
+    """A decision whose LLM call times out falls back to HOLD and is not cached."""
+    llm_agent.llm_client.set_backend(FakeLLMBackend(answer="BRACKET_BUY", latency=0.5))
+    original_timeout = llm_agent.llm_client.timeout
+    llm_agent.llm_client.timeout = 0.05
+    llm_agent.decision_cache.clear()
+    try:
+        metadata = {}
+        assert llm_agent.make_trade_decision("TSLA", metadata=metadata) == "HOLD"
+        assert metadata['llm_timeout'] is True
+        assert len(llm_agent.decision_cache) == 0
+    finally:
+        llm_agent.llm_client.timeout = original_timeout
+
+
+def test_streaming_decision_early_exit():
+    """Streaming stops generating once the decision keyword is recognized."""
+    print("🧪 Testing streaming early-exit decisions...")
+    # Every action keyword is recognized as soon as the character after it ends the word
+    for word in DECISION_VOCABULARY:
+        matcher = StreamingDecisionMatcher()
+        assert not matcher.feed("Decision: " + word)
+        assert matcher.feed(" trailing text") == (word != "HOLD")  # an action could still follow HOLD
+        assert matcher.finish() == llm_agent.parse_output(word) == DECISION_VOCABULARY[word]
+    # Streamed or whole, a completion resolves the same way: first whole-word action, HOLD only without one
+    for text, expected in [("OCO_SELL now; a BRACKET_BUY would chase the move", "OCO_SELL"),
+                           ("HOLD - no, STOP_LOSS after all", "STOP_LOSS"),
+                           ("Given the RSI threshold, OCO_SELL", "OCO_SELL"),
+                           ("Shareholders would want STOP_LOSS", "STOP_LOSS"),
+                           ("HOLDING is wrong; OCO_SELL", "OCO_SELL"),
+                           ("**HOLD** - the threshold isn't met", "HOLD"),
+                           ("XSTOP_LOSS and OCO_SELLING aren't keywords", None)]:
+        matcher = StreamingDecisionMatcher()
+        for i in range(0, len(text), 3):
+            if matcher.feed(text[i:i + 3]):
+                break
+        assert matcher.finish() == expected, text
+        assert llm_agent.parse_output(text) == (expected or "HOLD"), text
+
+    answer = "TRAILING_STOP_SELL - price is extended above the EMA and RSI is overbought, " * 5
+    backend = FakeLLMBackend(answer=answer, chunk_size=4, chunk_latency=0.002)
+    llm_agent.llm_client.set_backend(backend)
+    llm_agent.decision_cache.clear()
+    llm_agent.LLM_STREAM_DECISIONS = True
+    try:
+        metadata = {}
+        assert llm_agent.make_trade_decision("NVDA", metadata=metadata) == "TRAILING_STOP_SELL"
+    finally:
+        llm_agent.LLM_STREAM_DECISIONS = False
+
+    assert metadata['stopped_early'] is True
+    assert backend.chunks_sent == 5  # "TRAI" "LING" "_STO" "P_SE" "LL -"
+    assert metadata['first_token_ms'] <= metadata['decision_recognized_ms']
+    print(f"✅ Decision recognized after {metadata['stream_chunks']} chunks "
+          f"({metadata['decision_recognized_ms']}ms)")
+
+
+def test_model_cascade_escalation():
+    """Confident cheap answers stick; uncertain or high-stakes cases reach the strong model."""
+    print("🧪 Testing model cascade...")
+    cheap = FakeLLMBackend(answer="LIMIT_BUY\nCONFIDENCE: 40")
+    cascade = ModelCascade([RuleTier(), LLMTier("fake-lite", AsyncLLMClient(cheap))], final_tier_name="strong")
+    strong_calls = []
+
+    def strong():
+        strong_calls.append(1)
+        return "HOLD"
+
+    small_account = {'cash': '50', 'equity': '5000'}
+    # Up 10% and overbought: the rule engine is confident
+    clear = {'position_data': {'qty': '1', 'current_price': '110', 'avg_entry_price': '100'},
+             'indicators': {'rsi': 78.0, 'ema': 105.0}, 'account_data': small_account, 'prompt': "clear"}
+    metadata = {}
+    assert cascade.decide(clear, strong, metadata=metadata) == "OCO_SELL"
+    assert metadata['cascade_tier'] == "rules" and not strong_calls
+
+    # Mixed signals: rules and the cheap model are unsure, so escalate
+    mixed = {'position_data': {'qty': '1', 'current_price': '101', 'avg_entry_price': '100'},
+             'indicators': {'rsi': 50.0}, 'account_data': small_account, 'prompt': "mixed"}
+    metadata = {}
+    assert cascade.decide(mixed, strong, metadata=metadata) == "HOLD"
+    assert metadata['escalation_reason'] == "low_confidence" and len(strong_calls) == 1
+
+    # Large position relative to equity skips the cheap tiers entirely
+    concentrated = dict(clear, position_data={'qty': '20', 'current_price': '110', 'avg_entry_price': '100'})
+    metadata = {}
+    cascade.decide(concentrated, strong, metadata=metadata)
+    assert metadata['escalation_reason'] == "order_size" and len(strong_calls) == 2
+
+    stats = cascade.stats.snapshot()
+    assert stats['decisions'] == 3 and stats['escalations'] == 2
+    assert stats['tiers']['fake-lite']['disagreement_rate'] == 1.0
+
+    # Only the labelled number is the confidence, not a trail %, price or RSI level mentioned first
+    assert parse_confidence("TRAILING_STOP with 2% trail, confidence 90%") == 0.9
+    assert parse_confidence("Sell at $45 with RSI 72\nCONFIDENCE: 80") == 0.8
+    assert parse_confidence("LIMIT_BUY at 98.5, 3% below market") == 0.0
+
+    # A confident cheap answer is taken as it reads: the action, not HOLD out of "threshold"
+    sure = FakeLLMBackend(answer="Given the RSI threshold, OCO_SELL with a 3% stop.\nCONFIDENCE: 85")
+    cascade = ModelCascade([RuleTier(), LLMTier("fake-sure", AsyncLLMClient(sure))], final_tier_name="strong")
+    metadata = {}
+    assert cascade.decide(dict(mixed, prompt="mixed-sure"), strong, metadata=metadata) == "OCO_SELL"
+    assert metadata['cascade_tier'] == "fake-sure" and len(strong_calls) == 2
+    print(f"✅ Escalation rate {stats['escalation_rate']:.0%}")
+
+
+def test_compact_prompt_budget():
+    """Compact prompts are deterministic, keep the preamble prefix and respect the budget."""
+    print("🧪 Testing compact prompt builder...")
+    position = {'qty': '3', 'avg_entry_price': '100', 'current_price': '104',
+                'unrealized_pl': '12', 'unrealized_plpc': '0.04'}
+    indicators = {'c': 104.0, 'rsi': 64.2, 'ema': 102.5, 'atr': 0.8, 'volatility_score': 1.3}
+    news = [{'title': f"Headline number {i} " + "detail " * 30, 'sentiment': 'positive'} for i in range(5)]
+    market = {'sentiment': 'bullish', 'summary': "Stocks rallied " * 40, 'key_levels': ['4500', '4550']}
+    args = ("AAPL", position, indicators, {'cash': '12', 'buying_power': '24'}, [{'decision': 'HOLD'}], news, market)
+
+    roomy = build_compact_prompt(*args, token_budget=2000)
+    assert roomy == build_compact_prompt(*args, token_budget=2000)
+    assert roomy['text'].startswith(STATIC_PREAMBLE) and not roomy['dropped']
+    assert "IND rsi=64.2 ema=102.50 atr=0.80 vol=1.3" in roomy['body']
+
+    tight = build_compact_prompt(*args, token_budget=estimate_tokens(STATIC_PREAMBLE) + 90)
+    assert tight['tokens'] <= estimate_tokens(STATIC_PREAMBLE) + 90
+    assert "POS qty=3" in tight['body'] and "market_summary" in tight['dropped']
+
+    llm_agent.llm_client.set_backend(FakeLLMBackend(answer="HOLD"))
+    metadata = {}
+    llm_agent.make_trade_decision(*args, metadata=metadata)
+    assert 'prompt_tokens_before' not in metadata  # the verbose prompt isn't built unless logging asks for it
+    llm_agent.LLM_LOG_PROMPT_TOKENS = True
+    try:
+        metadata = {}
+        llm_agent.make_trade_decision(*args, metadata=metadata)
+    finally:
+        llm_agent.LLM_LOG_PROMPT_TOKENS = False
+    assert metadata['prompt_tokens'] < metadata['prompt_tokens_before']
+    print(f"✅ Prompt tokens {metadata['prompt_tokens_before']} -> {metadata['prompt_tokens']}")
+
+
+def test_tracing_policy_sampling_and_queue():
+    """Sampling is decided per trace, opt-in is per function and export never blocks."""
+    print("🧪 Testing tracing policy...")
+    exported = []
+    original = tracing.tracing_policy
+    tracing.tracing_policy = tracing.TracingPolicy(
+        enabled=True, sample_rate=1.0, traced_functions="outer,inner",
+        exporter=tracing.TraceExporter(sink=exported.extend, flush_interval=0.01))
+
+    @tracing.traced
+    def inner(x):
+        return x * 2
+
+    @tracing.traced
+    def not_opted_in(x):
+        return inner(x)
+
+    @tracing.traced(name="outer")
+    def outer(x):
+        return not_opted_in(x) + 1
+
+    try:
+        assert outer(3) == 7
+        assert tracing.tracing_policy.exporter.flush()
+        names = {run['name']: run for run in exported}
+        assert set(names) == {"outer", "inner"}
+        assert names["inner"]['parent_run_id'] == names["outer"]['id']
+        assert names["inner"]['dotted_order'].startswith(names["outer"]['dotted_order'] + ".")
+
+        # Sampled-out traces skip every nested call too
+        tracing.tracing_policy.sample_rate = 0.0
+        exported.clear()
+        outer(3)
+        tracing.tracing_policy.exporter.flush()
+        assert exported == []
+
+        # A full queue with a stalled sink drops runs instead of blocking the caller
+        stalled = tracing.TraceExporter(max_queue=5, sink=lambda runs: time.sleep(0.5))
+        accepted = sum(stalled.submit({'args': (), 'kwargs': {}, 'output': None}) for _ in range(50))
+        assert accepted <= 6 and stalled.stats['dropped'] >= 44
+    finally:
+        tracing.tracing_policy = original
+    print("✅ Sampling, opt-in and bounded export behave as expected")
+
+
+def test_tracing_overhead():
+    """Report per-call overhead with tracing off, sampled at 10% and always on."""
+    print("🧪 Measuring tracing overhead...")
+    original = tracing.tracing_policy
+
+    @tracing.traced(name="bench")
+    def bench(x):
+        return x + 1
+
+    results = {}
+    iterations = 20000
+    try:
+        for label, enabled, rate in [("off", False, 1.0), ("sampled 10%", True, 0.1), ("on", True, 1.0)]:
+            tracing.tracing_policy = tracing.TracingPolicy(
+                enabled=enabled, sample_rate=rate, traced_functions="bench",
+                exporter=tracing.TraceExporter(max_queue=iterations, sink=lambda runs: None))
+            start = time.perf_counter()
+            for i in range(iterations):
+                bench(i)
+            results[label] = (time.perf_counter() - start) / iterations * 1e6
+            tracing.tracing_policy.exporter.flush()
+    finally:
+        tracing.tracing_policy = original
+
+    for label, micros in results.items():
+        print(f"   {label}: {micros:.2f}µs per call")
+    assert results["off"] < results["on"]
+
+
+if __name__ == "__main__":
+    test_decision_cache()
+    test_decision_cache_ttl_lru_and_disk()
+    test_llm_client_concurrency_and_deadlines()
+    test_llm_client_retries_and_hedging()
+    test_make_trade_decision_timeout_holds()
+    test_streaming_decision_early_exit()
+    test_model_cascade_escalation()
+    test_compact_prompt_budget()
+    test_tracing_policy_sampling_and_queue()
+    test_tracing_overhead()
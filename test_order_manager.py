@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""Offline tests for order submission (Alpaca HTTP calls are replaced by a local fake)."""
+
+import time
+import types
+import requests
+
+from trading_agent.agents import order_manager
+from trading_agent import coordinator
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None, text=""):
+        self.status_code = status_code
+        self.payload = payload
+        self.text = text
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error")
+
+
+class FakeAlpaca:
+    """Minimal stand-in for the /v2/orders endpoints, keyed by client_order_id."""
+
+    exceptions = requests.exceptions
+
+    def __init__(self, timeout_first_post=False):
+        self.orders = {}
+        self.posts = 0
+        self.timeout_first_post = timeout_first_post
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.posts += 1
+        coid = json.get("client_order_id")
+        if coid in self.orders:
+            return FakeResponse(422, text='{"message": "client_order_id must be unique"}')
+        order = {"id": f"order-{len(self.orders) + 1}", "status": "accepted", **json}
+        self.orders[coid] = order
+        if self.timeout_first_post and self.posts == 1:
+            # The order landed, but the response never made it back
+            raise requests.exceptions.Timeout("read timed out")
+        return FakeResponse(200, order)
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        order = self.orders.get(params["client_order_id"])
+        return FakeResponse(200, order) if order else FakeResponse(404)
+
+
+def _with_fake_alpaca(fake):
+    original = order_manager.requests
+    order_manager.requests = fake
+    return original
+
+
+def test_idempotent_retry_after_timeout():
+    """A timed-out POST that actually landed is found by client_order_id, not resubmitted."""
+    print("🧪 Testing idempotent order retries...")
+    fake = FakeAlpaca(timeout_first_post=True)
+    original = _with_fake_alpaca(fake)
+    try:
+        coid = order_manager.make_client_order_id("20260101T093000", "AAPL", "STOP_LOSS")
+        assert coid == order_manager.make_client_order_id("20260101T093000", "AAPL", "STOP_LOSS")
+        order = order_manager.place_stop_order("AAPL", 5, "sell", 95.0, client_order_id=coid)
+        assert order["client_order_id"] == coid
+        assert len(fake.orders) == 1 and fake.posts == 1
+
+        # Re-running the same cycle's submission hits the duplicate check
+        again = order_manager.place_stop_order("AAPL", 5, "sell", 95.0, client_order_id=coid)
+        assert again["id"] == order["id"] and len(fake.orders) == 1
+    finally:
+        order_manager.requests = original
+    print("✅ Retries reuse the existing order")
+
+
+def test_rate_limiter_paces_requests():
+    """The token bucket spaces requests once the burst is used up."""
+    limiter = order_manager.RateLimiter(rate_per_minute=600, burst=1)
+    start = time.perf_counter()
+    for _ in range(5):
+        limiter.acquire()
+    elapsed = time.perf_counter() - start
+    assert 0.35 <= elapsed < 1.0, elapsed
+
+
+def test_execute_actions_submits_in_parallel():
+    """Slow order POSTs overlap and each action records its client_order_id and latency."""
+    print("🧪 Testing parallel order submission...")
+
+    def slow_place(*args, client_order_id=None, **kwargs):
+        time.sleep(0.2)
+        return {"id": client_order_id, "status": "accepted"}
+
+    fake_manager = types.SimpleNamespace(
+        make_client_order_id=order_manager.make_client_order_id,
+        place_stop_order=slow_place, place_trailing_stop=slow_place, place_oco_order=slow_place,
+        place_limit_order=slow_place, place_bracket_order=slow_place, place_order=slow_place)
+    position = {'qty': '4', 'current_price': '100', 'unrealized_plpc': '0.01'}
+    state = {
+        'cycle_id': "20260101T093000",
+        'account': {'cash': '1000'},
+        'decisions': {sym: {'decision': "STOP_LOSS", 'position': position, 'indicators': {}}
+                      for sym in ["AAPL", "MSFT", "NVDA", "AMD"]},
+    }
+
+    original = coordinator._get_order_manager
+    coordinator._get_order_manager = lambda: fake_manager
+    try:
+        start = time.perf_counter()
+        actions = coordinator.execute_actions(state)['actions_taken']
+        elapsed = time.perf_counter() - start
+    finally:
+        coordinator._get_order_manager = original
+
+    assert elapsed < 0.6, elapsed
+    for symbol, action in actions.items():
+        assert action['client_order_id'] == order_manager.make_client_order_id(state['cycle_id'], symbol, "STOP_LOSS")
+        assert action['submit_latency_ms'] >= 200
+    print(f"✅ 4 orders submitted in {elapsed:.2f}s")
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_order_book_mirror():
+    """The order book seeds once from REST and then follows trade update events."""
+    print("🧪 Testing local order book mirror...")
+    book = order_manager.OrderBook()
+    seeded = [
+        {"id": "o1", "symbol": "AAPL", "side": "sell", "type": "stop", "status": "new", "submitted_at": "2026-01-01T14:30:00Z"},
+        {"id": "o2", "symbol": "MSFT", "side": "buy", "type": "limit", "status": "new", "submitted_at": "2026-01-01T14:31:00Z"},
+    ]
+    assert book.seed(fetch=lambda: seeded) == 2
+    assert book.has_protective_order("AAPL") and not book.has_protective_order("MSFT")
+
+    source = order_manager.LocalEventSource()
+    book.consume(source)
+    assert book.is_live()
+
+    # MSFT limit buy fills, AAPL stop is canceled, and a new OCO exit protects MSFT
+    source.push({"event": "fill", "price": "410.5", "qty": "2",
+                 "order": dict(seeded[1], status="filled", filled_qty="2", filled_avg_price="410.5")})
+    source.push({"event": "canceled", "order": dict(seeded[0], status="canceled")})
+    source.push({"event": "new", "order": {
+        "id": "o3", "symbol": "MSFT", "side": "sell", "type": "limit", "order_class": "oco",
+        "status": "new", "submitted_at": "2026-01-01T14:32:00Z",
+        "legs": [{"id": "o3-stop", "symbol": "MSFT", "side": "sell", "type": "stop", "status": "held"}]}})
+    assert _wait_for(lambda: book.stats['events'] == 3)
+    source.close()
+
+    assert book.open_orders("AAPL") == [] and not book.has_protective_order("AAPL")
+    assert {o["id"] for o in book.protective_orders("MSFT")} == {"o3", "o3-stop"}
+    assert book.fills_for_symbol("MSFT")[0]["price"] == 410.5
+    assert book.cursor == "2026-01-01T14:32:00Z"
+    print("✅ Order book tracks fills, cancels and protective orders")
+
+
+def test_reconcile_protective_orders():
+    """Only changed protection is sent: equivalent orders are kept, drifted stops patched,
+    duplicates cancelled in one batch, and conflicting ones cancelled once the new order is in."""
+    print("🧪 Testing protective order reconciliation...")
+    calls = {"cancel": [], "replace": [], "place": [], "log": []}
+
+    def place(*args, client_order_id=None, **kwargs):
+        calls["place"].append(args[0])
+        calls["log"].append(("place", args[0]))
+        return {"id": client_order_id, "status": "accepted"}
+
+    def cancel_orders(order_ids):
+        calls["cancel"].extend(order_ids)
+        calls["log"].extend(("cancel", order_id) for order_id in order_ids)
+        return {order_id: None for order_id in order_ids}
+
+    def replace_order(order_id, **kwargs):
+        calls["replace"].append((order_id, kwargs))
+        return {"id": f"{order_id}-r", "status": "accepted", **kwargs}
+
+    fake_manager = types.SimpleNamespace(
+        order_book=order_manager.OrderBook(), is_protective_order=order_manager.is_protective_order,
+        TERMINAL_ORDER_STATUSES=order_manager.TERMINAL_ORDER_STATUSES,
+        make_client_order_id=order_manager.make_client_order_id,
+        cancel_orders=cancel_orders, replace_order=replace_order,
+        place_stop_order=place, place_trailing_stop=place, place_oco_order=place)
+    position = {'qty': '4', 'current_price': '100', 'unrealized_plpc': '0.01'}
+
+    def stop(order_id, symbol, stop_price):
+        return {"id": order_id, "symbol": symbol, "side": "sell", "type": "stop", "qty": "4",
+                "stop_price": stop_price, "status": "new"}
+
+    state = {
+        'cycle_id': "20260101T093000",
+        'account': {'cash': '1000'},
+        'orders': [
+            stop("a1", "AAPL", "95.00"),                      # already what we want
+            stop("m1", "MSFT", "90.00"),                      # stale price -> replace
+            {"id": "n1", "symbol": "NVDA", "side": "sell", "type": "trailing_stop",
+             "qty": "4", "trail_percent": "3", "status": "new"},  # wrong kind -> cancel + place
+            stop("d1", "AMD", "95.00"), stop("d2", "AMD", "95.00"),  # duplicate -> cancel one
+        ],
+        'decisions': {
+            "AAPL": {'decision': "STOP_LOSS", 'position': position, 'indicators': {}},
+            "MSFT": {'decision': "STOP_LOSS", 'position': position, 'indicators': {}},
+            "NVDA": {'decision': "OCO_SELL", 'position': position, 'indicators': {}},
+            "AMD": {'decision': "STOP_LOSS", 'position': position, 'indicators': {}},
+        },
+    }
+
+    original = coordinator._get_order_manager
+    coordinator._get_order_manager = lambda: fake_manager
+    try:
+        state = coordinator.reconcile_orders(state)
+        actions = coordinator.execute_actions(state)['actions_taken']
+    finally:
+        coordinator._get_order_manager = original
+
+    ops = {symbol: plan['op'] for symbol, plan in state['reconciliation'].items()}
+    assert ops == {"AAPL": "noop", "MSFT": "replace", "NVDA": "place", "AMD": "noop"}, ops
+    assert sorted(calls["cancel"]) == ["d2", "n1"]
+    assert calls["replace"] == [("m1", {"qty": 4, "stop_price": 95.0})]
+    assert calls["place"] == ["NVDA"]
+    assert actions["AAPL"]["action"] == "HOLD" and actions["AAPL"]["kept_order_id"] == "a1"
+    assert actions["MSFT"]["replaced_order_id"] == "m1"
+    assert actions["NVDA"]["action"] == "OCO_SELL" and actions["NVDA"]["superseded_order_ids"] == ["n1"]
+    # NVDA keeps its trailing stop until the OCO replacing it has been accepted
+    assert calls["log"].index(("place", "NVDA")) < calls["log"].index(("cancel", "n1"))
+
+    # The broker rejects the new order twice: the old stop is cancelled for the retry, then put back
+    def rejecting_place(*args, client_order_id=None, **kwargs):
+        calls["log"].append(("reject", args[0]))
+        raise RuntimeError("insufficient qty available for order")
+
+    calls["log"].clear()
+    fake_manager.place_oco_order = rejecting_place
+    state['decisions'] = {"NVDA": {'decision': "OCO_SELL", 'position': position, 'indicators': {}}}
+    coordinator._get_order_manager = lambda: fake_manager
+    try:
+        state = coordinator.reconcile_orders(state)
+        actions = coordinator.execute_actions(state)['actions_taken']
+    finally:
+        coordinator._get_order_manager = original
+    assert "error" in actions["NVDA"]
+    assert calls["log"] == [("reject", "NVDA"), ("cancel", "n1"), ("reject", "NVDA"), ("place", "NVDA")], calls["log"]
+
+    # A second pass with nothing changed sends nothing
+    from trading_agent.agents.order_reconciler import plan_protective_orders, protective_order_spec
+    plan = plan_protective_orders(protective_order_spec("STOP_LOSS", position), [stop("a1", "AAPL", "95.2")])
+    assert plan == {"op": "noop", "keep": "a1", "cancel": []}
+    print("✅ Reconciliation keeps, patches and cancels only what changed")
+
+
+def test_risk_engine_sizes_batch_together():
+    """Buys are checked as one batch: caps trim them and cash is never spent twice."""
+    print("🧪 Testing pre-trade risk engine...")
+    from trading_agent.agents.risk_engine import RiskEngine
+
+    engine = RiskEngine.from_account(
+        {"cash": "1000", "buying_power": "1000", "equity": "5000"},
+        positions=[{"symbol": "AAPL", "qty": "5", "current_price": "100", "market_value": "500"}],
+        orders=[{"symbol": "AMD", "side": "buy", "qty": "2", "limit_price": "100"}])
+    result = engine.check_orders(["AAPL", "MSFT", "NVDA"], [10, 5, 5], [100.0, 50.0, 200.0])
+    # $800 spendable after the open AMD buy. AAPL: 25% symbol cap leaves $750 -> 7 shares;
+    # MSFT gets the $100 left -> 2 shares; NVDA nothing
+    assert list(result["approved"]) == [7, 2, 0], result
+    assert list(result["reason"]) == [2, 3, 3]
+    assert engine.available_cash() == 0.0
+
+    # Reservations stick: a second batch can't spend the same cash
+    assert list(engine.check_orders(["MSFT"], [5], [50.0])["approved"]) == [0]
+    engine.release("MSFT", 100.0)
+    assert engine.available_cash() == 100.0
+
+    symbols = [f"S{i}" for i in range(100)]
+    big = RiskEngine(cash=1e6, equity=1e6)
+    big.check_orders(symbols, [10] * 100, [50.0] * 100, reserve=False)
+    start = time.perf_counter()
+    for _ in range(200):
+        big.check_orders(symbols, [10] * 100, [50.0] * 100, reserve=False)
+    per_batch_us = (time.perf_counter() - start) / 200 * 1e6
+    assert per_batch_us < 2000, per_batch_us
+
+    # In the graph: two bracket buys that each look affordable alone
+    placed = []
+
+    def place(symbol, qty, *args, client_order_id=None, **kwargs):
+        placed.append((symbol, qty))
+        return {"id": client_order_id, "status": "accepted"}
+
+    fake_manager = types.SimpleNamespace(make_client_order_id=order_manager.make_client_order_id,
+                                         place_bracket_order=place)
+    position = {'qty': '0', 'current_price': '100'}
+    state = {
+        'cycle_id': "20260101T093000",
+        'account': {'cash': '1000', 'buying_power': '1000', 'equity': '10000'},
+        'positions': [], 'orders': [],
+        'decisions': {sym: {'decision': "BRACKET_BUY", 'position': position, 'indicators': {}}
+                      for sym in ["AAPL", "MSFT"]},
+    }
+    original = coordinator._get_order_manager
+    coordinator._get_order_manager = lambda: fake_manager
+    try:
+        coordinator.execute_actions(state)
+    finally:
+        coordinator._get_order_manager = original
+    assert sum(qty for _, qty in placed) * 99.5 <= 1000, placed
+    print(f"✅ Risk engine checks 100 orders in {per_batch_us:.0f}µs")
+
+
+def test_polling_skips_open_legs():
+    """A poll looks up only orders that really closed: open legs are seen inside their parent,
+    and a closed parent's legs arrive with it."""
+    print("🧪 Testing order book polling...")
+    oco = {"id": "p1", "symbol": "MSFT", "side": "sell", "type": "limit", "order_class": "oco", "status": "new",
+           "legs": [{"id": "l1", "symbol": "MSFT", "side": "sell", "type": "stop", "status": "held"}]}
+    stop = {"id": "s1", "symbol": "AAPL", "side": "sell", "type": "stop", "status": "new"}
+    open_now, lookups = [oco], []
+
+    def get_order(order_id):
+        lookups.append(order_id)
+        if order_id == "p1":
+            return {**oco, "status": "filled", "legs": [{**oco["legs"][0], "status": "canceled"}]}
+        return {**stop, "status": "canceled"}
+
+    backend = types.SimpleNamespace(listeners=[], get_order=get_order,
+                                    list_orders=lambda status, **kwargs: open_now if status == "open" else [])
+    with order_manager.order_backend(backend):
+        book = order_manager.OrderBook()
+        book.seed(fetch=lambda: [oco, stop])
+        source = order_manager.PollingEventSource(book, interval=0)
+        events = source.events()
+        book.apply_event(next(events))
+        assert lookups == ["s1"], lookups
+        open_now.clear()
+        book.apply_event(next(events))
+        source.running = False
+    assert lookups == ["s1", "p1"], lookups
+    assert book.open_orders() == []
+    print("✅ Polling only fetches orders that left the open list")
+
+
+if __name__ == "__main__":
+    test_idempotent_retry_after_timeout()
+    test_rate_limiter_paces_requests()
+    test_execute_actions_submits_in_parallel()
+    test_order_book_mirror()
+    test_reconcile_protective_orders()
+    test_risk_engine_sizes_batch_together()
+    test_polling_skips_open_legs()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Tests for FIFO lot-matching P&L (incremental books, vectorized rebuild, aggregates)."""
+
+from trading_agent.agents.pnl_engine import PnLEngine, rebuild_pnl, fills_from_trades, benchmark
+from trading_agent.agents.performance_aggregates import PerformanceAggregates
+
+
+def _order(symbol, side, qty, price, filled=True):
+    return {"symbol": symbol, "side": side, "qty": str(qty), "filled_qty": str(qty if filled else 0),
+            "filled_avg_price": str(price) if filled else None}
+
+
+def test_fifo_matching_realized_and_unrealized():
+    print("🧪 Testing FIFO lot matching...")
+    engine = PnLEngine()
+    assert engine.apply_fill("AAPL", "buy", 10, 100) == 0
+    engine.apply_fill("AAPL", "buy", 10, 110)
+    assert engine.apply_fill("AAPL", "sell", 15, 120) == 10 * 20 + 5 * 10  # oldest lot first
+    assert engine.books["AAPL"].lots() == [(5, 110)]
+
+    engine.mark({"AAPL": 100})
+    pnl = engine.pnl("AAPL")
+    assert pnl["realized_pnl"] == 250 and pnl["unrealized_pnl"] == -50 and pnl["total_pnl"] == 200
+
+    # Selling through the position closes the long and opens a short with the rest
+    assert engine.apply_fill("AAPL", "sell", 8, 105) == 5 * -5
+    assert engine.books["AAPL"].side == -1 and engine.books["AAPL"].lots() == [(3, 105)]
+    assert engine.apply_fill("AAPL", "buy", 3, 100) == 15
+
+    restored = PnLEngine.from_document(engine.to_document())
+    restored.apply_fill("MSFT", "buy", 1, 50)
+    assert restored.pnl("AAPL")["realized_pnl"] == engine.pnl("AAPL")["realized_pnl"] == 240
+
+    assert engine.apply_order(_order("AAPL", "buy", 5, 100, filled=False)) is None  # not filled yet
+    assert engine.apply_order(_order("AAPL", "buy", 5, 100)) == 0
+    print("✅ FIFO matching realizes oldest lots first")
+
+
+def test_vectorized_rebuild_matches_incremental():
+    trades = [{"order_result": _order(*fill)} for fill in [
+        ("AAPL", "buy", 10, 100), ("MSFT", "sell", 5, 300), ("AAPL", "buy", 5, 90), ("AAPL", "sell", 12, 95),
+        ("MSFT", "buy", 8, 290), ("AAPL", "sell", 3, 101), ("AAPL", "buy", 4, 99), ("AAPL", "sell", 4, 102),
+    ]] + [{"order_result": _order("AAPL", "buy", 1, 1, filled=False)}]
+    fills = fills_from_trades(trades)
+    assert len(fills) == 8
+
+    engine = PnLEngine()
+    incremental = [engine.apply_fill(*row) for row in fills.itertuples(index=False)]
+    rebuilt_engine = PnLEngine()
+    vectorized = rebuild_pnl(fills, rebuilt_engine)["realized_pnl"].tolist()  # MSFT goes short first
+    assert all(abs(a - b) < 1e-9 for a, b in zip(incremental, vectorized)), (incremental, vectorized)
+    for symbol in ("AAPL", "MSFT"):
+        assert rebuilt_engine.books[symbol].lots() == engine.books[symbol].lots()
+
+    # The rebuilt engine carries on exactly like the incremental one
+    assert rebuilt_engine.apply_fill("AAPL", "sell", 2, 110) == engine.apply_fill("AAPL", "sell", 2, 110)
+
+
+def test_aggregates_use_lot_matched_pnl():
+    history = [
+        {"symbol": "AAPL", "decision": "BRACKET_BUY", "order_result": _order("AAPL", "buy", 10, 100)},
+        {"symbol": "AAPL", "decision": "SELL_PARTIAL", "order_result": _order("AAPL", "sell", 4, 110)},
+        {"symbol": "AAPL", "decision": "SELL_ALL", "order_result": _order("AAPL", "sell", 6, 95)},
+        {"symbol": "AAPL", "decision": "LIMIT_BUY", "order_result": _order("AAPL", "buy", 2, 90, filled=False)},
+    ]
+    live = PerformanceAggregates()
+    for trade in history:
+        live.apply(trade)
+    summary = live.summary()
+    assert summary["realized_pnl"] == 40 - 30 and summary["wins"] == 1 and summary["losses"] == 1
+    assert summary["win_rate"] == 50
+
+    rebuilt = PerformanceAggregates().rebuild(history)
+    assert rebuilt.summary()["realized_pnl"] == summary["realized_pnl"]
+    rebuilt.apply({"symbol": "AAPL", "decision": "BUY_MORE", "order_result": _order("AAPL", "buy", 1, 100)})
+    rebuilt.engine.mark({"AAPL": 105})
+    assert rebuilt.pnl("AAPL")["unrealized_pnl"] == 5 and rebuilt.pnl("AAPL")["total_pnl"] == 15
+
+
+def test_100k_fills_benchmark():
+    print("🧪 Benchmarking 100k fills...")
+    result = benchmark(100_000)
+    assert result["max_diff"] < 1e-6, result
+    assert result["incremental_us_per_fill"] < 100, result
+    print(f"✅ {result['fills']:,} fills: {result['incremental_us_per_fill']}us/fill incremental, "
+          f"{result['vectorized_s']}s vectorized rebuild")
+
+
+def test_fill_events_positions_and_no_phantom_shorts():
+    print("🧪 Testing fills that arrive after the trade record...")
+    live = PerformanceAggregates()
+    # A market order's submit response hasn't filled yet
+    submitted = {"id": "o1", **_order("AAPL", "sell", 10, 0, filled=False)}
+    live.apply({"symbol": "AAPL", "decision": "SELL_ALL", "order_result": submitted})
+    assert live.summary()["realized_pnl"] == 0
+
+    # Without lots a sell realizes nothing and opens no short
+    assert live.engine.seed_positions([{"symbol": "AAPL", "qty": "10", "avg_entry_price": "100"},
+                                       {"symbol": "MSFT", "qty": "0", "avg_entry_price": "0"}]) == ["AAPL"]
+    assert live.engine.seed_positions([{"symbol": "AAPL", "qty": "10", "avg_entry_price": "90"}]) == []  # has lots
+    partial = {**submitted, "filled_qty": "4", "filled_avg_price": "110"}
+    assert live.apply_fill(partial) == 40
+    assert live.apply_fill(partial) is None  # the same fill reported again
+    assert live.apply_fill({**submitted, "filled_qty": "10", "filled_avg_price": "106"}) == 20  # rest at 103.33
+    assert live.summary()["realized_pnl"] == 60 and live.summary()["wins"] == 2
+    assert live.engine.books["AAPL"].lots() == []
+
+    engine = PerformanceAggregates().engine
+    engine.apply_order({"id": "o2", **_order("AAPL", "sell", 10, 100)})
+    engine.mark({"AAPL": 110})
+    assert engine.pnl("AAPL")["unrealized_pnl"] == 0 and engine.books["AAPL"].side == 0
+
+    restored = PerformanceAggregates.from_document(live.to_document())
+    assert restored.apply_fill({**submitted, "filled_qty": "10", "filled_avg_price": "106"}) is None
+    rebuilt = PerformanceAggregates().rebuild([{"symbol": "AAPL", "decision": "SELL_ALL",
+                                               "order_result": {**submitted, "filled_qty": "10",
+                                                                "filled_avg_price": "106"}}])
+    assert rebuilt.summary()["realized_pnl"] == 0 and rebuilt.engine.books["AAPL"].side == 0
+    print("✅ Fill events realize P&L once, against seeded lots")
+
+
+if __name__ == "__main__":
+    test_fifo_matching_realized_and_unrealized()
+    test_vectorized_rebuild_matches_incremental()
+    test_aggregates_use_lot_matched_pnl()
+    test_100k_fills_benchmark()
+    test_fill_events_positions_and_no_phantom_shorts()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Tests for the local simulated broker (no network, fills come from synthetic bars)."""
+
+import time
+import numpy as np
+import pandas as pd
+
+from trading_agent.agents import order_manager
+from trading_agent.agents.sim_broker import SimulatedBroker, SimulatedBrokerError
+
+
+def _bars(closes, start="2026-01-05 14:30", spread=0.5):
+    """1-minute bars where each bar opens at the previous close."""
+    closes = np.asarray(closes, dtype=float)
+    opens = np.concatenate(([closes[0]], closes[:-1]))
+    index = pd.date_range(start, periods=len(closes), freq="1min", tz="UTC")
+    return pd.DataFrame({"o": opens, "h": np.maximum(opens, closes) + spread,
+                         "l": np.minimum(opens, closes) - spread, "c": closes, "v": 100}, index=index)
+
+
+def test_order_types_fill_against_bars():
+    """Market, limit, stop, stop-limit, trailing stop, bracket and OCO orders fill where the bars say."""
+    print("🧪 Testing simulated order matching...")
+    up_then_down = list(range(100, 111)) + list(range(109, 95, -1))
+    bars = _bars(up_then_down)
+    broker = SimulatedBroker(cash=10_000, bars={"AAPL": bars, "MSFT": bars})
+    broker.set_time(bars.index[0])
+
+    market = broker.submit_order({"symbol": "AAPL", "qty": 10, "side": "buy", "type": "market"})
+    broker.advance(bars.index[1])
+    assert broker.get_order(market["id"])["status"] == "filled"
+    assert float(broker.get_order(market["id"])["filled_avg_price"]) == 100.0  # next bar's open
+
+    # Limit sell above the market fills when the high reaches it
+    limit = broker.submit_order({"symbol": "AAPL", "qty": 2, "side": "sell", "type": "limit", "limit_price": 105})
+    # Trailing stop on the rest: 3% under the running high of 110.5 -> 107.185
+    trail = broker.submit_order({"symbol": "AAPL", "qty": 8, "side": "sell", "type": "trailing_stop",
+                                 "trail_percent": 3})
+    try:
+        broker.submit_order({"symbol": "AAPL", "qty": 1, "side": "sell", "type": "market"})
+        assert False, "selling more than is held must be rejected"
+    except SimulatedBrokerError:
+        pass
+    broker.advance(bars.index[-1])
+    assert float(broker.get_order(limit["id"])["filled_avg_price"]) == 105.0
+    trail_fill = float(broker.get_order(trail["id"])["filled_avg_price"])
+    assert abs(trail_fill - 110.5 * 0.97) < 1e-6, trail_fill
+    assert broker.get_positions() == []
+
+    # Bracket buy on MSFT: the 103 limit is marketable (fills at the 100 open),
+    # then the 106 take profit fills before the 99 stop
+    broker = SimulatedBroker(cash=10_000, bars={"MSFT": bars})
+    broker.set_time(bars.index[0])
+    bracket = broker.submit_order({"symbol": "MSFT", "qty": 5, "side": "buy", "type": "limit", "limit_price": 103,
+                                   "order_class": "bracket", "time_in_force": "gtc",
+                                   "take_profit": {"limit_price": 106}, "stop_loss": {"stop_price": 99}})
+    broker.advance(bars.index[-1])
+    done = broker.get_order(bracket["id"])
+    assert done["status"] == "filled" and float(done["filled_avg_price"]) == 100.0
+    take_profit, stop_loss = done["legs"]
+    assert take_profit["status"] == "filled" and float(take_profit["filled_avg_price"]) == 106.0
+    assert stop_loss["status"] == "canceled"
+    assert abs(broker.cash - (10_000 + 5 * 6)) < 1e-9
+
+    # OCO exit and stop-limit on the way down
+    broker = SimulatedBroker(cash=10_000, bars={"MSFT": bars})
+    broker.set_time(bars.index[0])
+    broker.submit_order({"symbol": "MSFT", "qty": 4, "side": "buy", "type": "market"})
+    broker.advance(bars.index[10])  # exits go in at the 110 top
+    oco = broker.submit_order({"symbol": "MSFT", "qty": 3, "side": "sell", "type": "limit", "order_class": "oco",
+                               "take_profit": {"limit_price": 120}, "stop_loss": {"stop_price": 104}})
+    stop_limit = broker.submit_order({"symbol": "MSFT", "qty": 1, "side": "sell", "type": "stop_limit",
+                                      "stop_price": 101, "limit_price": 100})
+    broker.advance(bars.index[-1])
+    oco = broker.get_order(oco["id"])
+    assert oco["status"] == "canceled" and oco["legs"][0]["status"] == "filled"
+    assert float(oco["legs"][0]["filled_avg_price"]) == 104.0
+    assert float(broker.get_order(stop_limit["id"])["filled_avg_price"]) == 101.0
+
+    # Day orders that never trade expire at the end of their day
+    broker = SimulatedBroker(cash=10_000, bars={"AAPL": bars})
+    broker.set_time(bars.index[0])
+    day = broker.submit_order({"symbol": "AAPL", "qty": 1, "side": "buy", "type": "limit", "limit_price": 50,
+                               "time_in_force": "day"})
+    broker.advance(bars.index[-1] + pd.Timedelta(days=1))
+    assert broker.get_order(day["id"])["status"] == "expired"
+    print("✅ All order types fill as expected")
+
+
+def test_order_manager_routes_to_simulator():
+    """order_manager's place_* functions and the order book work unchanged against the simulator."""
+    print("🧪 Testing order_manager with the simulated backend...")
+    bars = _bars(list(range(100, 120)))
+    broker = SimulatedBroker(cash=5_000, bars={"NVDA": bars})
+    broker.set_time(bars.index[0])
+    order_manager.set_order_backend(broker)
+    try:
+        order = order_manager.place_bracket_order("NVDA", 10, "buy", 101.0, 110.0, 95.0, client_order_id="cycle-1")
+        assert order_manager.order_book.orders[order["id"]]["status"] == "new"
+        # Same client_order_id again: the duplicate is rejected like Alpaca's 422
+        try:
+            order_manager.place_bracket_order("NVDA", 10, "buy", 101.0, 110.0, 95.0, client_order_id="cycle-1")
+            assert False, "duplicate client_order_id must be rejected"
+        except SimulatedBrokerError:
+            pass
+        broker.advance(bars.index[-1])
+        assert order_manager.order_book.orders[order["id"]]["status"] == "filled"
+        assert order_manager.get_order_by_client_order_id("cycle-1")["id"] == order["id"]
+        assert order_manager.list_orders(status="open") == []
+        account = broker.get_account()
+        assert float(account["cash"]) == 5_000 + 10 * (110 - 100)  # entry fills at the 100 open
+    finally:
+        order_manager.set_order_backend(None)
+    print("✅ Order manager runs against the simulator")
+
+
+def test_day_of_minute_bars_for_100_symbols():
+    """A full session (390 one-minute bars) for 100 symbols, advancing minute by minute."""
+    print("🧪 Benchmarking 100 symbols x 390 one-minute bars...")
+    rng = np.random.default_rng(7)
+    symbols = [f"SYM{i:03d}" for i in range(100)]
+    broker = SimulatedBroker(cash=10_000_000)
+    for symbol in symbols:
+        closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, 390)))
+        broker.load_bars(symbol, _bars(closes, spread=0.05))
+    clock = _bars(np.ones(390)).index
+
+    start = time.perf_counter()
+    broker.set_time(clock[0])
+    for symbol in symbols:
+        price = broker.last_price(symbol)
+        broker.submit_order({"symbol": symbol, "qty": 10, "side": "buy", "type": "limit",
+                             "limit_price": round(price * 0.999, 2), "order_class": "bracket",
+                             "time_in_force": "gtc", "take_profit": {"limit_price": round(price * 1.01, 2)},
+                             "stop_loss": {"stop_price": round(price * 0.99, 2)}})
+    for minute in clock[1:]:
+        broker.advance(minute)
+    elapsed = time.perf_counter() - start
+
+    assert broker.stats["orders"] == 100 and broker.stats["fills"] > 100
+    assert elapsed < 10, elapsed
+    print(f"✅ Simulated {len(symbols) * len(clock):,} bars in {elapsed:.2f}s "
+          f"({broker.stats['fills']} fills)")
+
+
+def test_failed_replace_keeps_the_old_order():
+    """A replacement the broker rejects leaves the original order working, not lost."""
+    print("🧪 Testing simulated cancel-replace...")
+    bars = _bars(range(100, 110))
+    broker = SimulatedBroker(cash=10_000, bars={"AAPL": bars})
+    broker.set_time(bars.index[0])
+    broker.submit_order({"symbol": "AAPL", "qty": 5, "side": "buy", "type": "market"})
+    broker.advance(bars.index[1])
+    stop = broker.submit_order({"symbol": "AAPL", "qty": 5, "side": "sell", "type": "stop", "stop_price": 95,
+                                "time_in_force": "gtc"})
+    try:
+        broker.replace_order(stop["id"], {"qty": 6, "stop_price": 97})
+        assert False, "a replacement for more than is held must be rejected"
+    except SimulatedBrokerError:
+        pass
+    assert broker.get_order(stop["id"])["status"] == "new"
+    assert [o["id"] for o in broker.list_orders(status="open")] == [stop["id"]]
+
+    replaced = broker.replace_order(stop["id"], {"qty": 5, "stop_price": 97})  # frees its own shares
+    assert broker.get_order(stop["id"])["status"] == "replaced" and replaced["stop_price"] == "97"
+    print("✅ Rejected replacements leave the original order in place")
+
+
+if __name__ == "__main__":
+    test_order_types_fill_against_bars()
+    test_order_manager_routes_to_simulator()
+    test_day_of_minute_bars_for_100_symbols()
+    test_failed_replace_keeps_the_old_order()
@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""Tests for the storage write paths (in-memory collections with simulated round-trip latency)."""
+
+import os
+import time
+import types
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from astrapy.exceptions import CollectionInsertManyException
+
+# Storage tests never touch the network or the working directory
+os.environ["ASTRA_DB_BACKEND"] = "memory"
+os.environ["LOCAL_STORE_PATH"] = ":memory:"
+
+from trading_agent.agents.astra_bulk import (bar_documents, indicator_documents, bulk_upsert, compare_write_paths,
+                                             frame_from_cursor)
+from trading_agent.agents.indicator_agent import calculate_indicators
+from trading_agent.agents.write_behind import WriteBehindQueue
+from trading_agent.agents.high_water import HighWaterMarks
+from trading_agent.agents.local_store import LocalStore, frame_from_documents
+from trading_agent.agents.bar_archive import BarArchive, compare_range_reads
+from trading_agent.agents.performance_aggregates import PerformanceAggregates
+from trading_agent.agents.bar_buckets import bucket_documents, upsert_buckets, unpack_buckets
+from trading_agent.agents.astra_memory import MemoryCollection
+from trading_agent.agents.retention import run_retention, downsample, parse_policy
+from trading_agent.agents import astra_db_agent
+from trading_agent.agents.astra_db_agent import AstraDatabaseAgent, AstraUnavailable
+
+
+class FakeCollection:
+    """Just enough of an astrapy Collection, with ``latency`` seconds per request."""
+
+    def __init__(self, latency=0.0, fail_ids=()):
+        self.docs = {}
+        self.latency = latency
+        self.fail_ids = set(fail_ids)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def find(self, filter=None, projection=None, sort=None, limit=None):
+        ids = (filter or {}).get("_id", {}).get("$in")
+        found = [dict(self.docs[i]) for i in ids if i in self.docs] if ids is not None else list(self.docs.values())
+        for _ in range(max(1, -(-len(found) // 20))):  # Data API pages of 20
+            self._request()
+        return found
+
+    def insert_many(self, documents, ordered=False, chunk_size=None, concurrency=None):
+        self._request()
+        inserted, errors = [], []
+        for doc in documents:
+            if doc["_id"] in self.docs or doc["_id"] in self.fail_ids:
+                errors.append(ValueError(f"cannot insert {doc['_id']}"))
+            else:
+                self.docs[doc["_id"]] = dict(doc)
+                inserted.append(doc["_id"])
+        if errors:
+            raise CollectionInsertManyException(inserted_ids=inserted, exceptions=errors)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        self._request()
+        if filter["_id"] in self.fail_ids:
+            raise ValueError(f"cannot write {filter['_id']}")
+        self.docs[filter["_id"]] = dict(replacement)
+
+
+def _bars(n=288, symbol_seed=0):
+    rng = np.random.default_rng(symbol_seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    index = pd.date_range("2026-01-05 14:30", periods=n, freq="5min", tz="UTC")
+    return pd.DataFrame({"o": closes, "h": closes + 0.2, "l": closes - 0.2, "c": closes,
+                         "v": rng.integers(100, 1000, n)}, index=index)
+
+
+def test_documents_match_per_row_layout():
+    """Column-wise documents are the same as the old iterrows() ones (NaN -> None)."""
+    bars = _bars(30)
+    docs = bar_documents("AAPL", bars)
+    first = docs[0]
+    assert first["_id"] == f"bars_AAPL_{bars.index[0].isoformat()}"
+    assert first["close"] == bars["c"].iloc[0] and first["vwap"] == bars["c"].iloc[0]
+    assert isinstance(first["close"], float) and isinstance(first["volume"], int)
+
+    indicators = calculate_indicators(bars)
+    docs = indicator_documents("AAPL", indicators)
+    assert docs[0]["_id"].startswith("indicators_AAPL_") and docs[0]["rsi"] is None  # warm-up NaN
+    assert abs(docs[-1]["ema"] - indicators["ema"].iloc[-1]) < 1e-12
+    assert set(docs[-1]) == {"_id", "symbol", "timestamp", *indicators.columns}
+
+
+def test_bulk_upsert_handles_partial_failures():
+    print("🧪 Testing bulk upserts...")
+    docs = bar_documents("AAPL", _bars(120))
+    bad = docs[7]["_id"]
+    collection = FakeCollection(fail_ids={bad})
+    result = bulk_upsert(collection, docs, chunk_size=50, concurrency=3)
+    assert result["chunks"] == 3 and result["failed"] == [bad] and result["failed_chunks"] == 1
+    assert result["inserted"] == 119 and len(collection.docs) == 119
+
+    # Re-sending the window: unchanged rows are skipped, the changed last bar is replaced
+    collection.fail_ids.clear()
+    docs[-1]["close"] += 1
+    result = bulk_upsert(collection, docs, chunk_size=50)
+    assert result["inserted"] == 1 and result["replaced"] == 1 and result["unchanged"] == 118
+    assert collection.docs[docs[-1]["_id"]]["close"] == docs[-1]["close"]
+    print("✅ Bulk upserts isolate failures per chunk")
+
+
+def test_bulk_writes_beat_per_document_round_trips():
+    """288 bars x 5 symbols with 2ms per request: the old path vs the bulk path."""
+    print("🧪 Benchmarking write paths...")
+    docs = [doc for i in range(5) for doc in bar_documents(f"SYM{i}", _bars(288, i))]
+    collection = FakeCollection(latency=0.002)
+    comparison = compare_write_paths(collection, docs)
+    assert comparison["bulk"]["unchanged"] == len(docs)
+    assert comparison["speedup"] > 10, comparison
+
+    cold = FakeCollection(latency=0.002)
+    result = bulk_upsert(cold, docs)
+    assert result["inserted"] == len(docs) and cold.requests < len(docs) / 5
+    print(f"✅ Bulk path {comparison['speedup']}x faster in steady state; "
+          f"cold insert of {len(docs)} docs took {cold.requests} requests")
+
+
+def test_write_behind_coalesces_and_flushes():
+    """Duplicate writes merge, batches flush by size or age, close() drains everything."""
+    print("🧪 Testing the write-behind queue...")
+    written = []
+    def writer(key, payload):
+        time.sleep(0.01)
+        written.append((key, payload))
+
+    queue = WriteBehindQueue(writer, batch_size=3, flush_interval=0.2)
+    bars = _bars(20)
+    assert queue.put(("market_data", "AAPL"), bars.iloc[:15])
+    queue.put(("market_data", "AAPL"), bars.iloc[10:])  # same key: merged, not queued twice
+    assert not written, "put must not wait on the writer"
+    assert queue.snapshot()["coalesced"] == 1 and queue.depth() == 1
+
+    time.sleep(0.4)  # flushed by age
+    assert len(written) == 1 and written[0][1].index.equals(bars.index)
+
+    for i in range(3):  # flushed by size without waiting for the interval
+        queue.put(("indicators", f"S{i}"), i)
+    time.sleep(0.1)
+    assert len(written) == 4
+
+    queue.put(("indicators", "LAST"), 99)
+    assert queue.close(timeout=2) and written[-1] == (("indicators", "LAST"), 99)
+    stats = queue.snapshot()
+    assert stats["depth"] == 0 and stats["written"] == 5 and stats["avg_flush_ms"] > 0
+    queue.put(("indicators", "AFTER"), 1)  # after shutdown: written in the caller
+    assert written[-1] == (("indicators", "AFTER"), 1)
+    print("✅ Write-behind queue coalesces, flushes and drains")
+
+
+def test_write_behind_backpressure_and_retries():
+    release = threading.Event()
+    calls = {"n": 0}
+    written = {}
+    def slow_writer(key, payload):
+        calls["n"] += 1
+        if key == "flaky" and calls["n"] == 1:
+            raise RuntimeError("transient")
+        release.wait()
+        written[key] = payload
+
+    queue = WriteBehindQueue(slow_writer, max_keys=2, batch_size=1, flush_interval=0.01, put_timeout=0.2)
+    queue.put("flaky", 1)       # fails once, then goes back in the queue
+    time.sleep(0.05)
+    queue.put("a", 1)
+    queue.put("b", 1)
+    start = time.perf_counter()
+    threading.Timer(0.1, release.set).start()
+    queue.put("c", 1)           # full: blocks until the writer frees a slot
+    waited = time.perf_counter() - start
+    assert 0.05 < waited < 1.0, waited
+    assert queue.flush(timeout=2)
+    stats = queue.snapshot()
+    assert set(written) == {"flaky", "a", "b", "c"} and stats["retried"] == 1 and stats["blocked_puts"] >= 1
+    queue.close()
+
+    # A failed write is retried after a flush interval, not straight away
+    attempts = []
+    def failing_once(key, payload):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RuntimeError("transient")
+    queue = WriteBehindQueue(failing_once, flush_interval=0.1)
+    queue.put("k", 1)
+    deadline = time.monotonic() + 2
+    while len(attempts) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(attempts) == 2 and attempts[1] - attempts[0] >= 0.09, attempts
+    queue.close()
+
+
+def test_high_water_marks_send_only_new_rows():
+    """One lookup per key on a cold start, then only rows from the last persisted one on."""
+    print("🧪 Testing delta persistence...")
+    bars = _bars(288)
+    stored = {("market_data", "AAPL"): bars.index[249].isoformat()}
+    lookups = []
+    def lookup(collection, symbol):
+        lookups.append((collection, symbol))
+        return stored.get((collection, symbol))
+
+    marks = HighWaterMarks(lookup)
+    key = ("market_data", "AAPL")
+    fresh = marks.new_rows(key, bars.iloc[:260])
+    assert fresh.index[0] == bars.index[249] and len(fresh) == 11  # last stored row re-sent (may be revised)
+    marks.advance(key, fresh)
+    assert marks.new_rows(key, bars.iloc[:260]).index.tolist() == [bars.index[259]]
+
+    # The next cycle's 24h window slid by two bars: 3 rows go out instead of 288
+    window = bars.iloc[2:262]
+    assert len(marks.new_rows(key, window)) == 3
+
+    other = ("indicators", "MSFT")  # nothing stored yet: everything is new
+    assert len(marks.new_rows(other, bars)) == 288
+    marks.new_rows(other, bars)
+    assert lookups == [key, other], lookups  # cached after the first lookup, even when empty
+
+    naive = bars.tz_localize(None)
+    assert len(marks.new_rows(key, naive.iloc[:262])) == 3  # naive timestamps are treated as UTC
+    assert marks.snapshot()["rows_skipped"] > 0
+    print("✅ Only new and revisable rows are persisted")
+
+
+def test_local_store_round_trip_and_range_reads():
+    """Bars, indicators and trades written locally come back as columnar arrays and frames."""
+    print("🧪 Testing the local store...")
+    store = LocalStore(":memory:")
+    bars = _bars(288)
+    assert store.write_frame("market_data", "AAPL", bars) == 288
+    store.write_frame("market_data", "MSFT", _bars(10, 1))
+
+    arrays = store.read_arrays("market_data", "AAPL")
+    assert arrays["ts"].dtype == np.int64 and np.array_equal(arrays["ts"], bars.index.asi8)
+    assert np.allclose(arrays["c"], bars["c"]) and np.isnan(arrays["vw"]).all()
+
+    recent = store.read_frame("market_data", "AAPL", limit=24)  # most recent rows, oldest first
+    assert recent.index.equals(bars.index[-24:]) and list(recent.columns) == ["o", "h", "l", "c", "v"]
+    window = store.read_frame("market_data", "AAPL", start=bars.index[100], end=bars.index[109].tz_localize(None))
+    assert len(window) == 10 and window.index[0] == bars.index[100]
+    assert store.latest_timestamp("market_data", "AAPL") == bars.index[-1]
+
+    revised = bars.iloc[-1:].copy()
+    revised["c"] += 1  # the newest bar is revised in place
+    store.write_frame("market_data", "AAPL", revised)
+    assert store.count("market_data", "AAPL") == 288
+    assert store.read_arrays("market_data", "AAPL", limit=1)["c"][0] == revised["c"].iloc[0]
+
+    indicators = calculate_indicators(bars)
+    store.write_frame("indicators", "AAPL", indicators)
+    stored = store.read_frame("indicators", "AAPL")
+    assert {"ema", "rsi"} <= set(stored.columns) and np.isnan(stored["rsi"].iloc[0])
+    assert np.allclose(stored["ema"], indicators["ema"])
+
+    store.write_trades([{"_id": f"t{i}", "symbol": "AAPL", "timestamp": bars.index[i], "decision": "BUY"}
+                        for i in range(3)])
+    trades = store.read_trades("AAPL", limit=2)
+    assert [t["_id"] for t in trades] == ["t2", "t1"] and store.read_trades("MSFT") == []
+    assert sorted(store.symbols()) == ["AAPL", "MSFT"]
+
+    documents = pd.DataFrame(bar_documents("AAPL", bars.iloc[:5])).set_index("timestamp")
+    assert list(frame_from_documents(documents).columns) == ["o", "h", "l", "c", "v", "vw"]
+    store.close()
+    print("✅ Local store serves symbol/time range reads")
+
+
+def test_bar_archive_range_reads_are_zero_copy():
+    """Appends in arbitrary chunks, sparse-index range reads, a revisable last bar, reopen from disk."""
+    print("🧪 Testing the bar archive...")
+    bars = _bars(5000)
+    bars["v"] = bars["v"].astype(float)
+    with tempfile.TemporaryDirectory() as root:
+        archive = BarArchive(root, index_every=64)
+        assert archive.append("AAPL", bars.iloc[:1000], "1Min")["appended"] == 1000
+        result = archive.append("AAPL", bars.iloc[900:3001], "1Min")  # overlap: old rows skipped
+        assert result == {"appended": 2001, "revised": 0, "skipped": 100}
+        revised = bars.iloc[3000:3001].copy()
+        revised["c"] += 1
+        assert archive.append("AAPL", revised, "1Min")["revised"] == 1
+        archive.append("AAPL", bars.iloc[3001:], "1Min")
+
+        start, end = bars.index[1234], bars.index[2345]
+        records = archive.read("AAPL", start, end, "1Min")
+        assert isinstance(records.base, np.memmap) or isinstance(records, np.memmap)  # a view, not a copy
+        assert len(records) == 1112 and records["ts"][0] == start.value and records["ts"][-1] == end.value
+        between = archive.read("AAPL", bars.index[10] + pd.Timedelta("30s"), bars.index[12] - pd.Timedelta("30s"), "1Min")
+        assert len(between) == 1 and np.shares_memory(records["c"], records)
+        assert len(archive.read("AAPL", end=bars.index[0] - pd.Timedelta("1min"), timeframe="1Min")) == 0
+
+        reopened = BarArchive(root, index_every=64)
+        os.remove(os.path.join(root, "AAPL_1Min.idx"))  # rebuilt from the records
+        frame = reopened.read_frame("AAPL", timeframe="1Min")
+        expected = bars.copy()
+        expected.iloc[3000, expected.columns.get_loc("c")] += 1
+        assert frame.index.equals(bars.index) and np.allclose(frame[["o", "h", "l", "c", "v"]], expected)
+        assert reopened.symbols() == ["AAPL"] and reopened.read_frame("MSFT").empty
+
+        # The Astra path for the same reads: one query, then documents -> DataFrame
+        collection = FakeCollection(latency=0.0005)
+        for doc in bar_documents("AAPL", bars):
+            collection.docs[doc["_id"]] = doc
+        def fetch(symbol, start, end):
+            docs = [d for d in collection.find({"symbol": symbol}) if start.isoformat() <= d["timestamp"] <= end.isoformat()]
+            df = pd.DataFrame(docs)
+            df["timestamp"] = pd.to_datetime(df["timestamp"])
+            return df.set_index("timestamp").sort_index()
+        ranges = [(bars.index[i], bars.index[i + 287]) for i in range(0, 4500, 500)]
+        comparison = compare_range_reads(reopened, "AAPL", fetch, ranges, "1Min")
+        assert comparison["archive"]["rows"] == comparison["fetch"]["rows"] == 288 * len(ranges)
+        assert comparison["speedup"] > 10, comparison
+    print(f"✅ Archive range reads {comparison['speedup']}x faster than the document path")
+
+
+def test_performance_aggregates_are_incremental():
+    """Folding trades in one at a time matches a rebuild, and survives the summary document."""
+    print("🧪 Testing performance aggregates...")
+    rng = np.random.default_rng(3)
+    decisions = ["BRACKET_BUY", "LIMIT_BUY", "SELL_PARTIAL", "SELL_ALL", "HOLD", "TRAILING_STOP"]
+    trades = [{"symbol": ["AAPL", "MSFT", "NVDA"][i % 3], "decision": decisions[rng.integers(len(decisions))],
+               "timestamp": f"2026-01-05T14:{i % 60:02d}:00", "realized_pnl": None}
+              for i in range(3000)]
+    for trade in trades:
+        if "SELL" in trade["decision"]:
+            trade["realized_pnl"] = float(rng.normal(5, 20))
+
+    live = PerformanceAggregates()
+    for trade in trades:
+        live.apply(trade)
+    rebuilt = PerformanceAggregates().rebuild(trades)
+    assert live.summary()["decisions"] == rebuilt.summary()["decisions"]
+
+    summary = live.summary()
+    sells = [t for t in trades if "SELL" in t["decision"]]
+    assert summary["total_trades"] == 3000 and summary["sell_decisions"] == len(sells)
+    assert summary["buy_decisions"] == sum("BUY" in t["decision"] for t in trades)
+    assert abs(summary["total_pnl"] - round(sum(t["realized_pnl"] for t in sells), 2)) < 0.01
+    wins = sum(t["realized_pnl"] > 0 for t in sells)
+    assert abs(summary["win_rate"] - wins / len(sells) * 100) < 1e-9
+    assert live.pnl("AAPL")["total_trades"] == 1000 and live.pnl("TSLA")["total_trades"] == 0
+
+    restored = PerformanceAggregates.from_document(live.to_document())
+    restored.apply({"symbol": "AAPL", "decision": "SELL_ALL", "realized_pnl": -1.0})
+    assert restored.pnl("AAPL")["losses"] == live.pnl("AAPL")["losses"] + 1
+    assert restored.summary()["decisions"]["SELL_ALL"] == summary["decisions"]["SELL_ALL"] + 1
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        live.pnl()
+    assert time.perf_counter() - start < 0.1  # reads don't scan trades
+    print("✅ Performance aggregates stay current without rescanning trades")
+
+
+def test_storage_runs_without_astra():
+    """No credentials: the in-memory backend stands in, and nothing connects until it's used."""
+    print("🧪 Testing storage without Astra DB...")
+    from trading_agent.agents.storage_agent import TradingStorage, astra_db
+    assert astra_db.backend == "memory"
+
+    storage = TradingStorage(local_path=":memory:")
+    storage.rebuild_performance()
+    bars = _bars(50)
+    storage.save_market_data("AAPL", bars)
+    assert storage.get_market_data("AAPL", limit=10).index.equals(bars.index[-10:])
+    storage.add_trade_record("AAPL", "BRACKET_BUY", {"rsi": 40}, {"cash": 1000},
+                             {"symbol": "AAPL", "side": "buy", "filled_qty": "2", "filled_avg_price": "100"})
+    assert storage.flush(timeout=5)
+    assert storage.get_trades_for_symbol("AAPL")[0]["decision"] == "BRACKET_BUY"
+    assert astra_db.get_latest_timestamp("market_data", "AAPL") == bars.index[-1].isoformat()
+    assert len(astra_db.get_trades("AAPL")) == 1
+
+    # A fresh local tier catches up from the replica
+    fresh = TradingStorage(local_path=":memory:")
+    report = fresh.reconcile(["AAPL"])
+    assert report["pulled"] >= 50 and not report["errors"]
+    assert fresh.get_market_data("AAPL").index.equals(bars.index)
+    assert fresh.get_performance_summary()["buy_decisions"] == 1
+    storage.close()
+    fresh.close()
+    print("✅ Storage works end to end on the in-memory backend")
+
+
+def test_fill_events_reach_performance_and_trades():
+    """A market order filled after its trade was recorded: the order book's fill event carries the P&L."""
+    from trading_agent.agents.storage_agent import TradingStorage, astra_db
+    from trading_agent.agents.order_manager import OrderBook
+
+    storage = TradingStorage(write_behind=False, local_path=":memory:")
+    storage.rebuild_performance()
+    assert storage.sync_positions([{"symbol": "FILL", "qty": "5", "avg_entry_price": "100"}]) == ["FILL"]
+    order = {"id": "fill-1", "symbol": "FILL", "side": "sell", "qty": "5", "filled_qty": "0",
+             "filled_avg_price": None, "status": "accepted"}
+    storage.add_trade_record("FILL", "SELL_ALL", {}, {"cash": 0}, order)
+    assert storage.calculate_pnl("FILL")["realized_pnl"] == 0
+
+    book = OrderBook()
+    book.fill_listeners.append(storage.record_fill)
+    filled = {**order, "filled_qty": "5", "filled_avg_price": "104", "status": "filled"}
+    book.apply_event({"event": "fill", "order": filled, "price": "104", "qty": "5"})
+    book.apply_event({"event": "fill", "order": filled, "price": "104", "qty": "5"})  # duplicate delivery
+    assert storage.calculate_pnl("FILL")["realized_pnl"] == 20
+    assert storage.get_trades_for_symbol("FILL")[0]["order_result"]["filled_qty"] == "5"
+    assert astra_db.get_trades("FILL")[0]["order_result"]["status"] == "filled"
+    assert storage.rebuild_performance()["symbols"]["FILL"]["wins"] == 1
+
+
+def test_astra_connection_is_lazy_with_backoff():
+    """No connection at construction; failed connects back off exponentially; handles are cached."""
+    attempts = []
+    original = astra_db_agent.MemoryDatabase
+    def flaky_database():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise ConnectionError("unreachable")
+        return original()
+
+    def call(agent):
+        try:
+            agent.get_recent_trades()
+        except AstraUnavailable:
+            pass
+
+    astra_db_agent.MemoryDatabase = flaky_database
+    old_base = astra_db_agent.ASTRA_RETRY_BASE_SECONDS
+    astra_db_agent.ASTRA_RETRY_BASE_SECONDS = 0.05
+    try:
+        agent = AstraDatabaseAgent("memory")
+        assert not attempts  # constructing it connects to nothing
+        call(agent)
+        call(agent)  # inside the 0.05s backoff: refused without a connection attempt
+        assert len(attempts) == 1 and agent.health["failures"] == 1
+        time.sleep(0.08)
+        call(agent)
+        assert len(attempts) == 2 and agent.health_check()["retry_in_s"] <= 0.1  # backoff doubled
+        time.sleep(0.15)
+        assert agent.health_check()["connected"] and len(attempts) == 3
+        first = agent._collection("trades")
+        assert agent._collection("trades") is first  # handles are cached
+    finally:
+        astra_db_agent.MemoryDatabase = original
+        astra_db_agent.ASTRA_RETRY_BASE_SECONDS = old_base
+
+def test_storage_has_no_side_effects_until_started():
+    """Building TradingStorage opens no file and starts no thread; start() does both."""
+    from trading_agent.agents.storage_agent import TradingStorage
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "store.sqlite3")
+        storage = TradingStorage(write_behind=False, local_path=path)
+        assert not os.path.exists(path) and storage._reconcile_thread is None
+        storage.start()
+        storage._reconcile_thread.join(5)
+        assert os.path.exists(path)
+        storage.local.close()
+
+
+def test_performance_summary_rebuilds_at_startup_not_per_trade():
+    """A missing summary is rebuilt by start(), not by the first trade of a cycle, and lands in its own collection."""
+    from datetime import datetime
+    from trading_agent.agents import storage_agent
+    from trading_agent.agents.performance_aggregates import SUMMARY_ID
+    agent = AstraDatabaseAgent("memory")
+    scans, iter_trades = [], agent.iter_trades
+    agent.iter_trades = lambda *args, **kwargs: scans.append(1) or iter_trades(*args, **kwargs)
+    agent.save_trade({"_id": "trade_old", "timestamp": datetime(2026, 1, 5, 14, 30), "symbol": "AAPL", "decision": "HOLD",
+                      "order_result": None, "realized_pnl": None})
+    original, storage_agent.astra_db = storage_agent.astra_db, agent
+    try:
+        storage = storage_agent.TradingStorage(write_behind=False, local_path=":memory:")
+        storage.add_trade_record("AAPL", "HOLD", {}, {"cash": 0})
+        assert not scans  # the trading cycle never scans the trade history
+        storage.start()
+        storage._reconcile_thread.join(5)
+        assert scans == [1] and storage.get_performance_summary()["hold_decisions"] == 2
+        storage.start()  # a stored summary now exists
+        assert scans == [1]
+    finally:
+        storage_agent.astra_db = original
+    assert agent.get_performance_summary_document(SUMMARY_ID)["totals"]["hold"] == 2
+
+    # On Astra DB the summary's collection is created with the rest, indexing only what it's queried by
+    created = {}
+    db = types.SimpleNamespace(create_collection=lambda name, **kwargs: created.update({name: kwargs}))
+    agent._ensure_minimal_collections(db)
+    assert created["performance"]["definition"] == {"indexing": {"allow": ["strategy", "timestamp"]}}
+
+
+def test_projected_reads_return_only_requested_fields():
+    """Callers that name fields get just those, from Astra documents and from the local tier."""
+    agent = AstraDatabaseAgent("memory")
+    bars = _bars(40)
+    agent.save_market_data("AAPL", bars)
+    full = agent.get_market_data("AAPL", limit=10)
+    assert {"_id", "symbol", "open", "close", "vwap"} <= set(full.columns) and full.index.equals(bars.index[-10:])
+    closes = agent.get_market_data("AAPL", limit=10, fields=["close", "volume"])
+    assert list(closes.columns) == ["close", "volume"] and np.allclose(closes["close"], bars["c"].iloc[-10:])
+
+    # Ragged documents: columns appear when first seen and are None elsewhere
+    ragged = frame_from_cursor(iter([{"timestamp": "2026-01-05T15:00:00+00:00", "a": 1},
+                                     {"timestamp": "2026-01-05T14:55:00+00:00", "b": 2}]))
+    assert ragged.index.is_monotonic_increasing and ragged["a"].iloc[1] == 1 and pd.isna(ragged["a"].iloc[0])
+
+    order = {"symbol": "AAPL", "side": "buy", "filled_qty": "1", "filled_avg_price": "100"}
+    for i in range(5):
+        agent.save_trade({"_id": f"t{i}", "symbol": "AAPL", "decision": f"D{i}", "timestamp": f"2026-01-05T15:0{i}",
+                          "order_result": order, "indicators": {"rsi": 50}})
+    recent = agent.get_trades("AAPL", limit=3, fields=["decision"])
+    assert recent == [{"_id": "t4", "decision": "D4"}, {"_id": "t3", "decision": "D3"}, {"_id": "t2", "decision": "D2"}]
+
+    store = LocalStore(":memory:")
+    store.write_trades(agent.get_trades("AAPL"))
+    assert store.read_trades("AAPL", limit=2, fields=["decision"]) == recent[:2]
+    assert store.read_trades("AAPL", limit=1, fields=["order_result"])[0]["order_result"] == order  # nested stays JSON
+    assert list(store.read_frame("market_data", "AAPL", columns=["c"]).columns) == []  # nothing stored locally
+    store.write_frame("market_data", "AAPL", bars)
+    assert list(store.read_frame("market_data", "AAPL", limit=5, columns=["c", "v"]).columns) == ["c", "v"]
+
+def test_bar_buckets_append_and_unpack():
+    """Day buckets hold a day of bars in one document; appends push, revisions rewrite, reads unpack."""
+    bars = _bars(288 * 2)  # two UTC days of 5-minute bars, split across three day buckets
+    docs = bucket_documents("AAPL", bars, "day")
+    assert len(docs) == 3 and sum(d["count"] for d in docs) == len(bars)
+    assert docs[0]["t"][0] == (14 * 60 + 30) * 60 and docs[0]["end"] == bars.index[docs[0]["count"] - 1].isoformat()
+
+    collection = MemoryCollection("market_data")
+    first = upsert_buckets(collection, "AAPL", bars.iloc[:300], "day")
+    assert first["inserted"] == 2 and not first["failed"]
+    pushes = []
+    update_one = collection.update_one
+    collection.update_one = lambda f, u, **kw: pushes.append(u) or update_one(f, u, **kw)
+    second = upsert_buckets(collection, "AAPL", bars.iloc[299:], "day")  # re-sends the last bar unchanged
+    assert second["appended"] == 1 and second["inserted"] == 1 and second["replaced"] == 0
+    assert len(pushes[0]["$push"]["t"]["$each"]) == docs[1]["count"] - (300 - docs[0]["count"])
+    assert upsert_buckets(collection, "AAPL", bars.iloc[-50:], "day")["unchanged"] == 1
+    assert collection.count_documents({}) == 3
+
+    revised = bars.iloc[[100]].assign(c=1.0)
+    assert upsert_buckets(collection, "AAPL", revised, "day")["replaced"] == 1
+    frame = unpack_buckets(collection.find({}))
+    assert frame.index.equals(bars.index) and frame["close"].iloc[100] == 1.0
+    assert np.allclose(frame["volume"], bars["v"]) and np.allclose(frame["close"].drop(frame.index[100]),
+                                                                    bars["c"].drop(bars.index[100]))
+    assert upsert_buckets(collection, "AAPL", bars, "day", max_rows=100)["failed"]  # over the array cap
+
+    agent = AstraDatabaseAgent("memory")
+    agent.save_market_data("MSFT", bars.iloc[:10])  # per-bar documents from before buckets were enabled
+    astra_db_agent.ASTRA_BAR_BUCKETS = "day"
+    try:
+        assert len(agent.get_market_data("MSFT", limit=5)) == 5  # falls back to per-bar documents
+        agent.save_market_data("AAPL", bars)
+        assert agent._collection("market_data").count_documents({"symbol": "AAPL"}) == 3
+        assert agent.get_latest_timestamp("market_data", "AAPL") == bars.index[-1].isoformat()
+        recent = agent.get_market_data("AAPL", limit=20, fields=["close"])
+        assert list(recent.columns) == ["close"] and recent.index.equals(bars.index[-20:])
+        since = agent.get_market_data("AAPL", start_date=bars.index[500].isoformat(), limit=1000)
+        assert since.index.equals(bars.index[500:]) and np.allclose(since["open"], bars["o"].iloc[500:])
+    finally:
+        astra_db_agent.ASTRA_BAR_BUCKETS = ""
+
+def test_retention_rolls_up_and_reclaims():
+    """Bars past retention become hourly/daily rollups in every tier; old indicators and rollups go."""
+    print("🧪 Testing retention and compaction...")
+    bars = _bars(288 * 10)
+    bars["v"] = bars["v"].astype(float)
+    now = bars.index[-1]
+    policy = parse_policy("5Min:3,1Hour:5,1Day:0")
+    raw_cutoff, hourly_cutoff = (now - pd.Timedelta(days=3)).floor("D"), (now - pd.Timedelta(days=5)).floor("D")
+
+    daily = downsample(bars, "D")
+    assert daily["h"].iloc[0] == bars["h"].loc[:daily.index[1]].iloc[:-1].max() and daily["v"].sum() == bars["v"].sum()
+
+    storage = type("Storage", (), {"local": LocalStore(":memory:"), "flush": lambda self: True})()
+    storage.local.write_frame("market_data", "AAPL", bars)
+    storage.local.write_frame("indicators", "AAPL", pd.DataFrame({"rsi": 50.0}, index=bars.index))
+    agent = AstraDatabaseAgent("memory")
+    agent.save_market_data("AAPL", bars)
+    agent.save_indicators("AAPL", pd.DataFrame({"rsi": 50.0}, index=bars.index))
+    with tempfile.TemporaryDirectory() as root:
+        archive = BarArchive(root)
+        archive.append("AAPL", bars, "5Min")
+        windows, find_range = [], agent.find_range
+        agent.find_range = lambda *args, **kwargs: windows.append(list(find_range(*args, **kwargs))) or windows[-1]
+        report = run_retention(storage, agent, archive, policy, indicator_days=1, now=now)
+        assert max(len(w) for w in windows) <= 288  # Astra documents are read a day at a time
+        assert all(not t["errors"] for t in report["tiers"].values()), report
+        assert report["documents_reclaimed"] > 0 and report["tiers"]["local"]["bytes_reclaimed"] > 0
+        assert report["tiers"]["archive"]["bytes_reclaimed"] > 0 and report["tiers"]["astra"]["bytes_reclaimed"] > 0
+
+        kept = bars[bars.index >= raw_cutoff]
+        assert storage.local.read_frame("market_data", "AAPL").index.equals(kept.index)
+        assert archive.read_frame("AAPL", timeframe="5Min").index.equals(kept.index)
+        assert agent._collection("market_data").count_documents({}) == len(kept)
+        assert storage.local.read_frame("indicators", "AAPL").index[0] >= (now - pd.Timedelta(days=1)).floor("D")
+
+        old = bars[bars.index < raw_cutoff]
+        hourly = downsample(old, "h")
+        for frame in (storage.local.read_rollups("AAPL", "1Hour"), archive.read_frame("AAPL", timeframe="1Hour")):
+            assert frame.index.equals(hourly.index[hourly.index >= hourly_cutoff])  # older hours are past retention
+        assert np.allclose(storage.local.read_rollups("AAPL", "1Day")["c"], downsample(old, "D")["c"])
+        assert agent._collection("bar_rollups").count_documents({"timeframe": "1Day"}) == len(downsample(old, "D"))
+
+        # Nothing is left to do on a second run
+        again = run_retention(storage, agent, archive, policy, indicator_days=1, now=now)
+        assert again["documents_reclaimed"] == 0 and again["rollups_written"] == 0
+    print(f"✅ Retention reclaimed {report['documents_reclaimed']} rows/documents")
+
+
+if __name__ == "__main__":
+    test_documents_match_per_row_layout()
+    test_bulk_upsert_handles_partial_failures()
+    test_bulk_writes_beat_per_document_round_trips()
+    test_write_behind_coalesces_and_flushes()
+    test_write_behind_backpressure_and_retries()
+    test_high_water_marks_send_only_new_rows()
+    test_local_store_round_trip_and_range_reads()
+    test_bar_archive_range_reads_are_zero_copy()
+    test_performance_aggregates_are_incremental()
+    test_storage_runs_without_astra()
+    test_fill_events_reach_performance_and_trades()
+    test_astra_connection_is_lazy_with_backoff()
+    test_storage_has_no_side_effects_until_started()
+    test_performance_summary_rebuilds_at_startup_not_per_trade()
+    test_projected_reads_return_only_requested_fields()
+    test_bar_buckets_append_and_unpack()
+    test_retention_rolls_up_and_reclaims()
@@ -0,0 +1,196 @@
+import os
+import time
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The Data API takes at most 100 documents per insertMany
+ASTRA_BULK_CHUNK_SIZE = min(100, int(os.getenv("ASTRA_BULK_CHUNK_SIZE", "50")))
+ASTRA_BULK_CONCURRENCY = int(os.getenv("ASTRA_BULK_CONCURRENCY", "4"))
+ASTRA_BULK_WRITES = os.getenv("ASTRA_BULK_WRITES", "true").lower() == "true"
+
+SENSITIVE_FIELDS = ['api_key', 'token', 'password', 'secret', 'key']
+
+def _iso_index(index: pd.Index) -> List[str]:
+    return [ts.isoformat() for ts in pd.DatetimeIndex(index)]
+
+def projection(fields: Optional[List[str]]) -> Optional[Dict[str, bool]]:
+    """Data API projection for ``fields`` (None: whole documents)."""
+    return {field: True for field in fields} if fields else None
+
+def frame_from_cursor(cursor, fields: Optional[List[str]] = None, index: str = "timestamp") -> pd.DataFrame:
+    """A DataFrame built straight from a document cursor, one list per field filled in a single pass.
+
+    The inverse of ``bar_documents``/``indicator_documents``: no intermediate
+    list of dicts, and with ``fields`` only those columns are kept. Rows come
+    back sorted by ``index``.
+    """
+    columns: Dict[str, List[Any]] = {field: [] for field in ([index, *fields] if fields else [])}
+    rows = 0
+    for doc in cursor:
+        if fields:
+            for field, column in columns.items():
+                column.append(doc.get(field))
+        else:
+            for field, value in doc.items():
+                column = columns.get(field)
+                if column is None:
+                    column = columns[field] = [None] * rows
+                column.append(value)
+            for column in columns.values():
+                if len(column) == rows:
+                    column.append(None)
+        rows += 1
+    if not rows:
+        return pd.DataFrame()
+    timestamps = pd.to_datetime(columns.pop(index))
+    frame = pd.DataFrame(columns, index=pd.DatetimeIndex(timestamps, name=index))
+    return frame.sort_index()
+
+def _records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Rows as plain-Python dicts with NaN as None (JSON null)."""
+    for field in SENSITIVE_FIELDS:
+        if field in frame.columns:
+            frame[field] = "***MASKED***"
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict("records")
+
+def bar_documents(symbol: str, data: pd.DataFrame) -> List[Dict[str, Any]]:
+    """``market_data`` documents for a bars DataFrame, built column-wise (same shape as the per-row path)."""
+    if data is None or data.empty:
+        return []
+    iso = _iso_index(data.index)
+    column = lambda name: data[name].to_numpy() if name in data.columns else np.full(len(data), None)
+    frame = pd.DataFrame({
+        "_id": [f"bars_{symbol}_{ts}" for ts in iso],
+        "symbol": symbol,
+        "timestamp": iso,
+        "open": column('o'),
+        "high": column('h'),
+        "low": column('l'),
+        "close": column('c'),
+        "volume": column('v'),
+        "vwap": data['vw'].fillna(data['c']).to_numpy() if 'vw' in data.columns else column('c'),
+    })
+    return _records(frame)
+
+def rollup_documents(symbol: str, timeframe: str, bars: pd.DataFrame) -> List[Dict[str, Any]]:
+    """``bar_rollups`` documents: ``bar_documents`` tagged with the timeframe, keyed per symbol/timeframe/bar."""
+    documents = bar_documents(symbol, bars)
+    for doc in documents:
+        doc["_id"] = f"rollup_{symbol}_{timeframe}_{doc['timestamp']}"
+        doc["timeframe"] = timeframe
+    return documents
+
+def indicator_documents(symbol: str, indicators: pd.DataFrame) -> List[Dict[str, Any]]:
+    """``indicators`` documents: every column of the frame plus _id/symbol/timestamp."""
+    if indicators is None or indicators.empty:
+        return []
+    iso = _iso_index(indicators.index)
+    frame = indicators.reset_index(drop=True)
+    frame.insert(0, "timestamp", iso)
+    frame.insert(0, "symbol", symbol)
+    frame.insert(0, "_id", [f"indicators_{symbol}_{ts}" for ts in iso])
+    return _records(frame)
+
+def upsert_one_by_one(collection, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """The original write path: one ``replace_one(upsert=True)`` round trip per document."""
+    started = time.perf_counter()
+    for doc in documents:
+        collection.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+    return _summary(len(documents), len(documents), 0, [], 1, 0, started)
+
+def _unchanged(stored: Dict[str, Any], doc: Dict[str, Any]) -> bool:
+    return all(stored.get(key) == value for key, value in doc.items())
+
+def _upsert_chunk(collection, chunk: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Upsert one chunk: one lookup of its _ids, one insert_many for the new documents and a
+    replace_one for each document whose stored copy differs."""
+    try:
+        stored = {d["_id"]: d for d in collection.find({"_id": {"$in": [doc["_id"] for doc in chunk]}})}
+    except Exception:
+        stored = {}  # Unknown: insert everything and replace whatever already exists
+    new = [doc for doc in chunk if doc["_id"] not in stored]
+    changed = [doc for doc in chunk if doc["_id"] in stored and not _unchanged(stored[doc["_id"]], doc)]
+    unchanged = len(chunk) - len(new) - len(changed)
+    error = None
+
+    inserted = 0
+    if new:
+        try:
+            collection.insert_many(new, ordered=False, chunk_size=len(new), concurrency=1)
+            inserted = len(new)
+        except Exception as e:
+            # CollectionInsertManyException reports which documents did go in
+            went_in = set(getattr(e, "inserted_ids", None) or [])
+            inserted = len(went_in)
+            changed += [doc for doc in new if doc["_id"] not in went_in]
+            error = str(e)
+
+    replaced, failed = 0, []
+    for doc in changed:
+        try:
+            collection.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            replaced += 1
+        except Exception as e:
+            failed.append(doc["_id"])
+            error = str(e)
+    return {"inserted": inserted, "replaced": replaced, "unchanged": unchanged,
+            "failed": failed, "error": error if failed else None}
+
+def bulk_upsert(collection, documents: List[Dict[str, Any]], chunk_size: int = ASTRA_BULK_CHUNK_SIZE,
+                concurrency: int = ASTRA_BULK_CONCURRENCY) -> Dict[str, Any]:
+    """Upsert ``documents`` in chunks, ``concurrency`` chunks at a time.
+
+    Rows that are already stored unchanged (most of a re-fetched bar window) cost
+    nothing beyond the chunk's lookup. A failing chunk doesn't stop the others:
+    documents insert_many couldn't take fall back to ``replace_one`` and
+    whatever still fails is listed in ``failed``.
+    """
+    started = time.perf_counter()
+    if not documents:
+        return _summary(0, 0, 0, [], 0, 0, started)
+    chunk_size = max(1, min(chunk_size, 100))
+    chunks = [documents[i:i + chunk_size] for i in range(0, len(documents), chunk_size)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as executor:
+        results = list(executor.map(lambda chunk: _upsert_chunk(collection, chunk), chunks))
+
+    failed = [doc_id for r in results for doc_id in r["failed"]]
+    summary = _summary(len(documents), sum(r["inserted"] for r in results), sum(r["replaced"] for r in results),
+                       failed, len(chunks), sum(1 for r in results if r["failed"]), started,
+                       sum(r["unchanged"] for r in results))
+    if failed:
+        summary["errors"] = [r["error"] for r in results if r["error"]][:5]
+    return summary
+
+def _summary(documents, inserted, replaced, failed, chunks, failed_chunks, started, unchanged=0):
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": documents,
+        "inserted": inserted,
+        "replaced": replaced,
+        "unchanged": unchanged,
+        "failed": failed,
+        "chunks": chunks,
+        "failed_chunks": failed_chunks,
+        "elapsed_s": round(elapsed, 4),
+        "docs_per_s": round(documents / elapsed, 1) if elapsed > 0 else None,
+    }
+
+def compare_write_paths(collection, documents: List[Dict[str, Any]], **bulk_options) -> Dict[str, Any]:
+    """Time the per-document path against ``bulk_upsert`` on the same documents.
+
+    The bulk pass runs second, so it measures the steady state of the trading
+    loop, where most of each cycle's rows are already stored.
+    """
+    one_by_one = upsert_one_by_one(collection, documents)
+    bulk = bulk_upsert(collection, documents, **bulk_options)
+    speedup = one_by_one["elapsed_s"] / bulk["elapsed_s"] if bulk["elapsed_s"] else None
+    print(f"📦 {len(documents)} documents: one-by-one {one_by_one['docs_per_s']} docs/s, "
+          f"bulk {bulk['docs_per_s']} docs/s")
+    return {"one_by_one": one_by_one, "bulk": bulk, "speedup": round(speedup, 1) if speedup else None}
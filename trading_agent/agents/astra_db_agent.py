@@ -1,43 +1,133 @@
 import os
+import json
+import time
+import threading
 from dotenv import load_dotenv
-from astrapy import DataAPIClient
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 import pandas as pd
+from .pnl_engine import fills_from_trades, rebuild_pnl
+from .astra_bulk import (ASTRA_BULK_WRITES, bar_documents, indicator_documents, rollup_documents, bulk_upsert,
+                         upsert_one_by_one, frame_from_cursor, projection)
+from .astra_memory import MemoryDatabase
+from .bar_buckets import ASTRA_BAR_BUCKETS, ARRAYS, upsert_buckets, unpack_buckets
 
 load_dotenv()
 
 ASTRA_DB_API_ENDPOINT = os.getenv("ASTRA_DB_API_ENDPOINT")
 ASTRA_DB_APPLICATION_TOKEN = os.getenv("ASTRA_DB_APPLICATION_TOKEN")
+# "astra" needs the credentials above; "memory" keeps everything in-process (the default without them)
+ASTRA_DB_BACKEND = os.getenv("ASTRA_DB_BACKEND", "astra" if ASTRA_DB_API_ENDPOINT and ASTRA_DB_APPLICATION_TOKEN
+                             else "memory").lower()
+ASTRA_RETRY_BASE_SECONDS = float(os.getenv("ASTRA_RETRY_BASE_SECONDS", "1.0"))
+ASTRA_RETRY_MAX_SECONDS = float(os.getenv("ASTRA_RETRY_MAX_SECONDS", "300"))
 
-class AstraDatabaseAgent:
-    """Astra DB agent for storing and retrieving trading data."""
-
-    def __init__(self):
-        """Initialize Astra DB connection with existing collections only."""
-        if not ASTRA_DB_API_ENDPOINT or not ASTRA_DB_APPLICATION_TOKEN:
-            raise ValueError("Astra DB credentials not found in environment variables")
-
-        self.client = DataAPIClient(ASTRA_DB_APPLICATION_TOKEN)
-        self.db = self.client.get_database_by_api_endpoint(ASTRA_DB_API_ENDPOINT)
-
-        # List existing collections - don't create new ones
-        self.existing_collections = self.db.list_collection_names()
-        print(f"Found existing collections: {self.existing_collections}")
-
-        # Use existing collections or create minimal ones if needed
-        self._ensure_minimal_collections()
+class AstraUnavailable(RuntimeError):
+    """Astra DB can't be reached right now (the next attempt waits out a backoff)."""
 
-    def _ensure_minimal_collections(self):
-        """Ensure only essential collections exist - skip performance to avoid index limits."""
-        collections = self.db.list_collection_names()
-        required_collections = ['trades', 'market_data', 'indicators']  # Skip 'performance'
+class AstraDatabaseAgent:
+    """Astra DB agent for storing and retrieving trading data.
+
+    Nothing touches the network until the first call that needs the database;
+    a failed connection is retried with exponential backoff, and collection
+    handles are cached once opened.
+    """
+
+    def __init__(self, backend: str = ASTRA_DB_BACKEND):
+        if backend == "astra" and (not ASTRA_DB_API_ENDPOINT or not ASTRA_DB_APPLICATION_TOKEN):
+            print("⚠️  Astra DB credentials not found in environment variables")
+            backend = "memory"
+        self.backend = backend
+        self._db = None
+        self._collections: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.existing_collections: List[str] = []
+        self.health = {"connected": False, "failures": 0, "next_attempt": 0.0, "last_error": None,
+                       "last_check": None}
+        if backend != "astra":
+            print("ℹ️  Astra DB not configured, using the in-memory backend")
+
+    @property
+    def db(self):
+        """The database handle, connecting on first use."""
+        if self._db is None:
+            self._connect()
+        return self._db
+
+    def _connect(self):
+        with self._lock:
+            if self._db is not None:
+                return
+            wait = self.health["next_attempt"] - time.monotonic()
+            if wait > 0:
+                raise AstraUnavailable(f"Astra DB unavailable, retrying in {wait:.0f}s "
+                                       f"({self.health['last_error']})")
+            try:
+                if self.backend == "astra":
+                    from astrapy import DataAPIClient
+                    client = DataAPIClient(ASTRA_DB_APPLICATION_TOKEN)
+                    db = client.get_database_by_api_endpoint(ASTRA_DB_API_ENDPOINT)
+                else:
+                    db = MemoryDatabase()
+
+                # List existing collections - don't create new ones
+                self.existing_collections = db.list_collection_names()
+                if self.backend == "astra":
+                    print(f"Found existing collections: {self.existing_collections}")
+
+                    # Use existing collections or create minimal ones if needed
+                    self._ensure_minimal_collections(db)
+            except Exception as e:
+                self._record_failure(e)
+                raise AstraUnavailable(f"Astra DB connection failed: {e}") from e
+            self._db = db
+            self.health.update(connected=True, failures=0, next_attempt=0.0, last_error=None)
+
+    def _record_failure(self, error: Exception):
+        failures = self.health["failures"] + 1
+        backoff = min(ASTRA_RETRY_MAX_SECONDS, ASTRA_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+        self.health.update(connected=False, failures=failures, last_error=str(error),
+                           next_attempt=time.monotonic() + backoff)
+        print(f"⚠️  Astra DB connection failed ({failures}x), next attempt in {backoff:.0f}s: {error}")
+
+    def _collection(self, name: str):
+        """Cached collection handle."""
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections.setdefault(name, self.db.get_collection(name))
+        return collection
+
+    def health_check(self) -> Dict[str, Any]:
+        """Connect (or ping) now; on failure drop the handles so the next use reconnects after the backoff."""
+        try:
+            if self._db is None:
+                self._connect()
+            else:
+                self._db.list_collection_names()
+        except Exception as e:
+            if not isinstance(e, AstraUnavailable):
+                with self._lock:
+                    self._db = None
+                    self._collections.clear()
+                    self._record_failure(e)
+        self.health["last_check"] = datetime.now().isoformat()
+        retry_in = max(0.0, self.health["next_attempt"] - time.monotonic())
+        return {"backend": self.backend, "connected": self.health["connected"], "failures": self.health["failures"],
+                "last_error": self.health["last_error"], "retry_in_s": round(retry_in, 1),
+                "cached_collections": sorted(self._collections)}
+
+    def _ensure_minimal_collections(self, db):
+        """Ensure only essential collections exist; performance indexes just the fields it is queried by."""
+        collections = self.existing_collections
+        required_collections = ['trades', 'market_data', 'indicators', 'bar_rollups', 'performance']
+        # The summary is read by _id and backtests by strategy/timestamp - no need to index the rest
+        definitions = {'performance': {"indexing": {"allow": ["strategy", "timestamp"]}}}
 
         for collection in required_collections:
             if collection not in collections:
                 try:
                     # Create collection
-                    self.db.create_collection(collection)
+                    db.create_collection(collection, definition=definitions.get(collection))
                     print(f"Created collection: {collection}")
                 except Exception as e:
                     print(f"Failed to create collection {collection}: {e}")
@@ -72,158 +162,176 @@ class AstraDatabaseAgent:
             # Mask sensitive data before storing
             masked_trade_data = self._mask_sensitive_data(trade_data)
             
-            collection = self.db.get_collection('trades')
-            masked_trade_data['_id'] = f"trade_{datetime.now().isoformat()}_{masked_trade_data.get('symbol', 'unknown')}"
+            collection = self._collection('trades')
+            masked_trade_data.setdefault('_id', f"trade_{datetime.now().isoformat()}_{masked_trade_data.get('symbol', 'unknown')}")
             result = collection.insert_one(masked_trade_data)
             return result.inserted_id
         except Exception as e:
             print(f"Error saving trade: {e}")
             return None
 
-    def get_trades(self, symbol: Optional[str] = None, limit: int = 100) -> List[Dict]:
-        """Get trade records, optionally filtered by symbol."""
-        collection = self.db.get_collection('trades')
+    def update_trade_order(self, order: Dict[str, Any]):
+        """Replace the ``order_result`` of the trade that placed ``order`` (e.g. once it has filled)."""
+        collection = self._collection('trades')
+        collection.update_one({"order_result.id": order["id"]},
+                              {"$set": {"order_result": self._mask_sensitive_data(order)}})
+
+    def get_trades(self, symbol: Optional[str] = None, limit: int = 100, fields: Optional[List[str]] = None) -> List[Dict]:
+        """Get trade records (newest first), optionally filtered by symbol and trimmed to ``fields``."""
+        collection = self._collection('trades')
         filter_criteria = {"symbol": symbol} if symbol else {}
-        cursor = collection.find(filter_criteria).sort({"timestamp": -1}).limit(limit)
+        cursor = collection.find(filter_criteria, projection=projection(fields)).sort({"timestamp": -1}).limit(limit)
         return list(cursor)
 
-    def get_recent_trades(self, limit: int = 10) -> List[Dict]:
+    def get_recent_trades(self, limit: int = 10, fields: Optional[List[str]] = None) -> List[Dict]:
         """Get most recent trades."""
-        collection = self.db.get_collection('trades')
-        cursor = collection.find().sort({"timestamp": -1}).limit(limit)
-        return list(cursor)
+        return self.get_trades(None, limit, fields)
 
-    # Market Data Operations
-    def save_market_data(self, symbol: str, data: pd.DataFrame):
-        """Save market data (bars) to Astra DB."""
-        collection = self.db.get_collection('market_data')
-
-        # Convert DataFrame to list of documents
-        documents = []
-        for timestamp, row in data.iterrows():
-            doc = {
-                "_id": f"bars_{symbol}_{timestamp.isoformat()}",
-                "symbol": symbol,
-                "timestamp": timestamp.isoformat(),
-                "open": row.get('o'),
-                "high": row.get('h'),
-                "low": row.get('l'),
-                "close": row.get('c'),
-                "volume": row.get('v'),
-                "vwap": row.get('vw', row.get('c'))
-            }
-            # Mask any sensitive data in the document
-            masked_doc = self._mask_sensitive_data(doc)
-            documents.append(masked_doc)
+    def iter_trades(self, fields: Optional[List[str]] = None):
+        """Every trade record, oldest first (the cursor pages through the collection)."""
+        collection = self._collection('trades')
+        return collection.find({}, projection=projection(fields)).sort({"timestamp": 1})
 
-        if documents:
+    # Market Data Operations
+    def _write_documents(self, collection_name: str, documents: List[Dict[str, Any]], label: str) -> Dict[str, Any]:
+        """Upsert documents in bulk (or one by one with ASTRA_BULK_WRITES=false)."""
+        collection = self._collection(collection_name)
+        if not ASTRA_BULK_WRITES:
             try:
-                # Use replace_one with upsert to handle existing documents
-                for doc in documents:
-                    collection.replace_one(
-                        {"_id": doc["_id"]},  # Filter by ID
-                        doc,                  # Replace with new document
-                        upsert=True           # Insert if doesn't exist
-                    )
+                return upsert_one_by_one(collection, documents)
             except Exception as e:
-                print(f"Error saving market data for {symbol}: {e}")
+                print(f"Error saving {label}: {e}")
+                return {"documents": len(documents), "failed": [d["_id"] for d in documents]}
 
-    def get_market_data(self, symbol: str, start_date: Optional[str] = None, limit: int = 1000) -> pd.DataFrame:
-        """Retrieve market data for a symbol."""
-        collection = self.db.get_collection('market_data')
+        result = bulk_upsert(collection, documents)
+        if result["failed"]:
+            print(f"Error saving {label}: {len(result['failed'])}/{len(documents)} documents failed "
+                  f"in {result['failed_chunks']} chunks ({'; '.join(result.get('errors', []))})")
+        return result
+
+    def save_market_data(self, symbol: str, data: pd.DataFrame):
+        """Save market data (bars) to Astra DB (as bucket documents with ASTRA_BAR_BUCKETS)."""
+        if ASTRA_BAR_BUCKETS:
+            result = upsert_buckets(self._collection('market_data'), symbol, data, ASTRA_BAR_BUCKETS)
+            if result["failed"]:
+                print(f"Error saving market data for {symbol}: {len(result['failed'])}/{result['documents']} "
+                      f"buckets failed ({'; '.join(result['errors'])})")
+            return result
+        documents = bar_documents(symbol, data)
+        if documents:
+            return self._write_documents('market_data', documents, f"market data for {symbol}")
+
+    def get_latest_timestamp(self, collection_name: str, symbol: str) -> Optional[str]:
+        """Timestamp of the newest stored row for a symbol (one query)."""
+        collection = self._collection(collection_name)
+        if collection_name == 'market_data' and ASTRA_BAR_BUCKETS:
+            doc = collection.find_one({"symbol": symbol, "bucket": {"$exists": True}}, sort={"timestamp": -1},
+                                      projection={"end": True})
+            if doc:
+                return doc.get("end")
+        doc = collection.find_one({"symbol": symbol}, sort={"timestamp": -1}, projection={"timestamp": True})
+        return doc.get("timestamp") if doc else None
+
+    def get_market_data(self, symbol: str, start_date: Optional[str] = None, limit: int = 1000,
+                        fields: Optional[List[str]] = None) -> pd.DataFrame:
+        """Retrieve market data for a symbol (only ``fields``, e.g. ["close", "volume"], if given)."""
+        collection = self._collection('market_data')
+        if ASTRA_BAR_BUCKETS:
+            frame = self._get_bucketed_market_data(collection, symbol, start_date, limit, fields)
+            if not frame.empty:
+                return frame
 
         filter_criteria = {"symbol": symbol}
         if start_date:
             filter_criteria["timestamp"] = {"$gte": start_date}
 
-        cursor = collection.find(filter_criteria).sort({"timestamp": -1}).limit(limit)
-        data = list(cursor)
+        cursor = collection.find(filter_criteria, projection=projection(fields and ["timestamp", *fields]))
+        return frame_from_cursor(cursor.sort({"timestamp": -1}).limit(limit), fields)
 
-        if not data:
-            return pd.DataFrame()
-
-        # Convert to DataFrame
-        df = pd.DataFrame(data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df.set_index('timestamp', inplace=True)
-        df = df.sort_index()
-        return df
+    def _get_bucketed_market_data(self, collection, symbol: str, start_date: Optional[str], limit: int,
+                                  fields: Optional[List[str]]) -> pd.DataFrame:
+        """The newest ``limit`` bars from bucket documents, read newest bucket first until enough are in."""
+        filter_criteria = {"symbol": symbol, "bucket": {"$exists": True}}
+        if start_date:
+            filter_criteria["end"] = {"$gte": start_date}
+        arrays = [f for f, (_, name) in ARRAYS.items() if not fields or name in fields]
+        cursor = collection.find(filter_criteria, projection=projection(["timestamp", "count", "t", *arrays]))
+        buckets, rows = [], 0
+        for doc in cursor.sort({"timestamp": -1}):
+            buckets.append(doc)
+            rows += doc.get("count") or len(doc.get("t") or [])
+            if rows >= limit:
+                break
+        frame = unpack_buckets(buckets, fields)
+        if start_date and not frame.empty:
+            start = pd.Timestamp(start_date)
+            frame = frame[frame.index >= (start.tz_localize("UTC") if start.tz is None else start)]
+        return frame.iloc[-limit:] if limit else frame
 
     # Indicator Operations
     def save_indicators(self, symbol: str, indicators: pd.DataFrame):
         """Save calculated indicators to Astra DB."""
-        collection = self.db.get_collection('indicators')
-
-        documents = []
-        for timestamp, row in indicators.iterrows():
-            # Convert row to dict and handle NaN values
-            row_dict = row.to_dict()
-            # Replace NaN values with None (which becomes null in JSON)
-            cleaned_dict = {k: (None if pd.isna(v) else v) for k, v in row_dict.items()}
-
-            doc = {
-                "_id": f"indicators_{symbol}_{timestamp.isoformat()}",
-                "symbol": symbol,
-                "timestamp": timestamp.isoformat(),
-                **cleaned_dict
-            }
-            # Mask any sensitive data in the document
-            masked_doc = self._mask_sensitive_data(doc)
-            documents.append(masked_doc)
-
+        documents = indicator_documents(symbol, indicators)
         if documents:
-            try:
-                # Use replace_one with upsert to handle existing documents
-                for doc in documents:
-                    collection.replace_one(
-                        {"_id": doc["_id"]},  # Filter by ID
-                        doc,                  # Replace with new document
-                        upsert=True           # Insert if doesn't exist
-                    )
-            except Exception as e:
-                print(f"Error saving indicators for {symbol}: {e}")
+            return self._write_documents('indicators', documents, f"indicators for {symbol}")
 
-    def get_indicators(self, symbol: str, limit: int = 1000) -> pd.DataFrame:
-        """Retrieve indicators for a symbol."""
-        collection = self.db.get_collection('indicators')
+    def get_indicators(self, symbol: str, limit: int = 1000, fields: Optional[List[str]] = None) -> pd.DataFrame:
+        """Retrieve indicators for a symbol (only ``fields`` if given)."""
+        collection = self._collection('indicators')
 
-        cursor = collection.find({"symbol": symbol}).sort({"timestamp": -1}).limit(limit)
-        data = list(cursor)
+        cursor = collection.find({"symbol": symbol}, projection=projection(fields and ["timestamp", *fields]))
+        return frame_from_cursor(cursor.sort({"timestamp": -1}).limit(limit), fields)
 
-        if not data:
-            return pd.DataFrame()
-
-        df = pd.DataFrame(data)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df.set_index('timestamp', inplace=True)
-        df = df.sort_index()
-        return df
+    # Retention
+    def save_rollups(self, symbol: str, timeframe: str, bars: pd.DataFrame):
+        """Save downsampled (hourly/daily) bars to the bar_rollups collection."""
+        documents = rollup_documents(symbol, timeframe, bars)
+        if documents:
+            return self._write_documents('bar_rollups', documents, f"{timeframe} rollups for {symbol}")
+
+    def find_range(self, collection_name: str, start: Optional[str], end: str,
+                   fields: Optional[List[str]] = None):
+        """Documents with ``start <= timestamp < end`` (a cursor, fetched page by page)."""
+        collection = self._collection(collection_name)
+        bounds = {"$lt": end, **({"$gte": start} if start is not None else {})}
+        return collection.find({"timestamp": bounds}, projection=projection(fields))
+
+    def any_before(self, collection_name: str, cutoff: str) -> bool:
+        """Is there any document with ``timestamp`` before ``cutoff``?"""
+        collection = self._collection(collection_name)
+        return collection.find_one({"timestamp": {"$lt": cutoff}}, projection={"timestamp": True}) is not None
+
+    def delete_before(self, collection_name: str, cutoff: str,
+                      filter_criteria: Optional[Dict[str, Any]] = None, start: Optional[str] = None) -> Dict[str, int]:
+        """Delete documents with ``timestamp`` before ``cutoff`` (and from ``start``, if given);
+        bytes are estimated from one sample document."""
+        collection = self._collection(collection_name)
+        bounds = {"$lt": cutoff, **({"$gte": start} if start is not None else {})}
+        criteria = {**(filter_criteria or {}), "timestamp": bounds}
+        sample = collection.find_one(criteria)
+        if sample is None:
+            return {"deleted": 0, "bytes": 0}
+        deleted = collection.delete_many(criteria).deleted_count
+        return {"deleted": deleted, "bytes": deleted * len(json.dumps(sample, default=str))}
 
     # Performance Analytics
     def calculate_pnl(self, symbol: Optional[str] = None) -> Dict[str, Any]:
-        """Calculate profit and loss for trades."""
-        trades = self.get_trades(symbol, limit=10000)
+        """Realized P&L of filled orders, FIFO lot-matched over the full trade history."""
+        trades = self.get_trades(symbol, limit=10000, fields=["timestamp", "symbol", "order_result"])
 
         if not trades:
             return {"total_trades": 0, "total_pnl": 0, "win_rate": 0}
 
-        total_pnl = 0
-        winning_trades = 0
+        fills = fills_from_trades(reversed(trades))  # get_trades is newest first
+        realized = rebuild_pnl(fills)["realized_pnl"] if not fills.empty else pd.Series(dtype=float)
+        closed = realized[realized != 0]
         total_trades = len(trades)
-
-        for trade in trades:
-            # This is a simplified P&L calculation
-            # In reality, you'd need entry/exit prices and commissions
-            if trade.get('order_result') and 'filled_avg_price' in str(trade.get('order_result', {})):
-                # Calculate based on order results
-                pass
-
-        win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
+        win_rate = ((closed > 0).sum() / len(closed) * 100) if len(closed) else 0
 
         return {
             "total_trades": total_trades,
-            "total_pnl": total_pnl,
-            "win_rate": win_rate,
+            "total_pnl": round(float(realized.sum()), 2),
+            "win_rate": float(win_rate),
             "symbol": symbol
         }
 
@@ -254,13 +362,22 @@ class AstraDatabaseAgent:
             "pnl": self.calculate_pnl()
         }
 
+    def save_performance_summary(self, summary: Dict[str, Any]):
+        """Store the incrementally maintained performance summary document."""
+        collection = self._collection('performance')
+        collection.replace_one({"_id": summary["_id"]}, summary, upsert=True)
+
+    def get_performance_summary_document(self, summary_id: str) -> Optional[Dict[str, Any]]:
+        collection = self._collection('performance')
+        return collection.find_one({"_id": summary_id})
+
     # Backtesting Data
     def save_backtest_data(self, strategy_name: str, results: Dict[str, Any]):
         """Save backtesting results."""
         # Mask sensitive data before storing
         masked_results = self._mask_sensitive_data(results)
         
-        collection = self.db.get_collection('performance')
+        collection = self._collection('performance')
         doc = {
             "_id": f"backtest_{strategy_name}_{datetime.now().isoformat()}",
             "strategy": strategy_name,
@@ -271,12 +388,11 @@ class AstraDatabaseAgent:
 
     def get_backtest_results(self, strategy_name: Optional[str] = None, limit: int = 10) -> List[Dict]:
         """Get backtesting results."""
-        collection = self.db.get_collection('performance')
+        collection = self._collection('performance')
 
         filter_criteria = {"strategy": strategy_name} if strategy_name else {}
         cursor = collection.find(filter_criteria).sort({"timestamp": -1}).limit(limit)
         return list(cursor)
 
-# Global instance - connect without resetting collections
-# Global instance - uses existing collections only
+# Global instance - connects lazily on first use, uses existing collections only
 astra_db = AstraDatabaseAgent()
\ No newline at end of file
@@ -0,0 +1,170 @@
+import copy
+import threading
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional
+
+_OPERATORS = {
+    "$in": lambda value, arg: value in arg,
+    "$nin": lambda value, arg: value not in arg,
+    "$ne": lambda value, arg: value != arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+    "$exists": lambda value, arg: (value is not None) == bool(arg),
+}
+
+def _value(doc: Dict[str, Any], key: str):
+    """A field by dotted path (``order_result.id``)."""
+    for part in key.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+def matches(doc: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """The Data API filter subset the agents use: equality (dotted paths too), $and/$or and the operators above."""
+    for key, condition in (filter or {}).items():
+        if key == "$and":
+            if not all(matches(doc, f) for f in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, f) for f in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            if not all(_OPERATORS[op](_value(doc, key), arg) for op, arg in condition.items()):
+                return False
+        elif _value(doc, key) != condition:
+            return False
+    return True
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(doc)
+    if any(projection.values()):
+        keep = {k for k, v in projection.items() if v} | ({"_id"} if projection.get("_id", True) else set())
+        return {k: copy.deepcopy(v) for k, v in doc.items() if k in keep}
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k not in projection}
+
+def _sorted(docs: List[Dict[str, Any]], sort: Optional[Dict[str, int]]) -> List[Dict[str, Any]]:
+    for field, direction in reversed(list((sort or {}).items())):
+        present = [d for d in docs if d.get(field) is not None]
+        missing = [d for d in docs if d.get(field) is None]
+        docs = sorted(present, key=lambda d: d[field], reverse=direction < 0) + missing
+    return docs
+
+class MemoryCursor:
+    """Lazy ``find`` result supporting the ``.sort(...).limit(...)`` chaining the agents use."""
+
+    def __init__(self, collection: "MemoryCollection", filter, projection=None, sort=None, limit=None):
+        self._collection = collection
+        self._filter, self._projection, self._sort, self._limit = filter, projection, sort, limit
+
+    def sort(self, sort: Dict[str, int]) -> "MemoryCursor":
+        self._sort = sort
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        with self._collection._lock:
+            docs = [d for d in self._collection.docs.values() if matches(d, self._filter)]
+        docs = _sorted(docs, self._sort)
+        if self._limit:
+            docs = docs[:self._limit]
+        return iter([project(d, self._projection) for d in docs])
+
+class MemoryCollection:
+    """Dict-backed stand-in for an astrapy ``Collection``."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def find(self, filter=None, projection=None, sort=None, limit=None):
+        return MemoryCursor(self, filter, projection, sort, limit)
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        return next(iter(MemoryCursor(self, filter, projection, sort, 1)), None)
+
+    def insert_one(self, document):
+        with self._lock:
+            if document["_id"] in self.docs:
+                raise ValueError(f"Document already exists with the given _id: {document['_id']}")
+            self.docs[document["_id"]] = copy.deepcopy(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    def insert_many(self, documents, ordered=False, chunk_size=None, concurrency=None):
+        from astrapy.exceptions import CollectionInsertManyException
+        inserted, errors = [], []
+        with self._lock:
+            for doc in documents:
+                if doc["_id"] in self.docs:
+                    errors.append(ValueError(f"Document already exists with the given _id: {doc['_id']}"))
+                    if ordered:
+                        break
+                else:
+                    self.docs[doc["_id"]] = copy.deepcopy(doc)
+                    inserted.append(doc["_id"])
+        if errors:
+            raise CollectionInsertManyException(inserted_ids=inserted, exceptions=errors)
+        return SimpleNamespace(inserted_ids=inserted)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        with self._lock:
+            current = next((k for k, d in self.docs.items() if matches(d, filter)), None)
+            if current is None and not upsert:
+                return SimpleNamespace(update_info={"n": 0})
+            key = current if current is not None else replacement.get("_id", filter.get("_id"))
+            self.docs[key] = {**copy.deepcopy(replacement), "_id": key}
+        return SimpleNamespace(update_info={"n": 1})
+
+    def update_one(self, filter, update, upsert=False):
+        """``$set``, ``$inc`` and ``$push`` (with ``$each``) on the first matching document."""
+        with self._lock:
+            key = next((k for k, d in self.docs.items() if matches(d, filter)), None)
+            if key is None:
+                if not upsert:
+                    return SimpleNamespace(update_info={"n": 0})
+                key = filter.get("_id")
+                self.docs[key] = {"_id": key}
+            doc = self.docs[key]
+            for field, value in (update.get("$set") or {}).items():
+                doc[field] = copy.deepcopy(value)
+            for field, value in (update.get("$inc") or {}).items():
+                doc[field] = doc.get(field, 0) + value
+            for field, value in (update.get("$push") or {}).items():
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                doc.setdefault(field, []).extend(copy.deepcopy(items))
+        return SimpleNamespace(update_info={"n": 1})
+
+    def delete_many(self, filter):
+        with self._lock:
+            doomed = [k for k, d in self.docs.items() if matches(d, filter)]
+            for key in doomed:
+                del self.docs[key]
+        return SimpleNamespace(deleted_count=len(doomed))
+
+    def count_documents(self, filter, upper_bound=None):
+        with self._lock:
+            return sum(1 for d in self.docs.values() if matches(d, filter))
+
+class MemoryDatabase:
+    """Process-local stand-in for an astrapy ``Database`` (used when Astra DB isn't configured)."""
+
+    def __init__(self):
+        self.collections: Dict[str, MemoryCollection] = {}
+        self._lock = threading.Lock()
+
+    def list_collection_names(self) -> List[str]:
+        return list(self.collections)
+
+    def create_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self.get_collection(name)
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        with self._lock:
+            return self.collections.setdefault(name, MemoryCollection(name))
@@ -0,0 +1,280 @@
+import os
+import math
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterable
+from dotenv import load_dotenv
+from .indicator_agent import calculate_indicators
+from .model_cascade import rule_based_decisions
+from .sim_broker import SimulatedBroker
+from .strategy_params import resolve_params
+
+load_dotenv()
+
+BACKTEST_STARTING_CASH = float(os.getenv("BACKTEST_STARTING_CASH", "100000"))
+BACKTEST_WARMUP_BARS = int(os.getenv("BACKTEST_WARMUP_BARS", "20"))
+# Bars between decisions (e.g. 5 on 1-minute bars for the live 5-minute cycle)
+BACKTEST_DECISION_EVERY = int(os.getenv("BACKTEST_DECISION_EVERY", "1"))
+
+# Stored documents use long column names; get_bars uses Alpaca's short ones
+_BAR_COLUMNS = {"open": "o", "high": "h", "low": "l", "close": "c", "volume": "v"}
+
+def normalize_bars(df: pd.DataFrame) -> pd.DataFrame:
+    """Bars in the ``get_bars`` layout (o/h/l/c/v, sorted datetime index)."""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=["o", "h", "l", "c", "v"])
+    df = df.rename(columns=_BAR_COLUMNS)
+    df = df[[c for c in ["o", "h", "l", "c", "v"] if c in df.columns]].astype(float)
+    df.index = pd.DatetimeIndex(df.index)
+    return df[~df.index.duplicated(keep="last")].sort_index().dropna(subset=["c"])
+
+def _covers(bars: pd.DataFrame, start_date: Optional[str], limit: int) -> bool:
+    """Does this history already span the requested window on its own?"""
+    if bars.empty:
+        return False
+    if len(bars) >= limit:
+        return True
+    if start_date is None:
+        return False
+    start = pd.Timestamp(start_date)
+    first = bars.index[0]
+    if start.tzinfo is None and first.tzinfo is not None:
+        start = start.tz_localize("UTC")
+    elif start.tzinfo is not None and first.tzinfo is None:
+        first = first.tz_localize("UTC")
+    return first <= start
+
+def load_history(symbols: Iterable[str], start_date: Optional[str] = None, limit: int = 100_000) -> Dict[str, pd.DataFrame]:
+    """Load stored bar history for each symbol.
+
+    The bar archive only fills from live bars onwards, so when it starts after
+    ``start_date`` (or holds fewer than ``limit`` bars) the older history comes
+    from storage_agent and the two are merged, archive bars winning on overlap.
+    """
+    from .bar_archive import get_bar_archive, to_frame
+    archive = get_bar_archive()
+    history = {}
+    for symbol in symbols:
+        records = archive.read(symbol, start=start_date)[-limit:] if archive is not None else []
+        bars = normalize_bars(to_frame(records) if len(records) else None)
+        if not _covers(bars, start_date, limit):
+            from .storage_agent import trading_storage
+            stored = normalize_bars(trading_storage.get_market_data(symbol, start_date, limit,
+                                                                    fields=["o", "h", "l", "c", "v"]))
+            if not stored.empty and not bars.empty:
+                if (stored.index.tz is None) != (bars.index.tz is None):
+                    stored.index = stored.index.tz_localize("UTC") if stored.index.tz is None else stored.index.tz_convert(None)
+                bars = normalize_bars(pd.concat([stored, bars]))[-limit:]
+            elif bars.empty:
+                bars = stored
+        if not bars.empty:
+            history[symbol] = bars
+        else:
+            print(f"⚠️  No stored bars for {symbol}, skipping")
+    return history
+
+def _periods_per_year(index: pd.DatetimeIndex) -> float:
+    if len(index) < 2:
+        return 252.0
+    step = float(np.median(np.diff(index.asi8))) / 1e9
+    if step >= 86_400:
+        return 252.0 * 86_400 / step
+    return 252.0 * 23_400 / step  # 6.5 trading hours a day
+
+def compute_stats(equity: pd.Series, fills: List[Dict[str, Any]], starting_cash: float) -> Dict[str, Any]:
+    """Return, drawdown, Sharpe and round-trip stats from an equity curve and its fills."""
+    values = equity.to_numpy(dtype=float)
+    returns = np.diff(values) / values[:-1] if len(values) > 1 else np.zeros(0)
+    peaks = np.maximum.accumulate(values) if len(values) else values
+    drawdowns = (values - peaks) / peaks if len(values) else values
+    realized = np.array([f["realized_pl"] for f in fills if f.get("realized_pl") is not None], dtype=float)
+    wins, losses = realized[realized > 0], realized[realized < 0]
+    std = returns.std() if len(returns) > 1 else 0.0
+
+    return {
+        "starting_equity": starting_cash,
+        "final_equity": float(values[-1]) if len(values) else starting_cash,
+        "total_return_pct": float((values[-1] / starting_cash - 1) * 100) if len(values) else 0.0,
+        "max_drawdown_pct": float(drawdowns.min() * 100) if len(values) else 0.0,
+        "sharpe": float(returns.mean() / std * math.sqrt(_periods_per_year(equity.index))) if std > 0 else 0.0,
+        "fills": len(fills),
+        "round_trips": int(len(realized)),
+        "win_rate": float(len(wins) / len(realized) * 100) if len(realized) else 0.0,
+        "avg_win": float(wins.mean()) if len(wins) else 0.0,
+        "avg_loss": float(losses.mean()) if len(losses) else 0.0,
+        "profit_factor": float(wins.sum() / -losses.sum()) if len(losses) else None,
+        "realized_pnl": float(realized.sum()),
+    }
+
+class Backtester:
+    """Replays the coordinator's trading rules over bar history on a SimulatedBroker.
+
+    Indicators come from ``indicator_agent`` in one pass over each symbol's full
+    history, and the rule engine scores every symbol of a step in one vectorized
+    call. Orders then go through the coordinator's own reconcile, risk check and
+    ``_submit_decision_orders`` sizing, so a backtest trades exactly the way
+    ``execute_actions`` would.
+    """
+
+    def __init__(self, bars: Dict[str, pd.DataFrame], starting_cash: float = BACKTEST_STARTING_CASH,
+                 decision_every: int = BACKTEST_DECISION_EVERY, warmup: int = BACKTEST_WARMUP_BARS,
+                 indicator_fn=calculate_indicators, params: Optional[Dict[str, Any]] = None, quiet: bool = True):
+        self.bars = {symbol: normalize_bars(df) for symbol, df in bars.items()}
+        self.bars = {symbol: df for symbol, df in self.bars.items() if not df.empty}
+        self.symbols = sorted(self.bars)
+        self.starting_cash = starting_cash
+        self.decision_every = max(1, decision_every)
+        self.warmup = warmup
+        self.indicator_fn = indicator_fn
+        self.overrides = dict(params or {})
+        self.params = resolve_params(self.overrides)
+        self.quiet = quiet
+
+    def _signal_arrays(self):
+        """Indicator columns for every symbol on one shared timeline, shape (symbols, times)."""
+        timeline = pd.DatetimeIndex(sorted(set().union(*(df.index for df in self.bars.values()))))
+        columns = {"c": [], "rsi": [], "ema": [], "volatility_score": []}
+        has_bar = []
+        for symbol in self.symbols:
+            frame = self.indicator_fn(self.bars[symbol], ema_period=self.params["ema_period"],
+                                      rsi_period=self.params["rsi_period"],
+                                      atr_period=self.params["atr_period"]).reindex(timeline)
+            has_bar.append(frame["c"].notna().to_numpy())
+            frame = frame.ffill()
+            for name in columns:
+                columns[name].append(frame[name].to_numpy(dtype=float))
+        arrays = {name: np.vstack(values) for name, values in columns.items()}
+        arrays["has_bar"] = np.vstack(has_bar)
+        return timeline, arrays
+
+    def run(self) -> Dict[str, Any]:
+        from trading_agent import coordinator
+        from . import order_manager
+
+        started = time.perf_counter()
+        timeline, arrays = self._signal_arrays()
+        broker = SimulatedBroker(cash=self.starting_cash, bars=self.bars)
+        steps = range(min(self.warmup, max(len(timeline) - 1, 0)), len(timeline), self.decision_every)
+        equity_points, decision_counts, actions_count, errors = [], {}, 0, 0
+
+        sink = open(os.devnull, "w") if self.quiet else None
+        try:
+            with order_manager.order_backend(broker), \
+                    (contextlib.redirect_stdout(sink) if sink else contextlib.nullcontext()):
+                for j in steps:
+                    now = timeline[j]
+                    broker.advance(now)
+                    positions = {p["symbol"]: p for p in broker.get_positions()}
+                    entry = np.array([float(positions[s]["avg_entry_price"]) if s in positions else 0.0
+                                      for s in self.symbols])
+                    decisions, confidence = rule_based_decisions(
+                        arrays["c"][:, j], entry, arrays["rsi"][:, j], arrays["ema"][:, j],
+                        arrays["volatility_score"][:, j])
+
+                    state = self._cycle_state(broker, now, j, decisions, positions, arrays)
+                    for decision in decisions[arrays["has_bar"][:, j]]:
+                        decision_counts[decision] = decision_counts.get(decision, 0) + 1
+                    if state['decisions']:
+                        coordinator.reconcile_orders(state)
+                        coordinator._apply_risk_checks(state)
+                        for symbol, decision_data in state['decisions'].items():
+                            action = coordinator._execute_single_action(symbol, decision_data, state['account'],
+                                                                        state['cycle_id'])
+                            if 'error' in action:
+                                errors += 1
+                            elif action.get('action') != "HOLD":
+                                actions_count += 1
+
+                    account = broker.get_account()
+                    equity_points.append((now, float(account["equity"]), float(account["cash"])))
+                if len(timeline):
+                    broker.advance(timeline[-1])
+        finally:
+            if sink:
+                sink.close()
+
+        equity = pd.DataFrame(equity_points, columns=["timestamp", "equity", "cash"]).set_index("timestamp")
+        stats = compute_stats(equity["equity"], broker.fills, self.starting_cash)
+        stats.update({
+            "symbols": len(self.symbols),
+            "bars": int(sum(len(df) for df in self.bars.values())),
+            "decision_steps": len(steps),
+            "orders_submitted": actions_count,
+            "order_errors": errors,
+            "decisions": decision_counts,
+            "elapsed_s": round(time.perf_counter() - started, 3),
+        })
+        return {"stats": stats, "params": self.params, "equity_curve": equity, "trades": broker.fills,
+                "positions": broker.get_positions(), "account": broker.get_account()}
+
+    def _cycle_state(self, broker, now, j, decisions, positions, arrays):
+        """A coordinator TradingState for this step, holding only actionable decisions."""
+        cycle_decisions = {}
+        for i, symbol in enumerate(self.symbols):
+            if not arrays["has_bar"][i, j] or decisions[i] == "HOLD":
+                continue
+            position = positions.get(symbol) or {
+                "symbol": symbol, "qty": "0", "avg_entry_price": "0", "unrealized_pl": "0",
+                "unrealized_plpc": "0", "current_price": str(arrays["c"][i, j])}
+            cycle_decisions[symbol] = {
+                "decision": decisions[i],
+                "position": position,
+                "indicators": {"rsi": arrays["rsi"][i, j], "ema": arrays["ema"][i, j],
+                               "volatility_score": arrays["volatility_score"][i, j]},
+                "metadata": {"cascade_tier": "rules"},
+                "params": self.overrides,
+            }
+        return {
+            "cycle_id": now.strftime("%Y%m%dT%H%M%S"),
+            "account": broker.get_account(),
+            "positions": list(positions.values()),
+            "orders": broker.list_orders(status="open"),
+            "decisions": cycle_decisions,
+        }
+
+def run_backtest(bars: Dict[str, pd.DataFrame], **kwargs) -> Dict[str, Any]:
+    """Backtest the rule-based strategy on ``{symbol: bars}``."""
+    return Backtester(bars, **kwargs).run()
+
+def backtest_document(results: Dict[str, Any], max_points: int = 500, max_trades: int = 1000) -> Dict[str, Any]:
+    """Compact, JSON-friendly form of a backtest for ``save_backtest_data``."""
+    equity = results["equity_curve"]
+    if len(equity) > max_points:
+        equity = equity.iloc[np.linspace(0, len(equity) - 1, max_points).astype(int)]
+    return {
+        "stats": results["stats"],
+        "params": results.get("params"),
+        "equity_curve": [{"timestamp": ts.isoformat(), "equity": round(row.equity, 2), "cash": round(row.cash, 2)}
+                         for ts, row in equity.iterrows()],
+        "trades": results["trades"][:max_trades],
+        "trades_truncated": len(results["trades"]) > max_trades,
+    }
+
+def save_backtest(results: Dict[str, Any], strategy_name: str = "rules") -> bool:
+    """Persist a backtest through ``astra_db.save_backtest_data``."""
+    try:
+        from .astra_db_agent import astra_db
+        astra_db.save_backtest_data(strategy_name, backtest_document(results))
+        print(f"💾 Saved backtest '{strategy_name}' ({results['stats']['fills']} fills)")
+        return True
+    except Exception as e:
+        print(f"⚠️  Failed to save backtest '{strategy_name}': {e}")
+        return False
+
+def print_summary(results: Dict[str, Any]):
+    stats = results["stats"]
+    print(f"📈 Backtest: {stats['symbols']} symbols, {stats['bars']} bars, {stats['decision_steps']} steps "
+          f"in {stats['elapsed_s']:.2f}s")
+    print(f"   Return: {stats['total_return_pct']:.2f}%  Max DD: {stats['max_drawdown_pct']:.2f}%  "
+          f"Sharpe: {stats['sharpe']:.2f}")
+    print(f"   Fills: {stats['fills']}  Round trips: {stats['round_trips']}  Win rate: {stats['win_rate']:.1f}%")
+
+if __name__ == "__main__":
+    import sys
+    symbols = sys.argv[1:] or ["AAPL", "MSFT", "NVDA"]
+    results = run_backtest(load_history(symbols))
+    print_summary(results)
+    save_backtest(results, f"rules_{datetime.now():%Y%m%d}")
@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Callable, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BAR_ARCHIVE_ENABLED = os.getenv("BAR_ARCHIVE_ENABLED", "true").lower() == "true"
+BAR_ARCHIVE_DIR = os.getenv("BAR_ARCHIVE_DIR", os.path.join("data", "bars"))
+# One sparse index entry per this many records
+BAR_ARCHIVE_INDEX_EVERY = int(os.getenv("BAR_ARCHIVE_INDEX_EVERY", "4096"))
+
+# Fixed-width little-endian record: UTC epoch ns + OHLCV (48 bytes)
+RECORD_DTYPE = np.dtype([("ts", "<i8"), ("o", "<f8"), ("h", "<f8"), ("l", "<f8"), ("c", "<f8"), ("v", "<f8")])
+INDEX_DTYPE = np.dtype([("ts", "<i8"), ("pos", "<i8")])
+MAGIC = b"BARARCH1"
+HEADER_SIZE = 64  # magic + record size, padded so records stay 8-byte aligned
+
+def _ns(ts) -> int:
+    ts = pd.Timestamp(ts)
+    return (ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")).value
+
+def to_records(bars: pd.DataFrame) -> np.ndarray:
+    """A ``get_bars`` frame (o/h/l/c/v) as sorted, de-duplicated archive records."""
+    index = pd.DatetimeIndex(bars.index)
+    index = index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+    records = np.empty(len(bars), dtype=RECORD_DTYPE)
+    records["ts"] = index.asi8
+    for name in ("o", "h", "l", "c", "v"):
+        records[name] = bars[name].to_numpy(dtype=float) if name in bars.columns else np.nan
+    records = records[np.argsort(records["ts"], kind="stable")]
+    keep = np.append(records["ts"][1:] != records["ts"][:-1], True)  # last write of a timestamp wins
+    return records[keep]
+
+def to_frame(records: np.ndarray) -> pd.DataFrame:
+    """Archive records as a ``get_bars`` frame (this copies; slice the records for zero-copy work)."""
+    index = pd.DatetimeIndex(records["ts"], tz="UTC", name="timestamp")
+    return pd.DataFrame({name: records[name] for name in ("o", "h", "l", "c", "v")}, index=index)
+
+class SymbolArchive:
+    """Append-only record file for one symbol and timeframe, read through ``np.memmap``.
+
+    Records are kept in timestamp order, so a time slice is two binary searches
+    and ``read`` returns a view straight onto the mapped pages. A sparse index
+    (the timestamp of every ``index_every``-th record, also on disk) narrows
+    each search to one block so a range read only touches a handful of pages
+    even for years of 1-minute bars. The newest record can be rewritten in
+    place (the live bar is still forming); anything older is immutable.
+    """
+
+    def __init__(self, path: str, index_every: int = BAR_ARCHIVE_INDEX_EVERY):
+        self.path = path
+        self.index_path = path[:-len(".bars")] + ".idx" if path.endswith(".bars") else path + ".idx"
+        self.index_every = index_every
+        self._lock = threading.Lock()
+        self._map: Optional[np.memmap] = None
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                header = MAGIC + np.int64(RECORD_DTYPE.itemsize).tobytes()
+                f.write(header.ljust(HEADER_SIZE, b"\0"))
+            open(self.index_path, "wb").close()
+        else:
+            with open(path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            if header[:len(MAGIC)] != MAGIC or np.frombuffer(header[8:16], "<i8")[0] != RECORD_DTYPE.itemsize:
+                raise ValueError(f"{path} is not a bar archive")
+        self._index = self._load_index()
+
+    def __len__(self) -> int:
+        return (os.path.getsize(self.path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+
+    def _records(self) -> np.ndarray:
+        """The whole file as a record array (re-mapped only after it has grown)."""
+        n = len(self)
+        if self._map is None or len(self._map) != n:
+            self._map = np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(n,)) if n \
+                else np.empty(0, dtype=RECORD_DTYPE)
+        return self._map
+
+    def _load_index(self) -> np.ndarray:
+        expected = (len(self) + self.index_every - 1) // self.index_every
+        if os.path.exists(self.index_path) and os.path.getsize(self.index_path) == expected * INDEX_DTYPE.itemsize:
+            index = np.fromfile(self.index_path, dtype=INDEX_DTYPE)
+            if not len(index) or index["pos"][-1] == (expected - 1) * self.index_every:
+                return index
+        # Missing or out of step (e.g. a crash between the two writes): rebuild from the records
+        records = self._records()
+        positions = np.arange(0, len(records), self.index_every)
+        index = np.empty(len(positions), dtype=INDEX_DTYPE)
+        index["ts"], index["pos"] = records["ts"][positions], positions
+        index.tofile(self.index_path)
+        return index
+
+    def last_timestamp(self) -> Optional[int]:
+        records = self._records()
+        return int(records["ts"][-1]) if len(records) else None
+
+    def append(self, records: np.ndarray) -> Dict[str, int]:
+        """Append records newer than the last stored one; the last one itself may be revised."""
+        with self._lock:
+            stored = self._records()
+            last = int(stored["ts"][-1]) if len(stored) else None
+            result = {"appended": 0, "revised": 0, "skipped": 0}
+            if last is not None:
+                if len(records) and (records["ts"] == last).any():
+                    revision = records[records["ts"] == last][-1:]
+                    if revision.tobytes() != stored[-1:].tobytes():
+                        with open(self.path, "r+b") as f:
+                            f.seek(HEADER_SIZE + (len(stored) - 1) * RECORD_DTYPE.itemsize)
+                            f.write(revision.tobytes())
+                        result["revised"] = 1
+                newer = records[records["ts"] > last]
+                result["skipped"] = len(records) - len(newer) - result["revised"]
+                records = newer
+            if not len(records):
+                return result
+            start = len(stored)
+            with open(self.path, "ab") as f:
+                f.write(np.ascontiguousarray(records).tobytes())
+            positions = np.arange(-start % self.index_every, len(records), self.index_every)
+            if len(positions):
+                entries = np.empty(len(positions), dtype=INDEX_DTYPE)
+                entries["ts"], entries["pos"] = records["ts"][positions], start + positions
+                with open(self.index_path, "ab") as f:
+                    f.write(entries.tobytes())
+                self._index = np.concatenate([self._index, entries])
+            self._map = None
+            result["appended"] = len(records)
+            return result
+
+    def _bound(self, ts: int, side: str) -> int:
+        """Position of ``ts`` in the file: sparse index first, then a search inside one block."""
+        records = self._records()
+        block = np.searchsorted(self._index["ts"], ts, side=side) - 1
+        lo = int(self._index["pos"][block]) if block >= 0 else 0
+        hi = min(lo + self.index_every, len(records)) if block >= 0 else min(self.index_every, len(records))
+        return lo + int(np.searchsorted(records["ts"][lo:hi], ts, side=side))
+
+    def read(self, start=None, end=None) -> np.ndarray:
+        """Records with start <= ts <= end, as a zero-copy view of the mapped file."""
+        with self._lock:
+            records = self._records()
+            lo = self._bound(_ns(start), "left") if start is not None else 0
+            hi = self._bound(_ns(end), "right") if end is not None else len(records)
+            return records[lo:max(lo, hi)]
+
+    def drop_before(self, ts) -> int:
+        """Compact the file to the records at or after ``ts``; returns how many were dropped.
+
+        The kept records are written to a new file that replaces this one, so
+        views handed out earlier keep reading the old (unlinked) mapping.
+        """
+        with self._lock:
+            records = self._records()
+            dropped = self._bound(_ns(ts), "left") if len(records) else 0
+            if not dropped:
+                return 0
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(header)
+                f.write(np.ascontiguousarray(records[dropped:]).tobytes())
+            self._map = None
+            os.replace(tmp, self.path)
+            os.remove(self.index_path)
+            self._index = self._load_index()
+            return dropped
+
+class BarArchive:
+    """``SymbolArchive`` files under ``root``, one per symbol and timeframe."""
+
+    def __init__(self, root: str = BAR_ARCHIVE_DIR, index_every: int = BAR_ARCHIVE_INDEX_EVERY):
+        self.root = root
+        self.index_every = index_every
+        self._archives: Dict[Tuple[str, str], SymbolArchive] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, symbol: str, timeframe: str) -> str:
+        name = re.sub(r"[^A-Za-z0-9.-]", "_", f"{symbol}_{timeframe}")
+        return os.path.join(self.root, f"{name}.bars")
+
+    def archive(self, symbol: str, timeframe: str = "5Min", create: bool = True) -> Optional[SymbolArchive]:
+        key = (symbol, timeframe)
+        with self._lock:
+            if key not in self._archives:
+                path = self._path(symbol, timeframe)
+                if not create and not os.path.exists(path):
+                    return None
+                os.makedirs(self.root, exist_ok=True)
+                self._archives[key] = SymbolArchive(path, self.index_every)
+            return self._archives[key]
+
+    def append(self, symbol: str, bars: pd.DataFrame, timeframe: str = "5Min") -> Dict[str, int]:
+        if bars is None or bars.empty:
+            return {"appended": 0, "revised": 0, "skipped": 0}
+        return self.archive(symbol, timeframe).append(to_records(bars))
+
+    def read(self, symbol: str, start=None, end=None, timeframe: str = "5Min") -> np.ndarray:
+        """Zero-copy record view for a time slice (empty when nothing is archived)."""
+        archive = self.archive(symbol, timeframe, create=False)
+        return archive.read(start, end) if archive is not None else np.empty(0, dtype=RECORD_DTYPE)
+
+    def read_frame(self, symbol: str, start=None, end=None, timeframe: str = "5Min") -> pd.DataFrame:
+        records = self.read(symbol, start, end, timeframe)
+        return to_frame(records) if len(records) else pd.DataFrame()
+
+    def symbols(self, timeframe: Optional[str] = None) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        names = [f[:-len(".bars")] for f in os.listdir(self.root) if f.endswith(".bars")]
+        return sorted({n.rsplit("_", 1)[0] for n in names if timeframe is None or n.endswith(f"_{timeframe}")})
+
+    def series(self) -> List[Tuple[str, str]]:
+        """(symbol, timeframe) for every archive file."""
+        if not os.path.isdir(self.root):
+            return []
+        names = [f[:-len(".bars")] for f in os.listdir(self.root) if f.endswith(".bars")]
+        return sorted(tuple(n.rsplit("_", 1)) for n in names if "_" in n)
+
+    def size_bytes(self) -> int:
+        if not os.path.isdir(self.root):
+            return 0
+        return sum(os.path.getsize(os.path.join(self.root, f)) for f in os.listdir(self.root)
+                   if f.endswith((".bars", ".idx")))
+
+def compare_range_reads(archive: BarArchive, symbol: str, fetch: Callable[[str, Any, Any], pd.DataFrame],
+                        ranges: Sequence[Tuple[Any, Any]], timeframe: str = "5Min") -> Dict[str, Any]:
+    """Time the same range reads from the archive and through ``fetch(symbol, start, end)``."""
+    timings = {}
+    for label, read in (("archive", lambda s, e: archive.read(symbol, s, e, timeframe)), ("fetch", lambda s, e: fetch(symbol, s, e))):
+        rows, start = 0, time.perf_counter()
+        for s, e in ranges:
+            rows += len(read(s, e))
+        timings[label] = {"seconds": round(time.perf_counter() - start, 4), "rows": rows}
+    fetch_s, archive_s = timings["fetch"]["seconds"], timings["archive"]["seconds"]
+    return {**timings, "reads": len(ranges), "speedup": round(fetch_s / archive_s, 1) if archive_s else None}
+
+_bar_archive = None
+
+def get_bar_archive() -> Optional[BarArchive]:
+    """The process-wide archive, or None with BAR_ARCHIVE_ENABLED=false."""
+    global _bar_archive
+    if _bar_archive is None and BAR_ARCHIVE_ENABLED:
+        _bar_archive = BarArchive()
+    return _bar_archive
@@ -0,0 +1,185 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Iterable, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "hour" or "day" stores bars as one document per symbol per bucket; empty keeps one document per bar
+ASTRA_BAR_BUCKETS = os.getenv("ASTRA_BAR_BUCKETS", "").lower()
+# The Data API caps arrays at 1000 elements: day buckets suit 5-minute bars, hour buckets 1-minute bars
+ASTRA_MAX_BUCKET_ROWS = int(os.getenv("ASTRA_MAX_BUCKET_ROWS", "1000"))
+
+_FREQ = {"hour": "h", "day": "D"}
+# Array field in a bucket document -> (get_bars column, market_data document field)
+ARRAYS = {"o": ("o", "open"), "h": ("h", "high"), "l": ("l", "low"), "c": ("c", "close"), "v": ("v", "volume"),
+          "vw": ("vw", "vwap")}
+LONG_NAMES = {long: short for short, (_, long) in ARRAYS.items()}
+
+def _utc_index(index) -> pd.DatetimeIndex:
+    index = pd.DatetimeIndex(index)
+    return index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+
+def bucket_id(symbol: str, granularity: str, start: pd.Timestamp) -> str:
+    return f"barbucket_{symbol}_{granularity}_{start.isoformat()}"
+
+def _columns(frame: pd.DataFrame) -> Dict[str, List[Any]]:
+    """Bucket arrays for a slice of a get_bars frame (vwap defaults to close, NaN to None)."""
+    columns = {}
+    for field, (column, _) in ARRAYS.items():
+        if column in frame.columns:
+            values = frame[column]
+        elif field == "vw" and "c" in frame.columns:
+            values = frame["c"]
+        else:
+            values = pd.Series(np.nan, index=frame.index)
+        if field == "vw" and "c" in frame.columns:
+            values = values.fillna(frame["c"])
+        columns[field] = values.astype(object).where(values.notna(), None).tolist()
+    return columns
+
+def bucket_documents(symbol: str, bars: pd.DataFrame, granularity: str) -> List[Dict[str, Any]]:
+    """One document per bucket: start ``timestamp``, ``end``, ``count``, second offsets ``t`` and OHLCV arrays."""
+    if bars is None or bars.empty:
+        return []
+    index = _utc_index(bars.index)
+    bars = bars.set_axis(index)
+    bars = bars[~index.duplicated(keep="last")].sort_index()
+    starts = bars.index.floor(_FREQ[granularity])
+    documents = []
+    for start, frame in bars.groupby(starts, sort=True):
+        offsets = ((frame.index - start).asi8 // 1_000_000_000).tolist()
+        documents.append({
+            "_id": bucket_id(symbol, granularity, start),
+            "symbol": symbol,
+            "bucket": granularity,
+            "timestamp": start.isoformat(),
+            "end": frame.index[-1].isoformat(),
+            "count": len(frame),
+            "t": offsets,
+            **_columns(frame),
+        })
+    return documents
+
+def _same(a, b) -> bool:
+    return a == b or (a is None or a != a) and (b is None or b != b)
+
+def _merge(stored: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Classify ``new`` rows against a stored bucket: unchanged, appendable, or a full rewrite."""
+    stored_rows = {t: i for i, t in enumerate(stored.get("t") or [])}
+    fresh = []
+    for j, t in enumerate(new["t"]):
+        i = stored_rows.get(t)
+        if i is None or not all(_same(stored[f][i] if i < len(stored.get(f) or []) else None, new[f][j]) for f in ARRAYS):
+            fresh.append(j)
+    if not fresh:
+        return {"action": "unchanged"}
+    last = stored["t"][-1] if stored.get("t") else -1
+    if all(new["t"][j] > last for j in fresh):
+        return {"action": "append", "rows": fresh}
+    merged = dict(zip(stored.get("t") or [], zip(*(stored.get(f) or [None] * len(stored["t"]) for f in ARRAYS))))
+    merged.update({new["t"][j]: tuple(new[f][j] for f in ARRAYS) for j in fresh})
+    offsets = sorted(merged)
+    rows = [merged[t] for t in offsets]
+    return {"action": "replace", "t": offsets, **{f: [row[k] for row in rows] for k, f in enumerate(ARRAYS)}}
+
+def upsert_buckets(collection, symbol: str, bars: pd.DataFrame, granularity: str,
+                   max_rows: int = ASTRA_MAX_BUCKET_ROWS) -> Dict[str, Any]:
+    """Write bars into bucket documents with one ``$in`` lookup for the buckets touched.
+
+    New buckets go in with one ``insert_many``; bars after a stored bucket's
+    last one are appended with ``$push`` (the stored arrays aren't re-sent);
+    revisions of stored bars rewrite that bucket. Buckets already holding the
+    same values cost nothing.
+    """
+    started = time.perf_counter()
+    documents = bucket_documents(symbol, bars, granularity)
+    result = {"documents": len(documents), "rows": 0 if bars is None else len(bars), "inserted": 0, "appended": 0,
+              "replaced": 0, "unchanged": 0, "failed": [], "errors": []}
+    if not documents:
+        return result
+    try:
+        stored = {d["_id"]: d for d in collection.find({"_id": {"$in": [d["_id"] for d in documents]}})}
+    except Exception:
+        stored = {}
+
+    new = []
+    for doc in documents:
+        if doc["_id"] not in stored:
+            if doc["count"] > max_rows:
+                result["failed"].append(doc["_id"])
+                result["errors"].append(f"{doc['_id']}: {doc['count']} rows exceed {max_rows}")
+            else:
+                new.append(doc)
+            continue
+        current = stored[doc["_id"]]
+        plan = _merge(current, doc)
+        try:
+            if plan["action"] == "unchanged":
+                result["unchanged"] += 1
+                continue
+            count = (current.get("count") or len(current.get("t") or [])) + len(plan.get("rows", []))
+            if plan["action"] == "append":
+                if count > max_rows:
+                    raise ValueError(f"{count} rows exceed {max_rows}")
+                rows = plan["rows"]
+                collection.update_one({"_id": doc["_id"]}, {
+                    "$push": {f: {"$each": [doc[f][j] for j in rows]} for f in ["t", *ARRAYS]},
+                    "$set": {"end": (pd.Timestamp(doc["timestamp"]) + pd.Timedelta(seconds=doc["t"][rows[-1]])).isoformat(),
+                             "count": count},
+                })
+                result["appended"] += 1
+            else:
+                if len(plan["t"]) > max_rows:
+                    raise ValueError(f"{len(plan['t'])} rows exceed {max_rows}")
+                start = pd.Timestamp(doc["timestamp"])
+                replacement = {**{k: doc[k] for k in ("_id", "symbol", "bucket", "timestamp")},
+                               "end": (start + pd.Timedelta(seconds=plan["t"][-1])).isoformat(),
+                               "count": len(plan["t"]), **{k: plan[k] for k in ["t", *ARRAYS]}}
+                collection.replace_one({"_id": doc["_id"]}, replacement, upsert=True)
+                result["replaced"] += 1
+        except Exception as e:
+            result["failed"].append(doc["_id"])
+            result["errors"].append(f"{doc['_id']}: {e}")
+
+    if new:
+        try:
+            collection.insert_many(new, ordered=False, chunk_size=len(new), concurrency=1)
+            result["inserted"] += len(new)
+        except Exception as e:
+            went_in = set(getattr(e, "inserted_ids", None) or [])
+            result["inserted"] += len(went_in)
+            for doc in new:
+                if doc["_id"] in went_in:
+                    continue
+                try:
+                    collection.replace_one({"_id": doc["_id"]}, doc, upsert=True)
+                    result["replaced"] += 1
+                except Exception as e2:
+                    result["failed"].append(doc["_id"])
+                    result["errors"].append(f"{doc['_id']}: {e2}")
+    result["errors"] = result["errors"][:5]
+    result["elapsed_s"] = round(time.perf_counter() - started, 4)
+    return result
+
+def unpack_buckets(documents: Iterable[Dict[str, Any]], fields: Optional[List[str]] = None) -> pd.DataFrame:
+    """Bucket documents as one contiguous, sorted bar series in the market_data layout (open/high/...)."""
+    wanted = [LONG_NAMES[f] for f in fields if f in LONG_NAMES] if fields else list(ARRAYS)
+    stamps, columns = [], {f: [] for f in wanted}
+    for doc in documents:
+        offsets = np.asarray(doc.get("t") or [], dtype=np.int64)
+        if not len(offsets):
+            continue
+        stamps.append(pd.Timestamp(doc["timestamp"]).value + offsets * 1_000_000_000)
+        for f in wanted:
+            values = doc.get(f)
+            columns[f].append(np.array([np.nan if v is None else v for v in values], dtype=float)
+                              if values is not None else np.full(len(offsets), np.nan))
+    if not stamps:
+        return pd.DataFrame()
+    index = pd.DatetimeIndex(np.concatenate(stamps), tz="UTC", name="timestamp")
+    frame = pd.DataFrame({ARRAYS[f][1]: np.concatenate(columns[f]) for f in wanted}, index=index)
+    frame = frame[~frame.index.duplicated(keep="last")]
+    return frame.sort_index()
@@ -18,14 +18,25 @@ HEADERS = {
     "APCA-API-SECRET-KEY": ALPACA_SECRET_KEY
 }
 
+def _order_backend():
+    """The simulated broker when one is plugged into order_manager, else None."""
+    from .order_manager import get_order_backend
+    return get_order_backend()
+
 def get_account():
     """Fetch account information from Alpaca."""
+    backend = _order_backend()
+    if backend is not None:
+        return backend.get_account()
     response = requests.get(f"{BASE_URL}/v2/account", headers=HEADERS)
     response.raise_for_status()
     return response.json()
 
 def get_positions():
     """Fetch current positions from Alpaca."""
+    backend = _order_backend()
+    if backend is not None:
+        return backend.get_positions()
     response = requests.get(f"{BASE_URL}/v2/positions", headers=HEADERS)
     response.raise_for_status()
     return response.json()
@@ -40,7 +51,7 @@ def get_bars(symbol, start_date=None, end_date=None, timeframe="5Min", hours_bac
     if alpaca_data is not None and not alpaca_data.empty:
         print(f"✅ Using fresh Alpaca data for {symbol}")
         # Save to database for future use
-        _save_bars_to_database(symbol, alpaca_data)
+        _save_bars_to_database(symbol, alpaca_data, timeframe)
         return alpaca_data
 
     # Fallback to database if Alpaca fails
@@ -147,12 +158,19 @@ def _get_bars_from_alpaca(symbol, start_date=None, end_date=None, timeframe="5Mi
         return pd.DataFrame()
 
 
-def _save_bars_to_database(symbol, data):
-    """Save market data to database for future use."""
+def _save_bars_to_database(symbol, data, timeframe="5Min"):
+    """Save market data to database (and the local bar archive) for future use."""
+    try:
+        from .bar_archive import get_bar_archive
+        archive = get_bar_archive()
+        if archive is not None:
+            archive.append(symbol, data, timeframe)
+    except Exception as e:
+        print(f"      ⚠️ Failed to archive bars: {e}")
     try:
         from .storage_agent import trading_storage
         trading_storage.save_market_data(symbol, data)
-        print(f"      💾 Saved {len(data)} bars for {symbol} to database")
+        print(f"      💾 Queued {len(data)} bars for {symbol} for the database")
     except Exception as e:
         print(f"      ⚠️ Failed to save data to database: {e}")
 
@@ -195,6 +213,14 @@ def get_quotes(symbol):
 
 def get_orders():
     """Fetch all orders."""
+    # Serve from the local order book mirror once it is seeded and receiving updates
+    from .order_manager import order_book
+    if order_book.is_live():
+        return order_book.open_orders()
+    backend = _order_backend()
+    if backend is not None:
+        return backend.list_orders(status="open")
+
     response = requests.get(f"{BASE_URL}/v2/orders", headers=HEADERS)
     response.raise_for_status()
     return response.json()
@@ -0,0 +1,113 @@
+from typing import Dict, List, Optional, Tuple
+
+# Decision keywords mapped to the decision they produce.
+# Legacy decisions are mapped onto the profit-focused ones.
+DECISION_KEYWORDS: List[Tuple[str, str]] = [
+    ("BRACKET_BUY", "BRACKET_BUY"),
+    ("LIMIT_BUY", "LIMIT_BUY"),
+    ("TRAILING_STOP_BUY", "TRAILING_STOP_BUY"),
+    ("OCO_SELL", "OCO_SELL"),
+    ("LIMIT_SELL", "LIMIT_SELL"),
+    ("TRAILING_STOP_SELL", "TRAILING_STOP_SELL"),
+    ("STOP_LOSS", "STOP_LOSS"),
+    ("REDUCE_POSITION", "REDUCE_POSITION"),
+    ("BUY_MORE", "BRACKET_BUY"),
+    ("SELL_PARTIAL", "OCO_SELL"),
+    ("SELL_ALL", "OCO_SELL"),
+]
+
+DEFAULT_DECISION = "HOLD"
+
+# Words the streaming matcher recognizes (HOLD only decides a reply without any action keyword)
+DECISION_VOCABULARY: Dict[str, str] = {**dict(DECISION_KEYWORDS), "HOLD": "HOLD"}
+
+class _TrieNode:
+    __slots__ = ("children", "word")
+
+    def __init__(self):
+        self.children = {}
+        self.word = None
+
+class DecisionTrie:
+    """Character trie over the decision vocabulary."""
+
+    def __init__(self, words):
+        self.root = _TrieNode()
+        for word in words:
+            node = self.root
+            for ch in word:
+                node = node.children.setdefault(ch, _TrieNode())
+            node.word = word
+
+def _is_word_char(ch: str) -> bool:
+    # Keywords are whole tokens: letters, digits and underscores never border one
+    return ch.isalnum() or ch == "_"
+
+class StreamingDecisionMatcher:
+    """Recognize a decision keyword in a token stream as soon as it is final.
+
+    Keywords only match as whole words, so "threshold" or "shareholders"
+    never read as HOLD, and a keyword counts once the character after it
+    shows the word has ended. The first action keyword wins (the rule
+    ``decision_from_text`` shares); HOLD is only the answer when no action
+    follows, so seeing it never stops the stream early.
+    """
+
+    def __init__(self, trie: Optional[DecisionTrie] = None):
+        self.trie = trie or DECISION_TRIE
+        self.node = self.trie.root  # trie position in the current word; None once it can't be a keyword
+        self.saw_hold = False
+        self.word = None
+        self.text = []
+
+    @property
+    def decision(self) -> Optional[str]:
+        return DECISION_VOCABULARY.get(self.word) if self.word else None
+
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk of streamed text; returns True once an action keyword is recognized."""
+        if self.word is not None:
+            return True
+        self.text.append(chunk)
+        for ch in chunk.upper():
+            if self._step(ch):
+                return True
+        return False
+
+    def _end_word(self) -> bool:
+        word = self.node.word if self.node is not None else None
+        self.node = self.trie.root
+        if word == DEFAULT_DECISION:
+            self.saw_hold = True
+        elif word is not None:
+            self.word = word
+            return True
+        return False
+
+    def _step(self, ch: str) -> bool:
+        if not _is_word_char(ch):
+            return self._end_word()
+        if self.node is not None:
+            self.node = self.node.children.get(ch)
+        return False
+
+    def finish(self) -> Optional[str]:
+        """Call at end of stream; returns the decision, or None if no keyword was seen."""
+        if self.word is None and not self._end_word() and self.saw_hold:
+            self.word = DEFAULT_DECISION
+        return self.decision
+
+    def full_text(self) -> str:
+        return "".join(self.text)
+
+DECISION_TRIE = DecisionTrie(DECISION_VOCABULARY)
+
+def decision_from_text(text: str) -> str:
+    """Map a full LLM completion to a decision: its first whole-word action keyword, else HOLD.
+
+    This is the rule StreamingDecisionMatcher applies as tokens arrive, so a
+    streamed and a whole completion of the same text always agree.
+    """
+    matcher = StreamingDecisionMatcher()
+    matcher.feed(text)
+    return matcher.finish() or DEFAULT_DECISION
@@ -0,0 +1,75 @@
+import threading
+import pandas as pd
+from typing import Dict, Any, Callable, Hashable, Optional
+
+def _utc(ts) -> Optional[pd.Timestamp]:
+    if ts is None:
+        return None
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+class HighWaterMarks:
+    """Last persisted timestamp per ``(collection, symbol)``, so saves only send what's new.
+
+    ``new_rows`` keeps rows at or after the mark: the newest stored row is
+    re-sent because a bar (and its indicators) can still be revised while it is
+    the latest one. A key seen for the first time costs one ``lookup(collection,
+    symbol)`` for the newest stored timestamp; ``advance`` moves the mark once a
+    write has succeeded.
+    """
+
+    def __init__(self, lookup: Callable[[str, str], Optional[str]]):
+        self.lookup = lookup
+        self.marks: Dict[Hashable, Optional[pd.Timestamp]] = {}
+        self.stats = {"lookups": 0, "rows_offered": 0, "rows_sent": 0, "rows_skipped": 0}
+        self._lock = threading.Lock()
+
+    def mark(self, key) -> Optional[pd.Timestamp]:
+        with self._lock:
+            if key in self.marks:
+                return self.marks[key]
+        collection, symbol = key
+        try:
+            latest = _utc(self.lookup(collection, symbol))
+        except Exception as e:
+            print(f"⚠️  Couldn't read the high-water mark for {symbol} {collection}: {e}")
+            return None  # unknown: send everything this time, don't cache
+        with self._lock:
+            self.stats["lookups"] += 1
+            return self.marks.setdefault(key, latest)
+
+    def new_rows(self, key, frame: pd.DataFrame) -> pd.DataFrame:
+        if frame is None or frame.empty:
+            return frame
+        mark = self.mark(key)
+        if mark is None:
+            fresh = frame
+        else:
+            index = pd.DatetimeIndex(frame.index)
+            index = index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+            fresh = frame[index >= mark]
+        with self._lock:
+            self.stats["rows_offered"] += len(frame)
+            self.stats["rows_sent"] += len(fresh)
+            self.stats["rows_skipped"] += len(frame) - len(fresh)
+        return fresh
+
+    def advance(self, key, frame: pd.DataFrame):
+        if frame is None or frame.empty:
+            return
+        latest = _utc(pd.DatetimeIndex(frame.index).max())
+        with self._lock:
+            current = self.marks.get(key)
+            if current is None or latest > current:
+                self.marks[key] = latest
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self.marks.clear()
+            else:
+                self.marks.pop(key, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "tracked": len(self.marks)}
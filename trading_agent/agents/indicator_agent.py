@@ -29,15 +29,15 @@ def calculate_volatility_score(data, period=14):
     volatility = atr / data['c'] * 100  # Percentage
     return volatility
 
-def calculate_indicators(data):
+def calculate_indicators(data, ema_period=20, rsi_period=14, atr_period=14):
     """Calculate all indicators for the data."""
     if data.empty:
         print("      📊 No data available for indicator calculation")
         return data  # Return empty DataFrame as-is
     
     data = data.copy()
-    data['ema'] = calculate_ema(data['c'], 20)
-    data['rsi'] = calculate_rsi(data['c'], 14)
-    data['atr'] = calculate_atr(data, 14)
-    data['volatility_score'] = calculate_volatility_score(data, 14)
+    data['ema'] = calculate_ema(data['c'], ema_period)
+    data['rsi'] = calculate_rsi(data['c'], rsi_period)
+    data['atr'] = calculate_atr(data, atr_period)
+    data['volatility_score'] = calculate_volatility_score(data, atr_period)
     return data
\ No newline at end of file
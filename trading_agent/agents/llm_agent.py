@@ -1,23 +1,61 @@
 import os
+from datetime import datetime
 import pandas as pd
 from langchain_google_genai import GoogleGenerativeAI
-from langsmith import traceable
 from dotenv import load_dotenv
+from .llm_cache import decision_cache, prompt_key
+from .llm_client import AsyncLLMClient, LangChainBackend, FakeLLMBackend, LLMTimeoutError
+from .decision_parser import StreamingDecisionMatcher, decision_from_text
+from .model_cascade import ModelCascade, RuleTier, LLMTier, LLM_CASCADE_ENABLED, LLM_CASCADE_TIERS
+from .prompt_builder import build_compact_prompt, compose_prompt, estimate_tokens, LLM_PROMPT_TOKEN_BUDGET
+from .tracing import traced
 
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "true").lower() == "true"
 
-if LANGSMITH_TRACING:
-    os.environ["LANGSMITH_TRACING"] = "true"
-    os.environ["LANGCHAIN_API_KEY"] = os.getenv("LANGCHAIN_API_KEY")
+# LangSmith tracing is configured in tracing.py (sampling, opt-in, background export)
 
-llm = GoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=GOOGLE_API_KEY)
+LLM_MODEL = "gemini-2.5-flash"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()  # "fake" runs fully offline
+LLM_STREAM_DECISIONS = os.getenv("LLM_STREAM_DECISIONS", "false").lower() == "true"
+LLM_COMPACT_PROMPT = os.getenv("LLM_COMPACT_PROMPT", "true").lower() == "true"
+# Builds the verbose prompt as well just to log its size - a debugging aid, off in normal runs
+LLM_LOG_PROMPT_TOKENS = os.getenv("LLM_LOG_PROMPT_TOKENS", "false").lower() == "true"
 
-@traceable
+# Retries are handled by llm_client with backoff, so don't retry inside LangChain too
+llm = GoogleGenerativeAI(model=LLM_MODEL, google_api_key=GOOGLE_API_KEY, max_retries=0)
+
+if LLM_BACKEND == "fake":
+    llm_client = AsyncLLMClient(FakeLLMBackend(answer=os.getenv("FAKE_LLM_ANSWER", "HOLD")))
+else:
+    llm_client = AsyncLLMClient(LangChainBackend(llm))
+
+def _build_cascade():
+    """Cheap tiers from LLM_CASCADE_TIERS (e.g. "rules,gemini-2.5-flash-lite"), then LLM_MODEL."""
+    tiers = []
+    for name in [t.strip() for t in LLM_CASCADE_TIERS.split(",") if t.strip()]:
+        if name == "rules":
+            tiers.append(RuleTier())
+        elif name != LLM_MODEL:
+            if LLM_BACKEND == "fake":
+                backend = FakeLLMBackend(answer=os.getenv("FAKE_LLM_ANSWER", "HOLD"))
+            else:
+                backend = LangChainBackend(GoogleGenerativeAI(model=name, google_api_key=GOOGLE_API_KEY, max_retries=0))
+            tiers.append(LLMTier(name, AsyncLLMClient(backend)))
+    return ModelCascade(tiers, final_tier_name=LLM_MODEL)
+
+model_cascade = _build_cascade()
+
+@traced
 def format_prompt(subject, data):
     """Format the prompt for the LLM."""
+    if LLM_COMPACT_PROMPT:
+        return compose_prompt(data)
+    return _format_verbose_prompt(subject, data)
+
+def _format_verbose_prompt(subject, data):
+    """Original verbose prompt wrapper (used when LLM_COMPACT_PROMPT=false)."""
     account_info = """
     ACCOUNT CAPABILITIES:
     - Commission-Free Trading: $0 commissions on US stocks/ETFs and options
@@ -51,13 +89,59 @@ def format_prompt(subject, data):
     Respond with only: BUY, SELL, or HOLD"""
     return prompt
 
-@traceable(run_type="llm")
-def invoke_llm(messages):
-    """Invoke the LLM with the messages."""
-    response = llm.invoke(messages)
+def _invoke_streaming(messages, metadata=None):
+    """Stream the completion and stop generating as soon as a decision is recognized."""
+    matcher = StreamingDecisionMatcher()
+    result = llm_client.invoke_stream(messages, matcher.feed)
+    word = matcher.finish()
+
+    if metadata is not None:
+        recognized_s = result['stopped_at_s'] if result['stopped_early'] else (result['elapsed_s'] if word else None)
+        metadata['streamed'] = True
+        metadata['stopped_early'] = result['stopped_early']
+        metadata['stream_chunks'] = result['chunks']
+        metadata['first_token_ms'] = round(result['first_token_s'] * 1000, 1) if result['first_token_s'] is not None else None
+        metadata['decision_recognized_ms'] = round(recognized_s * 1000, 1) if recognized_s is not None else None
+
+    # Hand parse_output the recognized keyword rather than a truncated completion
+    return word or result['text']
+
+def _invoke_cached(messages, metadata=None):
+    """Invoke the LLM through the decision cache (shared by traced and untraced calls)."""
+    key = prompt_key(messages, LLM_MODEL)
+    cached = decision_cache.get(key)
+
+    if metadata is not None:
+        metadata['cache_key'] = key[:16]
+        metadata['cache_hit'] = cached is not None
+
+    if cached is not None:
+        if metadata is not None:
+            metadata['cache_tier'] = cached['tier']
+            metadata['cached_at'] = datetime.fromtimestamp(cached['created_at']).isoformat()
+        return cached['response']
+
+    try:
+        if LLM_STREAM_DECISIONS:
+            response = _invoke_streaming(messages, metadata)
+        else:
+            response = llm_client.invoke(messages)
+    except LLMTimeoutError as e:
+        # Don't let one slow response stall the decision barrier - fall back to HOLD
+        print(f"⚠️  {e} - holding")
+        if metadata is not None:
+            metadata['llm_timeout'] = True
+        return "HOLD"
+
+    decision_cache.set(key, response, model=LLM_MODEL)
     return response
 
-@traceable
+@traced(run_type="llm")
+def invoke_llm(messages, metadata=None):
+    """Invoke the LLM with the messages."""
+    return _invoke_cached(messages, metadata)
+
+@traced
 def parse_output(response):
     """Parse the LLM output to extract the decision."""
     # Handle both string responses and objects with content attribute
@@ -66,41 +150,18 @@ def parse_output(response):
     else:
         text = str(response).strip().upper()
     
-    # Map to new profit-focused decisions
-    if "BRACKET_BUY" in text:
-        return "BRACKET_BUY"
-    elif "LIMIT_BUY" in text:
-        return "LIMIT_BUY"
-    elif "TRAILING_STOP_BUY" in text:
-        return "TRAILING_STOP_BUY"
-    elif "OCO_SELL" in text:
-        return "OCO_SELL"
-    elif "LIMIT_SELL" in text:
-        return "LIMIT_SELL"
-    elif "TRAILING_STOP_SELL" in text:
-        return "TRAILING_STOP_SELL"
-    elif "STOP_LOSS" in text:
-        return "STOP_LOSS"
-    elif "REDUCE_POSITION" in text:
-        return "REDUCE_POSITION"
-    elif "BUY_MORE" in text:
-        return "BRACKET_BUY"  # Map old decisions to new ones
-    elif "SELL_PARTIAL" in text:
-        return "OCO_SELL"
-    elif "SELL_ALL" in text:
-        return "OCO_SELL"
-    else:
-        return "HOLD"
+    # Map to new profit-focused decisions (legacy decisions map onto them)
+    return decision_from_text(text)
 
-@traceable
-def run_pipeline(symbol, data):
+@traced
+def run_pipeline(symbol, data, metadata=None):
     """Run the full pipeline for trade decision."""
     prompt = format_prompt(symbol, data)
-    response = invoke_llm(prompt)
+    response = invoke_llm(prompt, metadata=metadata)
     decision = parse_output(response)
     return decision
 
-@traceable
+@traced
 def _explain_indicator_simple(indicator, value):
     """Explain technical indicators in simple terms for beginners."""
     try:
@@ -135,8 +196,8 @@ def _explain_indicator_simple(indicator, value):
     except:
         return f"Technical indicator: {indicator}"
 
-def make_trade_decision(symbol, position_data=None, indicators=None, account_data=None, historical_trades=None, news_data=None, market_intelligence=None):
-    """Make a smart, fast profit-based trade decision using advanced order types."""
+def _build_verbose_data(symbol, position_data=None, indicators=None, account_data=None, historical_trades=None, news_data=None, market_intelligence=None):
+    """Build the original emoji-rich analysis prompt (used when LLM_COMPACT_PROMPT=false)."""
     data_str = f"🚀 PROFIT ANALYSIS for {symbol}:\n"
 
     # Add position details with profit/loss focus
@@ -256,6 +317,48 @@ def make_trade_decision(symbol, position_data=None, indicators=None, account_dat
     - Use news to confirm or contradict technical signals
 
     Respond with ONLY: BRACKET_BUY, LIMIT_BUY, TRAILING_STOP_BUY, OCO_SELL, LIMIT_SELL, TRAILING_STOP_SELL, STOP_LOSS, REDUCE_POSITION, or HOLD"""
+    return prompt
+
+def make_trade_decision(symbol, position_data=None, indicators=None, account_data=None, historical_trades=None, news_data=None, market_intelligence=None, metadata=None):
+    """Make a smart, fast profit-based trade decision using advanced order types.
+
+    Pass a dict as ``metadata`` to have it filled with details about how the
+    decision was produced (e.g. whether a cached LLM response was reused).
+    """
+    inputs = (symbol, position_data, indicators, account_data, historical_trades, news_data, market_intelligence)
+
+    if LLM_COMPACT_PROMPT:
+        compact = build_compact_prompt(*inputs, token_budget=LLM_PROMPT_TOKEN_BUDGET)
+        prompt = compact['body']
+        full_prompt = compact['text']
+        if LLM_LOG_PROMPT_TOKENS:
+            try:
+                tokens_before = estimate_tokens(_format_verbose_prompt(symbol, _build_verbose_data(*inputs)))
+            except (ValueError, TypeError, ZeroDivisionError):
+                tokens_before = None
+            print(f"   📝 {symbol} prompt tokens: {tokens_before} -> {compact['tokens']} (budget {LLM_PROMPT_TOKEN_BUDGET})")
+            if metadata is not None:
+                metadata['prompt_tokens_before'] = tokens_before
+        if metadata is not None:
+            metadata['prompt_tokens'] = compact['tokens']
+            if compact['dropped'] or compact['truncated']:
+                metadata['prompt_dropped'] = compact['dropped']
+                metadata['prompt_truncated'] = compact['truncated']
+    else:
+        prompt = _build_verbose_data(*inputs)
+        full_prompt = prompt
+        if metadata is not None:
+            metadata['prompt_tokens'] = estimate_tokens(_format_verbose_prompt(symbol, prompt))
+
+    if not LLM_CASCADE_ENABLED:
+        return run_pipeline(symbol, prompt, metadata=metadata)
 
-    decision = run_pipeline(symbol, prompt)
+    context = {
+        'symbol': symbol,
+        'prompt': full_prompt,
+        'position_data': position_data,
+        'indicators': indicators,
+        'account_data': account_data
+    }
+    decision = model_cascade.decide(context, lambda: run_pipeline(symbol, prompt, metadata=metadata), metadata=metadata)
     return decision
\ No newline at end of file
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "300"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "256"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR")  # Optional on-disk tier, off when unset
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_prompt(prompt) -> str:
+    """Normalize a prompt so near-identical prompts map to the same cache key."""
+    text = prompt.content if hasattr(prompt, 'content') else str(prompt)
+    # Indentation and blank lines change between builds of the same prompt
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def prompt_key(prompt, model: str = "") -> str:
+    """Hash a normalized prompt (and the model answering it) into a cache key."""
+    payload = f"{model}\n{normalize_prompt(prompt)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class DecisionCache:
+    """In-memory LRU of LLM responses with a TTL and an optional on-disk tier."""
+
+    def __init__(self, ttl_seconds: float = LLM_CACHE_TTL_SECONDS,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 cache_dir: Optional[str] = LLM_CACHE_DIR,
+                 enabled: bool = LLM_CACHE_ENABLED):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        # Decisions are made from a thread pool, so guard the LRU
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return now - entry["created_at"] > self.ttl_seconds
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, entry: Dict[str, Any]):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  LLM cache disk write failed: {e}")
+
+    def _remove_disk(self, key: str):
+        if not self.cache_dir:
+            return
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _store(self, key: str, entry: Dict[str, Any]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for a key, or None when missing or expired."""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_expired(entry, now):
+                    del self._entries[key]
+                    self.stats["expired"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return {**entry, "tier": "memory"}
+
+        # Fall through to the disk tier outside the lock
+        entry = self._read_disk(key)
+        if entry is not None:
+            if self._is_expired(entry, now):
+                self._remove_disk(key)
+                with self._lock:
+                    self.stats["expired"] += 1
+            else:
+                with self._lock:
+                    self._store(key, entry)
+                    self.stats["disk_hits"] += 1
+                return {**entry, "tier": "disk"}
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, response: str, model: str = ""):
+        """Cache a response under a key in memory and, when configured, on disk."""
+        if not self.enabled:
+            return
+
+        entry = {"response": response, "model": model, "created_at": time.time()}
+        with self._lock:
+            self._store(key, entry)
+        self._write_disk(key, entry)
+
+    def purge_expired(self) -> int:
+        """Drop expired entries from both tiers and return how many were removed."""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if self._is_expired(e, now)]:
+                del self._entries[key]
+                removed += 1
+
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                key = name[:-len(".json")]
+                entry = self._read_disk(key)
+                if entry is None or self._is_expired(entry, now):
+                    self._remove_disk(key)
+                    removed += 1
+
+        with self._lock:
+            self.stats["expired"] += removed
+        return removed
+
+    def clear(self):
+        """Empty the in-memory tier (the disk tier is left for other processes)."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+# Global cache shared by traced and untraced LLM calls
+decision_cache = DecisionCache()
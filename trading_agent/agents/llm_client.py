@@ -0,0 +1,286 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, Callable, Any, Dict, List
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1.0"))
+LLM_HEDGE_REQUESTS = os.getenv("LLM_HEDGE_REQUESTS", "false").lower() == "true"
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when an LLM call misses its deadline."""
+
+class RateLimitError(Exception):
+    """Raised by backends when the provider rejects a call for rate limiting."""
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Recognize rate-limit errors from our backends and from the Gemini SDK."""
+    if isinstance(error, RateLimitError):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in ("429", "resource exhausted", "resourceexhausted", "rate limit", "quota"))
+
+def _response_text(response) -> str:
+    return response.content if hasattr(response, 'content') else str(response)
+
+class LangChainBackend:
+    """Backend that calls a LangChain LLM (e.g. GoogleGenerativeAI) asynchronously."""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    async def ainvoke(self, prompt) -> str:
+        response = await self.llm.ainvoke(prompt)
+        return _response_text(response)
+
+    async def astream(self, prompt):
+        async for chunk in self.llm.astream(prompt):
+            yield _response_text(chunk)
+
+class FakeLLMBackend:
+    """Local stand-in LLM for offline runs and tests.
+
+    ``answer`` may be a string or a callable taking the prompt. ``latency`` may be
+    a number of seconds or a callable returning one per call. The first
+    ``rate_limit_failures`` calls raise ``RateLimitError``. When streaming, the
+    answer is emitted in ``chunk_size`` character chunks ``chunk_latency`` apart.
+    """
+
+    def __init__(self, answer="HOLD", latency=0.0, rate_limit_failures: int = 0,
+                 chunk_size: int = 4, chunk_latency: float = 0.0):
+        self.answer = answer
+        self.latency = latency
+        self.rate_limit_failures = rate_limit_failures
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chunks_sent = 0
+
+    async def ainvoke(self, prompt) -> str:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            delay = self.latency(self.calls) if callable(self.latency) else self.latency
+            if delay:
+                await asyncio.sleep(delay)
+            if self.calls <= self.rate_limit_failures:
+                raise RateLimitError("429 Resource exhausted (fake backend)")
+            return self.answer(prompt) if callable(self.answer) else self.answer
+        finally:
+            self.in_flight -= 1
+
+    async def astream(self, prompt):
+        text = await self.ainvoke(prompt)
+        for i in range(0, len(text), self.chunk_size):
+            if self.chunk_latency:
+                await asyncio.sleep(self.chunk_latency)
+            self.chunks_sent += 1
+            yield text[i:i + self.chunk_size]
+
+class LatencyTracker:
+    """Rolling window of call latencies used to decide when to hedge."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def p95(self) -> Optional[float]:
+        return self.percentile(95)
+
+class AsyncLLMClient:
+    """Async LLM invocation with a concurrency limit, deadlines, backoff and hedging.
+
+    All calls run on a private event loop thread so the semaphore limits
+    concurrency across every caller, including the coordinator's thread pools.
+    """
+
+    def __init__(self, backend, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT_SECONDS, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_seconds: float = LLM_BACKOFF_SECONDS, backoff_max: float = 30.0,
+                 hedge: bool = LLM_HEDGE_REQUESTS, hedge_min_samples: int = 20):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.latency = LatencyTracker(min_samples=hedge_min_samples)
+        self.stats = {"calls": 0, "timeouts": 0, "retries": 0, "hedged": 0, "hedge_wins": 0,
+                      "errors": 0, "streams": 0, "early_exits": 0}
+
+        self._loop = None
+        self._semaphore = None
+        self._loop_lock = threading.Lock()
+
+    def set_backend(self, backend):
+        """Swap the backend (e.g. to a FakeLLMBackend) and reset latency history."""
+        self.backend = backend
+        self.latency = LatencyTracker(min_samples=self.latency.min_samples)
+
+    def _ensure_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                threading.Thread(target=run, name="llm-client-loop", daemon=True).start()
+                ready.wait()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._loop = loop
+        return self._loop
+
+    async def _call_backend(self, prompt) -> str:
+        start = time.perf_counter()
+        result = await self.backend.ainvoke(prompt)
+        self.latency.record(time.perf_counter() - start)
+        return result
+
+    async def _attempt(self, prompt) -> str:
+        """One attempt, optionally hedged with a second request after the p95 latency."""
+        async with self._semaphore:
+            primary = asyncio.ensure_future(self._call_backend(prompt))
+            tasks = [primary]
+            try:
+                hedge_after = self.latency.p95() if self.hedge else None
+                if hedge_after is None:
+                    return await primary
+
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if done or self._semaphore.locked():
+                    # Finished in time, or no spare capacity to hedge with
+                    return await primary
+
+                async with self._semaphore:
+                    self.stats["hedged"] += 1
+                    backup = asyncio.ensure_future(self._call_backend(prompt))
+                    tasks.append(backup)
+                    pending = set(tasks)
+                    first_error = None
+                    while pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            if task.exception() is None:
+                                if task is backup:
+                                    self.stats["hedge_wins"] += 1
+                                return task.result()
+                            first_error = first_error or task.exception()
+                    raise first_error
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+
+    async def _stream_attempt(self, prompt, consume: Callable[[str], bool]) -> Dict[str, Any]:
+        """Stream one completion into ``consume`` and stop generating once it returns True."""
+        async with self._semaphore:
+            start = time.perf_counter()
+            chunks = []
+            timings = {"first_token_s": None, "stopped_at_s": None, "stopped_early": False}
+            stream = self.backend.astream(prompt)
+            try:
+                async for chunk in stream:
+                    if timings["first_token_s"] is None:
+                        timings["first_token_s"] = time.perf_counter() - start
+                    chunks.append(chunk)
+                    if consume(chunk):
+                        timings["stopped_at_s"] = time.perf_counter() - start
+                        timings["stopped_early"] = True
+                        self.stats["early_exits"] += 1
+                        break
+            finally:
+                # Closing the generator cancels the rest of the generation
+                await stream.aclose()
+            timings["elapsed_s"] = time.perf_counter() - start
+            if not timings["stopped_early"]:
+                self.latency.record(timings["elapsed_s"])
+            return {"text": "".join(chunks), "chunks": len(chunks), **timings}
+
+    async def _invoke_with_retries(self, prompt, consume: Optional[Callable[[str], bool]] = None):
+        for attempt in range(self.max_retries + 1):
+            try:
+                if consume is not None:
+                    return await self._stream_attempt(prompt, consume)
+                return await self._attempt(prompt)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                delay = min(self.backoff_max, self.backoff_seconds * (2 ** attempt))
+                await asyncio.sleep(delay * (0.5 + random.random() / 2))
+
+    async def _ainvoke(self, prompt, timeout: Optional[float] = None,
+                       consume: Optional[Callable[[str], bool]] = None):
+        timeout = self.timeout if timeout is None else timeout
+        self.stats["calls"] += 1
+        if consume is not None:
+            self.stats["streams"] += 1
+        try:
+            return await asyncio.wait_for(self._invoke_with_retries(prompt, consume), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise LLMTimeoutError(f"LLM call exceeded its {timeout:.1f}s deadline")
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+    async def ainvoke(self, prompt, timeout: Optional[float] = None) -> str:
+        """Await an LLM response from any event loop."""
+        loop = self._ensure_loop()
+        coro = self._ainvoke(prompt, timeout)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def invoke(self, prompt, timeout: Optional[float] = None) -> str:
+        """Blocking LLM call for synchronous callers (e.g. coordinator worker threads)."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._ainvoke(prompt, timeout), loop).result()
+
+    def invoke_stream(self, prompt, consume: Callable[[str], bool],
+                      timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Blocking streamed call; ``consume`` sees each chunk and returns True to stop early.
+
+        Returns the streamed text plus first-token and stop timings in seconds.
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._ainvoke(prompt, timeout, consume), loop).result()
+
+    def invoke_many(self, prompts: List[Any], timeout: Optional[float] = None) -> List[Any]:
+        """Run several prompts concurrently; failed calls come back as exceptions."""
+        loop = self._ensure_loop()
+
+        async def gather():
+            return await asyncio.gather(*(self._ainvoke(p, timeout) for p in prompts), return_exceptions=True)
+
+        return asyncio.run_coroutine_threadsafe(gather(), loop).result()
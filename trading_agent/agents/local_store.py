@@ -0,0 +1,277 @@
+import os
+import json
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional, Sequence
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOCAL_STORE_ENABLED = os.getenv("LOCAL_STORE_ENABLED", "true").lower() == "true"
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", os.path.join("data", "trading_store.sqlite3"))
+# Rows pulled from Astra DB per symbol when the local tier is behind
+LOCAL_STORE_RECONCILE_LIMIT = int(os.getenv("LOCAL_STORE_RECONCILE_LIMIT", "1000"))
+
+BAR_COLUMNS = ["o", "h", "l", "c", "v", "vw"]
+# Astra market_data documents use long names
+_ASTRA_BAR_COLUMNS = {"open": "o", "high": "h", "low": "l", "close": "c", "volume": "v", "vwap": "vw"}
+_DOCUMENT_FIELDS = {"_id", "symbol", "timestamp", "$vector"}
+
+def _ns(ts) -> int:
+    ts = pd.Timestamp(ts)
+    return (ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")).value
+
+def _index_ns(index) -> np.ndarray:
+    index = pd.DatetimeIndex(index)
+    index = index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+    return index.asi8
+
+def frame_from_documents(df: pd.DataFrame) -> pd.DataFrame:
+    """An Astra-layout frame (open/high/..., _id, symbol) in the get_bars layout (o/h/l/c/v/vw)."""
+    if df is None or df.empty:
+        return pd.DataFrame()
+    df = df.rename(columns=_ASTRA_BAR_COLUMNS)
+    return df.drop(columns=[c for c in _DOCUMENT_FIELDS if c in df.columns])
+
+class LocalStore:
+    """Embedded SQLite tier for bars, indicators and trades.
+
+    Rows are keyed by (symbol, ts) with ``ts`` in UTC epoch nanoseconds, so a
+    symbol/time-range read is a primary-key range scan. Reads come back as
+    numpy column arrays (``read_arrays``) or DataFrames built from them without
+    any per-row JSON. Indicator columns are added to the table as they appear.
+    """
+
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        self.path = path
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS market_data (symbol TEXT NOT NULL, ts INTEGER NOT NULL, "
+                + ", ".join(f"{c} REAL" for c in BAR_COLUMNS) + ", PRIMARY KEY (symbol, ts)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS indicators (symbol TEXT NOT NULL, ts INTEGER NOT NULL, "
+                              "PRIMARY KEY (symbol, ts)) WITHOUT ROWID")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bar_rollups (symbol TEXT NOT NULL, timeframe TEXT NOT NULL, "
+                "ts INTEGER NOT NULL, " + ", ".join(f"{c} REAL" for c in BAR_COLUMNS)
+                + ", PRIMARY KEY (symbol, timeframe, ts)) WITHOUT ROWID")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS trades (id TEXT PRIMARY KEY, symbol TEXT, ts INTEGER, "
+                              "doc TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS trades_symbol_ts ON trades (symbol, ts)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+            self.conn.commit()
+        self._columns = {table: self._table_columns(table) for table in ("market_data", "indicators")}
+
+    def _table_columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")][2:]
+
+    def _ensure_columns(self, table: str, names: Sequence[str]):
+        missing = [n for n in names if n not in self._columns[table]]
+        for name in missing:
+            self.conn.execute(f'ALTER TABLE {table} ADD COLUMN "{name}" REAL')
+        if missing:
+            self._columns[table] = self._table_columns(table)
+
+    # Time series
+    def write_frame(self, table: str, symbol: str, frame: pd.DataFrame) -> int:
+        """Upsert a bars (``market_data``) or ``indicators`` frame indexed by timestamp."""
+        if frame is None or frame.empty:
+            return 0
+        numeric = frame.select_dtypes(include=[np.number, "bool"])
+        if table == "market_data":
+            numeric = numeric[[c for c in BAR_COLUMNS if c in numeric.columns]]
+        columns = list(numeric.columns)
+        values = numeric.to_numpy(dtype=float)
+        values = np.where(np.isnan(values), None, values).tolist() if np.isnan(values).any() else values.tolist()
+        ts = _index_ns(frame.index).tolist()
+        rows = [(symbol, t, *row) for t, row in zip(ts, values)]
+        column_sql = ", ".join(f'"{c}"' for c in ["symbol", "ts", *columns])
+        placeholders = ", ".join("?" * (len(columns) + 2))
+        with self._lock:
+            if table == "indicators":
+                self._ensure_columns(table, columns)
+            self.conn.executemany(f"INSERT OR REPLACE INTO {table} ({column_sql}) VALUES ({placeholders})", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def read_arrays(self, table: str, symbol: str, start=None, end=None, limit: Optional[int] = None,
+                    columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+        """Columns for ``symbol`` in [start, end] as numpy arrays (``ts`` in epoch ns).
+
+        With ``limit`` the most recent rows are returned, oldest first; with
+        ``columns`` only those are read.
+        """
+        where, params = ["symbol = ?"], [symbol]
+        if start is not None:
+            where.append("ts >= ?")
+            params.append(_ns(start))
+        if end is not None:
+            where.append("ts <= ?")
+            params.append(_ns(end))
+        with self._lock:
+            stored = self._columns[table]
+            columns = [c for c in columns if c in stored] if columns else list(stored)
+            column_sql = ", ".join(["ts", *(f'"{c}"' for c in columns)])
+            sql = f"SELECT {column_sql} FROM {table} WHERE {' AND '.join(where)} ORDER BY ts"
+            if limit:
+                sql = f"SELECT * FROM ({sql} DESC LIMIT {int(limit)}) ORDER BY ts"
+            rows = self.conn.execute(sql, params).fetchall()
+        if not rows:
+            return {"ts": np.zeros(0, dtype=np.int64), **{c: np.zeros(0) for c in columns}}
+        ts, *values = zip(*rows)
+        arrays = {"ts": np.array(ts, dtype=np.int64)}
+        for name, column in zip(columns, values):
+            arrays[name] = np.array(column, dtype=float)
+        return arrays
+
+    def read_frame(self, table: str, symbol: str, start=None, end=None, limit: Optional[int] = None,
+                   columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        arrays = self.read_arrays(table, symbol, start, end, limit, columns)
+        if not len(arrays["ts"]):
+            return pd.DataFrame()
+        index = pd.DatetimeIndex(arrays.pop("ts"), tz="UTC", name="timestamp")
+        frame = pd.DataFrame(arrays, index=index)
+        return frame.dropna(axis=1, how="all")
+
+    def latest_timestamp(self, table: str, symbol: str) -> Optional[pd.Timestamp]:
+        with self._lock:
+            row = self.conn.execute(f"SELECT MAX(ts) FROM {table} WHERE symbol = ?", (symbol,)).fetchone()
+        return pd.Timestamp(row[0], tz="UTC") if row and row[0] is not None else None
+
+    def symbols(self, table: str = "market_data") -> List[str]:
+        with self._lock:
+            return [r[0] for r in self.conn.execute(f"SELECT DISTINCT symbol FROM {table}")]
+
+    # Downsampled bars (hourly/daily rollups of bars past retention)
+    def write_rollups(self, symbol: str, timeframe: str, frame: pd.DataFrame) -> int:
+        if frame is None or frame.empty:
+            return 0
+        columns = [c for c in BAR_COLUMNS if c in frame.columns]
+        values = frame[columns].to_numpy(dtype=float)
+        values = np.where(np.isnan(values), None, values).tolist()
+        rows = [(symbol, timeframe, t, *row) for t, row in zip(_index_ns(frame.index).tolist(), values)]
+        column_sql = ", ".join(["symbol", "timeframe", "ts", *columns])
+        with self._lock:
+            self.conn.executemany(f"INSERT OR REPLACE INTO bar_rollups ({column_sql}) "
+                                  f"VALUES ({', '.join('?' * (len(columns) + 3))})", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def read_rollups(self, symbol: str, timeframe: str, start=None, end=None) -> pd.DataFrame:
+        where, params = ["symbol = ?", "timeframe = ?"], [symbol, timeframe]
+        if start is not None:
+            where.append("ts >= ?")
+            params.append(_ns(start))
+        if end is not None:
+            where.append("ts <= ?")
+            params.append(_ns(end))
+        with self._lock:
+            rows = self.conn.execute(f"SELECT ts, {', '.join(BAR_COLUMNS)} FROM bar_rollups "
+                                     f"WHERE {' AND '.join(where)} ORDER BY ts", params).fetchall()
+        if not rows:
+            return pd.DataFrame()
+        frame = pd.DataFrame(rows, columns=["ts", *BAR_COLUMNS], dtype=float)
+        index = pd.DatetimeIndex(frame.pop("ts").astype(np.int64), tz="UTC", name="timestamp")
+        return frame.set_axis(index)
+
+    # Retention
+    def delete_before(self, table: str, cutoff, symbol: Optional[str] = None, timeframe: Optional[str] = None) -> int:
+        """Delete rows older than ``cutoff`` (optionally for one symbol / rollup timeframe); returns the count."""
+        sql, params = f"DELETE FROM {table} WHERE ts < ?", [_ns(cutoff)]
+        if symbol:
+            sql += " AND symbol = ?"
+            params.append(symbol)
+        if timeframe:
+            sql += " AND timeframe = ?"
+            params.append(timeframe)
+        with self._lock:
+            deleted = self.conn.execute(sql, params).rowcount
+            self.conn.commit()
+        return deleted
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            return pages * self.conn.execute("PRAGMA page_size").fetchone()[0]
+
+    def vacuum(self):
+        """Give the pages freed by deletes back to the filesystem."""
+        with self._lock:
+            self.conn.execute("VACUUM")
+
+    # Trades
+    def write_trades(self, trades: Sequence[Dict[str, Any]]) -> int:
+        rows = []
+        for trade in trades:
+            ts = trade.get("timestamp")
+            rows.append((str(trade["_id"]), trade.get("symbol"), _ns(ts) if ts is not None else None,
+                         json.dumps(trade, default=str)))
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO trades (id, symbol, ts, doc) VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def read_trades(self, symbol: Optional[str] = None, limit: int = 100,
+                    fields: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Newest first, like ``astra_db.get_trades``; with ``fields`` only those (and _id) are extracted."""
+        if fields:
+            fields = ["_id", *(f for f in fields if f != "_id")]
+            pairs = ", ".join("?, json_extract(doc, ?)" for _ in fields)
+            sql, params = f"SELECT json_object({pairs}) FROM trades", [x for f in fields for x in (f, f"$.{f}")]
+        else:
+            sql, params = "SELECT doc FROM trades", []
+        if symbol:
+            sql += " WHERE symbol = ?"
+            params.append(symbol)
+        sql += " ORDER BY ts DESC LIMIT ?"
+        params.append(int(limit))
+        with self._lock:
+            return [json.loads(r[0]) for r in self.conn.execute(sql, params)]
+
+    def update_trade_order(self, order: Dict[str, Any]) -> int:
+        """Replace the ``order_result`` of the trade(s) that placed ``order`` (e.g. once it has filled)."""
+        with self._lock:
+            updated = self.conn.execute(
+                "UPDATE trades SET doc = json_set(doc, '$.order_result', json(?)) "
+                "WHERE json_extract(doc, '$.order_result.id') = ?",
+                (json.dumps(order, default=str), order["id"])).rowcount
+            self.conn.commit()
+        return updated
+
+    def iter_trades(self):
+        """Every trade, oldest first."""
+        with self._lock:
+            rows = self.conn.execute("SELECT doc FROM trades ORDER BY ts").fetchall()
+        return (json.loads(r[0]) for r in rows)
+
+    # Single documents (e.g. summaries)
+    def put_document(self, doc: Dict[str, Any]):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO documents (id, doc) VALUES (?, ?)",
+                              (str(doc["_id"]), json.dumps(doc, default=str)))
+            self.conn.commit()
+
+    def get_document(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute("SELECT doc FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self, table: str, symbol: Optional[str] = None) -> int:
+        sql, params = f"SELECT COUNT(*) FROM {table}", []
+        if symbol:
+            sql += " WHERE symbol = ?"
+            params.append(symbol)
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,267 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+from dotenv import load_dotenv
+from .decision_parser import decision_from_text
+from .llm_cache import decision_cache, prompt_key
+
+load_dotenv()
+
+LLM_CASCADE_ENABLED = os.getenv("LLM_CASCADE_ENABLED", "false").lower() == "true"
+LLM_CASCADE_TIERS = os.getenv("LLM_CASCADE_TIERS", "rules,gemini-2.5-flash-lite")
+LLM_CASCADE_CONFIDENCE = float(os.getenv("LLM_CASCADE_CONFIDENCE", "0.7"))
+LLM_CASCADE_MAX_ORDER_NOTIONAL = float(os.getenv("LLM_CASCADE_MAX_ORDER_NOTIONAL", "1000"))
+LLM_CASCADE_MAX_POSITION_PCT = float(os.getenv("LLM_CASCADE_MAX_POSITION_PCT", "0.2"))
+
+CONFIDENCE_SUFFIX = ("\n\nAfter the decision, add your confidence from 0 to 100 on its own line, "
+                     "e.g. \"HOLD\nCONFIDENCE: 65\".")
+
+# Only a number labelled as the confidence counts - replies also mention trail %, prices and RSI levels
+_CONFIDENCE_RE = re.compile(r"\bconfidence(?:\s+(?:is|of|level))?\s*[:=]?\s*(\d{1,3}(?:\.\d+)?)\s*%?",
+                            re.IGNORECASE)
+
+def _to_float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def parse_confidence(text: str) -> float:
+    """Pull the labelled 0-100 confidence ("CONFIDENCE: 65") out of an LLM answer; 0 when missing."""
+    for match in _CONFIDENCE_RE.finditer(str(text)):
+        value = float(match.group(1))
+        if 0 <= value <= 100:
+            return value / 100
+    return 0.0
+
+def rule_based_decision(position_data: Optional[Dict], indicators: Optional[Dict]) -> Tuple[str, float]:
+    """Apply the prompt's CRITICAL RULES directly and score how one-sided the signals are."""
+    position_data = position_data or {}
+    indicators = indicators or {}
+    votes = {}
+
+    def vote(decision, weight):
+        votes[decision] = votes.get(decision, 0) + weight
+
+    price = _to_float(position_data.get('current_price'))
+    entry = _to_float(position_data.get('avg_entry_price'))
+    rsi = _to_float(indicators.get('rsi'))
+    ema = _to_float(indicators.get('ema'))
+    volatility = _to_float(indicators.get('volatility_score'))
+
+    if price and entry:
+        profit_pct = (price - entry) / entry * 100
+        if profit_pct > 5:
+            vote("OCO_SELL", 2.0)
+        elif profit_pct < -5:
+            vote("STOP_LOSS", 1.5)
+
+    if rsi is not None and rsi == rsi:  # skip NaN
+        if rsi > 70:
+            vote("OCO_SELL", 1.5)
+        elif rsi < 30:
+            vote("BRACKET_BUY", 1.5)
+
+    if price and ema:
+        if price > ema:
+            vote("BRACKET_BUY", 0.5)
+        else:
+            vote("STOP_LOSS", 0.5)
+
+    if not votes:
+        return "HOLD", 0.5
+
+    total = sum(votes.values())
+    decision, top = max(votes.items(), key=lambda item: item[1])
+    # One-sided signals with plenty of evidence are confident; mixed or thin ones are not
+    confidence = (top / total) * min(1.0, total / 3.0)
+    if volatility is not None and volatility > 5:
+        confidence *= 0.7
+    return decision, round(confidence, 3)
+
+# Column order doubles as the tie-break: it matches the vote insertion order above
+RULE_DECISIONS = np.array(["STOP_LOSS", "OCO_SELL", "BRACKET_BUY", "HOLD"], dtype=object)
+
+def rule_based_decisions(price, entry, rsi, ema, volatility=None) -> Tuple[np.ndarray, np.ndarray]:
+    """``rule_based_decision`` over whole arrays (NaN marks a missing value).
+
+    Returns an array of decisions and an array of confidences, e.g. one per bar
+    of a backtest or one per symbol of a cycle.
+    """
+    price = np.asarray(price, dtype=float)
+    entry = np.broadcast_to(np.asarray(entry, dtype=float), price.shape)
+    rsi = np.broadcast_to(np.asarray(rsi, dtype=float), price.shape)
+    ema = np.broadcast_to(np.asarray(ema, dtype=float), price.shape)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        has_profit = (price != 0) & (entry != 0) & ~np.isnan(price) & ~np.isnan(entry)
+        profit_pct = np.where(has_profit, (price - entry) / np.where(has_profit, entry, 1.0) * 100, 0.0)
+        has_trend = (price != 0) & ~np.isnan(price) & (ema != 0) & ~np.isnan(ema)
+
+        stop = np.where(has_profit & (profit_pct < -5), 1.5, 0.0) + np.where(has_trend & (price <= ema), 0.5, 0.0)
+        oco = np.where(has_profit & (profit_pct > 5), 2.0, 0.0) + np.where(rsi > 70, 1.5, 0.0)
+        buy = np.where(rsi < 30, 1.5, 0.0) + np.where(has_trend & (price > ema), 0.5, 0.0)
+
+    votes = np.stack([stop, oco, buy])
+    total = votes.sum(axis=0)
+    top_index = votes.argmax(axis=0)  # first maximum wins ties
+    top = votes.max(axis=0)
+    voted = total > 0
+
+    confidence = np.where(voted, top / np.where(voted, total, 1.0) * np.minimum(1.0, total / 3.0), 0.5)
+    if volatility is not None:
+        volatility = np.broadcast_to(np.asarray(volatility, dtype=float), price.shape)
+        with np.errstate(invalid="ignore"):
+            confidence = np.where(voted & (volatility > 5), confidence * 0.7, confidence)
+    decisions = RULE_DECISIONS[np.where(voted, top_index, 3)]
+    return decisions, np.round(confidence, 3)
+
+def is_high_stakes(position_data: Optional[Dict], account_data: Optional[Dict],
+                   max_order_notional: float = LLM_CASCADE_MAX_ORDER_NOTIONAL,
+                   max_position_pct: float = LLM_CASCADE_MAX_POSITION_PCT) -> Optional[str]:
+    """Return why a decision is high-stakes (and must go to the strong model), or None."""
+    position_data = position_data or {}
+    account_data = account_data or {}
+
+    price = _to_float(position_data.get('current_price'), 0.0)
+    qty = abs(_to_float(position_data.get('qty'), 0.0))
+    cash = _to_float(account_data.get('cash'), 0.0)
+    equity = _to_float(account_data.get('equity')) or _to_float(account_data.get('portfolio_value'), 0.0)
+
+    position_value = qty * price
+    # Largest order execute_actions could place: the whole position, or a 10-share buy
+    buy_value = min(10, int(cash // price)) * price if price > 0 and cash > 0 else 0.0
+    if max(position_value, buy_value) > max_order_notional:
+        return "order_size"
+    if equity > 0 and position_value / equity > max_position_pct:
+        return "position_concentration"
+    return None
+
+class RuleTier:
+    """Cheapest tier: the rule engine, no model call at all."""
+
+    name = "rules"
+
+    def decide(self, context: Dict[str, Any]) -> Tuple[str, float]:
+        return rule_based_decision(context.get('position_data'), context.get('indicators'))
+
+class LLMTier:
+    """A cheaper/faster model asked for a decision plus a confidence score."""
+
+    def __init__(self, model: str, client):
+        self.name = model
+        self.model = model
+        self.client = client
+
+    def decide(self, context: Dict[str, Any]) -> Tuple[str, float]:
+        prompt = context['prompt'] + CONFIDENCE_SUFFIX
+        key = prompt_key(prompt, self.model)
+        cached = decision_cache.get(key)
+        if cached is not None:
+            text = cached['response']
+        else:
+            text = self.client.invoke(prompt)
+            decision_cache.set(key, text, model=self.model)
+        return decision_from_text(text), parse_confidence(text)
+
+class CascadeStats:
+    """Thread-safe counters for escalations, per-tier latency and tier disagreement."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.decisions = 0
+        self.escalations = 0
+        self.escalation_reasons = {}
+        self.tiers = {}
+
+    def _tier(self, name):
+        return self.tiers.setdefault(name, {"invoked": 0, "answered": 0, "latency_s": 0.0,
+                                            "compared": 0, "disagreed": 0})
+
+    def record(self, path: List[Dict[str, Any]], final_tier: str, reason: Optional[str]):
+        with self._lock:
+            self.decisions += 1
+            if reason:
+                self.escalations += 1
+                self.escalation_reasons[reason] = self.escalation_reasons.get(reason, 0) + 1
+            final_decision = path[-1]['decision']
+            for step in path:
+                tier = self._tier(step['tier'])
+                tier['invoked'] += 1
+                tier['latency_s'] += step['latency_ms'] / 1000
+                if step['tier'] == final_tier:
+                    tier['answered'] += 1
+                else:
+                    # A cheap answer that was overruled: did the strong model agree?
+                    tier['compared'] += 1
+                    if step['decision'] != final_decision:
+                        tier['disagreed'] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "decisions": self.decisions,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.decisions if self.decisions else 0.0,
+                "escalation_reasons": dict(self.escalation_reasons),
+                "tiers": {
+                    name: {
+                        "invoked": t["invoked"],
+                        "answered": t["answered"],
+                        "avg_latency_ms": round(t["latency_s"] / t["invoked"] * 1000, 2) if t["invoked"] else 0.0,
+                        "disagreement_rate": t["disagreed"] / t["compared"] if t["compared"] else 0.0,
+                    }
+                    for name, t in self.tiers.items()
+                },
+            }
+
+class ModelCascade:
+    """Answer with the cheapest confident tier; escalate low-confidence or high-stakes cases."""
+
+    def __init__(self, tiers: List[Any], final_tier_name: str,
+                 confidence_threshold: float = LLM_CASCADE_CONFIDENCE):
+        self.tiers = tiers
+        self.final_tier_name = final_tier_name
+        self.confidence_threshold = confidence_threshold
+        self.stats = CascadeStats()
+
+    def decide(self, context: Dict[str, Any], final_decide, metadata: Optional[Dict] = None) -> str:
+        """Run the cascade; ``final_decide()`` invokes the strong model when escalating."""
+        path = []
+        reason = is_high_stakes(context.get('position_data'), context.get('account_data'))
+
+        if reason is None:
+            for tier in self.tiers:
+                start = time.perf_counter()
+                try:
+                    decision, confidence = tier.decide(context)
+                except Exception as e:
+                    print(f"⚠️  Cascade tier {tier.name} failed: {e}")
+                    continue
+                path.append({"tier": tier.name, "decision": decision, "confidence": confidence,
+                             "latency_ms": round((time.perf_counter() - start) * 1000, 2)})
+                if confidence >= self.confidence_threshold:
+                    break
+            else:
+                reason = "low_confidence"
+
+        if reason is not None:
+            start = time.perf_counter()
+            decision = final_decide()
+            path.append({"tier": self.final_tier_name, "decision": decision, "confidence": None,
+                         "latency_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+        final_tier = path[-1]['tier']
+        self.stats.record(path, final_tier, reason)
+
+        if metadata is not None:
+            metadata['cascade_tier'] = final_tier
+            metadata['cascade_path'] = path
+            metadata['escalation_reason'] = reason
+        return path[-1]['decision']
@@ -1,4 +1,10 @@
 import os
+import json
+import time
+import queue
+import hashlib
+import contextlib
+import threading
 import requests
 from dotenv import load_dotenv
 
@@ -8,15 +14,131 @@ ALPACA_API_KEY = os.getenv("ALPACA_API_KEY")
 ALPACA_SECRET_KEY = os.getenv("ALPACA_SECRET_KEY")
 BASE_URL = "https://paper-api.alpaca.markets"
 
+ALPACA_RATE_LIMIT_PER_MIN = int(os.getenv("ALPACA_RATE_LIMIT_PER_MIN", "200"))
+ORDER_SUBMIT_TIMEOUT = float(os.getenv("ORDER_SUBMIT_TIMEOUT", "10"))
+ORDER_SUBMIT_RETRIES = int(os.getenv("ORDER_SUBMIT_RETRIES", "2"))
+
 HEADERS = {
     "APCA-API-KEY-ID": ALPACA_API_KEY,
     "APCA-API-SECRET-KEY": ALPACA_SECRET_KEY
 }
 
+class RateLimiter:
+    """Thread-safe token bucket shared by every order request (Alpaca allows 200 calls/minute)."""
+
+    def __init__(self, rate_per_minute=ALPACA_RATE_LIMIT_PER_MIN, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1, rate_per_minute // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+order_rate_limiter = RateLimiter()
+
+# Pluggable order backend: None talks to Alpaca; a SimulatedBroker (sim_broker.py)
+# answers the same calls locally for backtests and replays
+_order_backend = None
+
+def set_order_backend(backend):
+    """Route order calls to ``backend`` instead of Alpaca (``None`` restores Alpaca)."""
+    global _order_backend
+    if _order_backend is not None and order_book.apply_event in _order_backend.listeners:
+        _order_backend.listeners.remove(order_book.apply_event)
+    _order_backend = backend
+    if backend is not None:
+        # The backend's trade updates feed the local order book like the Alpaca stream does
+        backend.listeners.append(order_book.apply_event)
+    return backend
+
+def get_order_backend():
+    return _order_backend
+
+@contextlib.contextmanager
+def order_backend(backend):
+    """Use ``backend`` with a fresh order book for the duration of a block (backtests, replays)."""
+    global order_book
+    saved_backend, saved_book = _order_backend, order_book
+    order_book = OrderBook()
+    set_order_backend(backend)
+    try:
+        yield backend
+    finally:
+        order_book = saved_book
+        set_order_backend(saved_backend)
+
+def make_client_order_id(cycle_id, symbol, action):
+    """Deterministic client_order_id so a retried submission can't create a second order."""
+    digest = hashlib.sha256(f"{cycle_id}|{symbol}|{action}".encode("utf-8")).hexdigest()[:20]
+    return f"{symbol}-{action}-{digest}"[:128]
+
+def get_order_by_client_order_id(client_order_id):
+    """Fetch an order by its client_order_id, or None if Alpaca has no such order."""
+    if _order_backend is not None:
+        return _order_backend.get_order_by_client_order_id(client_order_id)
+    order_rate_limiter.acquire()
+    response = requests.get(f"{BASE_URL}/v2/orders:by_client_order_id", headers=HEADERS,
+                            params={"client_order_id": client_order_id}, timeout=ORDER_SUBMIT_TIMEOUT)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+def _submit_order(data):
+    """POST an order through the rate limiter; retries are only safe with a client_order_id."""
+    if _order_backend is not None:
+        order = _order_backend.submit_order(data)
+        order_book.apply_order(order)
+        return order
+
+    client_order_id = data.get("client_order_id")
+    attempts = ORDER_SUBMIT_RETRIES + 1 if client_order_id else 1
+
+    for attempt in range(attempts):
+        order_rate_limiter.acquire()
+        try:
+            response = requests.post(f"{BASE_URL}/v2/orders", headers=HEADERS, json=data, timeout=ORDER_SUBMIT_TIMEOUT)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            if attempt == attempts - 1:
+                raise
+            print(f"   ⚠️ Order submit for {data['symbol']} failed ({e}), checking before retry...")
+            # The first POST may have landed - look it up instead of double-submitting
+            existing = get_order_by_client_order_id(client_order_id)
+            if existing:
+                order_book.apply_order(existing)
+                return existing
+            time.sleep(0.5 * (2 ** attempt))
+            continue
+
+        if response.status_code == 422 and client_order_id and "client_order_id" in response.text:
+            # Duplicate client_order_id: an earlier attempt already created the order
+            existing = get_order_by_client_order_id(client_order_id)
+            if existing:
+                order_book.apply_order(existing)
+                return existing
+        response.raise_for_status()
+        order = response.json()
+        # Our own orders show up in the local book immediately
+        order_book.apply_order(order)
+        return order
+
 def place_order(symbol, qty, side, type="market", time_in_force="gtc", 
                 limit_price=None, stop_price=None, trail_price=None, 
                 trail_percent=None, order_class="simple", 
-                take_profit=None, stop_loss=None, extended_hours=False):
+                take_profit=None, stop_loss=None, extended_hours=False,
+                client_order_id=None):
     """Place an order with full Alpaca order type support."""
     data = {
         "symbol": symbol,
@@ -38,6 +160,8 @@ def place_order(symbol, qty, side, type="market", time_in_force="gtc",
         data["trail_percent"] = trail_percent
     if extended_hours:
         data["extended_hours"] = True
+    if client_order_id:
+        data["client_order_id"] = client_order_id
     
     # Handle advanced order classes
     if order_class in ["bracket", "oco", "oto"]:
@@ -46,11 +170,9 @@ def place_order(symbol, qty, side, type="market", time_in_force="gtc",
         if stop_loss:
             data["stop_loss"] = stop_loss
     
-    response = requests.post(f"{BASE_URL}/v2/orders", headers=HEADERS, json=data)
-    response.raise_for_status()
-    return response.json()
+    return _submit_order(data)
 
-def place_bracket_order(symbol, qty, side, entry_price, take_profit_price, stop_loss_price, time_in_force="gtc"):
+def place_bracket_order(symbol, qty, side, entry_price, take_profit_price, stop_loss_price, time_in_force="gtc", client_order_id=None):
     """Place a bracket order: entry + take-profit + stop-loss."""
     take_profit = {"limit_price": take_profit_price}
     stop_loss = {"stop_price": stop_loss_price}
@@ -61,13 +183,14 @@ def place_bracket_order(symbol, qty, side, entry_price, take_profit_price, stop_
         side=side,
         type="limit" if side == "buy" else "limit",
         time_in_force=time_in_force,
+        client_order_id=client_order_id,
         limit_price=entry_price,
         order_class="bracket",
         take_profit=take_profit,
         stop_loss=stop_loss
     )
 
-def place_oco_order(symbol, qty, take_profit_price, stop_loss_price, time_in_force="gtc"):
+def place_oco_order(symbol, qty, take_profit_price, stop_loss_price, time_in_force="gtc", client_order_id=None):
     """Place OCO order: take-profit + stop-loss for existing position."""
     take_profit = {"limit_price": take_profit_price}
     stop_loss = {"stop_price": stop_loss_price}
@@ -78,12 +201,13 @@ def place_oco_order(symbol, qty, take_profit_price, stop_loss_price, time_in_for
         side="sell",  # OCO is for closing positions
         type="limit",
         time_in_force=time_in_force,
+        client_order_id=client_order_id,
         order_class="oco",
         take_profit=take_profit,
         stop_loss=stop_loss
     )
 
-def place_trailing_stop(symbol, qty, side, trail_price=None, trail_percent=None, time_in_force="day"):
+def place_trailing_stop(symbol, qty, side, trail_price=None, trail_percent=None, time_in_force="day", client_order_id=None):
     """Place a trailing stop order."""
     return place_order(
         symbol=symbol,
@@ -91,11 +215,12 @@ def place_trailing_stop(symbol, qty, side, trail_price=None, trail_percent=None,
         side=side,
         type="trailing_stop",
         time_in_force=time_in_force,
+        client_order_id=client_order_id,
         trail_price=trail_price,
         trail_percent=trail_percent
     )
 
-def place_limit_order(symbol, qty, side, limit_price, time_in_force="gtc"):
+def place_limit_order(symbol, qty, side, limit_price, time_in_force="gtc", client_order_id=None):
     """Place a limit order."""
     return place_order(
         symbol=symbol,
@@ -103,10 +228,11 @@ def place_limit_order(symbol, qty, side, limit_price, time_in_force="gtc"):
         side=side,
         type="limit",
         time_in_force=time_in_force,
+        client_order_id=client_order_id,
         limit_price=limit_price
     )
 
-def place_stop_order(symbol, qty, side, stop_price, time_in_force="gtc"):
+def place_stop_order(symbol, qty, side, stop_price, time_in_force="gtc", client_order_id=None):
     """Place a stop order."""
     return place_order(
         symbol=symbol,
@@ -114,17 +240,333 @@ def place_stop_order(symbol, qty, side, stop_price, time_in_force="gtc"):
         side=side,
         type="stop",
         time_in_force=time_in_force,
+        client_order_id=client_order_id,
         stop_price=stop_price
     )
 
-def place_stop_limit_order(symbol, qty, side, stop_price, limit_price, time_in_force="gtc"):
+def place_stop_limit_order(symbol, qty, side, stop_price, limit_price, time_in_force="gtc", client_order_id=None):
     """Place a stop-limit order."""
     return place_order(
         symbol=symbol,
         qty=qty,
         side=side,
-        type="stop",
+        type="stop_limit",
         time_in_force=time_in_force,
+        client_order_id=client_order_id,
         stop_price=stop_price,
         limit_price=limit_price
-    )
\ No newline at end of file
+    )
+
+# Local order book mirror
+ORDER_BOOK_STREAMING = os.getenv("ORDER_BOOK_STREAMING", "true").lower() == "true"
+# Each poll costs two list calls (plus a lookup per closed order) from the shared 200/min limit
+ORDER_BOOK_POLL_INTERVAL = float(os.getenv("ORDER_BOOK_POLL_INTERVAL", "20"))
+STREAM_URL = BASE_URL.replace("https://", "wss://") + "/stream"
+
+TERMINAL_ORDER_STATUSES = {"filled", "canceled", "expired", "rejected", "replaced"}
+PROTECTIVE_ORDER_TYPES = {"stop", "stop_limit", "trailing_stop"}
+
+def list_orders(status="open", after=None, limit=500, nested=True):
+    """List orders from Alpaca (oldest first when ``after`` is given)."""
+    if _order_backend is not None:
+        return _order_backend.list_orders(status=status, after=after, limit=limit, nested=nested)
+    params = {"status": status, "limit": limit, "nested": str(nested).lower()}
+    if after:
+        params["after"] = after
+        params["direction"] = "asc"
+    order_rate_limiter.acquire()
+    response = requests.get(f"{BASE_URL}/v2/orders", headers=HEADERS, params=params, timeout=ORDER_SUBMIT_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+def get_order(order_id):
+    """Fetch a specific order."""
+    if _order_backend is not None:
+        return _order_backend.get_order(order_id)
+    order_rate_limiter.acquire()
+    response = requests.get(f"{BASE_URL}/v2/orders/{order_id}", headers=HEADERS, timeout=ORDER_SUBMIT_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+def cancel_order(order_id):
+    """Cancel an open order (cancelling an OCO/bracket parent cancels its legs)."""
+    if _order_backend is not None:
+        _order_backend.cancel_order(order_id)
+    else:
+        order_rate_limiter.acquire()
+        response = requests.delete(f"{BASE_URL}/v2/orders/{order_id}", headers=HEADERS, timeout=ORDER_SUBMIT_TIMEOUT)
+        if response.status_code not in (200, 204):
+            response.raise_for_status()
+    order = order_book.orders.get(order_id)
+    if order:
+        order_book.apply_order({**order, "status": "canceled",
+                                "legs": [{**leg, "status": "canceled"} for leg in order.get("legs") or []]})
+    return order_id
+
+def cancel_orders(order_ids, max_workers=4):
+    """Cancel several orders concurrently; returns {order_id: None or error message}."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def cancel(order_id):
+        try:
+            cancel_order(order_id)
+            return None
+        except requests.exceptions.RequestException as e:
+            return str(e)
+
+    order_ids = list(dict.fromkeys(order_ids))
+    if not order_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(order_ids))) as executor:
+        return dict(zip(order_ids, executor.map(cancel, order_ids)))
+
+def replace_order(order_id, qty=None, limit_price=None, stop_price=None, trail=None,
+                  time_in_force=None, client_order_id=None):
+    """Amend an open order in place (PATCH); Alpaca answers with the replacement order."""
+    data = {}
+    if qty is not None:
+        data["qty"] = qty
+    if limit_price is not None:
+        data["limit_price"] = limit_price
+    if stop_price is not None:
+        data["stop_price"] = stop_price
+    if trail is not None:
+        data["trail"] = trail
+    if time_in_force is not None:
+        data["time_in_force"] = time_in_force
+    if client_order_id:
+        data["client_order_id"] = client_order_id
+
+    if _order_backend is not None:
+        order = _order_backend.replace_order(order_id, data)
+    else:
+        order_rate_limiter.acquire()
+        response = requests.patch(f"{BASE_URL}/v2/orders/{order_id}", headers=HEADERS, json=data, timeout=ORDER_SUBMIT_TIMEOUT)
+        response.raise_for_status()
+        order = response.json()
+    old = order_book.orders.get(order_id)
+    if old:
+        order_book.apply_order({**old, "status": "replaced"})
+    order_book.apply_order(order)
+    return order
+
+def is_protective_order(order):
+    """Stops, trailing stops and the exit legs of OCO/bracket orders protect a position."""
+    if order.get("side") != "sell":
+        return False
+    return order.get("type") in PROTECTIVE_ORDER_TYPES or order.get("order_class") in ("oco", "bracket")
+
+class OrderBook:
+    """In-memory mirror of open orders and fills, kept current from trade update events.
+
+    Lookups of open or protective orders for a symbol are dictionary hits, so
+    callers no longer need to pull the full order list from Alpaca. Each fill
+    event's order is also handed to every callable in ``fill_listeners``.
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self.fills = []
+        self._open_by_symbol = {}
+        self._protective_by_symbol = {}
+        self._lock = threading.Lock()
+        self.seeded = False
+        self.cursor = None  # submitted_at of the newest order seen (for after= polling)
+        self.last_event_at = None
+        self._feed = None
+        self.fill_listeners = []
+        self.stats = {"events": 0, "fills": 0, "seeded_orders": 0}
+
+    def _index(self, order):
+        order_id = order["id"]
+        symbol = order.get("symbol")
+        is_open = order.get("status") not in TERMINAL_ORDER_STATUSES
+        for index, include in ((self._open_by_symbol, is_open),
+                               (self._protective_by_symbol, is_open and is_protective_order(order))):
+            bucket = index.setdefault(symbol, {})
+            if include:
+                bucket[order_id] = order
+            else:
+                bucket.pop(order_id, None)
+                if not bucket:
+                    index.pop(symbol, None)
+
+    def apply_order(self, order):
+        """Insert or update an order (and its OCO/bracket legs)."""
+        if not order or "id" not in order:
+            return
+        with self._lock:
+            for item in [order] + list(order.get("legs") or []):
+                self.orders[item["id"]] = item
+                self._index(item)
+                submitted_at = item.get("submitted_at")
+                if submitted_at and (self.cursor is None or submitted_at > self.cursor):
+                    self.cursor = submitted_at
+
+    def apply_event(self, event):
+        """Apply an Alpaca trade_updates event (new, fill, partial_fill, canceled, ...)."""
+        order = event.get("order")
+        self.apply_order(order)
+        is_fill = event.get("event") in ("fill", "partial_fill", "filled", "partially_filled") and order
+        with self._lock:
+            self.stats["events"] += 1
+            self.last_event_at = time.time()
+            if is_fill:
+                self.fills.append({
+                    "order_id": order["id"],
+                    "symbol": order.get("symbol"),
+                    "side": order.get("side"),
+                    "price": float(event.get("price") or order.get("filled_avg_price") or 0),
+                    "qty": float(event.get("qty") or order.get("filled_qty") or 0),
+                    "timestamp": event.get("timestamp"),
+                })
+                self.stats["fills"] += 1
+        if is_fill:
+            for listener in list(self.fill_listeners):
+                try:
+                    listener(order)
+                except Exception as e:
+                    print(f"⚠️  Fill listener failed for {order.get('symbol')}: {e}")
+
+    def seed(self, fetch=None):
+        """Load open orders from REST once; afterwards events keep the book current."""
+        orders = (fetch or list_orders)()
+        for order in orders:
+            self.apply_order(order)
+        self.seeded = True
+        self.stats["seeded_orders"] = len(orders)
+        return len(orders)
+
+    def open_orders(self, symbol=None):
+        with self._lock:
+            if symbol is not None:
+                return list(self._open_by_symbol.get(symbol, {}).values())
+            return [o for bucket in self._open_by_symbol.values() for o in bucket.values()]
+
+    def protective_orders(self, symbol):
+        with self._lock:
+            return list(self._protective_by_symbol.get(symbol, {}).values())
+
+    def has_protective_order(self, symbol):
+        return symbol in self._protective_by_symbol
+
+    def fills_for_symbol(self, symbol):
+        with self._lock:
+            return [f for f in self.fills if f["symbol"] == symbol]
+
+    def is_live(self):
+        """True once seeded and an event feed is running."""
+        return self.seeded and self._feed is not None and self._feed.is_alive()
+
+    def consume(self, source):
+        """Apply events from ``source.events()`` on a background thread."""
+        def run():
+            try:
+                for event in source.events():
+                    self.apply_event(event)
+            except Exception as e:
+                print(f"⚠️  Order book feed stopped: {e}")
+
+        self._feed = threading.Thread(target=run, name="order-book-feed", daemon=True)
+        self._feed.start()
+        return self._feed
+
+class LocalEventSource:
+    """Stand-in trade update source for tests and simulations: push events in by hand."""
+
+    _CLOSE = object()
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def push(self, event):
+        self.queue.put(event)
+
+    def close(self):
+        self.queue.put(self._CLOSE)
+
+    def events(self):
+        while True:
+            event = self.queue.get()
+            if event is self._CLOSE:
+                return
+            yield event
+
+class PollingEventSource:
+    """Incremental REST polling when streaming is off: new orders via ``after=``, plus
+    a lookup of any locally-open order that dropped out of the open list."""
+
+    def __init__(self, book, interval=ORDER_BOOK_POLL_INTERVAL):
+        self.book = book
+        self.interval = interval
+        self.running = True
+
+    def events(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                for order in list_orders(status="all", after=self.book.cursor):
+                    yield {"event": "poll", "order": order}
+                # The open list is nested: legs only show up inside their parent
+                still_open = {item["id"] for o in list_orders(status="open")
+                              for item in [o] + list(o.get("legs") or [])}
+                gone = [o for o in self.book.open_orders() if o["id"] not in still_open]
+                # Fetching a parent brings its legs along, so those need no lookup of their own
+                covered = {leg["id"] for o in gone for leg in o.get("legs") or []}
+                for order in gone:
+                    if order["id"] not in covered:
+                        latest = get_order(order["id"])
+                        yield {"event": latest.get("status", "poll"), "order": latest,
+                               "price": latest.get("filled_avg_price"), "qty": latest.get("filled_qty")}
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  Order book poll failed: {e}")
+
+class AlpacaTradeUpdateSource:
+    """Alpaca trade_updates websocket stream (needs the optional ``websockets`` package).
+
+    Falls back to REST polling if the stream can't be opened or drops.
+    """
+
+    def __init__(self, book, url=STREAM_URL):
+        self.book = book
+        self.url = url
+
+    def events(self):
+        from websockets.sync.client import connect
+
+        try:
+            with connect(self.url) as ws:
+                ws.send(json.dumps({"action": "auth", "key": ALPACA_API_KEY, "secret": ALPACA_SECRET_KEY}))
+                ws.send(json.dumps({"action": "listen", "data": {"streams": ["trade_updates"]}}))
+                for message in ws:
+                    payload = json.loads(message)
+                    if payload.get("stream") == "trade_updates":
+                        yield payload["data"]
+        except Exception as e:
+            print(f"⚠️  Trade update stream unavailable ({e}) - polling instead")
+        yield from PollingEventSource(self.book).events()
+
+order_book = OrderBook()
+_order_book_lock = threading.Lock()
+
+def start_order_book(streaming=ORDER_BOOK_STREAMING):
+    """Seed the order book once and keep it current (stream, or polling as a fallback)."""
+    with _order_book_lock:
+        if order_book.is_live():
+            return order_book
+        if not order_book.seeded:
+            count = order_book.seed()
+            print(f"📒 Order book seeded with {count} open orders")
+
+        source = None
+        if _order_backend is not None:
+            # The backend pushes its trade updates straight into the book
+            source = LocalEventSource()
+        elif streaming:
+            try:
+                import websockets  # noqa: F401 - optional dependency
+                source = AlpacaTradeUpdateSource(order_book)
+            except ImportError:
+                print("⚠️  websockets not installed - polling for order updates instead")
+        order_book.consume(source or PollingEventSource(order_book))
+        return order_book
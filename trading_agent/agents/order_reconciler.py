@@ -0,0 +1,127 @@
+import os
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+from .strategy_params import resolve_params
+
+load_dotenv()
+
+RECONCILE_PRICE_TOLERANCE = float(os.getenv("RECONCILE_PRICE_TOLERANCE", "0.005"))  # 0.5%
+
+PROTECTIVE_DECISIONS = {"STOP_LOSS", "OCO_SELL", "TRAILING_STOP_SELL", "TRAILING_STOP_BUY"}
+
+def protective_order_spec(decision: str, position: Dict[str, Any],
+                          params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """The protective order a decision asks for (prices as execute_actions places them)."""
+    if decision not in PROTECTIVE_DECISIONS:
+        return None
+    try:
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+    except (ValueError, TypeError):
+        return None
+    if qty <= 0:
+        return None
+
+    params = resolve_params(params)
+    if decision == "STOP_LOSS":
+        return {"kind": "stop", "qty": qty, "stop_price": current_price * params["stop_loss"]}
+    if decision == "TRAILING_STOP_BUY":
+        return {"kind": "trailing_stop", "qty": qty, "trail_percent": params["trail_percent_buy"]}
+    if decision == "TRAILING_STOP_SELL":
+        return {"kind": "trailing_stop", "qty": qty, "trail_percent": params["trail_percent_sell"]}
+
+    # OCO_SELL: smart profit targets based on current P&L
+    unrealized_plpc = float(position.get('unrealized_plpc', 0))
+    if unrealized_plpc > 5:  # Good profit, take more
+        take_profit, stop_loss = current_price * 1.02, current_price * 0.98
+    elif unrealized_plpc > 2:  # Decent profit
+        take_profit, stop_loss = current_price * 1.03, current_price * 0.97
+    else:  # Small profit or loss
+        take_profit, stop_loss = current_price * 1.05, current_price * 0.95
+    return {"kind": "oco", "qty": qty, "take_profit": take_profit, "stop_loss": stop_loss}
+
+def _num(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _close(a, b, tolerance) -> bool:
+    a, b = _num(a), _num(b)
+    if a is None or b is None:
+        return False
+    return abs(a - b) <= tolerance * max(abs(b), 1e-9)
+
+def order_kind(order: Dict[str, Any]) -> Optional[str]:
+    """Classify an existing protective order the same way specs are described."""
+    if order.get("order_class") == "oco":
+        return "oco"
+    if order.get("type") == "trailing_stop":
+        return "trailing_stop"
+    if order.get("type") in ("stop", "stop_limit"):
+        return "stop"
+    return None
+
+def _oco_stop_price(order):
+    for leg in order.get("legs") or []:
+        if leg.get("stop_price") is not None:
+            return leg.get("stop_price")
+    return order.get("stop_price")
+
+def matches_spec(order: Dict[str, Any], spec: Dict[str, Any], tolerance: float = RECONCILE_PRICE_TOLERANCE) -> bool:
+    """Is this working order equivalent to the one we would place?"""
+    if order_kind(order) != spec["kind"] or _num(order.get("qty")) != spec["qty"]:
+        return False
+    if spec["kind"] == "stop":
+        return _close(order.get("stop_price"), spec["stop_price"], tolerance)
+    if spec["kind"] == "trailing_stop":
+        return _close(order.get("trail_percent"), spec["trail_percent"], 1e-6)
+    return (_close(order.get("limit_price"), spec["take_profit"], tolerance)
+            and _close(_oco_stop_price(order), spec["stop_loss"], tolerance))
+
+def order_spec(order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The spec a working protective order was placed from, so it can be placed again."""
+    kind, qty = order_kind(order), _num(order.get("qty"))
+    if kind is None or not qty:
+        return None
+    if kind == "stop":
+        return {"kind": kind, "qty": int(qty), "stop_price": _num(order.get("stop_price"))}
+    if kind == "trailing_stop":
+        return {"kind": kind, "qty": int(qty), "trail_percent": _num(order.get("trail_percent"))}
+    return {"kind": kind, "qty": int(qty), "take_profit": _num(order.get("limit_price")),
+            "stop_loss": _num(_oco_stop_price(order))}
+
+def _top_level(orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop OCO/bracket legs; cancelling or replacing the parent covers them."""
+    leg_ids = {leg["id"] for o in orders for leg in (o.get("legs") or [])}
+    return [o for o in orders if o["id"] not in leg_ids]
+
+def plan_protective_orders(spec: Optional[Dict[str, Any]], existing: List[Dict[str, Any]],
+                           tolerance: float = RECONCILE_PRICE_TOLERANCE) -> Dict[str, Any]:
+    """Diff one symbol's desired protective order against its working ones.
+
+    Returns ``op`` - "pass" (not a protective decision), "noop", "replace" or
+    "place" - plus the order ids to ``cancel`` and, for replace, the order to patch.
+    For place, the working orders are listed under ``supersede`` instead of
+    ``cancel``: they stay in force until the new order has been accepted.
+    """
+    if spec is None:
+        return {"op": "pass", "cancel": []}
+
+    existing = _top_level(existing)
+    # A bracket's take-profit leg isn't duplicate protection; only clear it when placing anew
+    stops = [o for o in existing if order_kind(o) is not None]
+    equivalent = next((o for o in stops if matches_spec(o, spec, tolerance)), None)
+    if equivalent is not None:
+        # Keep the matching order, clear out any duplicates piled up behind it
+        return {"op": "noop", "keep": equivalent["id"],
+                "cancel": [o["id"] for o in stops if o["id"] != equivalent["id"]]}
+
+    # Same simple kind at a different price/qty: patch it in place instead of cancel + place
+    replaceable = next((o for o in stops if spec["kind"] in ("stop", "trailing_stop")
+                        and order_kind(o) == spec["kind"]), None)
+    if replaceable is not None:
+        return {"op": "replace", "replace": replaceable["id"],
+                "cancel": [o["id"] for o in stops if o["id"] != replaceable["id"]]}
+
+    return {"op": "place", "cancel": [], "supersede": [o["id"] for o in existing]}
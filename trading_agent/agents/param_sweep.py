@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Optional, Sequence
+from dotenv import load_dotenv
+from .strategy_params import DEFAULT_STRATEGY_PARAMS, resolve_params
+
+load_dotenv()
+
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", str(os.cpu_count() or 1)))
+SWEEP_RANK_METRIC = os.getenv("SWEEP_RANK_METRIC", "sharpe")
+
+# A small grid around the live defaults
+DEFAULT_PARAM_GRID = {
+    "ema_period": [10, 20, 50],
+    "rsi_period": [7, 14],
+    "bracket_take_profit": [1.03, 1.05],
+    "bracket_stop_loss": [0.97, 0.98],
+    "stop_loss": [0.95, 0.97],
+}
+
+def grid_params(grid: Dict[str, Sequence]) -> List[Dict[str, Any]]:
+    """Every combination of the grid's values."""
+    resolve_params({name: values[0] for name, values in grid.items()})  # reject unknown names early
+    names = list(grid)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(grid[name] for name in names))]
+
+def random_params(space: Dict[str, Sequence], n: int, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """``n`` distinct random draws; a (low, high) tuple is a range, a list is a set of choices."""
+    unknown = set(space) - set(DEFAULT_STRATEGY_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown strategy parameters: {', '.join(sorted(unknown))}")
+    rng = np.random.default_rng(seed)
+    samples, seen = [], set()
+    for _ in range(n * 20):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(DEFAULT_STRATEGY_PARAMS[name], int):
+                    params[name] = int(rng.integers(low, high + 1))
+                else:
+                    params[name] = round(float(rng.uniform(low, high)), 4)
+            else:
+                params[name] = values[int(rng.integers(len(values)))]
+        key = tuple(sorted(params.items()))
+        if key not in seen:
+            seen.add(key)
+            samples.append(params)
+            if len(samples) == n:
+                break
+    return samples
+
+class SharedBars:
+    """Bars for every symbol packed into one shared-memory block.
+
+    Workers attach by name instead of receiving pickled DataFrames with each task:
+    timestamps and o/h/l/c/v go in one float64 array of shape (6, total_bars) and
+    ``spec`` (name, symbols, offsets) is all that crosses the process boundary.
+    """
+
+    FIELDS = ["o", "h", "l", "c", "v"]
+
+    def __init__(self, shm: shared_memory.SharedMemory, spec: Dict[str, Any], owner: bool):
+        self.shm = shm
+        self.spec = spec
+        self.owner = owner
+        self.array = np.ndarray(spec["shape"], dtype=np.float64, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, bars: Dict[str, pd.DataFrame]) -> "SharedBars":
+        from .backtester import normalize_bars
+        frames = {symbol: normalize_bars(df) for symbol, df in bars.items()}
+        frames = {symbol: df for symbol, df in frames.items() if not df.empty}
+        total = sum(len(df) for df in frames.values())
+        shape = (len(cls.FIELDS) + 1, total)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * shape[0] * shape[1]))
+        offsets, start = {}, 0
+        block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        for symbol, df in frames.items():
+            end = start + len(df)
+            # Row 0 holds the int64 ns timestamps bit-for-bit (float64 would round them)
+            block[0, start:end] = df.index.asi8.view(np.float64)
+            for row, field in enumerate(cls.FIELDS, start=1):
+                block[row, start:end] = df[field].to_numpy(dtype=float) if field in df else 0.0
+            offsets[symbol] = (start, end)
+            start = end
+        tz = next((str(df.index.tz) for df in frames.values() if df.index.tz is not None), None)
+        spec = {"name": shm.name, "shape": shape, "offsets": offsets, "tz": tz}
+        return cls(shm, spec, owner=True)
+
+    @classmethod
+    def attach(cls, spec: Dict[str, Any]) -> "SharedBars":
+        return cls(shared_memory.SharedMemory(name=spec["name"]), spec, owner=False)
+
+    def frames(self) -> Dict[str, pd.DataFrame]:
+        """Per-symbol DataFrames whose columns view the shared block."""
+        frames = {}
+        for symbol, (start, end) in self.spec["offsets"].items():
+            index = pd.DatetimeIndex(self.array[0, start:end].view(np.int64), tz="UTC")
+            if self.spec["tz"] and self.spec["tz"] != "UTC":
+                index = index.tz_convert(self.spec["tz"])
+            elif not self.spec["tz"]:
+                index = index.tz_localize(None)
+            frames[symbol] = pd.DataFrame({field: self.array[row, start:end]
+                                           for row, field in enumerate(self.FIELDS, start=1)}, index=index, copy=False)
+        return frames
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# Worker-process state: bars are attached once per worker, not once per task
+_worker_bars: Optional[Dict[str, pd.DataFrame]] = None
+_worker_shared: Optional[SharedBars] = None
+_worker_options: Dict[str, Any] = {}
+
+def _init_worker(spec: Dict[str, Any], options: Dict[str, Any]):
+    global _worker_bars, _worker_shared, _worker_options
+    _worker_shared = SharedBars.attach(spec)
+    _worker_bars = _worker_shared.frames()
+    _worker_options = options
+
+def _run_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    from .backtester import Backtester
+    started = time.perf_counter()
+    try:
+        results = Backtester(_worker_bars, params=params, **_worker_options).run()
+        stats = {k: v for k, v in results["stats"].items() if k != "decisions"}
+        return {"params": params, "stats": stats, "error": None, "pid": os.getpid(),
+                "elapsed_s": round(time.perf_counter() - started, 3)}
+    except Exception as e:
+        return {"params": params, "stats": None, "error": str(e), "pid": os.getpid(),
+                "elapsed_s": round(time.perf_counter() - started, 3)}
+
+def rank_results(results: List[Dict[str, Any]], metric: str = SWEEP_RANK_METRIC) -> List[Dict[str, Any]]:
+    """Best first by ``metric``; failed runs go last."""
+    def key(result):
+        value = (result.get("stats") or {}).get(metric)
+        return (value is None, -(value if value is not None else 0.0))
+    ranked = sorted(results, key=key)
+    for rank, result in enumerate(ranked, start=1):
+        result["rank"] = rank
+    return ranked
+
+def run_sweep(bars: Dict[str, pd.DataFrame], param_sets: List[Dict[str, Any]], workers: int = SWEEP_WORKERS,
+              metric: str = SWEEP_RANK_METRIC, shared: Optional[SharedBars] = None,
+              **backtest_options) -> Dict[str, Any]:
+    """Backtest every parameter set across a process pool and rank the results."""
+    for params in param_sets:
+        resolve_params(params)
+    owns_shared = shared is None
+    shared = shared or SharedBars.create(bars)
+    started = time.perf_counter()
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker,
+                                 initargs=(shared.spec, backtest_options)) as pool:
+            futures = [pool.submit(_run_params, params) for params in param_sets]
+            for i, future in enumerate(as_completed(futures), start=1):
+                results.append(future.result())
+                if i % max(1, len(futures) // 10) == 0 or i == len(futures):
+                    print(f"   🔬 {i}/{len(futures)} backtests done")
+    finally:
+        if owns_shared:
+            shared.close()
+    elapsed = time.perf_counter() - started
+
+    ranked = rank_results(results, metric)
+    failed = sum(1 for r in ranked if r["error"])
+    print(f"✅ Sweep of {len(param_sets)} parameter sets on {workers} workers in {elapsed:.2f}s"
+          f"{f' ({failed} failed)' if failed else ''}")
+    return {"metric": metric, "workers": workers, "elapsed_s": round(elapsed, 3), "results": ranked}
+
+def scaling_report(bars: Dict[str, pd.DataFrame], param_sets: List[Dict[str, Any]],
+                   core_counts: Optional[Sequence[int]] = None, **backtest_options) -> List[Dict[str, Any]]:
+    """Wall-clock time of the same sweep at each worker count, with speedup over one worker."""
+    core_counts = core_counts or sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    shared = SharedBars.create(bars)
+    report = []
+    try:
+        for workers in core_counts:
+            sweep = run_sweep(bars, param_sets, workers=workers, shared=shared, **backtest_options)
+            report.append({"workers": workers, "elapsed_s": sweep["elapsed_s"]})
+    finally:
+        shared.close()
+    baseline = report[0]["elapsed_s"] * report[0]["workers"]
+    for row in report:
+        row["speedup"] = round(baseline / row["elapsed_s"], 2) if row["elapsed_s"] else None
+        row["efficiency"] = round(row["speedup"] / row["workers"], 2) if row["speedup"] else None
+        print(f"   ⚙️  {row['workers']:>3} workers: {row['elapsed_s']:.2f}s "
+              f"(speedup {row['speedup']}x, efficiency {row['efficiency']:.0%})")
+    return report
+
+def save_sweep(sweep: Dict[str, Any], name: Optional[str] = None, path: Optional[str] = None, top: int = 50) -> bool:
+    """Persist the ranked sweep: the top ``top`` runs to Astra, and everything to ``path`` as JSON."""
+    name = name or f"sweep_{datetime.now():%Y%m%d_%H%M%S}"
+    if path:
+        with open(path, "w") as f:
+            json.dump({"name": name, **sweep}, f, indent=2, default=str)
+        print(f"💾 Wrote {len(sweep['results'])} sweep results to {path}")
+    try:
+        from .astra_db_agent import astra_db
+        astra_db.save_backtest_data(name, {"metric": sweep["metric"], "workers": sweep["workers"],
+                                           "elapsed_s": sweep["elapsed_s"], "runs": len(sweep["results"]),
+                                           "results": sweep["results"][:top]})
+        print(f"💾 Saved sweep '{name}' (top {min(top, len(sweep['results']))})")
+        return True
+    except Exception as e:
+        print(f"⚠️  Failed to save sweep '{name}': {e}")
+        return False
+
+if __name__ == "__main__":
+    import sys
+    from .backtester import load_history
+    symbols = sys.argv[1:] or ["AAPL", "MSFT", "NVDA"]
+    history = load_history(symbols)
+    sweep = run_sweep(history, grid_params(DEFAULT_PARAM_GRID))
+    for result in sweep["results"][:5]:
+        print(f"   #{result['rank']} {result['params']} -> {SWEEP_RANK_METRIC}={result['stats'] and result['stats'][SWEEP_RANK_METRIC]}")
+    save_sweep(sweep, path="sweep_results.json")
@@ -0,0 +1,171 @@
+import threading
+import pandas as pd
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional
+from .pnl_engine import PnLEngine, fill_from_order, rebuild_pnl
+
+SUMMARY_ID = "performance_summary"
+
+def decision_side(decision: Optional[str]) -> str:
+    """'buy', 'sell' or 'hold' for a decision/action name (BRACKET_BUY, SELL_PARTIAL, ...)."""
+    decision = (decision or "").upper()
+    if "BUY" in decision:
+        return "buy"
+    if "SELL" in decision:
+        return "sell"
+    return "hold"
+
+def _empty() -> Dict[str, Any]:
+    return {"total_trades": 0, "decisions": Counter(), "buy": 0, "sell": 0, "hold": 0,
+            "realized_pnl": 0.0, "wins": 0, "losses": 0, "last_trade_at": None}
+
+class PerformanceAggregates:
+    """Running trade counts and realized P&L, globally and per symbol.
+
+    ``apply`` folds one trade record in, so the summary is always current and
+    reading it costs nothing; ``rebuild`` recomputes everything from a full
+    trade history (one pass). A trade's realized P&L is its ``realized_pnl``
+    field, or what its filled ``order_result`` realizes against the FIFO lots
+    in ``engine``; positive counts as a win, negative as a loss. Fills that
+    arrive after their trade was recorded (a market order's submit response
+    is still unfilled) come in through ``apply_fill``. The account is
+    long-only, so the engine never opens shorts.
+    """
+
+    def __init__(self, engine: Optional[PnLEngine] = None):
+        self._lock = threading.Lock()
+        self.totals = _empty()
+        self.symbols: Dict[str, Dict[str, Any]] = {}
+        self.updated_at: Optional[str] = None
+        self.engine = engine or PnLEngine(allow_short=False)
+
+    @staticmethod
+    def _fold(agg: Dict[str, Any], decision: str, realized: Optional[float], timestamp):
+        agg["total_trades"] += 1
+        agg["decisions"][decision or "UNKNOWN"] += 1
+        agg[decision_side(decision)] += 1
+        if realized:
+            agg["realized_pnl"] += realized
+            agg["wins" if realized > 0 else "losses"] += 1
+        if timestamp is not None:
+            agg["last_trade_at"] = str(timestamp)
+
+    def apply(self, trade: Dict[str, Any]):
+        """Fold one trade record into the aggregates (O(1))."""
+        symbol = trade.get("symbol") or "unknown"
+        decision = trade.get("decision")
+        if "realized_pnl" in trade:
+            realized = trade["realized_pnl"]
+        else:
+            realized = self.engine.apply_order(trade.get("order_result"))
+        realized = float(realized) if realized is not None else None
+        with self._lock:
+            self._fold(self.totals, decision, realized, trade.get("timestamp"))
+            self._fold(self.symbols.setdefault(symbol, _empty()), decision, realized, trade.get("timestamp"))
+            self.updated_at = datetime.now().isoformat()
+
+    def apply_fill(self, order: Dict[str, Any]) -> Optional[float]:
+        """Fold in the new part of an order's fill (e.g. from an order book fill event); None if nothing is new."""
+        realized = self.engine.apply_order(order)
+        if realized:
+            symbol = order.get("symbol") or "unknown"
+            with self._lock:
+                for agg in (self.totals, self.symbols.setdefault(symbol, _empty())):
+                    agg["realized_pnl"] += realized
+                    agg["wins" if realized > 0 else "losses"] += 1
+                self.updated_at = datetime.now().isoformat()
+        return realized
+
+    def rebuild(self, trades: Iterable[Dict[str, Any]],
+                seeds: Optional[Dict[str, Any]] = None) -> "PerformanceAggregates":
+        """Recompute from a full history (oldest first); fills are lot-matched in one vectorized pass.
+
+        ``seeds`` (``engine.seeds``: lots opened from broker positions older
+        than the history) are opened first.
+        """
+        trades = list(trades)
+        seeds = dict(seeds or {})
+        fills = [(-1, (s, "buy" if q > 0 else "sell", abs(q), p)) for s, (q, p) in seeds.items()]
+        fills += [(i, fill) for i, fill in enumerate(fill_from_order(t.get("order_result")) for t in trades) if fill]
+        engine = PnLEngine(allow_short=False)
+        engine.seeds = seeds
+        realized = {}
+        if fills:
+            frame = pd.DataFrame([fill for _, fill in fills], columns=["symbol", "side", "qty", "price"])
+            pnl = rebuild_pnl(frame, engine)["realized_pnl"].tolist()
+            realized = {i: value for (i, _), value in zip(fills, pnl)}
+            for i, _ in fills:  # later fill events of these orders only add what's new
+                if i < 0:
+                    continue
+                order = trades[i]["order_result"]
+                if order.get("id"):
+                    engine.filled[order["id"]] = (float(order["filled_qty"]), float(order["filled_avg_price"]))
+        with self._lock:
+            self.totals, self.symbols, self.engine = _empty(), {}, engine
+        for i, trade in enumerate(trades):
+            self.apply({**trade, "realized_pnl": realized.get(i)})
+        return self
+
+    @staticmethod
+    def _view(agg: Dict[str, Any], symbol: Optional[str] = None) -> Dict[str, Any]:
+        closed = agg["wins"] + agg["losses"]
+        return {
+            "total_trades": agg["total_trades"],
+            "total_pnl": round(agg["realized_pnl"], 2),
+            "win_rate": agg["wins"] / closed * 100 if closed else 0,
+            "wins": agg["wins"],
+            "losses": agg["losses"],
+            "symbol": symbol,
+        }
+
+    def pnl(self, symbol: Optional[str] = None) -> Dict[str, Any]:
+        """Same shape as ``calculate_pnl``; ``total_pnl`` includes unrealized P&L at the last marks."""
+        lots = self.engine.pnl(symbol)
+        with self._lock:
+            agg = self.symbols.get(symbol, _empty()) if symbol else self.totals
+            view = self._view(agg, symbol)
+        return {**view, "realized_pnl": view["total_pnl"], "unrealized_pnl": lots["unrealized_pnl"],
+                "total_pnl": round(view["total_pnl"] + lots["unrealized_pnl"], 2)}
+
+    def summary(self) -> Dict[str, Any]:
+        """Same shape as ``get_performance_summary`` (plus per-symbol views)."""
+        pnl = self.pnl()
+        with self._lock:
+            return {
+                **pnl,
+                "buy_decisions": self.totals["buy"],
+                "sell_decisions": self.totals["sell"],
+                "hold_decisions": self.totals["hold"],
+                "decisions": dict(self.totals["decisions"]),
+                "pnl": pnl,
+                "symbols": {s: self._view(a, s) for s, a in self.symbols.items()},
+                "updated_at": self.updated_at,
+            }
+
+    def to_document(self) -> Dict[str, Any]:
+        """The stored summary document."""
+        with self._lock:
+            dump = lambda agg: {**agg, "decisions": dict(agg["decisions"])}
+            return {"_id": SUMMARY_ID, "updated_at": self.updated_at, "totals": dump(self.totals),
+                    "symbols": {s: dump(a) for s, a in self.symbols.items()}, "lots": self.engine.to_document()}
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "PerformanceAggregates":
+        aggregates = cls(PnLEngine.from_document(doc.get("lots"), allow_short=False))
+        load = lambda agg: {**_empty(), **agg, "decisions": Counter(agg.get("decisions") or {})}
+        aggregates.totals = load(doc.get("totals") or {})
+        aggregates.symbols = {s: load(a) for s, a in (doc.get("symbols") or {}).items()}
+        aggregates.updated_at = doc.get("updated_at")
+        return aggregates
+
+if __name__ == "__main__":
+    import sys
+    if "--rebuild" not in sys.argv:
+        print("Usage: python -m trading_agent.agents.performance_aggregates --rebuild")
+        sys.exit(1)
+    from .storage_agent import trading_storage
+    summary = trading_storage.rebuild_performance()
+    print(f"✅ Rebuilt performance summary from {summary['total_trades']} trades "
+          f"({len(summary['symbols'])} symbols, P&L ${summary['total_pnl']:.2f})")
+    trading_storage.close()
@@ -0,0 +1,325 @@
+import time
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+# Orders whose applied fill quantity is remembered (so a fill reported twice counts once)
+TRACKED_ORDERS = 1000
+
+def fill_from_order(order: Optional[Dict[str, Any]]) -> Optional[Tuple[str, str, float, float]]:
+    """``(symbol, side, qty, price)`` for the filled part of an Alpaca order dict, else None."""
+    if not isinstance(order, dict):
+        return None
+    try:
+        qty = float(order.get("filled_qty") or 0)
+        price = float(order.get("filled_avg_price") or 0)
+    except (TypeError, ValueError):
+        return None
+    side = str(order.get("side") or "").lower()
+    if qty <= 0 or price <= 0 or side not in ("buy", "sell") or not order.get("symbol"):
+        return None
+    return order["symbol"], side, qty, price
+
+class FifoBook:
+    """Open lots for one symbol, matched first-in first-out.
+
+    Lots are kept as running totals of quantity and cost; the matched
+    quantity so far is a single offset into them. The cost of any stretch of
+    lots is then two prefix-sum lookups (``bisect``), so a fill costs O(log n)
+    however many lots it closes. ``side`` is +1 while long, -1 while short;
+    a fill larger than the open position closes it and opens the rest the
+    other way.
+    """
+
+    def __init__(self):
+        self.side = 0
+        self.cum_qty: List[float] = []
+        self.cum_cost: List[float] = []
+        self.prices: List[float] = []
+        self.matched = 0.0
+        self.realized = 0.0
+
+    def _cost_at(self, x: float) -> float:
+        """Cost of the first ``x`` units ever opened on this side."""
+        i = bisect.bisect_left(self.cum_qty, x)
+        if i >= len(self.cum_qty):
+            return self.cum_cost[-1] if self.cum_cost else 0.0
+        before_qty = self.cum_qty[i - 1] if i else 0.0
+        before_cost = self.cum_cost[i - 1] if i else 0.0
+        return before_cost + (x - before_qty) * self.prices[i]
+
+    @property
+    def open_qty(self) -> float:
+        return (self.cum_qty[-1] - self.matched) if self.cum_qty else 0.0
+
+    @property
+    def open_cost(self) -> float:
+        return (self.cum_cost[-1] - self._cost_at(self.matched)) if self.cum_cost else 0.0
+
+    def _open(self, qty: float, price: float):
+        self.cum_qty.append((self.cum_qty[-1] if self.cum_qty else 0.0) + qty)
+        self.cum_cost.append((self.cum_cost[-1] if self.cum_cost else 0.0) + qty * price)
+        self.prices.append(price)
+
+    def _compact(self):
+        """Drop fully matched lots once they are most of the book (keeps memory bounded)."""
+        head = bisect.bisect_right(self.cum_qty, self.matched)
+        if head < 1024 or head * 2 < len(self.cum_qty):
+            return
+        base_qty, base_cost = self.cum_qty[head - 1], self.cum_cost[head - 1]
+        self.cum_qty = [q - base_qty for q in self.cum_qty[head:]]
+        self.cum_cost = [c - base_cost for c in self.cum_cost[head:]]
+        self.prices = self.prices[head:]
+        self.matched -= base_qty
+
+    def fill(self, side: int, qty: float, price: float, opens: bool = True) -> float:
+        """Apply a fill (+1 buy, -1 sell); returns the P&L it realizes.
+
+        With ``opens=False`` the fill only closes open lots: whatever is left
+        over is ignored instead of opening a position on its side.
+        """
+        if self.side != side and self.open_qty <= 1e-12:
+            if not opens:
+                return 0.0
+            self._reset(side)
+        if self.side == side:
+            self._open(qty, price)
+            return 0.0
+        close = min(qty, self.open_qty)
+        cost = self._cost_at(self.matched + close) - self._cost_at(self.matched)
+        realized = self.side * (close * price - cost)
+        self.matched += close
+        self.realized += realized
+        rest = qty - close
+        if rest > 1e-12 and opens:
+            self._reset(side)
+            self._open(rest, price)
+        else:
+            self._compact()
+        return realized
+
+    def _reset(self, side: int):
+        self.side = side
+        self.cum_qty, self.cum_cost, self.prices, self.matched = [], [], [], 0.0
+
+    def unrealized(self, mark: float) -> float:
+        return self.side * (self.open_qty * mark - self.open_cost) if self.side else 0.0
+
+    def lots(self) -> List[Tuple[float, float]]:
+        """Open lots as ``(qty, price)``, oldest first."""
+        head = bisect.bisect_right(self.cum_qty, self.matched)
+        lots = []
+        for i in range(head, len(self.cum_qty)):
+            start = max(self.cum_qty[i - 1] if i else 0.0, self.matched)
+            lots.append((self.cum_qty[i] - start, self.prices[i]))
+        return lots
+
+class PnLEngine:
+    """Per-symbol FIFO books with running realized and unrealized P&L.
+
+    With ``allow_short=False`` (a long-only account) a sell never opens a
+    short: selling more than the lots on record only closes those lots.
+    """
+
+    def __init__(self, allow_short: bool = True):
+        self.allow_short = allow_short
+        self.books: Dict[str, FifoBook] = {}
+        self.marks: Dict[str, float] = {}
+        self.filled: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # order id -> (qty, avg price) applied
+        self.seeds: Dict[str, Tuple[float, float]] = {}  # symbol -> signed qty, price opened from positions
+        self._lock = threading.Lock()
+
+    def apply_fill(self, symbol: str, side: str, qty: float, price: float) -> float:
+        with self._lock:
+            book = self.books.setdefault(symbol, FifoBook())
+            return book.fill(1 if side == "buy" else -1, float(qty), float(price),
+                             opens=self.allow_short or side == "buy")
+
+    def apply_order(self, order: Optional[Dict[str, Any]]) -> Optional[float]:
+        """Realized P&L of the part of an order's fill not applied yet, or None when nothing new has filled.
+
+        Orders are tracked by id, so the submit response, later fill events
+        and polls of the same order can all be fed in: only the quantity
+        filled since the last one counts, priced from the change in
+        ``filled_qty * filled_avg_price``.
+        """
+        fill = fill_from_order(order)
+        if not fill:
+            return None
+        symbol, side, qty, price = fill
+        order_id = order.get("id")
+        if order_id:
+            with self._lock:
+                seen_qty, seen_price = self.filled.pop(order_id, (0.0, 0.0))
+                self.filled[order_id] = (max(qty, seen_qty), price if qty >= seen_qty else seen_price)
+                while len(self.filled) > TRACKED_ORDERS:
+                    self.filled.popitem(last=False)
+            if qty - seen_qty <= 1e-9:
+                return None
+            qty, price = qty - seen_qty, (qty * price - seen_qty * seen_price) / (qty - seen_qty)
+        return self.apply_fill(symbol, side, qty, price)
+
+    def seed_positions(self, positions: Optional[List[Dict[str, Any]]]) -> List[str]:
+        """Open lots from broker positions (``qty``/``avg_entry_price``) for symbols with none on record.
+
+        Covers positions opened before the trade history starts, so selling
+        them realizes P&L against their real cost instead of nothing.
+        """
+        seeded = []
+        with self._lock:
+            for position in positions or []:
+                symbol = position.get("symbol")
+                try:
+                    qty = float(position.get("qty") or 0)
+                    price = float(position.get("avg_entry_price") or 0)
+                except (TypeError, ValueError):
+                    continue
+                book = self.books.get(symbol)
+                if not symbol or not qty or price <= 0 or (book is not None and book.open_qty > 1e-12):
+                    continue
+                book = self.books.setdefault(symbol, FifoBook())
+                book._reset(1 if qty > 0 else -1)
+                book._open(abs(qty), price)
+                self.seeds[symbol] = (qty, price)
+                seeded.append(symbol)
+        return seeded
+
+    def mark(self, prices: Dict[str, float]):
+        with self._lock:
+            self.marks.update({s: float(p) for s, p in prices.items() if p})
+
+    def pnl(self, symbol: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            symbols = [symbol] if symbol else list(self.books)
+            realized = unrealized = 0.0
+            for s in symbols:
+                book = self.books.get(s)
+                if book is None:
+                    continue
+                realized += book.realized
+                if s in self.marks:
+                    unrealized += book.unrealized(self.marks[s])
+            return {"realized_pnl": round(realized, 2), "unrealized_pnl": round(unrealized, 2),
+                    "total_pnl": round(realized + unrealized, 2), "symbol": symbol}
+
+    def to_document(self) -> Dict[str, Any]:
+        """Open lots and realized totals (matched lots are not needed to continue)."""
+        with self._lock:
+            return {"marks": dict(self.marks), "allow_short": self.allow_short,
+                    "filled": {k: list(v) for k, v in self.filled.items()},
+                    "seeds": {k: list(v) for k, v in self.seeds.items()}, "books": {
+                s: {"side": b.side, "realized": b.realized, "lots": b.lots()} for s, b in self.books.items()}}
+
+    @classmethod
+    def from_document(cls, doc: Optional[Dict[str, Any]], allow_short: bool = True) -> "PnLEngine":
+        engine = cls((doc or {}).get("allow_short", allow_short))
+        engine.filled.update((k, tuple(v)) for k, v in ((doc or {}).get("filled") or {}).items())
+        engine.seeds = {k: tuple(v) for k, v in ((doc or {}).get("seeds") or {}).items()}
+        for symbol, state in ((doc or {}).get("books") or {}).items():
+            book = FifoBook()
+            book.side = state.get("side", 0)
+            book.realized = state.get("realized", 0.0)
+            for qty, price in state.get("lots", []):
+                book._open(qty, price)
+            engine.books[symbol] = book
+        engine.marks = dict((doc or {}).get("marks") or {})
+        return engine
+
+def rebuild_pnl(fills: pd.DataFrame, engine: Optional[PnLEngine] = None) -> pd.DataFrame:
+    """Realized P&L per fill for a full history (columns symbol/side/qty/price, in time order).
+
+    Symbols that only ever hold long positions are matched vectorized: every
+    sell consumes the stretch [sold before, sold after] of the cumulative
+    bought quantity, priced with one ``searchsorted`` over the buy prefix
+    sums. Symbols that go short fall back to ``FifoBook``. Returns ``fills``
+    with a ``realized_pnl`` column; ``engine``, if given, is left holding the
+    resulting open lots so it can carry on incrementally (and, without
+    ``allow_short``, sells beyond the open lots close only those lots).
+    """
+    allow_short = engine.allow_short if engine is not None else True
+    fills = fills.reset_index(drop=True)
+    realized = np.zeros(len(fills))
+    for symbol, group in fills.groupby("symbol", sort=False):
+        sign = np.where(group["side"].str.lower().to_numpy() == "buy", 1.0, -1.0)
+        qty = group["qty"].to_numpy(dtype=float)
+        price = group["price"].to_numpy(dtype=float)
+        book = FifoBook()
+        if (np.cumsum(sign * qty) < -1e-9).any():
+            realized[group.index] = [book.fill(int(s), q, p, opens=allow_short or s > 0)
+                                     for s, q, p in zip(sign, qty, price)]
+            if engine is not None:
+                engine.books[symbol] = book
+            continue
+        buys = sign > 0
+        cum_qty = np.cumsum(qty[buys])
+        cum_cost = np.cumsum(qty[buys] * price[buys])
+        buy_prices = price[buys]
+        def cost_at(x):
+            i = np.searchsorted(cum_qty, x, side="left").clip(max=len(cum_qty) - 1)
+            before_qty = np.where(i > 0, cum_qty[i - 1], 0.0)
+            before_cost = np.where(i > 0, cum_cost[i - 1], 0.0)
+            return before_cost + (x - before_qty) * buy_prices[i]
+        sold = np.cumsum(np.where(buys, 0.0, qty))
+        sells = ~buys
+        if sells.any() and len(cum_qty):
+            end = sold[sells]
+            start = end - qty[sells]
+            realized[group.index[sells]] = qty[sells] * price[sells] - (cost_at(end) - cost_at(start))
+        if engine is not None:
+            # The book's state is exactly these prefix sums plus the quantity sold
+            book.side = 1 if len(cum_qty) else 0
+            book.cum_qty, book.cum_cost, book.prices = cum_qty.tolist(), cum_cost.tolist(), buy_prices.tolist()
+            book.matched = float(sold[-1]) if len(sold) else 0.0
+            book.realized = float(realized[group.index].sum())
+            book._compact()
+            engine.books[symbol] = book
+    return fills.assign(realized_pnl=realized)
+
+def fills_from_trades(trades) -> pd.DataFrame:
+    """Filled orders in trade records (``order_result``) as a fills frame, in record order."""
+    fills = [fill for fill in (fill_from_order(t.get("order_result")) for t in trades) if fill]
+    return pd.DataFrame(fills, columns=["symbol", "side", "qty", "price"])
+
+def benchmark(n_fills: int = 100_000, n_symbols: int = 20, seed: int = 0) -> Dict[str, Any]:
+    """Incremental vs vectorized matching over ``n_fills`` random long-only fills."""
+    rng = np.random.default_rng(seed)
+    symbols = rng.integers(0, n_symbols, n_fills)
+    qty = rng.integers(1, 100, n_fills).astype(float)
+    price = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, n_fills)))
+    side = np.where(rng.random(n_fills) < 0.55, "buy", "sell")
+    held = {}
+    for i, (s, q) in enumerate(zip(symbols, qty)):  # never sell more than is held
+        if side[i] == "sell":
+            q = min(q, held.get(s, 0.0))
+            if q <= 0:
+                side[i] = "buy"
+                q = qty[i]
+            qty[i] = q
+        held[s] = held.get(s, 0.0) + (q if side[i] == "buy" else -q)
+    fills = pd.DataFrame({"symbol": [f"S{s}" for s in symbols], "side": side, "qty": qty, "price": price})
+
+    start = time.perf_counter()
+    engine = PnLEngine()
+    incremental = [engine.apply_fill(s, sd, q, p) for s, sd, q, p in fills.itertuples(index=False)]
+    incremental_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = rebuild_pnl(fills)["realized_pnl"].to_numpy()
+    vectorized_s = time.perf_counter() - start
+    return {
+        "fills": n_fills,
+        "incremental_s": round(incremental_s, 3),
+        "incremental_us_per_fill": round(incremental_s / n_fills * 1e6, 2),
+        "vectorized_s": round(vectorized_s, 3),
+        "max_diff": float(np.abs(np.array(incremental) - vectorized).max()),
+        "realized_pnl": round(float(vectorized.sum()), 2),
+    }
+
+if __name__ == "__main__":
+    result = benchmark()
+    print(f"📊 {result['fills']} fills: incremental {result['incremental_s']}s "
+          f"({result['incremental_us_per_fill']}us/fill), vectorized rebuild {result['vectorized_s']}s, "
+          f"max difference {result['max_diff']:.2e}")
@@ -0,0 +1,143 @@
+import os
+import math
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "600"))
+
+# Static, byte-stable preamble. It always leads the prompt so providers with prefix
+# (context) caching - e.g. Gemini implicit caching - can reuse it across symbols.
+STATIC_PREAMBLE = """Trading assistant for a small commission-free US stock/ETF cash account (no forex, 200 API calls/min, regular+extended hours).
+Actions:
+BRACKET_BUY: buy with take-profit and stop-loss
+LIMIT_BUY: buy below market
+TRAILING_STOP_BUY: trailing stop on a long position
+OCO_SELL: take-profit + stop-loss exit
+LIMIT_SELL: sell above market
+TRAILING_STOP_SELL: trailing stop to let profits run
+STOP_LOSS: add stop-loss protection
+REDUCE_POSITION: sell part of the position
+HOLD: wait
+Rules:
+- profit >5%: OCO_SELL or TRAILING_STOP_SELL
+- profit <2% and cash available: BRACKET_BUY
+- RSI <30 oversold: buy; RSI >70 overbought: sell
+- high volatility: prefer limit orders
+- trade only available cash, max 10-20% of portfolio per trade, always protect with stops
+- news and market sentiment confirm or contradict the technicals
+Answer with exactly one action name.
+"""
+
+_INDICATOR_ORDER = [("rsi", "rsi", 1), ("ema", "ema", 2), ("atr", "atr", 2), ("volatility_score", "vol", 1)]
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting."""
+    return math.ceil(len(text) / 4) if text else 0
+
+def _num(value, default=0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _is_number(value) -> bool:
+    try:
+        return not math.isnan(float(value))
+    except (TypeError, ValueError):
+        return False
+
+def _clip(text, limit: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:max(0, limit - 3)].rstrip() + "..."
+
+def _required_lines(symbol, position_data, indicators, account_data) -> List[str]:
+    lines = [f"SYMBOL {symbol}"]
+
+    if position_data:
+        qty = _num(position_data.get('qty'))
+        entry = _num(position_data.get('avg_entry_price'))
+        price = _num(position_data.get('current_price'))
+        pl = _num(position_data.get('unrealized_pl'))
+        plpc = _num(position_data.get('unrealized_plpc'))
+        profit = (price - entry) / entry * 100 if entry else 0.0
+        lines.append(f"POS qty={qty:g} entry={entry:.2f} px={price:.2f} pl={pl:.2f} plpc={plpc:.1f} profit={profit:.1f}%")
+
+    if indicators:
+        fields = [f"{label}={_num(indicators[key]):.{digits}f}"
+                  for key, label, digits in _INDICATOR_ORDER
+                  if key in indicators and _is_number(indicators[key])]
+        if fields:
+            lines.append("IND " + " ".join(fields))
+
+    if account_data:
+        lines.append(f"ACCT cash={_num(account_data.get('cash')):.2f} bp={_num(account_data.get('buying_power')):.2f}")
+
+    return lines
+
+def _optional_sections(historical_trades, news_data, market_intelligence) -> List[Dict[str, Any]]:
+    """Optional context in priority order; ``truncatable`` sections may be shortened to fit."""
+    sections = []
+
+    if historical_trades:
+        recent = historical_trades[-3:]
+        wins = sum(1 for t in recent if t.get('decision') in ['SELL_PARTIAL', 'SELL_ALL'])
+        sections.append({"name": "performance", "text": f"PERF recent_success={wins / len(recent) * 100:.0f}%"})
+
+    if isinstance(news_data, list):
+        for i, item in enumerate(news_data[:3]):
+            title = _clip(item.get('title', 'No title'), 100)
+            sentiment = item.get('sentiment', 'neutral')
+            sections.append({"name": f"news_{i + 1}", "text": f"NEWS{i + 1} ({sentiment}) {title}", "truncatable": True})
+
+    if isinstance(market_intelligence, dict):
+        sentiment = market_intelligence.get('sentiment', 'neutral')
+        key_levels = market_intelligence.get('key_levels', [])
+        levels = f" levels={','.join(str(l) for l in key_levels[:3])}" if key_levels else ""
+        sections.append({"name": "market_sentiment", "text": f"MKT sentiment={sentiment}{levels}"})
+        summary = market_intelligence.get('summary')
+        if summary:
+            sections.append({"name": "market_summary", "text": f"MKT_SUMMARY {_clip(summary, 200)}", "truncatable": True})
+
+    return sections
+
+def build_compact_prompt(symbol, position_data=None, indicators=None, account_data=None,
+                         historical_trades=None, news_data=None, market_intelligence=None,
+                         token_budget: int = LLM_PROMPT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """Build a compact, deterministic decision prompt that fits within ``token_budget``.
+
+    Position, indicators and account lines are always kept; performance, news and
+    market intelligence are added in priority order and truncated or dropped once
+    the budget runs out. Returns the preamble, body, full text and token count.
+    """
+    lines = _required_lines(symbol, position_data, indicators, account_data)
+    remaining = token_budget - estimate_tokens(STATIC_PREAMBLE) - estimate_tokens("\n".join(lines))
+    dropped, truncated = [], []
+
+    for section in _optional_sections(historical_trades, news_data, market_intelligence):
+        cost = estimate_tokens(section["text"]) + 1  # +1 for the newline
+        if cost <= remaining:
+            lines.append(section["text"])
+            remaining -= cost
+        elif section.get("truncatable") and remaining > 8:
+            lines.append(_clip(section["text"], (remaining - 1) * 4))
+            truncated.append(section["name"])
+            remaining -= estimate_tokens(lines[-1]) + 1
+        else:
+            dropped.append(section["name"])
+
+    body = "\n".join(lines)
+    text = compose_prompt(body)
+    return {
+        "preamble": STATIC_PREAMBLE,
+        "body": body,
+        "text": text,
+        "tokens": estimate_tokens(text),
+        "dropped": dropped,
+        "truncated": truncated,
+    }
+
+def compose_prompt(body: str) -> str:
+    """Put the cached static preamble in front of a symbol-specific body."""
+    return f"{STATIC_PREAMBLE}\n{body}"
@@ -0,0 +1,251 @@
+import os
+import re
+import json
+import time
+import pandas as pd
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+from .astra_bulk import frame_from_cursor, rollup_documents
+from .bar_buckets import unpack_buckets
+from .local_store import frame_from_documents
+
+load_dotenv()
+
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+# Days of bars kept per timeframe (0 keeps them forever); intraday bars are rolled up before they go
+RETENTION_DAYS = os.getenv("RETENTION_DAYS", "1Min:7,5Min:30,15Min:30,1Hour:365,1Day:0")
+# Indicator rows are derived from bars and recomputed on demand, so only recent ones are kept
+RETENTION_INDICATOR_DAYS = int(os.getenv("RETENTION_INDICATOR_DAYS", "7"))
+# Minimum hours between scheduled runs
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+
+STORED_TIMEFRAME = "5Min"  # what get_bars saves to the local tier and Astra DB
+ROLLUPS = {"1Hour": "h", "1Day": "D"}
+LAST_RUN_ID = "retention_last_run"
+
+_UNITS = {"Min": "min", "Hour": "h", "Day": "D", "Week": "W"}
+
+def parse_policy(text: str = RETENTION_DAYS) -> Dict[str, int]:
+    """``"5Min:30,1Hour:365"`` -> ``{"5Min": 30, "1Hour": 365}``."""
+    policy = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        timeframe, _, days = item.partition(":")
+        policy[timeframe.strip()] = int(days)
+    return policy
+
+def timeframe_delta(timeframe: str) -> Optional[pd.Timedelta]:
+    match = re.fullmatch(r"(\d+)(Min|Hour|Day|Week)", timeframe)
+    return pd.Timedelta(int(match.group(1)), _UNITS[match.group(2)]) if match else None
+
+def cutoff(days: Optional[int], now: pd.Timestamp) -> Optional[pd.Timestamp]:
+    """Start of the oldest UTC day kept, or None when ``days`` keeps everything."""
+    return (now - pd.Timedelta(days=days)).floor("D") if days else None
+
+def downsample(bars: pd.DataFrame, rule: str) -> pd.DataFrame:
+    """OHLCV bars resampled to ``rule`` ("h", "D"); vwap is volume-weighted, empty periods are dropped."""
+    if bars is None or bars.empty:
+        return pd.DataFrame()
+    grouped = bars.resample(rule, label="left", closed="left")
+    price = bars["vw"].fillna(bars["c"]) if "vw" in bars.columns else bars["c"]
+    out = pd.DataFrame({"o": grouped["o"].first(), "h": grouped["h"].max(), "l": grouped["l"].min(),
+                        "c": grouped["c"].last(), "v": grouped["v"].sum()})
+    weighted = (price * bars["v"]).resample(rule, label="left", closed="left").sum()
+    out["vw"] = (weighted / out["v"]).where(out["v"] > 0, out["c"])
+    return out.dropna(subset=["c"])
+
+def _tier() -> Dict[str, Any]:
+    return {"documents_deleted": 0, "bytes_reclaimed": 0, "rollups_written": 0, "symbols": 0, "errors": []}
+
+def compact_local(store, policy: Dict[str, int], indicator_days: int, now: pd.Timestamp) -> Dict[str, Any]:
+    """Roll up and delete old bars, old rollups and old indicator rows in the SQLite tier, then VACUUM."""
+    result, before = _tier(), store.size_bytes()
+    raw_cutoff = cutoff(policy.get(STORED_TIMEFRAME), now)
+    if raw_cutoff is not None:
+        for symbol in store.symbols("market_data"):
+            old = store.read_frame("market_data", symbol, end=raw_cutoff - pd.Timedelta(1, "ns"))
+            if old.empty:
+                continue
+            for timeframe, rule in ROLLUPS.items():
+                result["rollups_written"] += store.write_rollups(symbol, timeframe, downsample(old, rule))
+            result["documents_deleted"] += store.delete_before("market_data", raw_cutoff, symbol)
+            result["symbols"] += 1
+    for timeframe in ROLLUPS:
+        rollup_cutoff = cutoff(policy.get(timeframe), now)
+        if rollup_cutoff is not None:
+            result["documents_deleted"] += store.delete_before("bar_rollups", rollup_cutoff, timeframe=timeframe)
+    indicator_cutoff = cutoff(indicator_days, now)
+    if indicator_cutoff is not None:
+        result["documents_deleted"] += store.delete_before("indicators", indicator_cutoff)
+    if result["documents_deleted"]:
+        store.vacuum()
+    result["bytes_reclaimed"] = before - store.size_bytes()
+    return result
+
+def compact_archive(archive, policy: Dict[str, int], now: pd.Timestamp) -> Dict[str, Any]:
+    """Roll intraday archive files up into 1Hour/1Day files, then drop records past retention."""
+    result, before = _tier(), archive.size_bytes()
+    intraday = lambda timeframe: (timeframe_delta(timeframe) or pd.Timedelta.max) < pd.Timedelta(hours=1)
+    # Intraday files first: the hourly/daily files they roll into then get their own retention
+    for rolled in (True, False):
+        for symbol, timeframe in archive.series():
+            tf_cutoff = cutoff(policy.get(timeframe), now)
+            if intraday(timeframe) != rolled or tf_cutoff is None or timeframe_delta(timeframe) is None:
+                continue
+            if rolled:
+                old = archive.read_frame(symbol, end=tf_cutoff - pd.Timedelta(1, "ns"), timeframe=timeframe)
+                for rollup, rule in ROLLUPS.items():
+                    result["rollups_written"] += archive.append(symbol, downsample(old, rule), rollup)["appended"]
+            dropped = archive.archive(symbol, timeframe).drop_before(tf_cutoff)
+            result["documents_deleted"] += dropped
+            result["symbols"] += 1 if dropped else 0
+    result["bytes_reclaimed"] = before - archive.size_bytes()
+    return result
+
+def _astra_bars(docs: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Per-bar and bucket market_data documents as one get_bars frame."""
+    frames = [frame_from_documents(frame_from_cursor(iter([d for d in docs if "bucket" not in d]))),
+              frame_from_documents(unpack_buckets(d for d in docs if "bucket" in d))]
+    frames = [f.set_axis(f.index.tz_convert("UTC") if f.index.tz else f.index.tz_localize("UTC"))
+              for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    bars = pd.concat(frames)
+    bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+    return bars.apply(pd.to_numeric, errors="coerce")
+
+def _compact_astra_day(agent, day: pd.Timestamp, result: Dict[str, Any], symbols: set):
+    """Roll up and delete one UTC day of market_data documents, symbol by symbol."""
+    start, end = day.date().isoformat(), (day + pd.Timedelta(days=1)).date().isoformat()
+    docs, sizes = defaultdict(list), defaultdict(int)
+    for doc in agent.find_range("market_data", start, end):
+        docs[doc.get("symbol")].append(doc)
+        sizes[doc.get("symbol")] += len(json.dumps(doc, default=str))
+    for symbol, symbol_docs in docs.items():
+        bars = _astra_bars(symbol_docs)
+        written, added = 0, 0
+        for timeframe, rule in ROLLUPS.items():
+            rollups = downsample(bars, rule)
+            saved = agent.save_rollups(symbol, timeframe, rollups) or {}
+            if saved.get("failed"):
+                result["errors"].append(f"{symbol} {start} {timeframe}: {len(saved['failed'])} rollups failed")
+                break
+            written += len(rollups)
+            added += sum(len(json.dumps(d, default=str)) for d in rollup_documents(symbol, timeframe, rollups))
+        else:
+            deleted = agent.delete_before("market_data", end, {"symbol": symbol}, start=start)
+            result["documents_deleted"] += deleted["deleted"]
+            result["bytes_reclaimed"] += sizes[symbol] - added
+            result["rollups_written"] += written
+            symbols.add(symbol)
+
+def compact_astra(agent, policy: Dict[str, int], indicator_days: int, now: pd.Timestamp) -> Dict[str, Any]:
+    """Same as ``compact_local`` for the Astra DB collections (bytes are JSON-size estimates).
+
+    Old market_data documents are worked through one UTC day at a time, newest
+    first, so memory holds a single day however much history has piled up.
+    Each day's documents are rolled up into ``bar_rollups`` per symbol and a
+    symbol's documents are only deleted once its rollups are written.
+    """
+    result, symbols = _tier(), set()
+    raw_cutoff = cutoff(policy.get(STORED_TIMEFRAME), now)
+    if raw_cutoff is not None:
+        # Date-only bounds: sort below every ISO timestamp of that day whatever its separator.
+        # Walking back with range filters only avoids sorting an unbounded collection.
+        day = pd.Timestamp(raw_cutoff.date()) - pd.Timedelta(days=1)
+        while agent.any_before("market_data", (day + pd.Timedelta(days=1)).date().isoformat()):
+            _compact_astra_day(agent, day, result, symbols)
+            day -= pd.Timedelta(days=1)
+    result["symbols"] = len(symbols)
+    for timeframe in ROLLUPS:
+        rollup_cutoff = cutoff(policy.get(timeframe), now)
+        if rollup_cutoff is not None:
+            deleted = agent.delete_before("bar_rollups", rollup_cutoff.date().isoformat(), {"timeframe": timeframe})
+            result["documents_deleted"] += deleted["deleted"]
+            result["bytes_reclaimed"] += deleted["bytes"]
+    indicator_cutoff = cutoff(indicator_days, now)
+    if indicator_cutoff is not None:
+        deleted = agent.delete_before("indicators", indicator_cutoff.date().isoformat())
+        result["documents_deleted"] += deleted["deleted"]
+        result["bytes_reclaimed"] += deleted["bytes"]
+    return result
+
+def _size(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+def run_retention(storage=None, agent=None, archive=None, policy: Optional[Dict[str, int]] = None,
+                  indicator_days: int = RETENTION_INDICATOR_DAYS, now=None) -> Dict[str, Any]:
+    """Apply retention to every tier (the shared storage, Astra DB and the bar archive by default).
+
+    Each tier is compacted independently, so one failing (e.g. Astra DB being
+    unreachable) doesn't stop the others; its error is in the report.
+    """
+    started = time.perf_counter()
+    if storage is None:
+        from .storage_agent import trading_storage as storage
+    if agent is None:
+        from .astra_db_agent import astra_db as agent
+    if archive is None:
+        from .bar_archive import get_bar_archive
+        archive = get_bar_archive()
+    policy = parse_policy() if policy is None else policy
+    now = pd.Timestamp(now or pd.Timestamp.now(tz="UTC"))
+    now = now.tz_localize("UTC") if now.tzinfo is None else now.tz_convert("UTC")
+
+    jobs = {"astra": lambda: (storage.flush(), compact_astra(agent, policy, indicator_days, now))[1]}
+    if storage.local is not None:
+        jobs["local"] = lambda: compact_local(storage.local, policy, indicator_days, now)
+    if archive is not None:
+        jobs["archive"] = lambda: compact_archive(archive, policy, now)
+    tiers = {}
+    for name, job in jobs.items():
+        try:
+            tiers[name] = job()
+        except Exception as e:
+            tiers[name] = {**_tier(), "errors": [str(e)]}
+
+    report = {
+        "ran_at": now.isoformat(),
+        "policy": policy,
+        "indicator_days": indicator_days,
+        "tiers": tiers,
+        "documents_reclaimed": sum(t["documents_deleted"] for t in tiers.values()),
+        "bytes_reclaimed": sum(t["bytes_reclaimed"] for t in tiers.values()),
+        "rollups_written": sum(t["rollups_written"] for t in tiers.values()),
+        "elapsed_s": round(time.perf_counter() - started, 3),
+    }
+    errors = [f"{name}: {e}" for name, t in tiers.items() for e in t["errors"]]
+    print(f"🧹 Retention: {report['documents_reclaimed']} documents/rows and {_size(report['bytes_reclaimed'])} "
+          f"reclaimed, {report['rollups_written']} rollup bars written ({report['elapsed_s']}s)"
+          + (f" ⚠️ {'; '.join(errors)}" if errors else ""))
+    return report
+
+_last_run: Optional[str] = None
+
+def run_if_due(storage=None, interval_hours: float = RETENTION_INTERVAL_HOURS, **kwargs) -> Optional[Dict[str, Any]]:
+    """Run retention if the last run (recorded in the local tier when there is one) is old enough."""
+    global _last_run
+    if not RETENTION_ENABLED:
+        return None
+    if storage is None:
+        from .storage_agent import trading_storage as storage
+    last = _last_run
+    if storage.local is not None:
+        doc = storage.local.get_document(LAST_RUN_ID)
+        last = doc["ran_at"] if doc else last
+    if last and datetime.now() - datetime.fromisoformat(last) < pd.Timedelta(hours=interval_hours):
+        return None
+    report = run_retention(storage=storage, **kwargs)
+    _last_run = datetime.now().isoformat()
+    if storage.local is not None:
+        storage.local.put_document({"_id": LAST_RUN_ID, "ran_at": _last_run, "report": report})
+    return report
+
+if __name__ == "__main__":
+    from .storage_agent import trading_storage
+    run_retention(trading_storage)
+    trading_storage.close()
@@ -0,0 +1,161 @@
+import os
+import threading
+import numpy as np
+from typing import Dict, Any, List, Optional, Sequence
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "max 10-20% of portfolio per trade" from the decision prompt
+RISK_MAX_TRADE_PCT = float(os.getenv("RISK_MAX_TRADE_PCT", "0.2"))
+RISK_MAX_SYMBOL_PCT = float(os.getenv("RISK_MAX_SYMBOL_PCT", "0.25"))
+RISK_MIN_CASH_BUFFER = float(os.getenv("RISK_MIN_CASH_BUFFER", "0"))
+
+def _num(value, default=0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def open_order_notional(order: Dict[str, Any]) -> float:
+    """Cash an open buy order will consume (remaining qty at its limit/stop price)."""
+    if order.get("side") != "buy":
+        return 0.0
+    if order.get("notional") is not None:
+        return _num(order["notional"])
+    qty = _num(order.get("qty")) - _num(order.get("filled_qty"))
+    price = _num(order.get("limit_price")) or _num(order.get("stop_price"))
+    return max(qty, 0.0) * price
+
+class RiskEngine:
+    """Pre-trade risk checks over the whole cycle's buy orders at once.
+
+    Per-symbol exposure, open-order notional and cycle reservations live in numpy
+    arrays indexed by symbol, so checking a batch is a handful of vector ops.
+    Approved quantities are reserved under a lock: two batches can never spend
+    the same cash.
+    """
+
+    def __init__(self, cash: float, buying_power: Optional[float] = None, equity: Optional[float] = None,
+                 max_trade_pct: float = RISK_MAX_TRADE_PCT, max_symbol_pct: float = RISK_MAX_SYMBOL_PCT,
+                 min_cash_buffer: float = RISK_MIN_CASH_BUFFER):
+        self.cash = float(cash)
+        self.buying_power = float(buying_power) if buying_power is not None else self.cash
+        self.equity = float(equity) if equity else self.cash
+        self.max_trade_pct = max_trade_pct
+        self.max_symbol_pct = max_symbol_pct
+        self.min_cash_buffer = min_cash_buffer
+
+        self.symbols: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.exposure = np.zeros(0)       # market value held per symbol
+        self.open_notional = np.zeros(0)  # open buy orders per symbol
+        self.reserved = np.zeros(0)       # approved this cycle, not yet known to the broker
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_account(cls, account: Dict[str, Any], positions: Optional[Sequence[Dict]] = None,
+                     orders: Optional[Sequence[Dict]] = None, **kwargs) -> "RiskEngine":
+        account = account or {}
+        engine = cls(cash=_num(account.get("cash")),
+                     buying_power=_num(account.get("buying_power"), None),
+                     equity=_num(account.get("equity")) or _num(account.get("portfolio_value")),
+                     **kwargs)
+        for position in positions or []:
+            if isinstance(position, dict) and position.get("symbol"):
+                value = _num(position.get("market_value")) or \
+                    _num(position.get("qty")) * _num(position.get("current_price"))
+                slot = engine._slot(position["symbol"])
+                engine.exposure[slot] += abs(value)
+        for order in orders or []:
+            if isinstance(order, dict) and order.get("symbol"):
+                slot = engine._slot(order["symbol"])
+                engine.open_notional[slot] += open_order_notional(order)
+        return engine
+
+    def _slot(self, symbol: str) -> int:
+        slot = self.index.get(symbol)
+        if slot is None:
+            slot = self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.exposure = np.append(self.exposure, 0.0)
+            self.open_notional = np.append(self.open_notional, 0.0)
+            self.reserved = np.append(self.reserved, 0.0)
+        return slot
+
+    def available_cash(self) -> float:
+        spendable = min(self.cash, self.buying_power) - self.min_cash_buffer
+        return max(0.0, spendable - self.open_notional.sum() - self.reserved.sum())
+
+    def check_orders(self, symbols: Sequence[str], qty: Sequence[float], price: Sequence[float],
+                     reserve: bool = True) -> Dict[str, np.ndarray]:
+        """Size a batch of buy orders (in priority order) against every limit together.
+
+        Returns arrays of ``approved`` share counts and a ``reason`` code per order
+        (0 ok, 1 trimmed by trade cap, 2 trimmed by symbol cap, 3 trimmed by cash).
+        With ``reserve`` the approved notional is held until ``release``/``reset``.
+        """
+        qty = np.asarray(qty, dtype=float)
+        price = np.asarray(price, dtype=float)
+        with self._lock:
+            slots = np.fromiter((self._slot(s) for s in symbols), dtype=np.intp, count=len(symbols))
+            valid_price = price > 0
+            safe_price = np.where(valid_price, price, 1.0)
+
+            trade_cap = np.floor(self.max_trade_pct * self.equity / safe_price)
+            held = self.exposure[slots] + self.open_notional[slots] + self.reserved[slots]
+            symbol_room = np.maximum(self.max_symbol_pct * self.equity - held, 0.0)
+            # Several orders for one symbol share its room: give it out in batch order
+            symbol_room = self._share_by_slot(slots, symbol_room, qty * price)
+            symbol_cap = np.floor(symbol_room / safe_price)
+
+            approved = np.minimum(np.floor(qty), np.minimum(trade_cap, symbol_cap))
+            approved = np.where(valid_price, np.maximum(approved, 0.0), 0.0)
+            reason = np.where(approved < np.floor(qty), np.where(trade_cap <= symbol_cap, 1, 2), 0)
+
+            # Cash goes to orders in priority order; whatever doesn't fit is trimmed
+            notional = approved * price
+            funded = np.minimum(np.cumsum(notional), self.available_cash())
+            funded_each = np.diff(funded, prepend=0.0)
+            cash_limited = np.floor(funded_each / safe_price + 1e-9)
+            reason = np.where(cash_limited < approved, 3, reason)
+            approved = np.minimum(approved, cash_limited)
+
+            if reserve:
+                np.add.at(self.reserved, slots, approved * price)
+        return {"approved": approved.astype(int), "reason": reason, "notional": approved * price}
+
+    @staticmethod
+    def _share_by_slot(slots: np.ndarray, room: np.ndarray, wanted: np.ndarray) -> np.ndarray:
+        """Room left for each order after earlier orders in the batch for the same symbol."""
+        if len(np.unique(slots)) == len(slots):
+            return room
+        used_before = np.zeros_like(room)
+        for slot in np.unique(slots):
+            positions = np.flatnonzero(slots == slot)
+            used_before[positions] = np.concatenate(([0.0], np.cumsum(wanted[positions])[:-1]))
+        return np.maximum(room - used_before, 0.0)
+
+    def release(self, symbol: str, notional: float):
+        """Give back a reservation whose order was never placed."""
+        with self._lock:
+            slot = self.index.get(symbol)
+            if slot is not None:
+                self.reserved[slot] = max(0.0, self.reserved[slot] - notional)
+
+    def reset(self):
+        """Drop reservations (e.g. once the broker's open orders reflect them)."""
+        with self._lock:
+            self.reserved[:] = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cash": self.cash,
+                "available_cash": self.available_cash(),
+                "open_order_notional": float(self.open_notional.sum()),
+                "reserved": float(self.reserved.sum()),
+                "exposure": {s: float(self.exposure[i]) for i, s in enumerate(self.symbols)},
+            }
+
+RISK_REASONS = {0: None, 1: "per-trade cap", 2: "per-symbol exposure cap", 3: "insufficient cash after reservations"}
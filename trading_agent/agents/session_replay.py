@@ -0,0 +1,297 @@
+import os
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from typing import Dict, Any, List, Optional, Callable
+from dotenv import load_dotenv
+from .backtester import normalize_bars
+from .model_cascade import rule_based_decision
+from .sim_broker import SimulatedBroker
+
+load_dotenv()
+
+REPLAY_CYCLE_MINUTES = int(os.getenv("REPLAY_CYCLE_MINUTES", "5"))  # the live loop runs every 5 minutes
+REPLAY_STARTING_CASH = float(os.getenv("REPLAY_STARTING_CASH", "100000"))
+
+GRAPH_NODES = ["get_account_positions", "analyze_positions", "make_position_decisions",
+               "reconcile_orders", "execute_actions", "log_actions"]
+
+class VirtualClock:
+    """Session time for a replay; it only moves when the replay advances it."""
+
+    def __init__(self, start: Optional[pd.Timestamp] = None):
+        self.current = pd.Timestamp(start) if start is not None else None
+
+    def now(self) -> pd.Timestamp:
+        return self.current
+
+    def set(self, when) -> pd.Timestamp:
+        self.current = pd.Timestamp(when)
+        return self.current
+
+    def advance(self, delta: timedelta) -> pd.Timestamp:
+        self.current = self.current + delta
+        return self.current
+
+class ReplayMarketData:
+    """``data_ingestor`` stand-in: recorded bars up to the virtual clock, account data from the broker."""
+
+    def __init__(self, bars: Dict[str, pd.DataFrame], broker: SimulatedBroker, clock: VirtualClock):
+        self.bars = bars
+        self.broker = broker
+        self.clock = clock
+        self.calls = 0
+
+    def get_bars(self, symbol, start_date=None, end_date=None, timeframe="5Min", hours_back=2):
+        self.calls += 1
+        df = self.bars.get(symbol)
+        if df is None:
+            return pd.DataFrame()
+        end = self.clock.now()
+        # Only bars that opened before "now" - no peeking at the rest of the session
+        lo, hi = df.index.searchsorted([end - pd.Timedelta(hours=hours_back), end])
+        return df.iloc[lo:hi]
+
+    def get_account(self):
+        return self.broker.get_account()
+
+    def get_positions(self):
+        return self.broker.get_positions()
+
+    def get_orders(self):
+        return self.broker.list_orders(status="open")
+
+    def functions(self):
+        return self.get_bars, self.get_account, self.get_positions, self.get_orders
+
+class RuleDecider:
+    """Deterministic ``make_trade_decision`` stand-in: the cascade's rule tier, or recorded answers.
+
+    ``recorded`` maps ``(cycle_id, symbol)`` or ``symbol`` to a decision; anything
+    not recorded falls through to ``rule_based_decision``.
+    """
+
+    def __init__(self, recorded: Optional[Dict[Any, str]] = None, clock: Optional[VirtualClock] = None):
+        self.recorded = recorded or {}
+        self.clock = clock
+        self.calls = 0
+
+    def __call__(self, symbol, position_data, indicators, account_data=None, historical_trades=None,
+                 news_data=None, market_intelligence=None, metadata=None):
+        self.calls += 1
+        cycle_id = self.clock.now().strftime("%Y%m%dT%H%M%S") if self.clock else None
+        decision = self.recorded.get((cycle_id, symbol)) or self.recorded.get(symbol)
+        confidence = 1.0
+        if decision is None:
+            decision, confidence = rule_based_decision(position_data, indicators)
+        if metadata is not None:
+            metadata.update({"cascade_tier": "replay", "confidence": confidence})
+        return decision
+
+class ReplayStorage:
+    """In-memory ``trading_storage`` stand-in."""
+
+    def __init__(self):
+        self.trades: List[Dict[str, Any]] = []
+        self.writes = 0
+
+    def save_market_data(self, symbol, bars):
+        self.writes += 1
+
+    def save_indicators(self, symbol, indicators):
+        self.writes += 1
+
+    def get_trades_for_symbol(self, symbol, limit=50, fields=None):
+        return [t for t in reversed(self.trades) if t["symbol"] == symbol][:limit]
+
+    def add_trade_record(self, symbol, decision, indicators, account, order_result):
+        self.trades.append({"symbol": symbol, "decision": decision, "order_id": (order_result or {}).get("id")})
+
+    def mark_to_market(self, prices):
+        pass
+
+    def record_fill(self, order):
+        pass
+
+    def sync_positions(self, positions):
+        return []
+
+    def get_performance_summary(self):
+        return {"total_trades": len(self.trades), "total_pnl": 0.0, "win_rate": 0.0}
+
+class ReplayNews:
+    """``ScrapingAgent`` stand-in serving recorded news (``{symbol: [items]}``)."""
+
+    def __init__(self, news: Optional[Dict[str, Any]] = None, market_intelligence: Any = None):
+        self.news = news or {}
+        self.market_intelligence = market_intelligence
+
+    def scrape_financial_news(self, symbol):
+        return self.news.get(symbol)
+
+    def scrape_market_data(self, url):
+        return self.market_intelligence
+
+class ReplayEmail:
+    def __init__(self):
+        self.reports = 0
+
+    def send_trading_report(self, trading_data):
+        self.reports += 1
+        return True
+
+@contextlib.contextmanager
+def replay_agents(market_data, decider, storage, news, email):
+    """Point the coordinator's agent getters at the replay stand-ins for the duration of a block."""
+    from trading_agent import coordinator
+    replacements = {
+        "_get_data_ingestor": market_data.functions,
+        "_get_llm_agent": lambda: decider,
+        "_get_storage_agent": lambda: storage,
+        "_get_scraping_agent": lambda: news,
+        "_get_email_agent": lambda: email,
+    }
+    saved = {name: getattr(coordinator, name) for name in replacements}
+    for name, getter in replacements.items():
+        setattr(coordinator, name, getter)
+    try:
+        yield coordinator
+    finally:
+        for name, getter in saved.items():
+            setattr(coordinator, name, getter)
+
+def _percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3) if values else None
+
+class SessionReplay:
+    """Replays recorded sessions through the compiled ``coordinator.app`` on a virtual clock.
+
+    Every cycle runs the real graph: account/positions/orders come from a
+    SimulatedBroker, bars from the recording (cut at the virtual time), and
+    decisions from ``RuleDecider`` (or recorded answers). Cycles run back to back,
+    so a session of 5-minute cycles replays as fast as the graph can execute.
+    """
+
+    def __init__(self, bars: Dict[str, pd.DataFrame], starting_cash: float = REPLAY_STARTING_CASH,
+                 initial_positions: Optional[Dict[str, int]] = None, decider: Optional[Callable] = None,
+                 news: Optional[Dict[str, Any]] = None, cycle_minutes: int = REPLAY_CYCLE_MINUTES,
+                 quiet: bool = True):
+        self.bars = {symbol: normalize_bars(df) for symbol, df in bars.items()}
+        self.clock = VirtualClock()
+        self.broker = SimulatedBroker(cash=starting_cash, bars=self.bars)
+        self.initial_positions = initial_positions if initial_positions is not None else \
+            {symbol: 10 for symbol in self.bars}
+        self.market_data = ReplayMarketData(self.bars, self.broker, self.clock)
+        self.decider = decider or RuleDecider()
+        if isinstance(self.decider, RuleDecider) and self.decider.clock is None:
+            self.decider.clock = self.clock
+        self.storage = ReplayStorage()
+        self.news = ReplayNews(news)
+        self.email = ReplayEmail()
+        self.cycle = pd.Timedelta(minutes=cycle_minutes)
+        self.quiet = quiet
+
+    def _schedule(self, start=None, end=None, max_cycles=None) -> pd.DatetimeIndex:
+        first = min(df.index[0] for df in self.bars.values() if len(df))
+        last = max(df.index[-1] for df in self.bars.values() if len(df))
+        start = pd.Timestamp(start) if start is not None else first
+        end = pd.Timestamp(end) if end is not None else last
+        times = pd.date_range(start, end, freq=self.cycle)
+        # Cycles only run while some symbol is trading
+        traded = np.zeros(len(times), dtype=bool)
+        for df in self.bars.values():
+            at = df.index.searchsorted(times, side="right") - 1
+            valid = at >= 0
+            traded[valid] |= (times[valid] - df.index[at[valid]]) < self.cycle
+        times = times[traded]
+        return times[:max_cycles] if max_cycles else times
+
+    def _seed_positions(self, at):
+        self.broker.set_time(at)
+        for symbol, qty in self.initial_positions.items():
+            if qty > 0:
+                self.broker.submit_order({"symbol": symbol, "qty": qty, "side": "buy", "type": "market"})
+
+    def run(self, start=None, end=None, max_cycles: Optional[int] = None) -> Dict[str, Any]:
+        from . import order_manager
+
+        schedule = self._schedule(start, end, max_cycles)
+        if not len(schedule):
+            raise ValueError("No trading cycles in the replay window")
+        self._seed_positions(schedule[0] - self.cycle)
+
+        node_latency = {node: [] for node in GRAPH_NODES}
+        cycle_latency, decision_counts, action_counts, cycle_errors = [], {}, {}, []
+        started = time.perf_counter()
+
+        sink = open(os.devnull, "w") if self.quiet else None
+        try:
+            with order_manager.order_backend(self.broker), \
+                    replay_agents(self.market_data, self.decider, self.storage, self.news, self.email) as coordinator, \
+                    (contextlib.redirect_stdout(sink) if sink else contextlib.nullcontext()):
+                for now in schedule:
+                    self.clock.set(now)
+                    self.broker.advance(now)
+                    state = {'cycle_id': now.strftime("%Y%m%dT%H%M%S"), 'positions': None, 'account': None,
+                             'orders': None, 'analysis_results': None, 'decisions': None,
+                             'reconciliation': None, 'actions_taken': None}
+                    cycle_start = last = time.perf_counter()
+                    try:
+                        for update in coordinator.app.stream(state, stream_mode="updates"):
+                            tick = time.perf_counter()
+                            for node, node_state in update.items():
+                                node_latency.setdefault(node, []).append(tick - last)
+                                state = node_state or state
+                            last = tick
+                    except Exception as e:
+                        cycle_errors.append({"cycle_id": state['cycle_id'], "error": str(e)})
+                    cycle_latency.append(time.perf_counter() - cycle_start)
+
+                    for decision_data in (state.get('decisions') or {}).values():
+                        decision = decision_data['decision']
+                        decision_counts[decision] = decision_counts.get(decision, 0) + 1
+                    for action in (state.get('actions_taken') or {}).values():
+                        name = "ERROR" if 'error' in action else action.get('action', 'HOLD')
+                        action_counts[name] = action_counts.get(name, 0) + 1
+        finally:
+            if sink:
+                sink.close()
+
+        wall = time.perf_counter() - started
+        session = (schedule[-1] - schedule[0]) + self.cycle
+        account = self.broker.get_account()
+        return {
+            "cycles": len(schedule),
+            "wall_s": round(wall, 3),
+            "cycles_per_s": round(len(schedule) / wall, 1) if wall else None,
+            "speedup": round(session.total_seconds() / wall, 1) if wall else None,
+            "cycle_ms": {"p50": _percentile_ms(cycle_latency, 50), "p95": _percentile_ms(cycle_latency, 95)},
+            "node_ms": {node: {"p50": _percentile_ms(values, 50), "p95": _percentile_ms(values, 95),
+                               "mean": round(float(np.mean(values)) * 1000, 3) if values else None}
+                        for node, values in node_latency.items()},
+            "decisions": decision_counts,
+            "actions": action_counts,
+            "orders": dict(self.broker.stats),
+            "llm_calls": getattr(self.decider, "calls", None),
+            "errors": cycle_errors,
+            "final_equity": float(account["equity"]),
+        }
+
+def print_report(report: Dict[str, Any]):
+    print(f"⏩ Replayed {report['cycles']} cycles in {report['wall_s']:.2f}s "
+          f"({report['cycles_per_s']} cycles/s, {report['speedup']}x real time)")
+    print(f"   Cycle latency p50 {report['cycle_ms']['p50']}ms, p95 {report['cycle_ms']['p95']}ms")
+    for node, latency in report['node_ms'].items():
+        print(f"   {node:<24} p50 {latency['p50']}ms  p95 {latency['p95']}ms")
+    print(f"   Decisions: {report['decisions']}")
+    print(f"   Actions: {report['actions']}  Orders: {report['orders']}")
+    if report['errors']:
+        print(f"   ⚠️  {len(report['errors'])} cycles failed, first: {report['errors'][0]['error']}")
+
+if __name__ == "__main__":
+    import sys
+    from .backtester import load_history
+    symbols = sys.argv[1:] or ["AAPL", "MSFT", "NVDA"]
+    print_report(SessionReplay(load_history(symbols)).run())
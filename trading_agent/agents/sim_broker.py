@@ -0,0 +1,503 @@
+import uuid
+import copy
+import threading
+import requests
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional, Callable
+
+OPEN_STATUSES = {"new", "accepted", "held", "partially_filled"}
+
+class SimulatedBrokerError(requests.exceptions.HTTPError):
+    """Order rejected by the simulated broker (raised where Alpaca would answer 4xx)."""
+
+def _first(mask: np.ndarray) -> int:
+    """Index of the first True in ``mask``, or -1."""
+    if not mask.size:
+        return -1
+    i = int(mask.argmax())
+    return i if mask[i] else -1
+
+def _num(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+class _Bars:
+    """One symbol's bars as contiguous arrays (timestamps in ns since epoch)."""
+
+    def __init__(self, df: pd.DataFrame):
+        index = pd.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index = index.tz_convert("UTC").tz_localize(None)
+        self.ts = index.asi8
+        self.o = df['o'].to_numpy(dtype=float)
+        self.h = df['h'].to_numpy(dtype=float)
+        self.l = df['l'].to_numpy(dtype=float)
+        self.c = df['c'].to_numpy(dtype=float)
+        # End of each bar's UTC day, for time_in_force=day expiry
+        self.day = self.ts // 86_400_000_000_000
+
+def _iso(ts_ns: int) -> str:
+    return pd.Timestamp(ts_ns, tz="UTC").isoformat()
+
+class SimulatedBroker:
+    """Local matching engine with Alpaca ``/v2/orders`` semantics, filled against bars.
+
+    Supports market, limit, stop, stop-limit and trailing-stop orders plus the
+    bracket and OCO classes. Orders placed at the broker clock become eligible
+    on the next bar: market orders fill at its open, limit/stop orders at their
+    price or the open when it gaps through. When a bar touches both exits of an
+    OCO/bracket, the stop is assumed to fill first. Partial fills and volume
+    limits are not modeled.
+
+    Each open order is matched with numpy over the bars since it was last
+    checked, so advancing the clock costs one vector search per open order.
+    """
+
+    def __init__(self, cash: float = 100_000.0, bars: Optional[Dict[str, pd.DataFrame]] = None):
+        self.starting_cash = float(cash)
+        self.cash = float(cash)
+        self.bars: Dict[str, _Bars] = {}
+        self.now: int = np.iinfo(np.int64).min  # broker clock, ns since epoch
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.positions: Dict[str, Dict[str, float]] = {}
+        self.fills: List[Dict[str, Any]] = []
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self.stats = {"orders": 0, "fills": 0, "rejected": 0, "canceled": 0}
+        self._by_client_id: Dict[str, str] = {}
+        self._open: Dict[str, Dict[str, Dict[str, Any]]] = {}  # symbol -> top-level open orders
+        self._state: Dict[str, Dict[str, Any]] = {}  # per-order matching cursor / trailing mark
+        self._lock = threading.RLock()
+        for symbol, df in (bars or {}).items():
+            self.load_bars(symbol, df)
+
+    # Market data and clock
+    def load_bars(self, symbol: str, df: pd.DataFrame):
+        """Register historical bars (``get_bars`` layout: o/h/l/c/v with a datetime index)."""
+        self.bars[symbol] = _Bars(df.sort_index())
+
+    def set_time(self, when):
+        """Move the clock to ``when`` (any pandas-parsable time), matching orders on the way."""
+        self.advance(when)
+
+    def advance(self, when) -> int:
+        """Match open orders against every bar up to and including ``when``; returns fills."""
+        ts = pd.Timestamp(when)
+        ts = (ts.tz_convert("UTC").tz_localize(None) if ts.tz is not None else ts).value
+        with self._lock:
+            events = []
+            for symbol, open_orders in list(self._open.items()):
+                bars = self.bars.get(symbol)
+                if bars is None or not open_orders:
+                    continue
+                end = int(np.searchsorted(bars.ts, ts, side="right"))
+                for order in list(open_orders.values()):
+                    events.extend(self._match(order, bars, end))
+            self.now = max(self.now, ts)
+            # Apply fills in time order so cash and positions evolve as they would have
+            events.sort(key=lambda e: (e[0], e[1]))
+            for idx, _, order, price, symbol in events:
+                self._fill(order, price, self.bars[symbol].ts[idx])
+            return len(events)
+
+    def last_price(self, symbol: str) -> Optional[float]:
+        bars = self.bars.get(symbol)
+        if bars is None:
+            return None
+        i = int(np.searchsorted(bars.ts, self.now, side="right")) - 1
+        return float(bars.c[i]) if i >= 0 else None
+
+    # Order entry (the /v2/orders surface used by order_manager)
+    def submit_order(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            coid = data.get("client_order_id")
+            if coid and coid in self._by_client_id:
+                raise SimulatedBrokerError("422 client_order_id must be unique")
+            symbol = data["symbol"]
+            if symbol not in self.bars:
+                self.stats["rejected"] += 1
+                raise SimulatedBrokerError(f"422 no bars loaded for {symbol}")
+
+            qty = float(data["qty"])
+            side = data["side"]
+            order_class = data.get("order_class") or "simple"
+            order_type = data.get("type", "market")
+            if qty <= 0:
+                raise SimulatedBrokerError("422 qty must be > 0")
+            if side == "sell" and qty > self._available_qty(symbol) + 1e-9:
+                self.stats["rejected"] += 1
+                raise SimulatedBrokerError(f"403 insufficient qty available for order (requested: {qty:g})")
+            if side == "buy":
+                price = _num(data.get("limit_price")) or _num(data.get("stop_price")) or self.last_price(symbol) or 0.0
+                if qty * price > self.buying_power() + 1e-6:
+                    self.stats["rejected"] += 1
+                    raise SimulatedBrokerError("403 insufficient buying power")
+
+            order = self._new_order(data, symbol, qty, side, order_type, order_class)
+            if order_class in ("bracket", "oco"):
+                legs = []
+                exit_side = "sell" if side == "buy" else "buy"
+                take_profit, stop_loss = data.get("take_profit") or {}, data.get("stop_loss") or {}
+                tif = {"time_in_force": order["time_in_force"]}
+                if order_class == "bracket" and take_profit:
+                    legs.append(self._new_order({"limit_price": take_profit["limit_price"], **tif}, symbol, qty,
+                                                exit_side, "limit", order_class, status="held"))
+                if stop_loss:
+                    leg_type = "stop_limit" if stop_loss.get("limit_price") else "stop"
+                    legs.append(self._new_order({**stop_loss, **tif}, symbol, qty,
+                                                exit_side if order_class == "bracket" else side,
+                                                leg_type, order_class, status="held" if order_class == "bracket" else "new"))
+                if order_class == "oco":
+                    order["limit_price"] = str(take_profit.get("limit_price", order.get("limit_price")))
+                order["legs"] = legs
+
+            self._open.setdefault(symbol, {})[order["id"]] = order
+            if coid:
+                self._by_client_id[coid] = order["id"]
+            self.stats["orders"] += 1
+            self._emit("new", order)
+            return copy.deepcopy(order)
+
+    def _new_order(self, data, symbol, qty, side, order_type, order_class, status="new"):
+        order = {
+            "id": str(uuid.uuid4()),
+            "client_order_id": data.get("client_order_id") or str(uuid.uuid4()),
+            "symbol": symbol,
+            "qty": f"{qty:g}",
+            "filled_qty": "0",
+            "filled_avg_price": None,
+            "side": side,
+            "type": order_type,
+            "order_class": order_class if order_class != "simple" else "",
+            "time_in_force": data.get("time_in_force", "day"),
+            "limit_price": str(data["limit_price"]) if data.get("limit_price") is not None else None,
+            "stop_price": str(data["stop_price"]) if data.get("stop_price") is not None else None,
+            "trail_percent": str(data["trail_percent"]) if data.get("trail_percent") is not None else None,
+            "trail_price": str(data["trail_price"]) if data.get("trail_price") is not None else None,
+            "hwm": None,
+            "status": status,
+            "submitted_at": _iso(max(self.now, 0)),
+            "filled_at": None,
+            "legs": None,
+        }
+        self.orders[order["id"]] = order
+        bars = self.bars[symbol]
+        start = int(np.searchsorted(bars.ts, self.now, side="right"))
+        state = {"cursor": start, "expires": None}
+        if order["time_in_force"] == "day" and start < len(bars.ts):
+            state["expires"] = int(np.searchsorted(bars.day, bars.day[start], side="right"))
+        if order_type == "trailing_stop":
+            state["mark"] = self.last_price(symbol) or (bars.o[start] if start < len(bars.ts) else None)
+        self._state[order["id"]] = state
+        return order
+
+    def _available_qty(self, symbol: str) -> float:
+        """Shares held minus those already committed to open sells (an OCO/bracket exit counts once)."""
+        held = self.positions.get(symbol, {}).get("qty", 0.0)
+        committed = 0.0
+        for o in self._open.get(symbol, {}).values():
+            if o["side"] == "sell":
+                committed += float(o["qty"])
+            elif o.get("order_class") == "bracket" and o["status"] == "filled":
+                committed += float(o["qty"])
+        return held - committed
+
+    # Matching
+    def _match(self, order, bars: _Bars, end: int):
+        """Find this order group's fills in bars [cursor, end); returns fill events."""
+        state = self._state[order["id"]]
+        if order.get("order_class") == "oco":
+            return self._match_oco(order, [order] + order["legs"], bars, end)
+        if order.get("order_class") == "bracket" and order["status"] == "filled":
+            return self._match_oco(order, order["legs"], bars, end)
+
+        limit = min(end, state["expires"]) if state["expires"] is not None else end
+        idx, price = self._first_fill(order, bars, state["cursor"], limit)
+        if idx < 0:
+            state["cursor"] = max(state["cursor"], limit)
+            if state["expires"] is not None and end >= state["expires"]:
+                self._close(order, "expired")
+            return []
+        state["cursor"] = idx + 1
+        events = [(idx, 0, order, price, order["symbol"])]
+        if order.get("order_class") == "bracket" and order["legs"]:
+            # Exits go live on the bar after the entry fills
+            for leg in order["legs"]:
+                self._state[leg["id"]]["cursor"] = idx + 1
+                self._state[leg["id"]]["expires"] = None
+                if leg["type"] == "trailing_stop":
+                    self._state[leg["id"]]["mark"] = price
+            events.extend(self._match_oco(order, order["legs"], bars, end, entry=True))
+        return events
+
+    def _match_oco(self, owner, legs, bars, end, entry=False):
+        """Whichever leg hits first fills and cancels the rest (stop wins a same-bar tie)."""
+        hits = []
+        for rank, leg in enumerate(legs):
+            if leg["status"] not in OPEN_STATUSES and not (entry and leg["status"] == "held"):
+                continue
+            state = self._state[leg["id"]]
+            idx, price = self._first_fill(leg, bars, state["cursor"], end)
+            priority = 0 if leg["type"] in ("stop", "stop_limit", "trailing_stop") else 1
+            if idx >= 0:
+                hits.append((idx, priority, rank, leg, price))
+            else:
+                state["cursor"] = max(state["cursor"], end)
+        if not hits:
+            return []
+        idx, priority, _, leg, price = min(hits, key=lambda hit: hit[:3])
+        return [(idx, 1 + priority, leg, price, owner["symbol"])]
+
+    def _first_fill(self, order, bars: _Bars, start: int, end: int):
+        """First bar index in [start, end) where ``order`` fills, and the fill price."""
+        if start >= end:
+            return -1, None
+        o, h, l = bars.o[start:end], bars.h[start:end], bars.l[start:end]
+        buy = order["side"] == "buy"
+        order_type = order["type"]
+        limit = _num(order.get("limit_price"))
+        stop = _num(order.get("stop_price"))
+
+        if order_type == "market":
+            return start, float(o[0])
+
+        if order_type == "limit":
+            i = _first(l <= limit) if buy else _first(h >= limit)
+            if i < 0:
+                return -1, None
+            return start + i, float(min(o[i], limit) if buy else max(o[i], limit))
+
+        if order_type == "trailing_stop":
+            state = self._state[order["id"]]
+            mark = state.get("mark")
+            if mark is None:
+                mark = o[0]
+            # Best price seen before each bar (the stop trails it without look-ahead)
+            if buy:
+                best = np.minimum.accumulate(np.concatenate(([mark], l[:-1])))
+            else:
+                best = np.maximum.accumulate(np.concatenate(([mark], h[:-1])))
+            trail_price = _num(order.get("trail_price"))
+            trail_percent = _num(order.get("trail_percent"), 0.0)
+            if trail_price:
+                stops = best + trail_price if buy else best - trail_price
+            else:
+                stops = best * (1 + trail_percent / 100) if buy else best * (1 - trail_percent / 100)
+            i = _first(h >= stops) if buy else _first(l <= stops)
+            if i < 0:
+                state["mark"] = float(min(best[-1], l[-1]) if buy else max(best[-1], h[-1]))
+                order["hwm"] = str(state["mark"])
+                order["stop_price"] = str(float(stops[-1]))
+                return -1, None
+            return start + i, float(max(o[i], stops[i]) if buy else min(o[i], stops[i]))
+
+        # stop / stop_limit: trigger first, then (stop_limit) work as a limit order
+        t = _first(h >= stop) if buy else _first(l <= stop)
+        if t < 0:
+            return -1, None
+        trigger_price = float(max(o[t], stop) if buy else min(o[t], stop))
+        if order_type == "stop" or limit is None:
+            return start + t, trigger_price
+        if (buy and trigger_price <= limit) or (not buy and trigger_price >= limit):
+            return start + t, trigger_price
+        i = _first(l[t + 1:] <= limit) if buy else _first(h[t + 1:] >= limit)
+        if i < 0:
+            return -1, None
+        j = t + 1 + i
+        return start + j, float(min(o[j], limit) if buy else max(o[j], limit))
+
+    def _fill(self, order, price: float, ts: int):
+        if order["status"] not in OPEN_STATUSES and order["status"] != "held":
+            return
+        qty = float(order["qty"])
+        symbol = order["symbol"]
+        order.update(status="filled", filled_qty=order["qty"], filled_avg_price=str(price), filled_at=_iso(ts))
+
+        position = self.positions.setdefault(symbol, {"qty": 0.0, "cost": 0.0})
+        realized = None
+        if order["side"] == "buy":
+            self.cash -= qty * price
+            position["cost"] += qty * price
+            position["qty"] += qty
+        else:
+            self.cash += qty * price
+            if position["qty"] > 0:
+                avg_cost = position["cost"] / position["qty"]
+                realized = qty * (price - avg_cost)
+                position["cost"] *= max(0.0, 1 - qty / position["qty"])
+            position["qty"] -= qty
+        if abs(position["qty"]) < 1e-9:
+            self.positions.pop(symbol, None)
+
+        fill = {"order_id": order["id"], "symbol": symbol, "side": order["side"], "price": price,
+                "qty": qty, "timestamp": _iso(ts), "type": order["type"], "realized_pl": realized}
+        self.fills.append(fill)
+        self.stats["fills"] += 1
+
+        group = self._parent(order) or order
+        if group is order and order.get("order_class") == "bracket":
+            # Entry filled: the exits go live
+            for leg in order["legs"]:
+                leg["status"] = "new"
+        else:
+            # Simple order, or one side of an OCO/bracket exit: the rest of the group is done
+            for sibling in [group] + list(group.get("legs") or []):
+                if sibling is not order and sibling["status"] in OPEN_STATUSES | {"held"}:
+                    sibling["status"] = "canceled"
+            self._open.get(symbol, {}).pop(group["id"], None)
+        self._emit("fill", order, price=price, qty=qty, timestamp=_iso(ts))
+
+    def _parent(self, order):
+        """The top-level order that owns ``order`` (itself for top-level orders)."""
+        top = self._open.get(order["symbol"], {})
+        if order["id"] in top:
+            return order
+        for candidate in top.values():
+            if any(leg is order for leg in candidate.get("legs") or []):
+                return candidate
+        return None
+
+    def _close(self, order, status):
+        order["status"] = status
+        for leg in order.get("legs") or []:
+            if leg["status"] in OPEN_STATUSES | {"held"}:
+                leg["status"] = status
+        self._open.get(order["symbol"], {}).pop(order["id"], None)
+        self._emit(status, order)
+
+    def _emit(self, event, order, **extra):
+        for listener in self.listeners:
+            listener({"event": event, "order": copy.deepcopy(order), **extra})
+
+    # Queries (mirroring the REST responses order_manager expects)
+    def get_order(self, order_id: str) -> Dict[str, Any]:
+        with self._lock:
+            if order_id not in self.orders:
+                raise SimulatedBrokerError(f"404 order not found: {order_id}")
+            return copy.deepcopy(self.orders[order_id])
+
+    def get_order_by_client_order_id(self, client_order_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            order_id = self._by_client_id.get(client_order_id)
+            return copy.deepcopy(self.orders[order_id]) if order_id else None
+
+    def list_orders(self, status="open", after=None, limit=500, nested=True) -> List[Dict[str, Any]]:
+        with self._lock:
+            leg_ids = {leg["id"] for o in self.orders.values() for leg in o.get("legs") or []}
+            orders = [o for o in self.orders.values() if not nested or o["id"] not in leg_ids]
+            working = OPEN_STATUSES | {"held"}
+
+            def is_open(o):
+                # A filled bracket entry stays listed while its exit legs are working
+                return o["status"] in working or (nested and any(l["status"] in working for l in o.get("legs") or []))
+
+            if status == "open":
+                orders = [o for o in orders if is_open(o)]
+            elif status == "closed":
+                orders = [o for o in orders if not is_open(o)]
+            if after:
+                orders = [o for o in orders if o["submitted_at"] > after]
+            return copy.deepcopy(orders[:limit])
+
+    def cancel_order(self, order_id: str):
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None:
+                raise SimulatedBrokerError(f"404 order not found: {order_id}")
+            if order["status"] not in OPEN_STATUSES | {"held"}:
+                raise SimulatedBrokerError(f"422 order is already {order['status']}")
+            self.stats["canceled"] += 1
+            group = self._parent(order) or order
+            if group is not order and group["status"] == "filled":
+                # Cancelling an exit of a filled bracket cancels the exits, not the entry
+                for leg in group["legs"]:
+                    if leg["status"] in OPEN_STATUSES | {"held"}:
+                        leg["status"] = "canceled"
+                self._open.get(group["symbol"], {}).pop(group["id"], None)
+                self._emit("canceled", order)
+            else:
+                self._close(group, "canceled")
+
+    def replace_order(self, order_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Cancel-replace: the old order becomes ``replaced`` and a new one takes its place."""
+        with self._lock:
+            old = self.orders.get(order_id)
+            if old is None or old["status"] not in OPEN_STATUSES:
+                raise SimulatedBrokerError(f"422 order {order_id} is not replaceable")
+            if self._parent(old) is not old:
+                # OCO/bracket legs are amended in place
+                for field in ("qty", "limit_price", "stop_price"):
+                    if data.get(field) is not None:
+                        old[field] = str(data[field])
+                self._emit("replaced", old)
+                return copy.deepcopy(old)
+            trail = data.get("trail")
+            new = {
+                "symbol": old["symbol"], "side": old["side"], "type": old["type"],
+                "qty": data.get("qty", old["qty"]),
+                "time_in_force": data.get("time_in_force", old["time_in_force"]),
+                "limit_price": data.get("limit_price", old["limit_price"]),
+                "stop_price": data.get("stop_price", old["stop_price"]) if old["type"] != "trailing_stop" else None,
+                "trail_percent": trail if trail is not None and old["trail_percent"] else old["trail_percent"],
+                "trail_price": trail if trail is not None and old["trail_price"] else old["trail_price"],
+                "client_order_id": data.get("client_order_id"),
+            }
+            # The old order's shares are freed for the new one, and it is only closed once that is in
+            open_orders = self._open.setdefault(old["symbol"], {})
+            open_orders.pop(order_id, None)
+            try:
+                replacement = self.submit_order(new)
+            except Exception:
+                open_orders[order_id] = old
+                raise
+            self._close(old, "replaced")
+            return replacement
+
+    # Account
+    def buying_power(self) -> float:
+        reserved = 0.0
+        for open_orders in self._open.values():
+            for o in open_orders.values():
+                if o["side"] == "buy":
+                    price = _num(o.get("limit_price")) or _num(o.get("stop_price")) or self.last_price(o["symbol"]) or 0.0
+                    reserved += float(o["qty"]) * price
+        return self.cash - reserved
+
+    def get_positions(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            positions = []
+            for symbol, position in self.positions.items():
+                qty = position["qty"]
+                price = self.last_price(symbol) or 0.0
+                avg = position["cost"] / qty if qty else 0.0
+                market_value = qty * price
+                unrealized = market_value - position["cost"]
+                positions.append({
+                    "symbol": symbol,
+                    "qty": f"{qty:g}",
+                    "side": "long" if qty > 0 else "short",
+                    "avg_entry_price": str(avg),
+                    "current_price": str(price),
+                    "market_value": str(market_value),
+                    "cost_basis": str(position["cost"]),
+                    "unrealized_pl": str(unrealized),
+                    "unrealized_plpc": str(unrealized / position["cost"] if position["cost"] else 0.0),
+                })
+            return positions
+
+    def get_account(self) -> Dict[str, Any]:
+        with self._lock:
+            market_value = sum(p["qty"] * (self.last_price(s) or 0.0) for s, p in self.positions.items())
+            equity = self.cash + market_value
+            return {
+                "id": "simulated",
+                "status": "ACTIVE",
+                "currency": "USD",
+                "cash": str(self.cash),
+                "buying_power": str(self.buying_power()),
+                "equity": str(equity),
+                "portfolio_value": str(equity),
+                "long_market_value": str(market_value),
+            }
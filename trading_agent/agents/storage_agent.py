@@ -1,72 +1,370 @@
 import os
+import atexit
+import threading
+import pandas as pd
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Iterable
 from .astra_db_agent import astra_db
+from .write_behind import STORAGE_WRITE_BEHIND, WriteBehindQueue
+from .high_water import HighWaterMarks
+from .performance_aggregates import SUMMARY_ID, PerformanceAggregates
+from .local_store import LOCAL_STORE_ENABLED, LOCAL_STORE_PATH, LOCAL_STORE_RECONCILE_LIMIT, LocalStore, frame_from_documents
+
+def _utc_index(index) -> pd.DatetimeIndex:
+    index = pd.DatetimeIndex(index)
+    return index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
 
 class TradingStorage:
-    """Storage system for trading history and AI memory using Astra DB."""
+    """Storage system for trading history and AI memory.
+
+    Bars, indicators and trades land in an embedded local store first and are
+    read back from it; Astra DB is an asynchronous replica fed by the
+    write-behind queue. ``reconcile`` brings the two tiers back in line after a
+    restart.
+    """
 
-    def __init__(self):
+    def __init__(self, write_behind: bool = STORAGE_WRITE_BEHIND, local_path: Optional[str] = LOCAL_STORE_PATH
+                 if LOCAL_STORE_ENABLED else None):
         # Simplified storage without langchain dependencies for now
-        pass
+        self._local_path = local_path
+        self._local: Optional[LocalStore] = None
+        self._local_lock = threading.Lock()
+        # Bar/indicator saves go through a background queue so analysis never waits on Astra
+        self.write_queue = WriteBehindQueue(self._write) if write_behind else None
+        # Only rows from the last persisted one on are re-sent each cycle
+        self.high_water = HighWaterMarks(astra_db.get_latest_timestamp)
+        self.reconciled: Dict[str, Any] = {}
+        self._reconcile_thread = None
+        self._trades_synced = False  # local trades hold the full history once reconciled
+        self.memory = deque(maxlen=50)  # recent trade notes for the AI context
+        self._performance: Optional[PerformanceAggregates] = None
+        self._performance_lock = threading.Lock()
+        self._performance_pending = False  # no stored summary yet: rebuild before persisting
+
+    @property
+    def local(self) -> Optional[LocalStore]:
+        """The embedded store, opened on first use so importing this module touches no files."""
+        if self._local is None and self._local_path:
+            with self._local_lock:
+                if self._local is None:
+                    self._local = LocalStore(self._local_path)
+        return self._local
+
+    def start(self):
+        """Startup hook: open the local store and reconcile it with Astra DB in the background.
+
+        Without a stored performance summary this also rebuilds it from the trade
+        history once, here rather than inside a trading cycle.
+        """
+        self.reconcile_in_background()
+        self.performance()
+        if self._performance_pending:
+            print("📊 No stored performance summary - rebuilding it from the trade history")
+            self.rebuild_performance()
+        return self
+
+    def _write(self, key, payload):
+        kind, symbol = key
+        if kind == "trades":
+            if astra_db.save_trade(payload) is None:
+                raise RuntimeError(f"trade {symbol} not written")
+            return
+        if kind == "performance":
+            astra_db.save_performance_summary(payload)
+            return
+        if kind == "trade_order":
+            astra_db.update_trade_order(payload)
+            return
+        payload = self.high_water.new_rows(key, payload)
+        if payload is None or payload.empty:
+            return
+        if kind == "market_data":
+            result = astra_db.save_market_data(symbol, payload)
+        else:
+            result = astra_db.save_indicators(symbol, payload)
+        if result and result.get("failed"):
+            # Lets the write-behind queue retry; rows already stored are skipped next time
+            raise RuntimeError(f"{len(result['failed'])} {kind} documents for {symbol} not written")
+        self.high_water.advance(key, payload)
+
+    def _save(self, kind: str, symbol: str, data):
+        if self.local is not None and isinstance(data, pd.DataFrame):
+            self.local.write_frame(kind, symbol, data)
+        self._replicate(kind, symbol, data)
+
+    def _replicate(self, kind: str, symbol: str, data):
+        if self.write_queue is not None:
+            self.write_queue.put((kind, symbol), data)
+        else:
+            self._write((kind, symbol), data)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait for queued writes to reach Astra DB."""
+        return self.write_queue.flush(timeout) if self.write_queue is not None else True
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Flush queued writes and stop the background writer (graceful shutdown)."""
+        return self.write_queue.close(timeout) if self.write_queue is not None else True
+
+    def queue_stats(self) -> Dict[str, Any]:
+        """Write-behind queue depth and flush latency, plus rows skipped by the high-water marks."""
+        stats = self.write_queue.snapshot() if self.write_queue is not None else {"depth": 0}
+        return {**stats, "delta": self.high_water.snapshot(), "reconciled_symbols": len(self.reconciled)}
 
     def add_trade_record(self, symbol: str, decision: str, indicators: Dict, account: Dict, order_result: Dict = None):
-        """Add a trade record to Astra DB."""
+        """Add a trade record locally and replicate it to Astra DB."""
+        performance = self.performance()  # loaded before this trade exists anywhere
+        now = datetime.now()
         trade_data = {
-            "timestamp": datetime.now(),
+            "_id": f"trade_{now.isoformat()}_{symbol}",
+            "timestamp": now,
             "symbol": symbol,
             "decision": decision,
             "indicators": indicators,
             "account_balance": account.get('cash', 0),
             "buying_power": account.get('buying_power', 0),
-            "order_result": order_result
+            "order_result": order_result,
+            # FIFO lot matching of the order's fill (None until it has filled)
+            "realized_pnl": performance.engine.apply_order(order_result)
         }
 
-        # Save to Astra DB
-        astra_db.save_trade(trade_data)
+        if self.local is not None:
+            self.local.write_trades([trade_data])
+        self._replicate("trades", trade_data["_id"], trade_data)
+
+        performance.apply(trade_data)
+        self._save_performance(performance)
 
         # Add to AI memory
         memory_text = f"Trade Decision for {symbol}: {decision} | Account: ${account.get('cash', 0)} | Indicators: {indicators}"
-        self.memory.save_context({"input": f"Analyzed {symbol}"}, {"output": memory_text})
+        self.memory.append(memory_text)
+
+    def record_fill(self, order: Dict[str, Any]) -> Optional[float]:
+        """Fold a broker fill (an order book fill event) into the P&L and the trade that placed the order.
+
+        Market orders are still unfilled when their trade is recorded, so this
+        is where their P&L arrives; parts already counted are skipped.
+        """
+        performance = self.performance()
+        realized = performance.apply_fill(order)
+        if realized is None:
+            return None
+        if self.local is not None:
+            self.local.update_trade_order(order)
+        self._replicate("trade_order", order["id"], order)
+        self._save_performance(performance)
+        return realized
+
+    def sync_positions(self, positions: Optional[List[Dict[str, Any]]]) -> List[str]:
+        """Seed FIFO lots from broker positions the trade history doesn't cover (see ``PnLEngine.seed_positions``)."""
+        performance = self.performance()
+        seeded = performance.engine.seed_positions(positions)
+        if seeded:
+            self._save_performance(performance)
+        return seeded
 
-    def get_recent_trades(self, limit: int = 10) -> List[Dict]:
-        """Get recent trading records from Astra DB."""
-        return astra_db.get_recent_trades(limit)
+    def get_recent_trades(self, limit: int = 10, fields: Optional[List[str]] = None) -> List[Dict]:
+        """Get recent trading records (newest first), only ``fields`` of each if given."""
+        return self._trades(None, limit, fields)
 
-    def get_trades_for_symbol(self, symbol: str) -> List[Dict]:
-        """Get trading history for a specific symbol from Astra DB."""
-        return astra_db.get_trades(symbol, limit=50)  # Last 50 trades for this symbol
+    def get_trades_for_symbol(self, symbol: str, limit: int = 50, fields: Optional[List[str]] = None) -> List[Dict]:
+        """Get trading history for a specific symbol (newest first; e.g. ``fields=["decision"]``)."""
+        return self._trades(symbol, limit, fields)
+
+    def _trades(self, symbol: Optional[str], limit: int, fields: Optional[List[str]]) -> List[Dict]:
+        """Local tier first; Astra DB when the local copy may be incomplete."""
+        if self.local is not None:
+            trades = self.local.read_trades(symbol, limit, fields)
+            if trades or self._trades_synced:
+                return trades
+        self.flush()
+        trades = astra_db.get_trades(symbol, limit, fields)
+        if self.local is not None and trades and not fields:
+            self.local.write_trades(trades)  # only whole documents are cached
+        return trades
 
     def get_memory_context(self) -> str:
         """Get AI memory context for decision making."""
-        if self.memory.buffer:
-            return str(self.memory.buffer[-5:])  # Last 5 memories
+        if self.memory:
+            return str(list(self.memory)[-5:])  # Last 5 memories
         return "No previous trading context available."
 
     def get_performance_summary(self) -> Dict[str, Any]:
-        """Get performance summary from Astra DB."""
-        return astra_db.get_performance_summary()
+        """Performance summary from the incrementally maintained aggregates."""
+        return self.performance().summary()
+
+    def performance(self) -> PerformanceAggregates:
+        """The running aggregates, loaded once from the stored summary.
+
+        With none stored they start empty and aren't persisted until ``start`` or
+        ``rebuild_performance`` has filled them from the trade history (never a
+        trading cycle), so a partial summary can't stand in for the full one.
+        """
+        if self._performance is not None:
+            return self._performance
+        with self._performance_lock:
+            if self._performance is None:
+                doc = self._stored_performance()
+                self._performance_pending = doc is None
+                self._performance = PerformanceAggregates.from_document(doc) if doc else PerformanceAggregates()
+        return self._performance
+
+    def _stored_performance(self) -> Optional[Dict[str, Any]]:
+        doc = self.local.get_document(SUMMARY_ID) if self.local is not None else None
+        if doc is None:
+            try:
+                doc = astra_db.get_performance_summary_document(SUMMARY_ID)
+            except Exception as e:
+                print(f"⚠️  Couldn't load the performance summary: {e}")
+        return doc
+
+    def _trade_history(self):
+        """Every stored trade, oldest first (Astra DB holds the full history; local if it's unreachable)."""
+        self.flush()
+        try:
+            return list(astra_db.iter_trades())
+        except Exception as e:
+            print(f"⚠️  Reading trade history from Astra DB failed, using the local store: {e}")
+            return list(self.local.iter_trades()) if self.local is not None else []
+
+    def _save_performance(self, performance: PerformanceAggregates):
+        if self._performance_pending:
+            return
+        doc = performance.to_document()
+        if self.local is not None:
+            self.local.put_document(doc)
+        self._replicate("performance", SUMMARY_ID, doc)
+
+    def rebuild_performance(self) -> Dict[str, Any]:
+        """Recompute the aggregates from the full trade history and store them."""
+        seeds = self._performance.engine.seeds if self._performance is not None else None
+        performance = PerformanceAggregates().rebuild(self._trade_history(), seeds)
+        with self._performance_lock:
+            self._performance = performance
+            self._performance_pending = False
+        self._save_performance(performance)
+        return performance.summary()
 
     # Additional Astra DB methods
-    def save_market_data(self, symbol: str, data):
-        """Save market data to Astra DB."""
-        astra_db.save_market_data(symbol, data)
+    def save_market_data(self, symbol: str, data, backfill: bool = False):
+        """Save market data locally and to Astra DB (queued with write-behind).
+
+        Only rows from the symbol's high-water mark on are written; ``backfill``
+        writes every row now (e.g. older history).
+        """
+        if backfill:
+            if self.local is not None:
+                self.local.write_frame("market_data", symbol, data)
+            return astra_db.save_market_data(symbol, data)
+        self._save("market_data", symbol, data)
 
-    def get_market_data(self, symbol: str, start_date=None, limit=1000):
-        """Get market data from Astra DB."""
-        return astra_db.get_market_data(symbol, start_date, limit)
+    def get_market_data(self, symbol: str, start_date=None, limit=1000, fields: Optional[List[str]] = None):
+        """Get bars in the ``get_bars`` layout (o/h/l/c/v/vw), from the local tier when it has them.
 
-    def save_indicators(self, symbol: str, indicators):
-        """Save indicators to Astra DB."""
-        astra_db.save_indicators(symbol, indicators)
+        ``fields`` (e.g. ["c", "v"]) limits the columns returned.
+        """
+        if self.local is not None:
+            bars = self.local.read_frame("market_data", symbol, start=start_date, limit=limit, columns=fields)
+            if not bars.empty:
+                return bars
+        bars = self._pull("market_data", symbol, start_date, limit)
+        return bars[[c for c in fields if c in bars.columns]] if fields and not bars.empty else bars
 
-    def get_indicators(self, symbol: str, limit=1000):
-        """Get indicators from Astra DB."""
-        return astra_db.get_indicators(symbol, limit)
+    def save_indicators(self, symbol: str, indicators, backfill: bool = False):
+        """Save indicators locally and to Astra DB (queued with write-behind, new rows only unless ``backfill``)."""
+        if backfill:
+            if self.local is not None:
+                self.local.write_frame("indicators", symbol, indicators)
+            return astra_db.save_indicators(symbol, indicators)
+        self._save("indicators", symbol, indicators)
+
+    def get_indicators(self, symbol: str, limit=1000, fields: Optional[List[str]] = None):
+        """Get indicators, from the local tier when it has them (only ``fields`` if given)."""
+        if self.local is not None:
+            indicators = self.local.read_frame("indicators", symbol, limit=limit, columns=fields)
+            if not indicators.empty:
+                return indicators
+        indicators = self._pull("indicators", symbol, None, limit)
+        return indicators[[c for c in fields if c in indicators.columns]] if fields and not indicators.empty \
+            else indicators
+
+    def _pull(self, kind: str, symbol: str, start_date=None, limit=1000) -> pd.DataFrame:
+        """Read from Astra DB and keep a local copy."""
+        self.flush()  # read our own queued writes
+        if kind == "market_data":
+            frame = frame_from_documents(astra_db.get_market_data(symbol, start_date, limit))
+        else:
+            frame = frame_from_documents(astra_db.get_indicators(symbol, limit))
+        if self.local is not None and not frame.empty:
+            self.local.write_frame(kind, symbol, frame)
+        return frame
+
+    # Tier reconciliation
+    def reconcile(self, symbols: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Bring the local tier and Astra DB in line for ``symbols`` (default: every local symbol).
+
+        Whichever side has the newer rows wins: local rows Astra hasn't seen
+        (e.g. still queued when the process stopped) are re-queued, and rows
+        only Astra has (e.g. written by another host) are pulled down.
+        """
+        if self.local is None:
+            return {}
+        if symbols is None:
+            symbols = set(self.local.symbols("market_data")) | set(self.local.symbols("indicators"))
+        report = {"pushed": 0, "pulled": 0, "errors": []}
+        for symbol in symbols:
+            for kind in ("market_data", "indicators"):
+                try:
+                    local_latest = self.local.latest_timestamp(kind, symbol)
+                    remote_latest = self.high_water.mark((kind, symbol))
+                    if local_latest is not None and (remote_latest is None or local_latest > remote_latest):
+                        rows = self.local.read_frame(kind, symbol, start=remote_latest)
+                        self._replicate(kind, symbol, rows)
+                        report["pushed"] += len(rows)
+                    elif remote_latest is not None and (local_latest is None or remote_latest > local_latest):
+                        rows = self._pull(kind, symbol, local_latest.isoformat() if local_latest is not None else None,
+                                          LOCAL_STORE_RECONCILE_LIMIT)
+                        if local_latest is not None and not rows.empty:
+                            rows = rows[_utc_index(rows.index) > local_latest]
+                        report["pulled"] += len(rows)
+                except Exception as e:
+                    report["errors"].append(f"{symbol} {kind}: {e}")
+            self.reconciled[symbol] = datetime.now().isoformat()
+        try:
+            if self.local.count("trades") == 0:
+                trades = astra_db.get_recent_trades(LOCAL_STORE_RECONCILE_LIMIT)
+                if trades:
+                    report["pulled"] += self.local.write_trades(trades)
+            self._trades_synced = True
+        except Exception as e:
+            report["errors"].append(f"trades: {e}")
+        return report
+
+    def reconcile_in_background(self, symbols: Optional[Iterable[str]] = None):
+        """Run ``reconcile`` on a daemon thread (startup must not wait on Astra)."""
+        if self.local is None or (self._reconcile_thread is not None and self._reconcile_thread.is_alive()):
+            return
+        def run():
+            report = self.reconcile(symbols)
+            if report["pushed"] or report["pulled"] or report["errors"]:
+                print(f"🔄 Storage tiers reconciled: {report['pushed']} rows re-queued for Astra DB, "
+                      f"{report['pulled']} pulled locally, {len(report['errors'])} errors")
+        self._reconcile_thread = threading.Thread(target=run, name="storage-reconcile", daemon=True)
+        self._reconcile_thread.start()
 
     def calculate_pnl(self, symbol=None):
-        """Calculate P&L from Astra DB."""
-        return astra_db.calculate_pnl(symbol)
+        """Realized (FIFO) and unrealized P&L from the running aggregates."""
+        return self.performance().pnl(symbol)
+
+    def mark_to_market(self, prices: Dict[str, float]):
+        """Latest prices for unrealized P&L on open lots."""
+        self.performance().engine.mark(prices)
+
+# Global storage instance (inert until used; entry points call start_storage())
+trading_storage = TradingStorage()
+atexit.register(trading_storage.close)
 
-# Global storage instance
-trading_storage = TradingStorage()
\ No newline at end of file
+def start_storage():
+    """Open local storage and start reconciling it with Astra DB (call once at startup)."""
+    return trading_storage.start()
@@ -0,0 +1,24 @@
+from typing import Dict, Any, Optional
+
+# Tunable knobs of the rule/LLM strategy, as execute_actions uses them by default
+DEFAULT_STRATEGY_PARAMS = {
+    "ema_period": 20,
+    "rsi_period": 14,
+    "atr_period": 14,
+    "bracket_entry": 0.995,       # Buy at 0.5% discount
+    "bracket_take_profit": 1.05,  # 5% profit target
+    "bracket_stop_loss": 0.97,    # 3% stop loss
+    "limit_buy_discount": 0.98,   # Buy at 2% discount
+    "trail_percent_buy": 2.0,     # TRAILING_STOP_BUY
+    "trail_percent_sell": 3.0,    # TRAILING_STOP_SELL
+    "stop_loss": 0.95,            # STOP_LOSS at 5% below the current price
+}
+
+def resolve_params(overrides: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Defaults with ``overrides`` applied; unknown keys are rejected."""
+    if not overrides:
+        return dict(DEFAULT_STRATEGY_PARAMS)  # a copy: callers may change it freely
+    unknown = set(overrides) - set(DEFAULT_STRATEGY_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown strategy parameters: {', '.join(sorted(unknown))}")
+    return {**DEFAULT_STRATEGY_PARAMS, **overrides}
@@ -0,0 +1,235 @@
+import os
+import time
+import uuid
+import queue
+import random
+import atexit
+import functools
+import threading
+import contextvars
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Callable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "true").lower() == "true"
+LANGSMITH_PROJECT = os.getenv("LANGSMITH_PROJECT", "alpaca-agent")
+# Head-based sampling: the root call of a trace decides for everything nested under it
+LANGSMITH_SAMPLE_RATE = float(os.getenv("LANGSMITH_SAMPLE_RATE", "0.1"))
+LANGSMITH_SAMPLE_RATES = os.getenv("LANGSMITH_SAMPLE_RATES", "")  # e.g. "run_pipeline=0.05,invoke_llm=1"
+# Per-function opt-in ("*" traces every decorated function)
+LANGSMITH_TRACED_FUNCTIONS = os.getenv("LANGSMITH_TRACED_FUNCTIONS", "run_pipeline,invoke_llm")
+LANGSMITH_TRACE_QUEUE_SIZE = int(os.getenv("LANGSMITH_TRACE_QUEUE_SIZE", "1000"))
+
+# This module owns export, so stop LangChain from auto-tracing every LLM call unsampled
+os.environ["LANGSMITH_TRACING"] = "false"
+os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+_MAX_REPR = 2000
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            try:
+                rates[name.strip()] = float(rate)
+            except ValueError:
+                print(f"⚠️  Ignoring bad LangSmith sample rate: {item}")
+    return rates
+
+def _safe(value):
+    """Make an argument JSON-friendly for export (done on the export thread, not the hot path)."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= _MAX_REPR else value[:_MAX_REPR] + "..."
+    if isinstance(value, dict):
+        return {str(k): _safe(v) for k, v in list(value.items())[:50]}
+    if isinstance(value, (list, tuple)):
+        return [_safe(v) for v in list(value)[:50]]
+    text = repr(value)
+    return text if len(text) <= _MAX_REPR else text[:_MAX_REPR] + "..."
+
+def _langsmith_sink():
+    """Default sink: batch-ingest finished runs into LangSmith."""
+    from langsmith import Client
+    client = Client(auto_batch_tracing=False)
+
+    def send(runs: List[Dict[str, Any]]):
+        client.batch_ingest_runs(create=runs)
+
+    return send
+
+class TraceExporter:
+    """Bounded background queue of finished runs; drops instead of blocking when full."""
+
+    def __init__(self, max_queue: int = LANGSMITH_TRACE_QUEUE_SIZE, batch_size: int = 50,
+                 flush_interval: float = 1.0, sink: Optional[Callable[[List[Dict]], None]] = None):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sink = sink
+        self.stats = {"submitted": 0, "dropped": 0, "exported": 0, "errors": 0}
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def submit(self, run: Dict[str, Any]) -> bool:
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(run)
+            self.stats["submitted"] += 1
+            return True
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return False
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._export(batch)
+
+    def _export(self, batch: List[Dict[str, Any]]):
+        runs = [self._serialize(run) for run in batch]
+        try:
+            if self.sink is None:
+                self.sink = _langsmith_sink()
+            self.sink(runs)
+            self.stats["exported"] += len(runs)
+        except Exception as e:
+            if self.stats["errors"] == 0:
+                print(f"⚠️  LangSmith trace export failed: {e}")
+            self.stats["errors"] += 1
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    @staticmethod
+    def _serialize(run: Dict[str, Any]) -> Dict[str, Any]:
+        run = dict(run)
+        args, kwargs = run.pop("args"), run.pop("kwargs")
+        run["inputs"] = {"args": _safe(args), **{k: _safe(v) for k, v in kwargs.items()}}
+        run["outputs"] = {"output": _safe(run.pop("output"))} if run.get("error") is None else None
+        return run
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait (up to ``timeout`` seconds) for queued runs to be exported."""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.queue.unfinished_tasks == 0
+
+class TracingPolicy:
+    """Decides which decorated calls are traced: opt-in by function, sampled per trace."""
+
+    def __init__(self, enabled: bool = LANGSMITH_TRACING, sample_rate: float = LANGSMITH_SAMPLE_RATE,
+                 sample_rates: Optional[Dict[str, float]] = None,
+                 traced_functions: str = LANGSMITH_TRACED_FUNCTIONS,
+                 exporter: Optional[TraceExporter] = None, project: str = LANGSMITH_PROJECT):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.sample_rates = sample_rates if sample_rates is not None else _parse_rates(LANGSMITH_SAMPLE_RATES)
+        self.set_traced_functions(traced_functions)
+        self.exporter = exporter or TraceExporter()
+        self.project = project
+        self.stats = {"traces_started": 0, "traces_sampled_out": 0}
+
+    def set_traced_functions(self, spec: str):
+        names = {n.strip() for n in spec.split(",") if n.strip()}
+        self.trace_all = "*" in names
+        self.traced_functions = names - {"*"}
+
+    def is_opted_in(self, name: str) -> bool:
+        return self.trace_all or name in self.traced_functions
+
+    def sample(self, name: str) -> bool:
+        rate = self.sample_rates.get(name, self.sample_rate)
+        return rate >= 1.0 or random.random() < rate
+
+# Active trace for the current call chain: None (no trace yet), or a dict with
+# sampled=False (skip everything nested) or the run ids needed to attach children.
+_current_trace = contextvars.ContextVar("langsmith_trace", default=None)
+
+tracing_policy = TracingPolicy()
+atexit.register(lambda: tracing_policy.exporter.flush(timeout=2.0))
+
+def _dotted(start: datetime, run_id: uuid.UUID) -> str:
+    return f"{start.strftime('%Y%m%dT%H%M%S%fZ')}{run_id}"
+
+def traced(func=None, *, name: Optional[str] = None, run_type: str = "chain"):
+    """Drop-in replacement for ``langsmith.traceable`` governed by ``tracing_policy``.
+
+    Untraced calls cost a couple of attribute lookups; traced calls only build a
+    small run dict and hand it to the background exporter.
+    """
+    if func is None:
+        return functools.partial(traced, name=name, run_type=run_type)
+
+    run_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        policy = tracing_policy
+        if not policy.enabled or not policy.is_opted_in(run_name):
+            return func(*args, **kwargs)
+
+        parent = _current_trace.get()
+        if parent is None:
+            if not policy.sample(run_name):
+                policy.stats["traces_sampled_out"] += 1
+                token = _current_trace.set({"sampled": False})
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _current_trace.reset(token)
+            policy.stats["traces_started"] += 1
+        elif not parent["sampled"]:
+            return func(*args, **kwargs)
+
+        run_id = uuid.uuid4()
+        start = datetime.now(timezone.utc)
+        trace_id = parent["trace_id"] if parent else run_id
+        dotted_order = f"{parent['dotted_order']}.{_dotted(start, run_id)}" if parent else _dotted(start, run_id)
+        token = _current_trace.set({"sampled": True, "trace_id": trace_id, "run_id": run_id,
+                                    "dotted_order": dotted_order})
+        output, error = None, None
+        try:
+            output = func(*args, **kwargs)
+            return output
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            _current_trace.reset(token)
+            policy.exporter.submit({
+                "id": str(run_id),
+                "trace_id": str(trace_id),
+                "parent_run_id": str(parent["run_id"]) if parent else None,
+                "dotted_order": dotted_order,
+                "name": run_name,
+                "run_type": run_type,
+                "start_time": start.isoformat(),
+                "end_time": datetime.now(timezone.utc).isoformat(),
+                "session_name": policy.project,
+                "args": args,
+                "kwargs": kwargs,
+                "output": output,
+                "error": error,
+            })
+
+    return wrapper
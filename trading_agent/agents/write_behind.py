@@ -0,0 +1,197 @@
+import os
+import time
+import threading
+import pandas as pd
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Hashable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STORAGE_WRITE_BEHIND = os.getenv("STORAGE_WRITE_BEHIND", "true").lower() == "true"
+STORAGE_QUEUE_MAX_KEYS = int(os.getenv("STORAGE_QUEUE_MAX_KEYS", "200"))
+STORAGE_FLUSH_BATCH = int(os.getenv("STORAGE_FLUSH_BATCH", "20"))
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", "2.0"))
+STORAGE_PUT_TIMEOUT = float(os.getenv("STORAGE_PUT_TIMEOUT", "5.0"))
+
+def merge_frames(older, newer):
+    """Coalesce two pending writes for one key: DataFrames are unioned (newer rows win), anything else is replaced."""
+    if isinstance(older, pd.DataFrame) and isinstance(newer, pd.DataFrame):
+        merged = pd.concat([older, newer])
+        return merged[~merged.index.duplicated(keep="last")].sort_index()
+    return newer
+
+class WriteBehindQueue:
+    """Bounded write-behind buffer keyed by e.g. ``("market_data", symbol)``.
+
+    ``put`` returns immediately; a background thread hands pending payloads to
+    ``writer(key, payload)`` once ``batch_size`` keys are waiting or the oldest
+    has waited ``flush_interval`` seconds. Writes to a key that is already
+    pending are merged into it, so a symbol's bars saved twice in one cycle are
+    written once. When ``max_keys`` distinct keys are pending, ``put`` blocks
+    (backpressure) and after ``put_timeout`` writes the payload itself rather
+    than drop it.
+    """
+
+    def __init__(self, writer: Callable[[Hashable, Any], Any], max_keys: int = STORAGE_QUEUE_MAX_KEYS,
+                 batch_size: int = STORAGE_FLUSH_BATCH, flush_interval: float = STORAGE_FLUSH_INTERVAL,
+                 put_timeout: float = STORAGE_PUT_TIMEOUT, merge: Callable[[Any, Any], Any] = merge_frames,
+                 max_attempts: int = 2):
+        self.writer = writer
+        self.max_keys = max_keys
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.merge = merge
+        self.max_attempts = max_attempts
+
+        self._pending: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._worker = None
+        self.stats = {"enqueued": 0, "coalesced": 0, "written": 0, "failed": 0, "retried": 0, "batches": 0,
+                      "blocked_puts": 0, "sync_writes": 0, "last_flush_ms": None, "max_flush_ms": 0.0,
+                      "total_flush_ms": 0.0}
+
+    def put(self, key: Hashable, payload: Any) -> bool:
+        """Queue a write; False if it had to be written synchronously (queue full or closed)."""
+        with self._cond:
+            if not self._closed:
+                self._ensure_worker()
+                if key in self._pending:
+                    item = self._pending[key]
+                    item["payload"] = self.merge(item["payload"], payload)
+                    self.stats["enqueued"] += 1
+                    self.stats["coalesced"] += 1
+                    return True
+
+                if len(self._pending) >= self.max_keys:
+                    self.stats["blocked_puts"] += 1
+                    self._cond.notify_all()
+                    deadline = time.monotonic() + self.put_timeout
+                    while len(self._pending) >= self.max_keys and not self._closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+
+                if len(self._pending) < self.max_keys and not self._closed:
+                    self._pending[key] = {"payload": payload, "since": time.monotonic(), "attempts": 0}
+                    self.stats["enqueued"] += 1
+                    if len(self._pending) >= self.batch_size:
+                        self._cond.notify_all()
+                    return True
+
+        # Full for too long (or shut down): write in the caller rather than lose the data
+        self.stats["sync_writes"] += 1
+        self.writer(key, payload)
+        return False
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="storage-write-behind", daemon=True)
+            self._worker.start()
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        if self._flush_requested or self._closed or len(self._pending) >= self.batch_size:
+            return True
+        oldest = next(iter(self._pending.values()))["since"]
+        return time.monotonic() - oldest >= self.flush_interval
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due():
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._pending:
+                        oldest = next(iter(self._pending.values()))["since"]
+                        timeout = max(0.0, self.flush_interval - (time.monotonic() - oldest))
+                    self._cond.wait(timeout)
+                batch = []
+                while self._pending and len(batch) < self.batch_size:
+                    batch.append(self._pending.popitem(last=False))
+                self._in_flight += len(batch)
+                self._cond.notify_all()  # room for blocked producers
+            self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        start = time.perf_counter()
+        for key, item in batch:
+            try:
+                self.writer(key, item["payload"])
+                self.stats["written"] += 1
+            except Exception as e:
+                item["attempts"] += 1
+                with self._cond:
+                    if item["attempts"] < self.max_attempts:
+                        # Try again with the next batch, folded into any newer write for the key
+                        if key in self._pending:
+                            newer = self._pending[key]
+                            newer["payload"] = self.merge(item["payload"], newer["payload"])
+                        else:
+                            # Waits a flush interval like a fresh write instead of retrying at once
+                            item["since"] = time.monotonic()
+                            self._pending[key] = item
+                        self.stats["retried"] += 1
+                        continue
+                self.stats["failed"] += 1
+                print(f"⚠️  Write-behind write for {key} failed: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._cond:
+            self._in_flight -= len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed_ms), 2)
+            self.stats["total_flush_ms"] += elapsed_ms
+            if not self._pending:
+                self._flush_requested = False
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Write everything pending now and wait (up to ``timeout`` seconds) for it to land."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._worker is None:
+                return not self._pending
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Flush and stop the worker (graceful shutdown); later puts write synchronously."""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join(timeout=1.0)
+        return flushed
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue depth, oldest pending age and flush latency."""
+        with self._cond:
+            oldest = next(iter(self._pending.values()))["since"] if self._pending else None
+            batches = self.stats["batches"]
+            return {
+                **{k: v for k, v in self.stats.items() if k != "total_flush_ms"},
+                "depth": len(self._pending) + self._in_flight,
+                "pending_keys": len(self._pending),
+                "in_flight": self._in_flight,
+                "oldest_pending_s": round(time.monotonic() - oldest, 3) if oldest is not None else None,
+                "avg_flush_ms": round(self.stats["total_flush_ms"] / batches, 2) if batches else None,
+            }
@@ -4,6 +4,10 @@ from datetime import datetime
 from typing import TypedDict, Optional, Any, Dict
 import concurrent.futures
 import asyncio
+import os
+import time
+
+ORDER_SUBMIT_WORKERS = int(os.getenv("ORDER_SUBMIT_WORKERS", "5"))
 
 # Lazy imports to avoid startup issues
 def _get_data_ingestor():
@@ -19,11 +23,20 @@ def _get_llm_agent():
     return make_trade_decision
 
 def _get_order_manager():
-    from trading_agent.agents.order_manager import (
-        place_order, place_bracket_order, place_oco_order, place_trailing_stop,
-        place_limit_order, place_stop_order, place_stop_limit_order
-    )
-    return place_order, place_bracket_order, place_oco_order, place_trailing_stop, place_limit_order, place_stop_order, place_stop_limit_order
+    from trading_agent.agents import order_manager
+    return order_manager
+
+def _get_order_reconciler():
+    from trading_agent.agents import order_reconciler
+    return order_reconciler
+
+def _get_risk_engine():
+    from trading_agent.agents.risk_engine import RiskEngine, RISK_REASONS
+    return RiskEngine, RISK_REASONS
+
+def _get_strategy_params():
+    from trading_agent.agents.strategy_params import resolve_params
+    return resolve_params
 
 def _get_storage_agent():
     from trading_agent.agents.storage_agent import trading_storage
@@ -39,11 +52,13 @@ def _get_scraping_agent():
 
 # Define the state - simplified for account-focused trading
 class TradingState(TypedDict):
+    cycle_id: Optional[str]   # Identifies the cycle (used for idempotent client_order_ids)
     positions: Optional[Any]  # Account positions (what we actually own)
     account: Optional[Any]    # Account balance and info
     orders: Optional[Any]     # Pending orders
     analysis_results: Optional[Dict[str, Any]]  # Analysis for each position
-    decisions: Optional[Dict[str, str]]  # Decisions for each position
+    decisions: Optional[Dict[str, Any]]  # Decisions (and decision metadata) for each position
+    reconciliation: Optional[Dict[str, Any]]  # Protective order plan per symbol
     actions_taken: Optional[Dict[str, Any]]  # Actions executed
 
 # Define nodes - simplified account-first approach
@@ -53,9 +68,23 @@ def get_account_positions(state):
     start_time = datetime.now()
 
     get_bars, get_account, get_positions, get_orders = _get_data_ingestor()
+    storage = _get_storage_agent()
+    try:
+        # Seeds the local order book once; later cycles read orders from it
+        book = _get_order_manager().start_order_book()
+        # Fill events carry the P&L of orders that were still open when their trade was recorded
+        if storage.record_fill not in book.fill_listeners:
+            book.fill_listeners.append(storage.record_fill)
+    except Exception as e:
+        print(f"⚠️  Order book unavailable, using REST orders: {e}")
     account = get_account()
     positions = get_positions()
     orders = get_orders()
+    try:
+        # Positions opened before the trade history need lots to sell against
+        storage.sync_positions(positions)
+    except Exception as e:
+        print(f"⚠️  Couldn't seed P&L lots from positions: {e}")
 
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
@@ -93,7 +122,8 @@ def analyze_single_position(position):
     
     # Get historical trades for this symbol
     trading_storage_func = _get_storage_agent()
-    historical_trades = trading_storage_func.get_trades_for_symbol(symbol)
+    # The prompt only looks at the last few decisions
+    historical_trades = trading_storage_func.get_trades_for_symbol(symbol, limit=3, fields=["decision", "timestamp"])
     
     # Gather news and market intelligence
     news_data = None
@@ -192,6 +222,7 @@ def make_single_decision(symbol, analysis, account):
 
     # Make decision using LLM with position context
     make_trade_decision_func = _get_llm_agent()
+    decision_metadata = {}
     decision = make_trade_decision_func(
         symbol=symbol,
         position_data=position,
@@ -199,14 +230,16 @@ def make_single_decision(symbol, analysis, account):
         account_data=account,
         historical_trades=analysis['historical_trades'],
         news_data=analysis.get('news'),
-        market_intelligence=analysis.get('market_intelligence')
+        market_intelligence=analysis.get('market_intelligence'),
+        metadata=decision_metadata
     )
 
     return {
         'symbol': symbol,
         'decision': decision,
         'position': position,
-        'indicators': latest_indicators
+        'indicators': latest_indicators,
+        'metadata': decision_metadata
     }
 
 def make_position_decisions(state):
@@ -240,242 +273,485 @@ def make_position_decisions(state):
             decisions[symbol] = {
                 'decision': result['decision'],
                 'position': result['position'],
-                'indicators': result['indicators']
+                'indicators': result['indicators'],
+                'metadata': result['metadata']
             }
-            print(f"✅ {symbol}: Decision '{result['decision']}' complete")
+            notes = []
+            if result['metadata'].get('cascade_tier'):
+                notes.append(f"tier: {result['metadata']['cascade_tier']}")
+            if result['metadata'].get('cache_hit'):
+                notes.append("cached")
+            note_str = f" ({', '.join(notes)})" if notes else ""
+            print(f"✅ {symbol}: Decision '{result['decision']}' complete{note_str}")
 
     end_time = datetime.now()
     total_duration = (end_time - start_time).total_seconds()
 
     print(f"✅ Decision making complete in {total_duration:.2f}s")
     print(f"   Decisions made: {len(decisions)}/{total_symbols}")
+    if any(d['metadata'].get('cascade_tier') for d in decisions.values()):
+        escalated = sum(1 for d in decisions.values() if d['metadata'].get('escalation_reason'))
+        print(f"   Escalated to strong model: {escalated}/{len(decisions)}")
 
     state['decisions'] = decisions
     return state
 
-def execute_actions(state):
-    """Execute the decided actions."""
-    print("\n⚡ STEP 4: Executing trading actions...")
-    start_time = datetime.now()
-
-    if not state['decisions']:
-        print("⚠️  No decisions to execute")
-        state['actions_taken'] = {}
-        return state
-
-    actions_taken = {}
-    total_decisions = len(state['decisions'])
-
-    print(f"🔄 Processing {total_decisions} decisions...")
+# Buy sizing per decision: (strategy parameter for the price multiplier off the current price, max shares)
+BUY_SIZING = {"BRACKET_BUY": ("bracket_entry", 10), "LIMIT_BUY": ("limit_buy_discount", 5), "BUY_MORE": (None, 5)}
+
+def _proposed_buy(decision, position, cash, params=None):
+    """Shares and price a buy decision would use before risk checks."""
+    param, max_shares = BUY_SIZING[decision]
+    multiplier = _get_strategy_params()(params)[param] if param else 1.0
+    price = float(position.get('current_price', 0)) * multiplier
+    shares = min(max_shares, int(cash // price)) if price > 0 else 0
+    return shares, price
+
+def _submit_decision_orders(symbol, decision_data, account, submit):
+    """Turn one decision into orders; ``submit`` places them with an idempotent client_order_id."""
+    order_manager = _get_order_manager()
+    protective_order_spec = _get_order_reconciler().protective_order_spec
+    decision = decision_data['decision']
+    position = decision_data['position']
+    # Per-decision overrides of the default strategy parameters (e.g. from a backtest sweep)
+    params = _get_strategy_params()(decision_data.get('params'))
+
+    print(f"📋 {symbol}: Processing decision '{decision}'...")
+
+    risk = decision_data.get('risk')
+    if risk and risk['approved_qty'] <= 0:
+        print(f"   🚫 Blocked by pre-trade risk check: {risk['reason']}")
+        return {"action": "HOLD", "reason": f"Risk check: {risk['reason']}"}
+
+    if decision == "BRACKET_BUY":
+        # Smart bracket buy: entry + take-profit + stop-loss
+        cash = float(account.get('cash', 0))
+        current_price = float(position.get('current_price', 0))
+        
+        # Calculate smart prices based on technicals
+        entry_price = current_price * params['bracket_entry']  # Buy at 0.5% discount
+        take_profit_price = current_price * params['bracket_take_profit']  # 5% profit target
+        stop_loss_price = current_price * params['bracket_stop_loss']  # 3% stop loss
+        
+        if cash > entry_price * 2:  # Can afford at least 2 shares
+            shares_to_buy, _ = _proposed_buy(decision, position, cash, params)  # Buy up to 10 shares
+            if risk:
+                shares_to_buy = min(shares_to_buy, risk['approved_qty'])
+            print(f"   🎯 Smart Bracket Buy: {shares_to_buy} shares")
+            print(f"      Entry: ${entry_price:.2f}, Target: ${take_profit_price:.2f}, Stop: ${stop_loss_price:.2f}")
+            
+            order = submit(order_manager.place_bracket_order, symbol, shares_to_buy, "buy", entry_price, take_profit_price, stop_loss_price)
+            print(f"   ✅ Bracket order placed: {shares_to_buy} shares with profit protection")
+            return {"action": "BRACKET_BUY", "shares": shares_to_buy, "order": order}
+        else:
+            print(f"   ❌ Insufficient cash for smart bracket buy")
+            return {"action": "HOLD", "reason": "Insufficient cash for bracket buy"}
 
-    for symbol, decision_data in state['decisions'].items():
-        decision = decision_data['decision']
-        position = decision_data['position']
+    elif decision == "LIMIT_BUY":
+        # Buy at better price than market
+        cash = float(account.get('cash', 0))
+        current_price = float(position.get('current_price', 0))
+        
+        limit_price = current_price * params['limit_buy_discount']  # Buy at 2% discount
+        if cash > limit_price * 2:
+            shares_to_buy, _ = _proposed_buy(decision, position, cash, params)
+            if risk:
+                shares_to_buy = min(shares_to_buy, risk['approved_qty'])
+            print(f"   🎯 Limit Buy: {shares_to_buy} shares at ${limit_price:.2f}")
+            
+            order = submit(order_manager.place_limit_order, symbol, shares_to_buy, "buy", limit_price)
+            print(f"   ✅ Limit buy order placed: {shares_to_buy} shares")
+            return {"action": "LIMIT_BUY", "shares": shares_to_buy, "limit_price": limit_price, "order": order}
+        else:
+            print(f"   ❌ Insufficient cash for limit buy")
+            return {"action": "HOLD", "reason": "Cash insufficient for limit buy"}
 
-        print(f"📋 {symbol}: Processing decision '{decision}'...")
+    elif decision == "TRAILING_STOP_BUY":
+        # Set trailing stop for long position
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+        
+        if qty > 0:
+            trail_percent = protective_order_spec(decision, position, params)['trail_percent']  # 2% trailing stop
+            print(f"   🎯 Trailing Stop Buy: Protect {qty} shares with {trail_percent}% trail")
+            
+            order = submit(order_manager.place_trailing_stop, symbol, qty, "sell", trail_percent=trail_percent)
+            print(f"   ✅ Trailing stop set for {qty} shares")
+            return {"action": "TRAILING_STOP_BUY", "shares": qty, "trail_percent": trail_percent, "order": order}
+        else:
+            print(f"   ❌ No position to set trailing stop")
+            return {"action": "HOLD", "reason": "No position to protect"}
 
-        if decision == "BRACKET_BUY":
-            # Smart bracket buy: entry + take-profit + stop-loss
-            cash = float(state['account'].get('cash', 0))
-            current_price = float(position.get('current_price', 0))
+    elif decision == "OCO_SELL":
+        # Smart OCO sell: take-profit + stop-loss
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+        
+        if qty > 0:
+            # Smart profit targets based on current P&L
+            spec = protective_order_spec(decision, position, params)
+            take_profit_price, stop_loss_price = spec['take_profit'], spec['stop_loss']
             
-            # Calculate smart prices based on technicals
-            entry_price = current_price * 0.995  # Buy at 0.5% discount
-            take_profit_price = current_price * 1.05  # 5% profit target
-            stop_loss_price = current_price * 0.97  # 3% stop loss
+            print(f"   🎯 Smart OCO Sell: {qty} shares")
+            print(f"      Take Profit: ${take_profit_price:.2f}, Stop Loss: ${stop_loss_price:.2f}")
             
-            if cash > entry_price * 2:  # Can afford at least 2 shares
-                shares_to_buy = min(10, int(cash // entry_price))  # Buy up to 10 shares
-                print(f"   🎯 Smart Bracket Buy: {shares_to_buy} shares")
-                print(f"      Entry: ${entry_price:.2f}, Target: ${take_profit_price:.2f}, Stop: ${stop_loss_price:.2f}")
-                
-                order = _get_order_manager().place_bracket_order(symbol, shares_to_buy, "buy", entry_price, take_profit_price, stop_loss_price)
-                actions_taken[symbol] = {"action": "BRACKET_BUY", "shares": shares_to_buy, "order": order}
-                print(f"   ✅ Bracket order placed: {shares_to_buy} shares with profit protection")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "Insufficient cash for bracket buy"}
-                print(f"   ❌ Insufficient cash for smart bracket buy")
+            order = submit(order_manager.place_oco_order, symbol, qty, take_profit_price, stop_loss_price)
+            print(f"   ✅ OCO order placed: take-profit + stop-loss protection")
+            return {"action": "OCO_SELL", "shares": qty, "take_profit": take_profit_price, "stop_loss": stop_loss_price, "order": order}
+        else:
+            print(f"   ❌ No position to place OCO order")
+            return {"action": "HOLD", "reason": "No position to sell"}
 
-        elif decision == "LIMIT_BUY":
-            # Buy at better price than market
-            cash = float(state['account'].get('cash', 0))
-            current_price = float(position.get('current_price', 0))
+    elif decision == "LIMIT_SELL":
+        # Sell at better price than market
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+        
+        if qty > 0:
+            limit_price = current_price * 1.02  # Sell at 2% premium
+            print(f"   🎯 Limit Sell: {qty} shares at ${limit_price:.2f}")
             
-            limit_price = current_price * 0.98  # Buy at 2% discount
-            if cash > limit_price * 2:
-                shares_to_buy = min(5, int(cash // limit_price))
-                print(f"   🎯 Limit Buy: {shares_to_buy} shares at ${limit_price:.2f}")
-                
-                order = _get_order_manager().place_limit_order(symbol, shares_to_buy, "buy", limit_price)
-                actions_taken[symbol] = {"action": "LIMIT_BUY", "shares": shares_to_buy, "limit_price": limit_price, "order": order}
-                print(f"   ✅ Limit buy order placed: {shares_to_buy} shares")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "Cash insufficient for limit buy"}
-                print(f"   ❌ Insufficient cash for limit buy")
+            order = submit(order_manager.place_limit_order, symbol, qty, "sell", limit_price)
+            print(f"   ✅ Limit sell order placed: {qty} shares")
+            return {"action": "LIMIT_SELL", "shares": qty, "limit_price": limit_price, "order": order}
+        else:
+            print(f"   ❌ No position to sell")
+            return {"action": "HOLD", "reason": "No position to sell"}
 
-        elif decision == "TRAILING_STOP_BUY":
-            # Set trailing stop for long position
-            qty = int(float(position.get('qty', 0)))
-            current_price = float(position.get('current_price', 0))
+    elif decision == "TRAILING_STOP_SELL":
+        # Set trailing stop to let profits run
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+        
+        if qty > 0:
+            trail_percent = protective_order_spec(decision, position, params)['trail_percent']  # 3% trailing stop for profit protection
+            print(f"   🎯 Trailing Stop Sell: Let profits run on {qty} shares with {trail_percent}% trail")
             
-            if qty > 0:
-                trail_percent = 2.0  # 2% trailing stop
-                print(f"   🎯 Trailing Stop Buy: Protect {qty} shares with {trail_percent}% trail")
-                
-                order = _get_order_manager().place_trailing_stop(symbol, qty, "sell", trail_percent=trail_percent)
-                actions_taken[symbol] = {"action": "TRAILING_STOP_BUY", "shares": qty, "trail_percent": trail_percent, "order": order}
-                print(f"   ✅ Trailing stop set for {qty} shares")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "No position to protect"}
-                print(f"   ❌ No position to set trailing stop")
+            order = submit(order_manager.place_trailing_stop, symbol, qty, "sell", trail_percent=trail_percent)
+            print(f"   ✅ Trailing stop set for profit protection")
+            return {"action": "TRAILING_STOP_SELL", "shares": qty, "trail_percent": trail_percent, "order": order}
+        else:
+            print(f"   ❌ No position to set trailing stop")
+            return {"action": "HOLD", "reason": "No position to protect"}
 
-        elif decision == "OCO_SELL":
-            # Smart OCO sell: take-profit + stop-loss
-            qty = int(float(position.get('qty', 0)))
-            current_price = float(position.get('current_price', 0))
+    elif decision == "STOP_LOSS":
+        # Add stop-loss protection
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+        
+        if qty > 0:
+            stop_price = protective_order_spec(decision, position, params)['stop_price']  # 5% stop loss
+            print(f"   🛡️ Stop Loss: Protect {qty} shares below ${stop_price:.2f}")
             
-            if qty > 0:
-                # Smart profit targets based on current P&L
-                unrealized_plpc = float(position.get('unrealized_plpc', 0))
-                
-                if unrealized_plpc > 5:  # Good profit, take more
-                    take_profit_price = current_price * 1.02  # 2% more profit
-                    stop_loss_price = current_price * 0.98  # Protect 2% below current
-                elif unrealized_plpc > 2:  # Decent profit
-                    take_profit_price = current_price * 1.03  # 3% more profit  
-                    stop_loss_price = current_price * 0.97  # Protect 3% below current
-                else:  # Small profit or loss
-                    take_profit_price = current_price * 1.05  # 5% profit target
-                    stop_loss_price = current_price * 0.95  # 5% stop loss
-                
-                print(f"   🎯 Smart OCO Sell: {qty} shares")
-                print(f"      Take Profit: ${take_profit_price:.2f}, Stop Loss: ${stop_loss_price:.2f}")
-                
-                order = _get_order_manager().place_oco_order(symbol, qty, take_profit_price, stop_loss_price)
-                actions_taken[symbol] = {"action": "OCO_SELL", "shares": qty, "take_profit": take_profit_price, "stop_loss": stop_loss_price, "order": order}
-                print(f"   ✅ OCO order placed: take-profit + stop-loss protection")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "No position to sell"}
-                print(f"   ❌ No position to place OCO order")
+            order = submit(order_manager.place_stop_order, symbol, qty, "sell", stop_price)
+            print(f"   ✅ Stop-loss order placed for risk protection")
+            return {"action": "STOP_LOSS", "shares": qty, "stop_price": stop_price, "order": order}
+        else:
+            print(f"   ❌ No position to add stop-loss")
+            return {"action": "HOLD", "reason": "No position to protect"}
 
-        elif decision == "LIMIT_SELL":
-            # Sell at better price than market
-            qty = int(float(position.get('qty', 0)))
-            current_price = float(position.get('current_price', 0))
+    elif decision == "REDUCE_POSITION":
+        # Sell partial position to lock in profits
+        qty = int(float(position.get('qty', 0)))
+        current_price = float(position.get('current_price', 0))
+        
+        if qty > 1:
+            shares_to_sell = qty // 2  # Sell half
+            print(f"   💰 Reduce Position: Sell {shares_to_sell} of {qty} shares")
             
-            if qty > 0:
-                limit_price = current_price * 1.02  # Sell at 2% premium
-                print(f"   🎯 Limit Sell: {qty} shares at ${limit_price:.2f}")
-                
-                order = _get_order_manager().place_limit_order(symbol, qty, "sell", limit_price)
-                actions_taken[symbol] = {"action": "LIMIT_SELL", "shares": qty, "limit_price": limit_price, "order": order}
-                print(f"   ✅ Limit sell order placed: {qty} shares")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "No position to sell"}
-                print(f"   ❌ No position to sell")
+            order = submit(order_manager.place_order, symbol, shares_to_sell, "sell")  # Market order for quick execution
+            print(f"   ✅ Sold {shares_to_sell} shares to lock in profits")
+            return {"action": "REDUCE_POSITION", "shares": shares_to_sell, "order": order}
+        else:
+            print(f"   ❌ Position too small to reduce")
+            return {"action": "HOLD", "reason": "Position too small to reduce"}
 
-        elif decision == "TRAILING_STOP_SELL":
-            # Set trailing stop to let profits run
-            qty = int(float(position.get('qty', 0)))
-            current_price = float(position.get('current_price', 0))
-            
-            if qty > 0:
-                trail_percent = 3.0  # 3% trailing stop for profit protection
-                print(f"   🎯 Trailing Stop Sell: Let profits run on {qty} shares with {trail_percent}% trail")
-                
-                order = _get_order_manager().place_trailing_stop(symbol, qty, "sell", trail_percent=trail_percent)
-                actions_taken[symbol] = {"action": "TRAILING_STOP_SELL", "shares": qty, "trail_percent": trail_percent, "order": order}
-                print(f"   ✅ Trailing stop set for profit protection")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "No position to protect"}
-                print(f"   ❌ No position to set trailing stop")
+    elif decision == "BUY_MORE":
+        # Legacy support - map to BRACKET_BUY
+        cash = float(account.get('cash', 0))
+        current_price = float(position.get('current_price', 0))
+        print(f"   💰 Cash: ${cash:.2f}, Stock Price: ${current_price:.2f}")
+
+        if cash > current_price * 2:  # Can afford at least 2 shares
+            shares_to_buy, _ = _proposed_buy(decision, position, cash, params)  # Buy up to 5 shares
+            if risk:
+                shares_to_buy = min(shares_to_buy, risk['approved_qty'])
+            print(f"   🛒 Buying {shares_to_buy} shares of {symbol}...")
+            order = submit(order_manager.place_order, symbol, shares_to_buy, "buy")
+            print(f"   ✅ Buy order placed: {shares_to_buy} shares")
+            return {"action": "BUY_MORE", "shares": shares_to_buy, "order": order}
+        else:
+            print(f"   ❌ Insufficient cash to buy more {symbol}")
+            return {"action": "HOLD", "reason": "Insufficient cash"}
 
-        elif decision == "STOP_LOSS":
-            # Add stop-loss protection
-            qty = int(float(position.get('qty', 0)))
-            current_price = float(position.get('current_price', 0))
-            
-            if qty > 0:
-                stop_price = current_price * 0.95  # 5% stop loss
-                print(f"   🛡️ Stop Loss: Protect {qty} shares below ${stop_price:.2f}")
-                
-                order = _get_order_manager().place_stop_order(symbol, qty, "sell", stop_price)
-                actions_taken[symbol] = {"action": "STOP_LOSS", "shares": qty, "stop_price": stop_price, "order": order}
-                print(f"   ✅ Stop-loss order placed for risk protection")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "No position to protect"}
-                print(f"   ❌ No position to add stop-loss")
+    elif decision == "SELL_PARTIAL":
+        # Legacy support - map to REDUCE_POSITION
+        qty = int(float(position.get('qty', 0)))
+        print(f"   📊 Current position: {qty} shares")
+
+        if qty > 1:
+            shares_to_sell = qty // 2
+            print(f"   💸 Selling {shares_to_sell} shares of {symbol}...")
+            order = submit(order_manager.place_order, symbol, shares_to_sell, "sell")
+            print(f"   ✅ Sell order placed: {shares_to_sell} shares")
+            return {"action": "SELL_PARTIAL", "shares": shares_to_sell, "order": order}
+        else:
+            print(f"   ❌ Position too small to sell partial")
+            return {"action": "HOLD", "reason": "Position too small to sell partial"}
 
-        elif decision == "REDUCE_POSITION":
-            # Sell partial position to lock in profits
-            qty = int(float(position.get('qty', 0)))
-            current_price = float(position.get('current_price', 0))
-            
-            if qty > 1:
-                shares_to_sell = qty // 2  # Sell half
-                print(f"   💰 Reduce Position: Sell {shares_to_sell} of {qty} shares")
-                
-                order = _get_order_manager().place_order(symbol, shares_to_sell, "sell")  # Market order for quick execution
-                actions_taken[symbol] = {"action": "REDUCE_POSITION", "shares": shares_to_sell, "order": order}
-                print(f"   ✅ Sold {shares_to_sell} shares to lock in profits")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "Position too small to reduce"}
-                print(f"   ❌ Position too small to reduce")
+    elif decision == "SELL_ALL":
+        # Legacy support - map to OCO_SELL
+        qty = int(float(position.get('qty', 0)))
+        print(f"   📊 Current position: {qty} shares")
 
-        elif decision == "BUY_MORE":
-            # Legacy support - map to BRACKET_BUY
-            cash = float(state['account'].get('cash', 0))
-            current_price = float(position.get('current_price', 0))
-            print(f"   💰 Cash: ${cash:.2f}, Stock Price: ${current_price:.2f}")
-
-            if cash > current_price * 2:  # Can afford at least 2 shares
-                shares_to_buy = min(5, int(cash // current_price))  # Buy up to 5 shares
-                print(f"   🛒 Buying {shares_to_buy} shares of {symbol}...")
-                order = _get_order_manager().place_order(symbol, shares_to_buy, "buy")
-                actions_taken[symbol] = {"action": "BUY_MORE", "shares": shares_to_buy, "order": order}
-                print(f"   ✅ Buy order placed: {shares_to_buy} shares")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "Insufficient cash"}
-                print(f"   ❌ Insufficient cash to buy more {symbol}")
-
-        elif decision == "SELL_PARTIAL":
-            # Legacy support - map to REDUCE_POSITION
-            qty = int(float(position.get('qty', 0)))
-            print(f"   📊 Current position: {qty} shares")
-
-            if qty > 1:
-                shares_to_sell = qty // 2
-                print(f"   💸 Selling {shares_to_sell} shares of {symbol}...")
-                order = _get_order_manager().place_order(symbol, shares_to_sell, "sell")
-                actions_taken[symbol] = {"action": "SELL_PARTIAL", "shares": shares_to_sell, "order": order}
-                print(f"   ✅ Sell order placed: {shares_to_sell} shares")
-            else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "Position too small to sell partial"}
-                print(f"   ❌ Position too small to sell partial")
-
-        elif decision == "SELL_ALL":
-            # Legacy support - map to OCO_SELL
-            qty = int(float(position.get('qty', 0)))
-            print(f"   📊 Current position: {qty} shares")
-
-            if qty > 0:
-                print(f"   💸 Selling all {qty} shares of {symbol}...")
-                order = _get_order_manager().place_order(symbol, qty, "sell")
-                actions_taken[symbol] = {"action": "SELL_ALL", "shares": qty, "order": order}
-                print(f"   ✅ Sell order placed: {qty} shares")
+        if qty > 0:
+            print(f"   💸 Selling all {qty} shares of {symbol}...")
+            order = submit(order_manager.place_order, symbol, qty, "sell")
+            print(f"   ✅ Sell order placed: {qty} shares")
+            return {"action": "SELL_ALL", "shares": qty, "order": order}
+        else:
+            print(f"   ❌ No position to sell")
+            return {"action": "HOLD", "reason": "No position to sell"}
+
+    else:  # HOLD
+        print(f"   ⏸️  Holding {symbol} position")
+        return {"action": "HOLD", "reason": "No action needed"}
+
+def _existing_protective_orders(symbol, orders):
+    """Working protective orders for a symbol: the live order book, else the cycle's REST snapshot."""
+    order_manager = _get_order_manager()
+    if order_manager.order_book.is_live():
+        return order_manager.order_book.protective_orders(symbol)
+    # Nested snapshots carry exits as legs (e.g. of a filled bracket buy)
+    flat = [item for o in (orders or []) for item in [o] + list(o.get('legs') or [])]
+    return [o for o in flat
+            if o.get('symbol') == symbol and order_manager.is_protective_order(o)
+            and o.get('status') not in order_manager.TERMINAL_ORDER_STATUSES]
+
+def _apply_replacement(symbol, decision, spec, order_id):
+    """Patch an existing stop/trailing stop to the newly desired qty and price."""
+    order_manager = _get_order_manager()
+    if spec['kind'] == 'stop':
+        order = order_manager.replace_order(order_id, qty=spec['qty'], stop_price=round(spec['stop_price'], 2))
+        detail = {"stop_price": spec['stop_price']}
+    else:
+        order = order_manager.replace_order(order_id, qty=spec['qty'], trail=spec['trail_percent'])
+        detail = {"trail_percent": spec['trail_percent']}
+    print(f"   🔁 {symbol}: Replaced protective order {order_id} in place")
+    return {"action": decision, "shares": spec['qty'], "replaced_order_id": order_id, "order": order, **detail}
+
+def reconcile_orders(state):
+    """Diff desired protective orders against working ones and apply the minimal change set."""
+    print("\n🧮 STEP 4a: Reconciling protective orders...")
+    start_time = datetime.now()
+
+    if not state['decisions']:
+        state['reconciliation'] = {}
+        return state
+
+    reconciler = _get_order_reconciler()
+    plans = {}
+    for symbol, decision_data in state['decisions'].items():
+        spec = reconciler.protective_order_spec(decision_data['decision'], decision_data['position'] or {},
+                                                decision_data.get('params'))
+        existing = _existing_protective_orders(symbol, state.get('orders')) if spec else []
+        plans[symbol] = {**reconciler.plan_protective_orders(spec, existing), "spec": spec}
+
+    # One batch of cancels for the duplicates across all symbols; orders being
+    # superseded by a new placement stay working until execute_actions has placed it
+    to_cancel = [order_id for plan in plans.values() for order_id in plan['cancel']]
+    cancel_errors = _get_order_manager().cancel_orders(to_cancel) if to_cancel else {}
+    for order_id, error in cancel_errors.items():
+        if error:
+            print(f"   ⚠️  Cancel of {order_id} failed: {error}")
+
+    for symbol, plan in plans.items():
+        decision_data = state['decisions'][symbol]
+        decision = decision_data['decision']
+        if plan['op'] == 'noop':
+            print(f"   ✅ {symbol}: {decision} already covered by order {plan['keep']} - nothing to send")
+            decision_data['reconciled_action'] = {"action": "HOLD", "reason": f"{decision} already in place",
+                                                  "kept_order_id": plan['keep']}
+        elif plan['op'] == 'replace':
+            try:
+                decision_data['reconciled_action'] = _apply_replacement(symbol, decision, plan['spec'], plan['replace'])
+            except Exception as e:
+                # Fall back to placing a fresh order in execute_actions; the old one goes once that lands
+                print(f"   ⚠️  {symbol}: replace failed ({e}), placing a new order to supersede it")
+                plan['op'] = 'place'
+                plan['supersede'] = [plan['replace']]
+        if plan['op'] == 'place' and plan.get('supersede'):
+            working = {o['id']: o for o in _existing_protective_orders(symbol, state.get('orders'))}
+            decision_data['supersede'] = [working.get(order_id, {"id": order_id}) for order_id in plan['supersede']]
+        plan.pop('spec')
+
+    ops = [plan['op'] for plan in plans.values()]
+    duration = (datetime.now() - start_time).total_seconds()
+    print(f"✅ Reconciliation complete in {duration:.2f}s")
+    print(f"   Unchanged: {ops.count('noop')}, replaced: {ops.count('replace')}, "
+          f"to place: {ops.count('place')}, cancelled: {len(to_cancel)}, "
+          f"superseded after placing: {sum(len(plan.get('supersede', [])) for plan in plans.values())}")
+
+    state['reconciliation'] = plans
+    return state
+
+def _execute_single_action(symbol, decision_data, account, cycle_id):
+    """Execute one symbol's decision, capturing the client_order_id and submit latency."""
+    decision = decision_data['decision']
+    submit_info = {}
+
+    if decision_data.get('reconciled_action'):
+        # Reconciliation already kept or replaced the protective order
+        return decision_data['reconciled_action']
+
+    def submit(place_func, *args, **kwargs):
+        client_order_id = _get_order_manager().make_client_order_id(cycle_id, symbol, decision)
+        start = time.perf_counter()
+        try:
+            return place_func(*args, client_order_id=client_order_id, **kwargs)
+        finally:
+            submit_info['client_order_id'] = client_order_id
+            submit_info['submit_latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+    try:
+        if decision_data.get('supersede'):
+            action = _supersede_protective_orders(symbol, decision_data, account, submit)
+        else:
+            action = _submit_decision_orders(symbol, decision_data, account, submit)
+    except Exception as e:
+        print(f"   ❌ {symbol}: order submission failed: {e}")
+        action = {"action": decision, "error": str(e)}
+
+    action.update(submit_info)
+    return action
+
+def _cancel_logged(symbol, order_ids):
+    errors = _get_order_manager().cancel_orders(order_ids)
+    for order_id, error in errors.items():
+        if error:
+            print(f"   ⚠️  {symbol}: cancel of {order_id} failed: {error}")
+    return [order_id for order_id, error in errors.items() if not error]
+
+def _restore_protective_orders(symbol, orders):
+    """Place cancelled protective orders again; returns the specs that could not be restored."""
+    order_manager = _get_order_manager()
+    order_spec = _get_order_reconciler().order_spec
+    lost = []
+    for order in orders:
+        spec = order_spec(order)
+        try:
+            if spec is None:
+                raise ValueError("unknown order shape")
+            if spec['kind'] == 'stop':
+                order_manager.place_stop_order(symbol, spec['qty'], "sell", spec['stop_price'])
+            elif spec['kind'] == 'trailing_stop':
+                order_manager.place_trailing_stop(symbol, spec['qty'], "sell", trail_percent=spec['trail_percent'])
             else:
-                actions_taken[symbol] = {"action": "HOLD", "reason": "No position to sell"}
-                print(f"   ❌ No position to sell")
+                order_manager.place_oco_order(symbol, spec['qty'], spec['take_profit'], spec['stop_loss'])
+            print(f"   ♻️  {symbol}: restored protective order {order['id']}")
+        except Exception as e:
+            print(f"   ⚠️  {symbol}: could not restore protective order {order['id']}: {e}")
+            lost.append(spec or {"id": order['id']})
+    return lost
+
+def _supersede_protective_orders(symbol, decision_data, account, submit):
+    """Place the new protective order first and cancel the ones it replaces only once it's in.
+
+    The broker may reject the new order while the old ones still hold the shares;
+    then the old ones are cancelled, the order retried, and restored if it fails again.
+    """
+    old = decision_data['supersede']
+    old_ids = [o['id'] for o in old]
+    try:
+        action = _submit_decision_orders(symbol, decision_data, account, submit)
+    except Exception as e:
+        print(f"   ⚠️  {symbol}: new protective order rejected next to {', '.join(old_ids)} ({e}); "
+              f"cancelling those and retrying")
+        cancelled = set(_cancel_logged(symbol, old_ids))
+        try:
+            action = _submit_decision_orders(symbol, decision_data, account, submit)
+        except Exception:
+            lost = _restore_protective_orders(symbol, [o for o in old if o['id'] in cancelled])
+            if lost:
+                print(f"   🚨 {symbol}: position is UNPROTECTED - {len(lost)} protective order(s) could not be restored")
+            raise
+        action['superseded_order_ids'] = sorted(cancelled)
+        return action
+
+    if 'order' in action:
+        action['superseded_order_ids'] = _cancel_logged(symbol, old_ids)
+    return action
+
+def _apply_risk_checks(state):
+    """Size every buy in the cycle together against cash, open orders and position caps.
+
+    Each buy decision gets ``decision_data['risk']`` with its approved share count.
+    """
+    buys = [(symbol, d) for symbol, d in state['decisions'].items()
+            if d['decision'] in BUY_SIZING and not d.get('reconciled_action')]
+    if not buys:
+        return None
+
+    RiskEngine, RISK_REASONS = _get_risk_engine()
+    account = state.get('account') or {}
+    engine = RiskEngine.from_account(account, state.get('positions'), state.get('orders'))
+    cash = float(account.get('cash', 0))
+    proposals = [_proposed_buy(d['decision'], d['position'] or {}, cash, d.get('params')) for _, d in buys]
+    result = engine.check_orders([symbol for symbol, _ in buys],
+                                 [shares for shares, _ in proposals], [price for _, price in proposals])
+
+    for i, (symbol, decision_data) in enumerate(buys):
+        approved = int(result['approved'][i])
+        reason = RISK_REASONS[int(result['reason'][i])]
+        decision_data['risk'] = {"requested_qty": proposals[i][0], "approved_qty": approved,
+                                 "notional": float(result['notional'][i]), "reason": reason}
+        if reason:
+            print(f"   🧮 {symbol}: {proposals[i][0]} -> {approved} shares ({reason})")
+    print(f"   Cash reserved for buys: ${float(result['notional'].sum()):.2f} "
+          f"(available ${engine.available_cash():.2f} after reservations)")
+    return engine
 
-        else:  # HOLD
-            actions_taken[symbol] = {"action": "HOLD", "reason": "No action needed"}
-            print(f"   ⏸️  Holding {symbol} position")
+def execute_actions(state):
+    """Execute the decided actions."""
+    print("\n⚡ STEP 4: Executing trading actions...")
+    start_time = datetime.now()
+
+    if not state['decisions']:
+        print("⚠️  No decisions to execute")
+        state['actions_taken'] = {}
+        return state
+
+    actions_taken = {}
+    total_decisions = len(state['decisions'])
+
+    print(f"🔄 Processing {total_decisions} decisions...")
+
+    cycle_id = state.get('cycle_id') or start_time.strftime("%Y%m%dT%H%M%S")
+    risk_engine = _apply_risk_checks(state)
+
+    # Submit orders concurrently; order_manager's rate limiter bounds the request rate
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(total_decisions, ORDER_SUBMIT_WORKERS)) as executor:
+        future_to_symbol = {
+            executor.submit(_execute_single_action, symbol, decision_data, state['account'], cycle_id): symbol
+            for symbol, decision_data in state['decisions'].items()
+        }
+
+        for future in concurrent.futures.as_completed(future_to_symbol):
+            symbol = future_to_symbol[future]
+            actions_taken[symbol] = future.result()
+            risk = state['decisions'][symbol].get('risk')
+            if risk_engine and risk and (actions_taken[symbol].get('error') or 'order' not in actions_taken[symbol]):
+                # Nothing was placed, so the reservation goes back
+                risk_engine.release(symbol, risk['notional'])
 
     end_time = datetime.now()
     total_duration = (end_time - start_time).total_seconds()
 
     print(f"✅ Action execution complete in {total_duration:.2f}s")
-    print(f"   Actions taken: {len([a for a in actions_taken.values() if a['action'] != 'HOLD'])} trades")
+    print(f"   Actions taken: {len([a for a in actions_taken.values() if a['action'] != 'HOLD' and 'error' not in a])} trades")
+    failed = [s for s, a in actions_taken.items() if 'error' in a]
+    if failed:
+        print(f"   Failed submissions: {', '.join(failed)}")
 
     state['actions_taken'] = actions_taken
     return state
@@ -554,7 +830,10 @@ def log_actions(state):
 
     # Get performance metrics
     try:
-        performance = _get_storage_agent().get_performance_summary()
+        storage = _get_storage_agent()
+        storage.mark_to_market({p['symbol']: float(p.get('current_price') or 0)
+                                for p in state.get('positions') or [] if p.get('symbol')})
+        performance = storage.get_performance_summary()
         trading_data.update({
             'total_trades': performance.get('total_trades', 0),
             'total_pnl': f"{performance.get('total_pnl', 0):.2f}",
@@ -604,13 +883,15 @@ graph = StateGraph(TradingState)
 graph.add_node("get_account_positions", get_account_positions)
 graph.add_node("analyze_positions", analyze_positions)
 graph.add_node("make_position_decisions", make_position_decisions)
+graph.add_node("reconcile_orders", reconcile_orders)
 graph.add_node("execute_actions", execute_actions)
 graph.add_node("log_actions", log_actions)
 
 graph.set_entry_point("get_account_positions")
 graph.add_edge("get_account_positions", "analyze_positions")
 graph.add_edge("analyze_positions", "make_position_decisions")
-graph.add_edge("make_position_decisions", "execute_actions")
+graph.add_edge("make_position_decisions", "reconcile_orders")
+graph.add_edge("reconcile_orders", "execute_actions")
 graph.add_edge("execute_actions", "log_actions")
 graph.add_edge("log_actions", END)
 
@@ -623,11 +904,13 @@ def run_trading_cycle():
     cycle_start = datetime.now()
 
     initial_state = {
+        'cycle_id': cycle_start.strftime("%Y%m%dT%H%M%S"),
         'positions': None,
         'account': None,
         'orders': None,
         'analysis_results': None,
         'decisions': None,
+        'reconciliation': None,
         'actions_taken': None
     }
 